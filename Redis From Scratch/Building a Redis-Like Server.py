@@ -1,46 +1,149 @@
 import socket  # Import the socket module for network connections
 import select  # Import the select module for I/O multiplexing
 import errno  # Import the errno module for error codes
+import functools  # Import functools to bind a client's socket into its send callback
+import selectors  # Import the selectors module for epoll/kqueue-backed I/O multiplexing
+import sys  # Import the sys module to read command-line configuration
+import time  # Import the time module to schedule periodic background tasks
+from time import perf_counter_ns  # Import the nanosecond clock that times each loop iteration
+
+from resp import RespParser, ProtocolError, encode_error  # RESP2 request parser and reply encoders
+from commands import Client, CommandCore, parse_config_args  # The command table and dispatcher shared by every front end
+from cluster import PeerChannel, decode_args, run_cluster  # Sharded multi-process mode
 
 class RedisLikeServer:  # Defines the main class for our Redis-like server
-    def __init__(self, host='localhost', port=6379):  # Initializes the server with a host and port
+    def __init__(self, host='localhost', port=6379, use_selectors=True, coalesce_replies=True, config=None, cluster=None, peers=None):  # Initializes the server with a host and port
         # Basic server configuration
         self.host = host  # The hostname or IP address to bind to (default: localhost)
         self.port = port  # The port number to listen on (default: 6379, the standard Redis port)
         self.running = True  # A flag to control the main server loop
+        self.use_selectors = use_selectors  # Use the selectors reactor (epoll on Linux); False falls back to the select() loop
+        self.selector = None  # The selectors.DefaultSelector instance, created in start() when the reactor is used
+        self.max_accepts_per_tick = 256  # Upper bound on accept() calls per readiness event so a connection storm cannot starve clients
+        self.max_reads_per_tick = 16  # Upper bound on recv() calls per readable event so one busy client cannot starve the others
+        self.hz = 10  # How many times per second background tasks (active key expiry) run
+        self.next_cron_time = 0.0  # time.monotonic() at which _server_cron() runs next
+        self.coalesce_replies = coalesce_replies  # Batch all replies of a loop iteration into one send() per client; False writes after every reply
 
         # Data structures for managing clients and storage
         self.client_sockets = set()  # A set to store all connected client sockets
-        self.client_buffers = {}  # A dictionary to buffer incoming data from clients
+        self.client_parsers = {}  # A dictionary mapping each client to its incremental RESP parser (holds the input buffer)
         self.client_addresses = {}  # A dictionary to map client sockets to their addresses
-        self.store = {}  # A dictionary to store key-value data, acting as the Redis-like database
+        self.client_outbuffers = {}  # A dictionary of pending outbound bytes per client, flushed when the socket is writable
+        self.client_states = {}  # A dictionary mapping each client socket to the connection state command handlers see
+        self.clients_pending_write = set()  # Clients that received replies during this loop iteration and need a flush
+        self.clients_to_close = set()  # Clients dropped by CLIENT KILL, timeout or a buffer limit; closed at the end of the loop iteration
+        self.core = CommandCore(config)  # The dataset plus the table-driven command dispatcher (config: persistence and other settings)
+
+        # Sharded mode (see cluster.py): this process is one worker owning a range of hash slots
+        self.cluster = cluster  # ClusterState, or None when running as a single server
+        self.core.cluster = cluster  # CLUSTER KEYSLOT/SLOTS/INFO read the slot layout
+        self.peer_channels = {sock: PeerChannel(worker, sock) for worker, sock in (peers or {}).items()}  # Socketpairs to the other workers
+        self.peers_by_worker = {channel.worker: channel for channel in self.peer_channels.values()}  # Worker index -> channel
+        self.clients_awaiting_peer = {}  # Client socket -> [worker, unanswered forwarded commands]
+        self.deferred_commands = {}  # Client socket -> the command that must wait until its forwarded replies arrive
+        self.listen_sockets = set()  # The shared listening socket, plus the worker's private one in sharded mode
+        self.link_socket = None  # Socket of the replication link to our primary, while registered with the selector
 
     def start(self):  # Method to initialize and start the server
         """Initialize and start the server."""
+        self.core.load()  # Restore the dataset from disk before accepting clients
         # Create a TCP socket
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # Create a new TCP/IP socket
         # Allow reuse of the same address after restart
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Allows the socket to be reused immediately after it's closed - Server বন্ধ → আবার চালালে port reuse করা যাবে
         # Set non-blocking mode
         self.server_socket.setblocking(False)  # Set the socket to non-blocking mode to handle multiple clients - Socket non-blocking → একাধিক client handle সম্ভব
+        if self.cluster is not None:  # Every worker binds the same port; the kernel spreads connections across them
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         # Bind to the specified host and port
         self.server_socket.bind((self.host, self.port))  # Bind the socket to the configured host and port
         # Start listening for incoming connections
         self.server_socket.listen(128)  # Listen for incoming connections, with a backlog of 128 - Client accept করার জন্য queue তৈরি (max 128 waiting client)
+        self.listen_sockets.add(self.server_socket)  # Accept connections from it in the event loop
+
+        if self.cluster is not None:  # A port only this worker listens on, for -MOVED and cluster-aware clients
+            private_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # Create the worker's own listening socket
+            private_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Same reuse rules as the shared socket
+            private_socket.setblocking(False)  # Accepted in the same non-blocking loop
+            private_socket.bind((self.host, self.cluster.port_of(self.cluster.worker)))  # port + 1 + worker index
+            private_socket.listen(128)  # Same backlog as the shared socket
+            self.listen_sockets.add(private_socket)  # Accept connections from it in the event loop
 
         print(f"Single-threaded Redis-like server listening on {self.host}:{self.port}")  # Print a message indicating the server is running
-        self._event_loop()  # Start the main event loop
+        use_reactor = self.use_selectors or self.cluster is not None or bool(self.core.config["replicaof"])  # Sharded mode and replicas need the reactor
+        self.core.metrics.server.update(tcp_port=self.port, hz=self.hz,  # Fields of INFO server
+                                        multiplexing_api=selectors.DefaultSelector.__name__.replace("Selector", "").lower() if use_reactor else "select")
+        self.core.replication.link_supported = use_reactor and self.cluster is None  # The reactor polls the link to a primary
+        self.core.replication.forget_socket = self._forget_link_socket  # Called before the link closes its socket
+        if self.core.config["replicaof"]:  # e.g. --replicaof "127.0.0.1 6379"
+            master_host, master_port = self.core.config["replicaof"].split()
+            self.core.replication.replicate(master_host, int(master_port))  # Connects from the first cron tick
+        if use_reactor:  # Prefer the reactor with persistent registrations
+            self._reactor_loop()  # Start the selectors-based event loop
+        else:
+            self._event_loop()  # Start the select() fallback event loop
+
+    def _reactor_loop(self):  # The main event loop built on selectors (epoll/kqueue)
+        """Main event loop using a selectors reactor with persistent registrations."""
+        self.selector = selectors.DefaultSelector()  # Picks epoll on Linux, kqueue on BSD/macOS, select elsewhere
+        for listen_socket in self.listen_sockets:  # Listening sockets stay registered for the server's lifetime
+            self.selector.register(listen_socket, selectors.EVENT_READ)
+        for peer_socket in self.peer_channels:  # So do the channels to the other workers
+            self.selector.register(peer_socket, selectors.EVENT_READ)
 
-    def _event_loop(self):  # The main event loop for handling I/O
-        """Main event loop using select() for I/O multiplexing."""
+        try:
+            while self.running:  # Loop as long as the server is running
+                events = self.selector.select(self._cron_timeout())  # Wait for readiness events until the next cron tick, O(ready) instead of O(clients)
+                tick_start = perf_counter_ns()  # Time the work, not the wait
+
+                for key, mask in events:  # Iterate over the sockets that are ready
+                    sock = key.fileobj  # The socket the event belongs to
+                    if key.data is not None:  # The replication link to our primary
+                        key.data.handle(mask)  # Connect, handshake, snapshot or command stream
+                        continue
+                    if sock in self.listen_sockets:  # A listening socket is readable: connections are waiting
+                        self._accept_new_connection(sock)  # Drain the accept queue
+                        continue
+                    if sock in self.peer_channels:  # Another worker sent requests or replies
+                        channel = self.peer_channels[sock]  # Its framed channel
+                        if mask & selectors.EVENT_READ:
+                            self._handle_peer_data(channel)  # Execute forwarded commands, relay replies
+                        if mask & selectors.EVENT_WRITE:
+                            self._flush_peer(channel)  # Continue writing queued frames
+                        continue
+
+                    if sock not in self.client_sockets:  # The client was disconnected earlier in this batch
+                        continue
+                    if mask & selectors.EVENT_READ:  # Incoming data (or EOF) from the client
+                        self._handle_client_data(sock)  # Read and process it
+                    if mask & selectors.EVENT_WRITE and sock in self.client_sockets:  # Kernel send buffer has room again
+                        self._flush_client(sock)  # Continue writing the pending output
+
+                self._handle_blocked_clients()  # Time out BLPOP/BRPOP waiters and resume clients that were served
+                self.core.before_sleep()  # Write the AOF buffer before any reply leaves the server
+                self._flush_pending_writes()  # One send() per client for everything produced in this iteration
+                self._server_cron()  # Background tasks, if a tick is due
+                self._close_pending_clients()  # Connections killed during this iteration
+                self._sync_master_link()  # The link may have connected, reconnected or gone away
+                self.core.metrics.loop.record(perf_counter_ns() - tick_start, len(events))  # INFO eventloop_* fields
+        finally:
+            if self.core.replication.link is not None:  # Close the connection to our primary
+                self.core.replication.link.close()
+            self.selector.close()  # Release the epoll/kqueue file descriptor
+            self.selector = None  # Mark the reactor as stopped
+
+    def _event_loop(self):  # The fallback event loop for handling I/O
+        """Fallback event loop using select() for I/O multiplexing."""
         while self.running:  # Loop as long as the server is running
             # Monitor readable sockets (server + all clients)
             readable = [self.server_socket] + list(self.client_sockets)  # Sockets to check for readability (new connections or incoming data)
-            writable = []  # Sockets to check for writability (we are not using this here)
+            writable = [sock for sock, pending in self.client_outbuffers.items() if pending]  # Only clients with pending output need write readiness
             errors = list(self.client_sockets)  # Sockets to check for errors
 
-            # Wait for socket events (1-second timeout)
-            ready_read, ready_write, error_sockets = select.select(readable, writable, errors, 1.0)  # Use select to wait for I/O events
+            # Wait for socket events until the next cron tick
+            ready_read, ready_write, error_sockets = select.select(readable, writable, errors, self._cron_timeout())  # Use select to wait for I/O events
+            tick_start = perf_counter_ns()  # Time the work, not the wait
 
             # Handle new client connections
             if self.server_socket in ready_read:  # If the server socket is readable, it means there's a new connection
@@ -48,129 +151,317 @@ class RedisLikeServer:  # Defines the main class for our Redis-like server
 
             # Handle data from connected clients
             for client_socket in ready_read:  # Iterate over sockets with incoming data
-                if client_socket != self.server_socket:  # If it's a client socket
+                if client_socket != self.server_socket and client_socket in self.client_sockets:  # If it's a still-connected client socket
                     self._handle_client_data(client_socket)  # Handle the data from that client
 
+            self._handle_blocked_clients()  # Time out BLPOP/BRPOP waiters and resume clients that were served
+            self.core.before_sleep()  # Write the AOF buffer before any reply leaves the server
+            self._flush_pending_writes()  # One send() per client for everything produced in this iteration
+
+            # Flush pending output to clients that can accept more data
+            for client_socket in ready_write:  # Iterate over sockets with room in their send buffer
+                if client_socket in self.client_sockets:  # Skip clients disconnected earlier in this iteration
+                    self._flush_client(client_socket)  # Write as much pending output as the kernel accepts
+
             # Handle socket errors
             for sock in error_sockets:  # Iterate over sockets with errors
-                self._disconnect_client(sock)  # Disconnect the client
+                if sock in self.client_sockets:  # Skip clients that are already gone
+                    self._disconnect_client(sock)  # Disconnect the client
+
+            self._server_cron()  # Background tasks, if a tick is due
+            self._close_pending_clients()  # Connections killed during this iteration
+            self.core.metrics.loop.record(perf_counter_ns() - tick_start, len(ready_read) + len(ready_write) + len(error_sockets))  # INFO eventloop_* fields
+
+    def _sync_master_link(self):  # Method to keep the replication link registered with the selector
+        """Register the current socket of the link to our primary with the interest it needs."""
+        link = self.core.replication.link  # None unless REPLICAOF made us a replica
+        sock = link.sock if link is not None else None  # Replaced on every reconnect
+        if sock is not self.link_socket:  # A new connection attempt since the last iteration
+            self.selector.register(sock, link.events(), link)  # data=link routes its events to link.handle()
+            self.link_socket = sock
+        elif sock is not None and self.selector.get_key(sock).events != link.events():  # Connect finished or output backed up
+            self.selector.modify(sock, link.events(), link)
+
+    def _forget_link_socket(self, sock):  # Method the replication link calls before closing its socket
+        """Unregister the link's socket so its file descriptor can be reused safely."""
+        if sock is self.link_socket:
+            self.selector.unregister(sock)
+            self.link_socket = None
+
+    def _cron_timeout(self):  # Method to compute how long the loop may sleep
+        """Return the seconds left until the next cron tick or blocking-call deadline (the poll timeout)."""
+        timeout = max(0.0, self.next_cron_time - time.monotonic())  # Never negative
+        blocked_timeout = self.core.blocked_timeout()  # Earliest BLPOP/BRPOP deadline, if any
+        if blocked_timeout is not None:  # Wake up in time to send the nil reply
+            timeout = min(timeout, blocked_timeout)
+        return timeout
+
+    def _handle_blocked_clients(self):  # Method to finish blocking calls
+        """Reply to timed-out BLPOP/BRPOP clients and run the commands that queued up behind served ones."""
+        self.core.expire_blocked()  # Nil replies for clients whose timeout elapsed
+        unblocked = self.core.take_unblocked()  # Clients served by a push or timed out since the last iteration
+        while unblocked:  # Resumed commands may unblock (or block) further clients
+            for client in unblocked:
+                if client.conn in self.client_sockets:  # Skip clients that disconnected meanwhile
+                    self._process_client_buffer(client.conn)  # Pipelined commands sent while it was blocked
+            unblocked = self.core.take_unblocked()
+
+    def _server_cron(self):  # Method to run periodic background tasks
+        """Run the command core's background tasks hz times per second."""
+        now = time.monotonic()  # Monotonic clock: immune to wall-clock jumps
+        if now < self.next_cron_time:  # Not due yet
+            return
+        self.next_cron_time = now + 1.0 / self.hz  # Schedule the next tick
+        self.core.cron()  # Active expiry and other housekeeping
+
+    def _accept_new_connection(self, server_socket=None):  # Method to accept new client connections
+        """Accept incoming client connections until the accept queue is drained."""
+        server_socket = server_socket or self.server_socket  # The listening socket that became readable
+        for _ in range(self.max_accepts_per_tick):  # Batch accepts: one readiness event can cover many queued connections
+            try:
+                client_socket, address = server_socket.accept()  # Accept the connection
+            except (BlockingIOError, InterruptedError):  # EAGAIN: the accept queue is empty
+                return  # Nothing more to accept this tick
+            except socket.error:  # Handle other errors during accept (e.g. EMFILE, ECONNABORTED)
+                return  # Try again on the next readiness event
 
-    def _accept_new_connection(self):  # Method to accept a new client connection
-        """Accept new incoming client connections."""
-        try:
-            client_socket, address = self.server_socket.accept()  # Accept the connection
             client_socket.setblocking(False)  # Set the new client socket to non-blocking mode
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Replies are already batched per loop iteration, so don't let Nagle delay them
+            client = Client(address, send=functools.partial(self._send_to_client, client_socket), conn=client_socket)  # Per-connection state; send() lets PUBLISH queue messages for this client
+            if not self.core.add_client(client):  # maxclients connections are already open
+                try:
+                    client_socket.send(b"-ERR max number of clients reached\r\n")  # Best effort: the socket buffer of a new connection is empty
+                except socket.error:
+                    pass
+                client_socket.close()  # Refuse it
+                continue
+            client.close = functools.partial(self._close_client_later, client_socket)  # CLIENT KILL, timeout
+            client.buffers = functools.partial(self._client_buffers, client_socket)  # CLIENT LIST qbuf/omem/tot-mem
 
             # Track the new client
             self.client_sockets.add(client_socket)  # Add the new client socket to our set of clients
-            self.client_buffers[client_socket] = ""  # Initialize an empty buffer for the client
+            self.client_parsers[client_socket] = RespParser()  # Initialize an empty input buffer and parser for the client
             self.client_addresses[client_socket] = address  # Store the client's address
+            self.client_outbuffers[client_socket] = bytearray()  # Initialize an empty output buffer for the client
+            self.client_states[client_socket] = client  # The connection state command handlers see
+            if self.selector is not None:  # Register once; the registration persists until disconnect
+                self.selector.register(client_socket, selectors.EVENT_READ)  # Only read interest until output backs up
 
-            print(f"New connection from {address}")  # Print a message about the new connection
-            self._send_to_client(client_socket, "+OK Redis-like server ready\r\n")  # Send a welcome message to the client
-
-        except socket.error:  # Handle potential errors during accept
-            pass  # Ignore errors for now
+            self.core.metrics.connected_clients += 1  # INFO clients
+            self.core.metrics.connections_received += 1  # INFO stats
 
     def _handle_client_data(self, client_socket):  # Method to handle data received from a client
-        """Read and process data from a client."""
-        try:
-            data = client_socket.recv(4096).decode('utf-8')  # Receive up to 4096 bytes of data and decode it
+        """Read and process data from a client until its socket would block."""
+        self.client_states[client_socket].last_interaction = time.monotonic()  # Idle time and timeout are measured from here
+        for _ in range(self.max_reads_per_tick):  # Drain the socket, bounded so other clients still get a turn
+            try:
+                data = client_socket.recv(16384)  # Receive up to 16 KiB of raw bytes (no decoding: values are binary-safe)
+            except socket.error as e:  # Handle socket errors
+                if e.errno not in (errno.EWOULDBLOCK, errno.EAGAIN, errno.EINTR):  # If the error is not a "would block" error (meaning no data to read)
+                    self._disconnect_client(client_socket)  # Disconnect the client
+                return  # Nothing more to read right now
+
             if not data:  # If no data is received, the client has disconnected
                 self._disconnect_client(client_socket)  # Disconnect the client
                 return  # Stop processing for this client
 
             # Accumulate partial data in buffer
-            self.client_buffers[client_socket] += data  # Add the received data to the client's buffer
+            self.client_parsers[client_socket].feed(data)  # Append the received bytes to the client's input buffer
             # Process complete commands
             self._process_client_buffer(client_socket)  # Process the buffer for complete commands
-
-        except socket.error as e:  # Handle socket errors
-            if e.errno != errno.EWOULDBLOCK:  # If the error is not a "would block" error (meaning no data to read)
-                self._disconnect_client(client_socket)  # Disconnect the client
+            if client_socket not in self.client_sockets:  # The client sent QUIT or failed while writing
+                return  # Stop reading from a closed socket
+            if self.client_parsers[client_socket].pending() > self.core.config["client-query-buffer-limit"]:  # e.g. a line that never ends
+                print(f"Closing client {self.client_addresses[client_socket]}: query buffer over client-query-buffer-limit")
+                self._disconnect_client(client_socket)  # The unparsed input would otherwise grow without bound
+                return
 
     def _process_client_buffer(self, client_socket):  # Method to process the command buffer for a client
-        """Process commands from the client's buffer."""
-        buffer = self.client_buffers[client_socket].replace('\r\n', '\n')  # Normalize line endings
-
-        while '\n' in buffer:  # Process as long as there are complete lines in the buffer
-            line, buffer = buffer.split('\n', 1)  # Split the buffer into the first line and the rest
-            message = line.strip()  # Remove leading/trailing whitespace from the command
-
-            if not message:  # If the message is empty, continue to the next line
-                continue
-
-            self._execute_command(client_socket, message)  # Execute the command
-
-        # Update remaining partial buffer
-        self.client_buffers[client_socket] = buffer  # Store any remaining partial command back in the buffer
-
-    def _execute_command(self, client_socket, message):  # Method to execute a single command
-        """Parse and execute a single command."""
-        parts = message.split()  # Split the command into parts
-        command = parts[0].upper()  # The command is the first part, converted to uppercase
-
-        if command == "PING":  # Handle the PING command
-            self._send_to_client(client_socket, "+PONG\r\n")  # Respond with PONG
-
-        elif command == "ECHO":  # Handle the ECHO command
-            response = " ".join(parts[1:]) if len(parts) > 1 else ""  # Get the message to echo
-            self._send_to_client(client_socket, f"+{response}\r\n")  # Send the echoed message back
-
-        elif command == "SET":  # Handle the SET command
-            if len(parts) >= 3:  # SET requires a key and a value
-                key = parts[1]  # The key is the second part
-                value = " ".join(parts[2:])  # The value is the rest of the command
-                self.store[key] = value  # Store the key-value pair
-                self._send_to_client(client_socket, "+OK\r\n")  # Respond with OK
-            else:
-                self._send_to_client(client_socket, "-ERR SET requires key and value\r\n")  # Send an error if syntax is wrong
-
-        elif command == "GET":  # Handle the GET command
-            if len(parts) >= 2:  # GET requires a key
-                key = parts[1]  # The key is the second part
-                value = self.store.get(key)  # Get the value from the store
-                if value is not None:  # If the key exists
-                    self._send_to_client(client_socket, f"+{value}\r\n")  # Send the value
-                else:
-                    self._send_to_client(client_socket, "$-1\r\n")  # Send a null bulk string if the key doesn't exist
-            else:
-                self._send_to_client(client_socket, "-ERR GET requires key\r\n")  # Send an error if syntax is wrong
-
-        elif command == "DEL":  # Handle the DEL command
-            if len(parts) >= 2:  # DEL requires a key
-                key = parts[1]  # The key is the second part
-                if key in self.store:  # If the key exists in the store
-                    del self.store[key]  # Delete the key
-                    self._send_to_client(client_socket, "+OK\r\n")  # Respond with OK
-                else:
-                    self._send_to_client(client_socket, "$-1\r\n")  # Respond with -1 if key not found
-            else:
-                self._send_to_client(client_socket, "-ERR DEL requires key\r\n")  # Send an error if syntax is wrong
-
-        elif command == "QUIT":  # Handle the QUIT command
-            self._send_to_client(client_socket, "+OK Goodbye\r\n")  # Respond with a goodbye message
+        """Execute every complete command in the client's input buffer."""
+        parser = self.client_parsers[client_socket]  # The client's incremental parser
+        client = self.client_states[client_socket]  # Its connection state
+
+        while client_socket in self.client_sockets and not client.blocked_keys and client_socket not in self.deferred_commands:  # Stop if a command closed the connection, blocked the client or waits for another worker
+            try:
+                args = parser.next_command()  # Parse one command from the cursor onwards
+            except ProtocolError as e:  # The client sent something that is not RESP
+                self._send_to_client(client_socket, encode_error(f"ERR Protocol error: {e}"))  # Tell the client why
+                self._flush_client(client_socket)  # Best-effort write before closing
+                self._disconnect_client(client_socket)  # The stream cannot be resynchronised, so drop the client
+                return
+            if args is None:  # No complete command left; the partial tail stays in the parser
+                return
+            self._execute_command(client_socket, args)  # Execute the command
+
+    def _execute_command(self, client_socket, args):  # Method to execute a single command
+        """Execute a single command given as a list of bytes arguments."""
+        client = self.client_states[client_socket]  # The connection state for this socket
+        if self.cluster is not None:  # Sharded mode: the key may belong to another worker
+            owner = self.cluster.route(args)  # None (local), a worker index, or a -MOVED/-CROSSSLOT reply
+            awaiting = self.clients_awaiting_peer.get(client_socket)  # Forwarded commands still in flight for this client
+            if awaiting is not None and owner != awaiting[0]:  # Its reply would overtake theirs: run it once they are answered
+                self.deferred_commands[client_socket] = args
+                return
+            if owner is not None and client.multi is not None:  # A transaction runs on the worker that received MULTI
+                client.multi_error = True  # EXEC will abort
+                if not isinstance(owner, bytes):
+                    owner = b"-ERR keys in a transaction must belong to the worker that received MULTI\r\n"
+            if isinstance(owner, bytes):  # Redirection or error
+                self._send_to_client(client_socket, owner)
+                return
+            if owner is not None:  # Forward it; the reply is relayed by _handle_peer_data
+                self.peers_by_worker[owner].send_request(args, client_socket)  # Same channel, so replies come back in order
+                self.cluster.forwarded += 1  # Stats for CLUSTER INFO
+                if awaiting is None:
+                    self.clients_awaiting_peer[client_socket] = [owner, 1]
+                else:  # Pipelined commands for the same worker share the round trip
+                    awaiting[1] += 1
+                return
+        reply = self.core.execute(client, args)  # Dispatch through the command table
+        if reply is not None:  # None: the client blocked (BLPOP) and is answered later through client.send
+            self._send_to_client(client_socket, reply)  # Queue the reply
+
+        if client.close_after_reply:  # QUIT asked for the connection to be closed
+            self._flush_client(client_socket)  # Push the reply out before closing
             self._disconnect_client(client_socket)  # Disconnect the client
 
-        else:  # Handle unknown commands
-            self._send_to_client(client_socket, "-ERR unknown command\r\n")  # Send an error for any other command
-
-    def _send_to_client(self, client_socket, message):  # Method to send a message to a client
-        """Send a response to a client."""
+    def _send_to_client(self, client_socket, data):  # Method to send an encoded reply to a client
+        """Queue an encoded reply; it is written once per loop iteration by _flush_pending_writes()."""
+        outbuffer = self.client_outbuffers.get(client_socket)  # The client's pending output
+        if outbuffer is None:  # The client was already disconnected
+            return
+        outbuffer += data  # Append the reply bytes to the output buffer
+        if len(outbuffer) > self.core.output_limit_floor and self.core.output_limit_exceeded(self.client_states[client_socket], len(outbuffer)):  # A client not reading its replies
+            print(f"Closing client {self.client_addresses[client_socket]}: output buffer over client-output-buffer-limit")
+            self._close_client_later(client_socket)  # Not now: this may run inside a PUBLISH iterating over the subscribers
+            return
+        if self.coalesce_replies:  # Defer the write so pipelined replies share one syscall and TCP segment
+            self.clients_pending_write.add(client_socket)  # Flushed at the end of the loop iteration
+        else:
+            self._flush_client(client_socket)  # Write right away (one send() per reply)
+
+    def _flush_pending_writes(self):  # Method to write out the replies gathered during one loop iteration
+        """Flush every client that received replies during this loop iteration."""
+        for channel in self.peer_channels.values():  # Forwarded commands and replies for other workers
+            if channel.outbuffer:
+                self._flush_peer(channel)
+        if not self.clients_pending_write:  # Nothing was produced
+            return
+        pending, self.clients_pending_write = self.clients_pending_write, set()  # Swap so flushing can queue new writes safely
+        for client_socket in pending:  # One write attempt per client
+            if client_socket in self.client_sockets:  # Skip clients that disconnected after their replies were queued
+                self._flush_client(client_socket)  # Anything the kernel does not take waits for write readiness
+
+    def _flush_client(self, client_socket):  # Method to write pending output to a client
+        """Write pending output without blocking; wait for write readiness if the kernel buffer is full."""
+        outbuffer = self.client_outbuffers.get(client_socket)  # The client's pending output
+        if outbuffer is None:  # The client was already disconnected
+            return
+
+        pending = len(outbuffer)  # To account for what this flush wrote
+        while outbuffer:  # Keep writing until everything is sent or the socket would block
+            try:
+                sent = client_socket.send(outbuffer)  # Non-blocking send of as much as the kernel accepts
+            except (BlockingIOError, InterruptedError):  # Send buffer is full (EAGAIN)
+                break  # Wait for the socket to become writable again
+            except socket.error:  # Handle errors during sending
+                self._disconnect_client(client_socket)  # Disconnect the client if sending fails
+                return
+            del outbuffer[:sent]  # Drop the bytes the kernel accepted
+        client = self.client_states[client_socket]  # Output limit bookkeeping
+        if client.output_allowance:  # Part of a full-sync snapshot went out
+            client.output_allowance = max(0, client.output_allowance - (pending - len(outbuffer)))
+        if not outbuffer:  # Drained: a later backlog starts a fresh soft-limit period
+            client.output_soft_since = 0.0
+
+        if self.selector is not None:  # Keep write interest only while output is pending
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE if outbuffer else selectors.EVENT_READ  # Desired interest set
+            if self.selector.get_key(client_socket).events != events:  # Avoid a syscall when nothing changes
+                self.selector.modify(client_socket, events)  # Update the persistent registration
+
+    def _handle_peer_data(self, channel):  # Method to process frames from another worker
+        """Execute commands forwarded by another worker and relay replies to forwarded commands."""
         try:
-            client_socket.sendall(message.encode())  # Encode the message to bytes and send it
-        except socket.error:  # Handle errors during sending
-            self._disconnect_client(client_socket)  # Disconnect the client if sending fails
+            data = channel.sock.recv(262144)  # Frames are small; one large read per readiness event
+        except (BlockingIOError, InterruptedError):  # Spurious wakeup
+            return
+        if not data:  # The other worker exited: the shard layout is broken, so stop too
+            print(f"Cluster: worker {channel.worker} went away, shutting down")
+            self.running = False
+            return
+        channel.inbuffer += data  # Accumulate partial frames
+        for kind, payload in channel.frames():  # Complete frames, in order
+            if kind == b"Q":  # A command for a slot we own
+                channel.send_reply(self.core.execute(channel.client, decode_args(payload)))  # Never None: the pseudo-client cannot block
+            else:  # The reply to our oldest forwarded command
+                client_socket = channel.waiting.popleft()  # Channels are FIFO
+                awaiting = self.clients_awaiting_peer.get(client_socket)
+                if awaiting is None:  # The client disconnected meanwhile
+                    continue
+                self._send_to_client(client_socket, payload)  # Relay the raw reply
+                awaiting[1] -= 1
+                if awaiting[1] == 0:  # Everything forwarded is answered: resume the client
+                    del self.clients_awaiting_peer[client_socket]
+                    args = self.deferred_commands.pop(client_socket, None)  # The command that had to wait
+                    if args is not None:
+                        self._execute_command(client_socket, args)
+                    if client_socket in self.client_sockets:  # It may have been QUIT
+                        self._process_client_buffer(client_socket)  # Run the commands that queued up behind it
+
+    def _flush_peer(self, channel):  # Method to write queued frames to another worker
+        """Write a peer channel's output without blocking; wait for write readiness if the socketpair is full."""
+        while channel.outbuffer:
+            try:
+                sent = channel.sock.send(channel.outbuffer)  # Non-blocking send
+            except (BlockingIOError, InterruptedError):  # Socketpair buffer full
+                break
+            del channel.outbuffer[:sent]
+        if self.selector is not None:  # Write interest only while frames are pending
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE if channel.outbuffer else selectors.EVENT_READ
+            if self.selector.get_key(channel.sock).events != events:
+                self.selector.modify(channel.sock, events)
+
+    def _close_client_later(self, client_socket):  # Client.close: CLIENT KILL, timeout, output buffer limit
+        """Stop serving a client now and close its connection at the end of the loop iteration."""
+        if client_socket in self.client_sockets:
+            self.client_sockets.remove(client_socket)  # Its events, pipelined commands and pushes are skipped from here on
+            self.core.metrics.connected_clients -= 1  # INFO clients
+            self.client_outbuffers.pop(client_socket, None)  # Pending output is dropped, as Redis does
+            client = self.client_states[client_socket]
+            if client.blocked_keys:  # A push must not be handed to a connection that is going away
+                self.core.blocked.unblock(client)
+            self.clients_to_close.add(client_socket)
+
+    def _close_pending_clients(self):  # Method to close the connections killed during a loop iteration
+        """Disconnect the clients _close_client_later() marked."""
+        while self.clients_to_close:
+            self._disconnect_client(self.clients_to_close.pop())
+
+    def _client_buffers(self, client_socket):  # Client.buffers, for CLIENT LIST
+        """Return the client's unparsed input bytes, pending output bytes and the memory allocated for both."""
+        parser = self.client_parsers[client_socket]
+        outbuffer = self.client_outbuffers.get(client_socket) or bytearray()
+        return parser.pending(), len(outbuffer), sys.getsizeof(parser.buffer) + sys.getsizeof(outbuffer)
 
     def _disconnect_client(self, client_socket):  # Method to disconnect a client
         """Remove a disconnected client from all records."""
-        address = self.client_addresses.get(client_socket, "Unknown")  # Get the client's address for logging
-        print(f"Disconnected {address}")  # Print a message about the disconnection
-
         if client_socket in self.client_sockets:  # If the client is in our set of sockets
             self.client_sockets.remove(client_socket)  # Remove it
-        self.client_buffers.pop(client_socket, None)  # Remove the client's buffer
+            self.core.metrics.connected_clients -= 1  # INFO clients
+        self.client_parsers.pop(client_socket, None)  # Remove the client's parser and input buffer
         self.client_addresses.pop(client_socket, None)  # Remove the client's address mapping
+        self.client_outbuffers.pop(client_socket, None)  # Drop any output that was still pending
+        self.clients_pending_write.discard(client_socket)  # Nothing left to flush for this client
+        self.clients_awaiting_peer.pop(client_socket, None)  # A reply still in flight from another worker is dropped on arrival
+        self.deferred_commands.pop(client_socket, None)  # And so is the command waiting behind it
+        client = self.client_states.pop(client_socket, None)  # Forget the connection state
+        if client is not None:
+            self.core.client_closed(client)  # Drop its subscriptions: O(its channels), not O(all channels)
+        if self.selector is not None:  # Remove the persistent registration before closing the fd
+            try:
+                self.selector.unregister(client_socket)  # Stop watching the socket
+            except (KeyError, ValueError):  # Already unregistered or never registered
+                pass
 
         try:
             client_socket.close()  # Close the socket connection
@@ -179,5 +470,10 @@ class RedisLikeServer:  # Defines the main class for our Redis-like server
 
 
 if __name__ == "__main__":  # If this script is executed directly
-    server = RedisLikeServer()  # Create an instance of the server
-    server.start()  # Start the server
+    config = parse_config_args(sys.argv[1:])  # e.g. --port 6380 --appendonly yes --appendfsync always
+    host, port = config.pop("host", "localhost"), int(config.pop("port", 6379))  # Where to listen
+    if config.get("cluster-workers"):  # e.g. --cluster-workers 4: one event-loop process per core, keys sharded by hash slot
+        run_cluster(RedisLikeServer, host, port, config)
+    else:
+        server = RedisLikeServer(host=host, port=port, config=config)  # Create an instance of the server
+        server.start()  # Start the server
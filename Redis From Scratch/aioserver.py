@@ -0,0 +1,257 @@
+"""asyncio front end: the same CommandCore as RedisLikeServer, served by asyncio.Protocol.
+
+Run it with `python aioserver.py --port 6380` (same options as the select
+server), or embed it in an existing asyncio application:
+
+    server = AsyncRedisServer(port=6380)
+    await server.start()        # Listening; returns immediately
+    ...
+    server.close()
+    await server.wait_closed()
+
+Commands run as their bytes arrive (data_received, no stream readers).
+The replies of one read are written with a single transport.write()
+right after the AOF buffer, as the reactor does at the end of its loop
+iteration. Output for other connections (PUBLISH, a push serving a
+BLPOP) is queued and written by one callback at the end of the loop
+iteration, which also times out blocked clients. The transport buffers
+what the socket does not take; above its high-water mark pause_writing()
+stops reading and executing that client's commands until
+resume_writing().
+
+uvloop is used when it is installed and use_uvloop is left on. Sharded
+mode (--cluster-workers) needs the select server.
+"""
+import asyncio  # Event loop, transports and protocols
+import sys  # Command-line configuration
+import time  # Last interaction of a client
+
+from commands import Client, CommandCore, parse_config_args  # The command table and dispatcher shared by every front end
+from resp import ProtocolError, RespParser, encode_error  # RESP2 request parser and reply encoders
+
+try:
+    import uvloop  # Optional libuv-based event loop
+except ImportError:  # Plain asyncio works the same, only slower
+    uvloop = None
+
+
+class RedisProtocol(asyncio.Protocol):  # One instance per connection
+    """Parses requests, executes them and queues the replies of one client."""
+
+    def __init__(self, server):
+        self.server = server  # The AsyncRedisServer that owns the connection
+        self.core = server.core  # Shortcut for the hot path
+        self.transport = None  # Set by connection_made()
+        self.parser = RespParser()  # Incremental request parser (holds the input buffer)
+        self.client = None  # Connection state the command handlers see
+        self.replies = []  # Encoded replies produced since the last flush
+        self.write_paused = False  # The transport's buffer is above its high-water mark
+        self.close_after_flush = False  # Protocol error: close once the error reply is written
+        self.in_batch = False  # process() is running: replies are written when it returns
+        self.closed = False  # connection_lost() ran or close() was requested
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.client = Client(transport.get_extra_info("peername"), send=self.send, conn=self)  # send() lets PUBLISH and BLPOP reply later
+        self.client.close = self.kill  # CLIENT KILL, timeout
+        self.client.buffers = self.buffers  # CLIENT LIST
+        self.server.connections.add(self)
+        self.core.metrics.connected_clients += 1  # INFO clients
+        self.core.metrics.connections_received += 1  # INFO stats
+        if not self.core.add_client(self.client):  # maxclients connections are already open
+            transport.write(b"-ERR max number of clients reached\r\n")
+            self.closed = True
+            transport.close()
+
+    def data_received(self, data):  # Called with whatever one read returned
+        self.client.last_interaction = time.monotonic()  # Idle time and timeout are measured from here
+        self.parser.feed(data)  # Append to the input buffer
+        self.process()  # Execute every complete command
+        if self.parser.pending() > self.core.config["client-query-buffer-limit"] and not self.closed:  # e.g. a line that never ends
+            print(f"Closing client {self.client.address}: query buffer over client-query-buffer-limit")
+            self.kill()
+
+    def process(self):  # Also called when a blocked client is served or writing resumes
+        """Execute the complete commands in the input buffer until the client blocks, pauses or closes."""
+        parser = self.parser
+        client = self.client
+        execute = self.core.execute
+        self.in_batch = True
+        while not (self.closed or self.write_paused or client.blocked_keys or client.close_after_reply or self.close_after_flush):
+            try:
+                args = parser.next_command()  # One command, or None if incomplete
+            except ProtocolError as e:  # The stream cannot be resynchronised
+                self.send(encode_error(f"ERR Protocol error: {e}"))
+                self.close_after_flush = True
+                break
+            if args is None:  # The partial tail stays in the parser
+                break
+            reply = execute(client, args)  # Dispatch through the command table
+            if reply is not None:  # None: the client blocked and is answered later through send()
+                self.send(reply)
+        self.in_batch = False
+        self.core.before_sleep()  # The AOF buffer reaches the log before the replies leave
+        self.flush()
+        if client.blocked_keys or self.core.blocked.unblocked:  # Arm its timeout, or resume the clients this batch served
+            self.server.schedule_flush()
+
+    def send(self, data):  # Client.send: replies, pub/sub messages, BLPOP results
+        """Queue an encoded reply for the end of the loop iteration."""
+        if self.closed:
+            return
+        if not self.replies and not self.in_batch:  # Pushed from elsewhere: written at the end of the loop iteration
+            self.server.pending_flush.add(self)
+            self.server.schedule_flush()
+        self.replies.append(data)
+
+    def flush(self):  # Called after the AOF is written
+        """Hand the queued replies to the transport in one write, then close if QUIT or an error asked for it."""
+        if self.closed:
+            return
+        self.server.pending_flush.discard(self)
+        replies = self.replies
+        if replies:
+            self.transport.write(replies[0] if len(replies) == 1 else b"".join(replies))  # The transport buffers what the socket does not take
+            self.replies = []
+            size = self.transport.get_write_buffer_size()  # What the client has not read yet
+            if size > self.core.output_limit_floor and self.core.output_limit_exceeded(self.client, size):
+                print(f"Closing client {self.client.address}: output buffer over client-output-buffer-limit")
+                self.kill()
+                return
+        if self.client.close_after_reply or self.close_after_flush:
+            self.closed = True
+            self.transport.close()  # Closes once the buffered replies are written
+
+    def kill(self):  # Client.close: CLIENT KILL, timeout, buffer limits
+        """Drop the connection without writing what is still queued; connection_lost() cleans up."""
+        if not self.closed:
+            self.closed = True
+            self.replies = []
+            if self.client.blocked_keys:  # A push must not be handed to a connection that is going away
+                self.core.blocked.unblock(self.client)
+            self.transport.abort()
+
+    def buffers(self):  # Client.buffers, for CLIENT LIST
+        """Return unparsed input bytes, pending output bytes and the memory allocated for both."""
+        output = (self.transport.get_write_buffer_size() if not self.closed else 0) + sum(len(reply) for reply in self.replies)
+        return self.parser.pending(), output, sys.getsizeof(self.parser.buffer) + output
+
+    def pause_writing(self):  # The client is not reading its replies fast enough
+        self.write_paused = True
+        self.transport.pause_reading()  # Stop taking in commands whose replies would pile up
+
+    def resume_writing(self):  # The buffer drained below the low-water mark
+        self.write_paused = False
+        self.client.output_soft_since = 0.0  # A later backlog starts a fresh soft-limit period
+        self.client.output_allowance = min(self.client.output_allowance, self.transport.get_write_buffer_size())  # Only the unsent part of a snapshot stays exempt
+        self.transport.resume_reading()
+        self.process()  # Commands that arrived before the pause
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self.replies = []
+        self.server.connections.discard(self)
+        self.core.metrics.connected_clients -= 1
+        self.server.pending_flush.discard(self)
+        self.core.client_closed(self.client)  # Drop subscriptions and blocked-key registrations
+
+
+class AsyncRedisServer:  # asyncio counterpart of RedisLikeServer
+    """Serves a CommandCore on an asyncio event loop."""
+
+    def __init__(self, host='localhost', port=6379, config=None, backlog=128):
+        self.host = host  # The hostname or IP address to bind to
+        self.port = port  # The port to listen on (0 picks a free one; the real port is stored by start())
+        self.backlog = backlog  # Listen backlog
+        self.hz = 10  # How many times per second background tasks run
+        self.core = CommandCore(config)  # The dataset plus the table-driven command dispatcher
+        self.connections = set()  # Open RedisProtocol instances
+        self.pending_flush = set()  # Connections with replies queued during this loop iteration
+        self.flush_scheduled = False  # A _flush() callback is already queued
+        self.loop = None  # The running loop, set by start()
+        self.server = None  # asyncio.Server, set by start()
+        self.cron_handle = None  # Next _cron() call
+        self.blocked_handle = None  # Wake-up for the earliest BLPOP/BRPOP timeout
+
+    async def start(self):  # Embedding entry point
+        """Load the dataset, start listening and return; the loop serves clients from then on."""
+        self.loop = asyncio.get_running_loop()
+        self.core.load()  # Restore the dataset from disk before accepting clients
+        self.server = await self.loop.create_server(lambda: RedisProtocol(self), self.host, self.port,
+                                                    backlog=self.backlog, reuse_address=True)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.core.metrics.server.update(tcp_port=self.port, hz=self.hz, multiplexing_api=type(self.loop).__module__.split(".")[0])  # asyncio or uvloop
+        self.cron_handle = self.loop.call_later(1.0 / self.hz, self._cron)
+        print(f"asyncio Redis-like server listening on {self.host}:{self.port} ({type(self.loop).__module__} loop)")
+
+    async def serve_forever(self):  # Standalone entry point
+        """Start if needed and serve until cancelled."""
+        if self.server is None:
+            await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop listening, drop every connection and the background timers."""
+        if self.server is not None:
+            self.server.close()
+        for handle in (self.cron_handle, self.blocked_handle):
+            if handle is not None:
+                handle.cancel()
+        for protocol in list(self.connections):
+            protocol.transport.close()
+
+    async def wait_closed(self):
+        """Wait until the listening socket is closed."""
+        if self.server is not None:
+            await self.server.wait_closed()
+
+    def schedule_flush(self):  # Called whenever something will need writing
+        """Run _flush() once, after every callback of the current loop iteration."""
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.loop.call_soon(self._flush)
+
+    def _flush(self):  # End of a loop iteration that produced output outside data_received
+        """Time out blocked clients, resume served ones, write the AOF, then write every queued reply."""
+        self.flush_scheduled = False
+        core = self.core
+        core.expire_blocked()  # Nil replies for clients whose timeout elapsed
+        unblocked = core.take_unblocked()
+        while unblocked:  # Resumed commands may unblock (or block) further clients
+            for client in unblocked:
+                if not client.conn.closed:
+                    client.conn.process()  # Pipelined commands sent while it was blocked
+            unblocked = core.take_unblocked()
+        core.before_sleep()  # The AOF buffer reaches the log before any reply leaves
+        pending, self.pending_flush = self.pending_flush, set()
+        for protocol in pending:
+            protocol.flush()
+        if self.blocked_handle is not None:
+            self.blocked_handle.cancel()
+            self.blocked_handle = None
+        timeout = core.blocked_timeout()  # Earliest BLPOP/BRPOP deadline, if any
+        if timeout is not None:
+            self.blocked_handle = self.loop.call_later(timeout, self.schedule_flush)
+
+    def _cron(self):  # hz times per second
+        self.core.cron()  # Active expiry and other housekeeping
+        self.cron_handle = self.loop.call_later(1.0 / self.hz, self._cron)
+
+
+def run(server, use_uvloop=True):  # Blocking entry point for the command line
+    """Serve on a fresh event loop (uvloop if installed and wanted) until Ctrl+C."""
+    if use_uvloop and uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print("\nShutting down server...")
+
+
+if __name__ == "__main__":  # If this script is executed directly
+    config = parse_config_args(sys.argv[1:])  # e.g. --port 6380 --appendonly yes
+    host, port = config.pop("host", "localhost"), int(config.pop("port", 6379))  # Where to listen
+    run(AsyncRedisServer(host=host, port=port, config=config))
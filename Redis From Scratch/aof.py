@@ -0,0 +1,220 @@
+"""Append-only file persistence.
+
+Write commands are appended to an in-process buffer by feed() and written
+to the file once per event-loop iteration by flush(), before replies are
+sent. The appendfsync policy decides when the data is forced to disk:
+"always" fsyncs on every flush, "everysec" hands the fsync to a
+background thread at most once per second (the thread also wakes up by
+itself each second, so writes followed by silence still reach the disk),
+"no" leaves it to the OS.
+
+BGREWRITEAOF forks a child that writes the smallest command sequence that
+recreates the dataset. Commands executed meanwhile are also kept in a
+rewrite buffer, which is appended to the new file before it atomically
+replaces the old one.
+"""
+import os  # fork, fsync, rename
+import threading  # Background fsync thread
+import time  # fsync scheduling
+
+from hashes import Hash  # Hash values
+from quicklist import QuickList  # List values
+from resp import RespParser, encode_command  # The same parser clients go through, and the request encoder
+from sets import Set  # Set values
+from zset import ZSet, format_score  # Sorted set values
+
+FSYNC_POLICIES = ("always", "everysec", "no")  # Valid appendfsync values
+LOAD_CHUNK = 1024 * 1024  # Bytes read per step while replaying
+REWRITE_ITEMS_PER_CMD = 64  # Elements per RPUSH/SADD/... in a rewritten log, so no single command gets huge
+
+
+class AppendOnlyFile:  # The AOF of one server
+    """Buffered command log with fsync policies and fork-based rewriting."""
+
+    def __init__(self, path, fsync_policy="everysec"):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"appendfsync must be one of {', '.join(FSYNC_POLICIES)}")
+        self.path = path  # Location of the log
+        self.fsync_policy = fsync_policy  # always | everysec | no
+        self.buffer = bytearray()  # Commands fed since the last flush
+        self.file = open(path, "ab", buffering=0)  # Unbuffered: flush() does exactly one write()
+        self.last_fsync = time.monotonic()  # When the last fsync was scheduled
+        self.fsync_lock = threading.Lock()  # Serialises fsync with the file swap at the end of a rewrite
+        self.fsync_pending = threading.Event()  # Set to wake the background fsync thread
+        self.unsynced = False  # Data was written since the last fsync started (everysec)
+        self.rewrite_child = None  # PID of the BGREWRITEAOF child, if one is running
+        self.rewrite_buffer = None  # Commands fed while the child is running
+        self.rewrite_temp = None  # File the child writes to
+        self.rewrites = 0  # Completed rewrites (stats)
+        if fsync_policy == "everysec":  # fsync must never run on the event-loop thread
+            threading.Thread(target=self._fsync_loop, name="aof-fsync", daemon=True).start()
+
+    def feed(self, args):  # Log one write command
+        """Append one command (list of bytes) to the log buffer."""
+        data = encode_command(*args)  # Same wire format clients use, so replay goes through the parser
+        self.buffer += data
+        if self.rewrite_buffer is not None:  # A rewrite is running: the child's snapshot misses this command
+            self.rewrite_buffer += data
+
+    def flush(self):  # Called once per event-loop iteration
+        """Write buffered commands to the file and apply the fsync policy."""
+        if not self.buffer:  # Nothing logged since the last flush
+            return
+        self.file.write(self.buffer)  # One write() per loop iteration
+        self.buffer.clear()
+        self.unsynced = True  # After the write: an fsync that clears it covers this data
+        if self.fsync_policy == "always":  # Durable before any reply is sent
+            os.fsync(self.file.fileno())
+        elif self.fsync_policy == "everysec":  # Let the background thread do it, at most once a second
+            now = time.monotonic()
+            if now - self.last_fsync >= 1.0:
+                self.last_fsync = now
+                self.fsync_pending.set()
+
+    def _fsync_loop(self):  # Background thread for appendfsync everysec
+        """fsync the log when the event loop asks for it, or each second while written data is unsynced."""
+        while True:
+            self.fsync_pending.wait(1.0)  # Until flush() requests an fsync, or a second passes without writes
+            self.fsync_pending.clear()
+            if not self.unsynced:
+                continue
+            with self.fsync_lock:  # The file may be swapped by a finishing rewrite
+                self.unsynced = False  # Before the fsync: later writes set it again
+                self.last_fsync = time.monotonic()
+                try:
+                    os.fsync(self.file.fileno())
+                except (OSError, ValueError):  # File closed during shutdown
+                    pass
+
+    def load(self, execute):  # Replay the log at startup
+        """Stream the log through RespParser, calling execute(args) for each command.
+
+        Returns the number of commands replayed. An incomplete command at
+        the end of the file (e.g. a crash mid-write) is truncated away.
+        """
+        parser = RespParser(max_inline_len=LOAD_CHUNK)  # Fresh parser for the file
+        commands = 0  # Commands replayed
+        offset = 0  # Bytes read so far
+        with open(self.path, "rb") as log:
+            while True:
+                chunk = log.read(LOAD_CHUNK)  # Bounded memory regardless of file size
+                if not chunk:
+                    break
+                offset += len(chunk)
+                parser.feed(chunk)
+                while True:
+                    args = parser.next_command()
+                    if args is None:  # Need more bytes
+                        break
+                    execute(args)
+                    commands += 1
+
+        if parser.pending():  # A partial command at the tail
+            valid = offset - parser.pending()  # End of the last complete command
+            print(f"AOF: truncating {parser.pending()} bytes of an incomplete command at offset {valid}")
+            self.file.truncate(valid)
+        return commands
+
+    def start_rewrite(self, snapshot):  # BGREWRITEAOF
+        """Fork a child that writes the commands produced by snapshot() to a temp file.
+
+        Returns False if a rewrite is already running. On platforms without
+        fork() the rewrite runs synchronously.
+        """
+        if self.rewrite_child is not None:
+            return False
+        self.flush()  # Everything before the fork goes to the old file
+        self.rewrite_temp = f"{self.path}.temp-rewrite-{os.getpid()}"
+        if not hasattr(os, "fork"):  # Windows: no copy-on-write snapshot available
+            write_commands(self.rewrite_temp, snapshot())
+            self.rewrite_buffer = bytearray()
+            self._install_rewrite()
+            return True
+
+        pid = os.fork()
+        if pid == 0:  # Child: serialise the copy-on-write view of the dataset and exit
+            status = 1
+            try:
+                write_commands(self.rewrite_temp, snapshot())
+                status = 0
+            finally:
+                os._exit(status)  # Skip the parent's cleanup handlers
+        self.rewrite_child = pid
+        self.rewrite_buffer = bytearray()  # Collect writes the child cannot see
+        return True
+
+    def check_rewrite(self):  # Called from the cron
+        """Finish a rewrite whose child has exited; return True when a rewrite completed."""
+        if self.rewrite_child is None:
+            return False
+        pid, status = os.waitpid(self.rewrite_child, os.WNOHANG)  # Non-blocking reap
+        if pid == 0:  # Still running
+            return False
+        self.rewrite_child = None
+        if os.waitstatus_to_exitcode(status) != 0:  # Child failed: keep the old log
+            print("AOF: background rewrite failed")
+            self.rewrite_buffer = None
+            try:
+                os.unlink(self.rewrite_temp)
+            except OSError:
+                pass
+            return False
+        self._install_rewrite()
+        return True
+
+    def _install_rewrite(self):  # Swap the rewritten log in
+        """Append the rewrite buffer to the new log and atomically replace the old one."""
+        self.flush()  # Old file is complete up to now
+        with open(self.rewrite_temp, "ab") as new_log:  # Writes made while the child ran
+            new_log.write(self.rewrite_buffer)
+            new_log.flush()
+            os.fsync(new_log.fileno())
+        self.rewrite_buffer = None
+        with self.fsync_lock:  # Don't let the fsync thread touch a closed file
+            os.replace(self.rewrite_temp, self.path)  # Atomic on POSIX
+            self.file.close()
+            self.file = open(self.path, "ab", buffering=0)
+        self.rewrites += 1
+        print("AOF: background rewrite finished")
+
+    def close(self):  # Shutdown
+        """Flush, fsync and close the log."""
+        self.flush()
+        with self.fsync_lock:
+            os.fsync(self.file.fileno())
+            self.file.close()
+
+
+def rewrite_value(key, value):  # Commands that recreate one key
+    """Yield the commands that recreate key with the given value."""
+    if value.__class__ is QuickList:
+        yield from batched(b"RPUSH", key, value)
+    elif value.__class__ is Hash:
+        yield from batched(b"HSET", key, (item for pair in value.items() for item in pair))  # Even batch size keeps pairs together
+    elif value.__class__ is Set:
+        yield from batched(b"SADD", key, value)
+    elif value.__class__ is ZSet:
+        yield from batched(b"ZADD", key, (item for member, score in value.items() for item in (format_score(score), member)))
+    else:
+        yield [b"SET", key, value]
+
+
+def batched(name, key, items):  # Split a container into bounded commands
+    """Yield [name, key, item, ...] commands of at most REWRITE_ITEMS_PER_CMD items each."""
+    batch = [name, key]
+    for item in items:
+        batch.append(item)
+        if len(batch) == REWRITE_ITEMS_PER_CMD + 2:
+            yield batch
+            batch = [name, key]
+    if len(batch) > 2:
+        yield batch
+
+
+def write_commands(path, commands):  # Used by the rewrite child
+    """Write an iterable of commands to path and fsync it."""
+    with open(path, "wb") as out:  # Buffered writes: the child only writes
+        for args in commands:
+            out.write(encode_command(*args))
+        out.flush()
+        os.fsync(out.fileno())
@@ -0,0 +1,730 @@
+"""Micro-benchmarks for the Redis-like server components.
+
+Run all of them with `python benchmarks.py`, or pick some by name:
+`python benchmarks.py parser`.
+"""
+import asyncio  # Event loop for the asyncio engine
+import functools  # Bound callbacks of simulated clients
+import importlib.util  # Load server scripts whose file names contain spaces
+import json  # Baseline snapshot format
+import multiprocessing  # Load from several client processes
+import os  # Paths relative to this file
+import pickle  # Baseline snapshot format
+import random  # Random query positions
+import socket  # Benchmark clients
+import subprocess  # Sharded server in its own process tree
+import sys  # Command-line arguments
+import tempfile  # Scratch directory for snapshot files
+import threading  # Run a server in the background of the benchmark process
+import time  # High-resolution timers
+import tracemalloc  # Real allocation sizes for the encoding comparison
+
+import aioserver  # The asyncio engine under test
+import client as client_library  # Pooled client library under test
+import hyperloglog  # PFCOUNT merges under test
+import rdb  # The binary snapshot format under test
+import scripting  # Script compilation and cache under test
+from cluster import ClusterState, key_hash_slot  # Slot layout of the sharded mode
+from commands import Client, CommandCore  # The single-lock threaded server the handler pool replaces
+from hashes import Hash  # Small-hash encoding under test
+from resp import RespParser, encode_bulk, encode_command  # The RESP parser under test
+from storage import Keyspace  # Snapshot target
+from strings import string_object  # String encodings under test
+from zset import ZSet  # Sorted set under test
+
+
+def legacy_line_parser(chunks):  # The str/line buffer that RedisLikeServer used before the RESP parser
+    """Split an inline pipeline the old way: decode, normalize CRLF, split one line at a time."""
+    commands = 0  # Number of commands found
+    buffer = ""  # Accumulated partial input
+    for chunk in chunks:  # One iteration per recv()
+        buffer += chunk.decode('utf-8')  # Decode and append
+        buffer = buffer.replace('\r\n', '\n')  # Normalize over the whole accumulated buffer
+        while '\n' in buffer:  # One split (and remainder copy) per command
+            line, buffer = buffer.split('\n', 1)
+            message = line.strip()
+            if message:
+                message.split()  # What _execute_command did with each line
+                commands += 1
+    return commands
+
+
+def resp_parser(chunks):  # The incremental parser
+    """Parse a pipeline with RespParser, one feed() per recv()."""
+    parser = RespParser()  # Fresh parser, as for a new connection
+    commands = 0  # Number of commands found
+    for chunk in chunks:  # One iteration per recv()
+        parser.feed(chunk)  # Append to the input buffer
+        while parser.next_command() is not None:  # Drain every complete command
+            commands += 1
+    return commands
+
+
+def chunked(data, size):  # Simulate recv() boundaries
+    """Split data into size-byte chunks."""
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def timed(func, *args, repeat=3):  # Best-of-N wall time
+    """Return the best wall time of repeat runs, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_parser(commands=10000):  # Parser throughput on a 10k-command pipeline
+    """Compare the legacy line parser with RespParser on one large pipeline."""
+    inline = b"".join(b"SET key:%d value:%d\r\n" % (i, i) for i in range(commands))  # Inline pipeline
+    resp = b"".join(encode_command("SET", "key:%d" % i, "value:%d" % i) for i in range(commands))  # RESP pipeline
+
+    for recv_size in (4096, 65536, len(resp)):  # recv()-sized chunks, then the whole pipeline at once
+        inline_chunks = chunked(inline, recv_size)
+        resp_chunks = chunked(resp, recv_size)
+        assert legacy_line_parser(inline_chunks) == resp_parser(resp_chunks) == resp_parser(inline_chunks) == commands
+
+        legacy = timed(legacy_line_parser, inline_chunks)
+        inline_new = timed(resp_parser, inline_chunks)
+        resp_new = timed(resp_parser, resp_chunks)
+        print(f"parser  {commands} cmds, recv={recv_size:>7}: legacy inline {legacy * 1000:8.2f} ms | "
+              f"resp inline {inline_new * 1000:8.2f} ms ({legacy / inline_new:4.1f}x) | "
+              f"resp multibulk {resp_new * 1000:8.2f} ms")
+
+
+def load_script(filename):  # Import one of the server scripts as a module
+    """Load a script from this directory as a module (the file names are not importable)."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)  # Absolute path of the script
+    spec = importlib.util.spec_from_file_location(os.path.splitext(filename)[0].replace(" ", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def free_port():  # Ask the kernel for an unused TCP port
+    """Return a TCP port that is free on localhost."""
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(**options):  # Run a RedisLikeServer on a background thread
+    """Start RedisLikeServer in a daemon thread and return it once it accepts connections."""
+    server = load_script("Building a Redis-Like Server.py").RedisLikeServer(port=free_port(), **options)
+    threading.Thread(target=server.start, daemon=True).start()
+    for _ in range(100):  # Wait until the listening socket is up
+        try:
+            socket.create_connection(("localhost", server.port)).close()
+            return server
+        except OSError:
+            time.sleep(0.02)
+    raise RuntimeError("server did not start")
+
+
+def run_pipeline(port, depth, total):  # Send `total` GETs in batches of `depth`
+    """Return ops/sec for GETs issued in pipelined batches of the given depth."""
+    reply = encode_bulk(b"bar")  # Every GET returns the same reply
+    batch = encode_command("GET", "foo") * depth  # One pipelined batch
+    expected = len(reply) * depth  # Bytes to read per batch
+    with socket.create_connection(("localhost", port)) as sock:
+        sock.sendall(encode_command("SET", "foo", "bar"))
+        sock.recv(64)
+        start = time.perf_counter()
+        for _ in range(total // depth):
+            sock.sendall(batch)
+            received = 0
+            while received < expected:  # Wait for every reply of the batch
+                chunk = sock.recv(65536)
+                if not chunk:
+                    raise RuntimeError("server closed the connection")
+                received += len(chunk)
+        return (total // depth) * depth / (time.perf_counter() - start)
+
+
+def bench_pipeline(total=20000):  # Reply coalescing vs one send() per reply
+    """Compare GET throughput with and without reply coalescing at pipeline depths 1/16/128."""
+    servers = {"per-reply send": start_server(coalesce_replies=False), "coalesced": start_server()}
+    for depth in (1, 16, 128):
+        results = {name: run_pipeline(server.port, depth, total) for name, server in servers.items()}
+        print(f"pipeline depth {depth:>3}: " + " | ".join(f"{name} {ops:10.0f} ops/s" for name, ops in results.items())
+              + f" | gain {results['coalesced'] / results['per-reply send']:4.2f}x")
+    for server in servers.values():
+        server.running = False
+
+
+def bench_rdb(keys=1000000):  # Snapshot save/load times
+    """Compare rdb.save/load with pickle and JSON dumps of the same keyspace."""
+    db = Keyspace()
+    for i in range(keys):  # Mix of integer-like and text values, like a typical cache
+        db.data[b"key:%d" % i] = b"%d" % i if i % 2 else b"value:%d" % i
+    with tempfile.TemporaryDirectory() as scratch:
+        path = os.path.join(scratch, "dump")
+
+        def save_rdb():
+            rdb.save(path + ".rdb", db.data, db.expires, 0)
+
+        def load_rdb():
+            rdb.load(path + ".rdb", Keyspace())
+
+        def save_pickle():
+            with open(path + ".pickle", "wb") as out:
+                pickle.dump(db.data, out, protocol=pickle.HIGHEST_PROTOCOL)
+
+        def load_pickle():
+            with open(path + ".pickle", "rb") as src:
+                pickle.load(src)
+
+        def save_json():  # JSON cannot hold bytes: decode everything first, as a JSON dump would have to
+            with open(path + ".json", "w") as out:
+                json.dump({key.decode(): value.decode() for key, value in db.data.items()}, out)
+
+        def load_json():
+            with open(path + ".json") as src:
+                {key.encode(): value.encode() for key, value in json.load(src).items()}
+
+        for name, save, load, suffix in (("rdb", save_rdb, load_rdb, ".rdb"), ("pickle", save_pickle, load_pickle, ".pickle"),
+                                         ("json", save_json, load_json, ".json")):
+            save_time = timed(save, repeat=1)
+            load_time = timed(load, repeat=1)
+            size = os.path.getsize(path + suffix)
+            print(f"snapshot {keys} keys, {name:>6}: save {save_time:6.2f} s | load {load_time:6.2f} s | {size / 1e6:7.1f} MB")
+
+
+def bench_small_hashes(count=100000):  # Memory of many tiny hashes
+    """Compare the allocated memory of `count` 3-field hashes as listpacks and as dicts."""
+    fields = [(b"name", b"user:%d"), (b"visits", b"%d"), (b"plan", b"free")]  # A typical per-user record
+
+    def build(factory, store):
+        tracemalloc.start()
+        values = []
+        for i in range(count):
+            value = factory()
+            for field, template in fields:
+                store(value, field, template % i if b"%" in template else template)
+            values.append(value)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size
+
+    listpack_size = build(Hash, Hash.set)
+    dict_size = build(dict, dict.__setitem__)
+    print(f"hashes  {count} x 3 fields: listpack {listpack_size / count:6.0f} B/hash | dict {dict_size / count:6.0f} B/hash "
+          f"| {dict_size / listpack_size:4.1f}x smaller")
+
+
+def bench_zset(members=1000000, queries=2000):  # Ranked queries on a large sorted set
+    """Time inserts and rank/score range queries on a sorted set with `members` members."""
+    scores = [random.random() * members for _ in range(members)]
+    zset = ZSet()
+    start = time.perf_counter()
+    for i, score in enumerate(scores):  # One O(log n) skiplist insert each, as ZADD does
+        zset.set(b"member:%d" % i, score)
+    build = time.perf_counter() - start
+    print(f"zset    {members} ZADDs: {build:6.2f} s ({build / members * 1e6:5.1f} us/insert)")
+
+    ranks = [random.randrange(members - 100) for _ in range(queries)]
+    lows = [random.random() * members for _ in range(queries)]
+    members_to_rank = [b"member:%d" % random.randrange(members) for _ in range(queries)]
+    cases = (
+        ("ZRANGE start start+9", lambda i: zset.range_by_rank(ranks[i], ranks[i] + 9)),
+        ("ZRANGE start start+99", lambda i: zset.range_by_rank(ranks[i], ranks[i] + 99)),
+        ("ZRANGEBYSCORE LIMIT 0 10", lambda i: zset.range_by_score(lows[i], False, float("inf"), False, 0, 10)),
+        ("ZRANK", lambda i: zset.rank(members_to_rank[i])),
+        ("ZSCORE", lambda i: zset.score(members_to_rank[i])),
+    )
+    for name, query in cases:
+        start = time.perf_counter()
+        for i in range(queries):
+            query(i)
+        elapsed = (time.perf_counter() - start) / queries
+        print(f"zset    {members} members, {name:<26}: {elapsed * 1e6:8.1f} us/query")
+
+
+def cluster_client(port, keys, total, depth, results):  # Runs in a client process
+    """Issue `total` pipelined SET/GET pairs over `keys` against port and report ops/sec on results."""
+    batch = b"".join(encode_command("SET", key, "value") + encode_command("GET", key) for key in keys[:depth // 2])
+    expected = len(b"+OK\r\n$5\r\nvalue\r\n") * (depth // 2)  # Bytes of replies per batch
+    with socket.create_connection(("localhost", port)) as sock:
+        start = time.perf_counter()
+        for _ in range(total // depth):
+            sock.sendall(batch)
+            received = 0
+            while received < expected:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    raise RuntimeError("server closed the connection")
+                received += len(chunk)
+        results.put((total // depth) * depth / (time.perf_counter() - start))
+
+
+def bench_cluster(total=40000, depth=32):  # Sharded mode scaling
+    """Compare aggregate GET/SET throughput of 1 worker with one worker per core, cluster-aware and forwarding."""
+    cores = os.cpu_count() or 1
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Building a Redis-Like Server.py")
+    clients = 2 * max(cores, 2)  # The same client load for every layout
+    print(f"cluster {cores} CPU core(s) here; throughput can only scale up to that many workers")
+    for workers, redirect in ((1, "moved"), (max(cores, 2), "moved"), (max(cores, 2), "forward")):
+        port = free_port()
+        server = subprocess.Popen([sys.executable, script, "--port", str(port), "--cluster-workers", str(workers),
+                                   "--cluster-redirect", redirect, "--dir", tempfile.mkdtemp()], stdout=subprocess.DEVNULL)
+        try:
+            time.sleep(1.0)  # Let every worker bind
+            layout = ClusterState(0, workers, "localhost", port)
+            results = multiprocessing.Queue()
+            processes = []
+            for client in range(clients):
+                owner = client % workers
+                if redirect == "moved":  # Cluster-aware: keys of one worker, sent to that worker's own port
+                    keys = [key for key in (f"key:{client}:{i}" for i in range(depth * workers * 4))
+                            if layout.slot_owner[key_hash_slot(key.encode())] == owner]
+                    target = layout.port_of(owner)
+                else:  # Plain client: any keys, the shared port, forwarding inside the cluster
+                    keys = [f"key:{client}:{i}" for i in range(depth)]
+                    target = port
+                processes.append(multiprocessing.Process(target=cluster_client, args=(target, keys, total, depth, results)))
+            for process in processes:
+                process.start()
+            ops = sum(results.get() for _ in processes)
+            for process in processes:
+                process.join()
+            print(f"cluster {workers} worker(s), {redirect:>7}, {clients} clients: {ops:10.0f} ops/s")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+class LegacyThreadedServer:  # minimal_tcp-server.py before the handler pool, kept for comparison
+    """One thread per connection, one lock around one CommandCore, a print per received message."""
+
+    def __init__(self, port, log_file):
+        self.server_socket = socket.create_server(("localhost", port), backlog=5)
+        self.core = CommandCore()
+        self.lock = threading.Lock()
+        self.log_file = log_file  # Where the per-message prints go (a file, so the benchmark output stays readable)
+
+    def handle_client(self, conn, addr):
+        buffer = ""
+        client = Client(addr)
+        with conn:
+            while True:
+                data = conn.recv(1024)
+                if not data:
+                    return
+                buffer += data.decode(errors="ignore")
+                while "\n" in buffer:
+                    line, buffer = buffer.split("\n", 1)
+                    message = line.strip()
+                    if not message:
+                        continue
+                    print(f"Received from {addr}: {message}", file=self.log_file, flush=True)
+                    with self.lock:
+                        reply = self.core.execute(client, message.encode().split())
+                        self.core.before_sleep()
+                    conn.sendall(reply)
+
+    def run(self):
+        while True:
+            conn, addr = self.server_socket.accept()
+            threading.Thread(target=self.handle_client, args=(conn, addr), daemon=True).start()
+
+
+def threaded_client(port, connections, total, barrier, results):  # Runs in a client process
+    """Keep one inline SET or GET in flight on each of `connections` sockets for `total` requests; report the finish time."""
+    socks = [socket.create_connection(("localhost", port)) for _ in range(connections)]
+    requests = [(b"SET key:%d:%d value\r\n" % (os.getpid(), i), b"GET key:%d:%d\r\n" % (os.getpid(), i)) for i in range(connections)]
+    barrier.wait()  # Every client is connected: start together
+    for round_number in range(total // connections):  # Every socket has one request outstanding per round
+        for sock, request in zip(socks, requests):
+            sock.sendall(request[round_number % 2])
+        for sock in socks:
+            if not sock.recv(64):
+                raise RuntimeError("server closed the connection")
+    results.put(time.time())
+    for sock in socks:
+        sock.close()
+
+
+def storm_throughput(port, connections, total, processes):  # Aggregate ops/sec of several client processes
+    """Run threaded_client in `processes` processes against port; return the aggregate ops/sec and the thread count under load."""
+    barrier = multiprocessing.Barrier(processes + 1)
+    finished = multiprocessing.Queue()
+    clients = [multiprocessing.Process(target=threaded_client, args=(port, connections, total, barrier, finished))
+               for _ in range(processes)]
+    for client in clients:
+        client.start()
+    barrier.wait()
+    start = time.time()
+    threads = threading.active_count()  # Every client is connected by now
+    end = max(finished.get() for _ in clients)  # Aggregate throughput: until the last client is done
+    for client in clients:
+        client.join()
+    return processes * (total // connections) * connections / (end - start), threads
+
+
+def bench_threaded(total=20000, processes=4):  # Connection storm against the threaded front end
+    """Compare thread-per-connection with one global lock against the handler pool with a lock-striped store."""
+    module = load_script("minimal_tcp-server.py")
+    with tempfile.TemporaryDirectory() as directory, open(os.path.join(directory, "messages.log"), "w") as log_file:
+        for connections in (8, 64, 256):  # Per client process
+            results, thread_counts = {}, {}
+            for name in ("thread per connection", "pool + 16 shards"):
+                port = free_port()
+                if name == "thread per connection":
+                    server = LegacyThreadedServer(port, log_file)
+                else:
+                    server = module.TCPServer(port=port, config={"dir": directory})
+                    server.run = server.pool.serve_forever  # Skip loading and the console log listener
+                threading.Thread(target=server.run, daemon=True).start()
+                results[name], thread_counts[name] = storm_throughput(port, connections, total, processes)
+                if name == "thread per connection":
+                    server.server_socket.close()  # Its accept thread dies with the next accept()
+                else:
+                    server.pool.stop()
+                    server.server_socket.close()
+            print(f"threaded {processes * connections:>5} connections: " + " | ".join(f"{name} {ops:8.0f} ops/s ({thread_counts[name]} threads)" for name, ops in results.items())
+                  + f" | gain {results['pool + 16 shards'] / results['thread per connection']:4.2f}x")
+
+
+def start_async_server(use_uvloop=False, **options):  # Run an AsyncRedisServer on its own loop in a background thread
+    """Start AsyncRedisServer on a new event loop in a daemon thread and return it once it listens."""
+    server = aioserver.AsyncRedisServer(port=0, **options)
+    ready = threading.Event()
+
+    def serve():
+        loop = aioserver.uvloop.new_event_loop() if use_uvloop else asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, daemon=True).start()
+    ready.wait()
+    return server
+
+
+def bench_asyncio(total=20000, processes=4, connections=64):  # Engine head-to-head
+    """Compare the selectors reactor with the asyncio.Protocol engine (and uvloop when installed)."""
+    with tempfile.TemporaryDirectory() as directory:
+        servers = {"select": start_server(config={"dir": directory}).port,
+                   "asyncio": start_async_server(config={"dir": directory}).port}
+        if aioserver.uvloop is not None:
+            servers["uvloop"] = start_async_server(use_uvloop=True, config={"dir": directory}).port
+        else:
+            print("asyncio uvloop is not installed; comparing against the default asyncio loop only")
+        for depth in (1, 16, 128):  # One connection, pipelined
+            results = {name: run_pipeline(port, depth, total) for name, port in servers.items()}
+            print(f"asyncio pipeline depth {depth:>3}: " + " | ".join(f"{name} {ops:9.0f} ops/s" for name, ops in results.items()))
+        results = {name: storm_throughput(port, connections, total, processes)[0] for name, port in servers.items()}
+        print(f"asyncio {processes * connections} connections:  " + " | ".join(f"{name} {ops:9.0f} ops/s" for name, ops in results.items()))
+
+
+def round_trip(sock, request, expected):  # One request, wait for its whole reply
+    """Send request and read until `expected` bytes of reply arrived."""
+    sock.sendall(request)
+    received = 0
+    while received < expected:
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise RuntimeError("server closed the connection")
+        received += len(chunk)
+
+
+def bench_multikey(keys=100, rounds=200, fields=500000):  # Batched keys and lazy freeing
+    """Compare `keys` GET round trips with one MGET, then DEL with UNLINK of a hash with `fields` fields."""
+    with tempfile.TemporaryDirectory() as directory:
+        server = start_server(config={"dir": directory})
+        names = [b"key:%d" % i for i in range(keys)]
+        reply = encode_bulk(b"value")
+        with socket.create_connection(("localhost", server.port)) as sock:
+            round_trip(sock, encode_command("MSET", *[arg for name in names for arg in (name, b"value")]), 5)
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for name in names:  # One round trip per key
+                    round_trip(sock, encode_command("GET", name), len(reply))
+            single = (time.perf_counter() - start) / rounds
+            mget = encode_command("MGET", *names)
+            start = time.perf_counter()
+            for _ in range(rounds):
+                round_trip(sock, mget, len(b"*%d\r\n" % keys) + len(reply) * keys)
+            batched = (time.perf_counter() - start) / rounds
+        print(f"multikey {keys} keys: {keys} x GET {single * 1e3:7.2f} ms | MGET {batched * 1e3:7.2f} ms ({single / batched:4.1f}x)")
+
+    core = CommandCore({"dir": tempfile.gettempdir()})
+    client = Client()
+    for command in (b"DEL", b"UNLINK"):
+        for first in range(0, fields, 10000):  # Build the hash in bounded HSETs
+            core.execute(client, [b"HSET", b"big"] + [arg for i in range(first, min(first + 10000, fields)) for arg in (b"f%d" % i, b"v")])
+        start = time.perf_counter()
+        core.execute(client, [command, b"big"])
+        blocked = time.perf_counter() - start
+        steps = 0
+        start = time.perf_counter()
+        while core.lazyfree.pending:  # What the cron does in the background, one slice per tick
+            core.lazyfree.step()
+            steps += 1
+        print(f"multikey {command.decode():<6} of a {fields}-field hash: command {blocked * 1e3:8.2f} ms"
+              + (f" | then {steps} cron slices, {(time.perf_counter() - start) * 1e3:6.1f} ms in total" if steps else ""))
+
+
+def bench_scan(keys=1000000):  # Cursor iteration vs one blocking pass
+    """Compare one KEYS-style pass over `keys` keys with SCAN calls at several COUNTs (worst call and whole scan)."""
+    core = CommandCore({"dir": tempfile.gettempdir()})
+    client = Client()
+    for i in range(keys):
+        core.db.set(b"key:%d" % i, b"value")
+    start = time.perf_counter()
+    matched = [key for key in core.db.data if key.startswith(b"key:1")]  # What a KEYS key:1* would hold the loop for
+    print(f"scan    {keys} keys, one blocking pass: {(time.perf_counter() - start) * 1e3:8.1f} ms ({len(matched)} matches)")
+    for count in (10, 100, 1000):
+        latencies, total, cursor = [], time.perf_counter(), b"0"
+        while True:
+            start = time.perf_counter()
+            reply = core.execute(client, [b"SCAN", cursor, b"MATCH", b"key:1*", b"COUNT", b"%d" % count])
+            latencies.append(time.perf_counter() - start)
+            cursor = reply.split(b"\r\n", 3)[2]
+            if cursor == b"0":
+                break
+        latencies.sort()
+        print(f"scan    COUNT {count:>4}: p99 call {latencies[len(latencies) * 99 // 100] * 1e6:7.1f} us, worst {latencies[-1] * 1e6:8.1f} us"
+              f" | {len(latencies)} calls, {(time.perf_counter() - total) * 1e3:7.1f} ms in total")
+
+
+def bench_stats(total=200000, rounds=5):  # Cost of the per-command instrumentation
+    """Time CommandCore.execute of GET with latency-tracking on and off, alternating rounds to even out noise."""
+    core = CommandCore({"dir": tempfile.gettempdir()})
+    client = Client()
+    core.execute(client, [b"SET", b"key", b"value"])
+    args = [b"GET", b"key"]
+    best = {b"yes": float("inf"), b"no": float("inf")}
+    for _ in range(rounds):
+        for setting in best:
+            core.execute(client, [b"CONFIG", b"SET", b"latency-tracking", setting])
+            execute = core.execute
+            start = time.perf_counter_ns()
+            for _ in range(total):
+                execute(client, args)
+            best[setting] = min(best[setting], (time.perf_counter_ns() - start) / total)
+    print(f"stats GET execute: latency-tracking no {best[b'no']:6.0f} ns | yes {best[b'yes']:6.0f} ns "
+          f"(+{best[b'yes'] - best[b'no']:4.0f} ns per command)")
+
+
+def wait_for(condition, timeout=60.0):  # Poll until condition() holds
+    """Return the seconds it took for condition() to become true."""
+    start = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start > timeout:
+            raise RuntimeError("timed out")
+        time.sleep(0.001)
+    return time.perf_counter() - start
+
+
+def bench_replication(keys=200000, writes=1000):  # Full sync vs partial resync after a blip
+    """Time a replica's full sync of `keys` keys, then its catch-up after a dropped connection missed `writes` writes."""
+    with tempfile.TemporaryDirectory() as primary_dir, tempfile.TemporaryDirectory() as replica_dir:
+        primary = start_server(config={"dir": primary_dir})
+        with socket.create_connection(("localhost", primary.port)) as sock:
+            for first in range(0, keys, 10000):
+                round_trip(sock, encode_command("MSET", *[arg for i in range(first, min(first + 10000, keys)) for arg in (b"key:%d" % i, b"value:%d" % i)]), 5)
+        replica = start_server(config={"dir": replica_dir, "replicaof": f"localhost {primary.port}"})
+        link = replica.core.replication.link
+        connected = lambda: link.state == link.CONNECTED
+        full = wait_for(connected)
+        snapshot = os.path.getsize(os.path.join(replica_dir, "dump.rdb"))
+        link.sock.shutdown(socket.SHUT_RDWR)  # A network blip: the replica reconnects from its cron
+        wait_for(lambda: not connected())
+        with socket.create_connection(("localhost", primary.port)) as sock:
+            for i in range(writes):  # Missed while disconnected, kept in the backlog
+                round_trip(sock, encode_command("SET", b"key:%d" % i, b"changed"), 5)
+        missed = primary.core.replication.offset - replica.core.replication.offset
+        link.next_attempt = 0  # Reconnect on the next cron tick instead of after RECONNECT_INTERVAL
+        partial = wait_for(lambda: connected() and replica.core.replication.offset == primary.core.replication.offset)
+        print(f"replication {keys} keys: full sync {full * 1e3:7.1f} ms ({snapshot / 1e6:5.1f} MB snapshot) | "
+              f"partial resync after {writes} missed writes {partial * 1e3:7.1f} ms ({missed / 1e3:5.1f} kB from the backlog)")
+
+
+def bench_timeouts(clients=100000, ticks=600, timeout=60):  # Idle timeouts: timer wheel vs scanning every client
+    """Time `ticks` cron ticks (0.1 s apart) of idle-timeout checks over `clients` connections, most of them busy."""
+    core = CommandCore({"dir": tempfile.gettempdir(), "maxclients": clients, "timeout": timeout})
+    start_time = time.monotonic()
+    closed = []
+    population = []
+    for index in range(clients):
+        client = Client(("127.0.0.1", index))
+        client.last_interaction = start_time - index * timeout / clients  # Spread over one timeout period
+        client.close = functools.partial(closed.append, client)
+        population.append(client)
+        core.add_client(client)
+    busy = population[: clients * 9 // 10]  # A tenth never send anything again
+    wheel_ns = scan_ns = 0
+    for tick in range(1, ticks + 1):
+        now = start_time + tick * 0.1
+        for client in busy[tick % 100::100]:  # Each busy client sends a command every 10 s
+            client.last_interaction = now
+        begin = time.perf_counter_ns()
+        core.close_idle_clients(now)
+        wheel_ns += time.perf_counter_ns() - begin
+        begin = time.perf_counter_ns()
+        idle = [client for client in population if now - client.last_interaction > timeout]  # What a per-tick scan costs
+        scan_ns += time.perf_counter_ns() - begin
+    print(f"timeouts {clients} clients, {ticks} ticks: wheel {wheel_ns / ticks / 1000:8.1f} us/tick | "
+          f"scan {scan_ns / ticks / 1000:8.1f} us/tick ({len(closed)} idle clients closed, {len(idle)} idle at the end)")
+
+
+def bench_scripting(rounds=5000, compiles=2000):  # Read-modify-write in one round trip
+    """Compare GET-then-SET from the client with one EVALSHA doing both, then compiling a script with finding it in the cache."""
+    source = b"value = int(call('GET', KEYS[0])) + 1\ncall('SET', KEYS[0], value)\nreturn value\n"
+    with tempfile.TemporaryDirectory() as directory:
+        server = start_server(config={"dir": directory})
+        with socket.create_connection(("localhost", server.port)) as sock:
+            round_trip(sock, encode_command("SET", "counter", "0"), 5)
+            start = time.perf_counter()
+            for value in range(rounds):  # Two round trips, and racy without WATCH
+                round_trip(sock, encode_command("GET", "counter"), len(encode_bulk(b"%d" % value)))
+                round_trip(sock, encode_command("SET", "counter", value + 1), 5)
+            client_side = (time.perf_counter() - start) / rounds
+            round_trip(sock, encode_command("SCRIPT", "LOAD", source), 47)
+            evalsha = encode_command("EVALSHA", scripting.sha1hex(source), 1, "counter")
+            start = time.perf_counter()
+            for value in range(rounds, 2 * rounds):
+                round_trip(sock, evalsha, len(b":%d\r\n" % (value + 1)))
+            scripted = (time.perf_counter() - start) / rounds
+    print(f"scripting read-modify-write: GET+SET {client_side * 1e6:7.1f} us | EVALSHA {scripted * 1e6:7.1f} us ({client_side / scripted:4.1f}x)")
+    start = time.perf_counter()
+    for _ in range(compiles):
+        scripting.compile_script(source)
+    compiled = (time.perf_counter() - start) / compiles
+    start = time.perf_counter()
+    for _ in range(compiles):
+        scripting.load(source)  # SHA1 of the source, then a dict hit
+    cached = (time.perf_counter() - start) / compiles
+    print(f"scripting script lookup: compile {compiled * 1e6:7.1f} us | cache {cached * 1e6:7.1f} us ({compiled / cached:4.0f}x)")
+
+
+def bench_client(requests=2000, batch=100):  # Connection per request vs pooled vs pipelined
+    """Time small GETs over a new socket each, through the client's pool, and in pipelines of `batch`."""
+    with tempfile.TemporaryDirectory() as directory:
+        server = start_server(config={"dir": directory})
+        redis = client_library.Redis(port=server.port)
+        redis.set("key", "value")
+        request = encode_command("GET", "key")
+        start = time.perf_counter()
+        for _ in range(requests // 4):  # What the app servers do today
+            with socket.create_connection(("localhost", server.port)) as sock:
+                round_trip(sock, request, 11)
+        fresh = (time.perf_counter() - start) / (requests // 4)
+        start = time.perf_counter()
+        for _ in range(requests):
+            redis.get("key")
+        pooled = (time.perf_counter() - start) / requests
+        start = time.perf_counter()
+        for _ in range(requests // batch):
+            pipe = redis.pipeline()
+            for _ in range(batch):
+                pipe.get("key")
+            pipe.execute()
+        pipelined = (time.perf_counter() - start) / requests
+        redis.close()
+    print(f"client GET: new socket {fresh * 1e6:7.1f} us | pooled {pooled * 1e6:7.1f} us ({fresh / pooled:4.1f}x) | "
+          f"pipeline of {batch} {pipelined * 1e6:7.1f} us ({fresh / pipelined:5.1f}x)")
+
+
+def bench_counting(megabytes=100, days=365, users=1000000):  # Bitmaps and HyperLogLogs
+    """Time BITCOUNT and SETBIT on a `megabytes` MB bitmap, then PFCOUNT over `days` daily counters."""
+    core = CommandCore({"dir": tempfile.gettempdir()})
+    client = Client()
+    core.db.set(b"active", bytearray(os.urandom(megabytes * 1024 * 1024)))
+    start = time.perf_counter()
+    core.execute(client, [b"BITCOUNT", b"active"])
+    bit_count = time.perf_counter() - start
+    table = bytes(bin(byte).count("1") for byte in range(256))  # Per-byte lookup, the pure-Python alternative
+    sample = memoryview(core.db.get(b"active"))[:4 * 1024 * 1024]
+    start = time.perf_counter()
+    sum(map(table.__getitem__, sample))
+    per_byte = (time.perf_counter() - start) * megabytes / 4
+    sample.release()
+    print(f"counting BITCOUNT {megabytes} MB: int.bit_count {bit_count * 1000:7.1f} ms | per-byte table {per_byte * 1000:7.0f} ms ({per_byte / bit_count:4.0f}x)")
+    offsets = [random.randrange(megabytes * 8 * 1024 * 1024) for _ in range(1000)]
+    start = time.perf_counter()
+    for offset in offsets:
+        core.execute(client, [b"SETBIT", b"active", b"%d" % offset, b"1"])
+    in_place = (time.perf_counter() - start) / len(offsets)
+    value = bytes(core.db.get(b"active"))
+    start = time.perf_counter()
+    for offset in offsets[:20]:  # What an immutable bytes value would cost: a copy per write
+        value = value[:offset >> 3] + bytes((value[offset >> 3] | 0x80 >> (offset & 7),)) + value[(offset >> 3) + 1:]
+    copied = (time.perf_counter() - start) / 20
+    print(f"counting SETBIT {megabytes} MB: in place {in_place * 1e6:7.1f} us | copy per write {copied * 1e6:9.1f} us ({copied / in_place:5.0f}x)")
+    core.db.delete(b"active")
+    start = time.perf_counter()
+    for day in range(days):  # Daily unique visitors, about 20k a day
+        core.execute(client, [b"PFADD", b"visitors:%d" % day, *[b"user:%d" % random.randrange(users) for _ in range(200)]])
+    pfadd = (time.perf_counter() - start) / (days * 200)
+    for day in range(days):  # Fill the rest in bulk: dense counters of a realistic shape
+        registers = bytes(min(hyperloglog.element_position(b"%d:%d" % (day, register))[1] + 1, 51) for register in range(hyperloglog.REGISTERS))
+        core.db.set(b"visitors:%d" % day, hyperloglog.from_registers(registers))
+    keys = [b"visitors:%d" % day for day in range(days)]
+    start = time.perf_counter()
+    core.execute(client, [b"PFCOUNT", *keys])
+    swar = time.perf_counter() - start
+    registers = [hyperloglog.registers(core.db.get(key)) for key in keys[:10]]
+    start = time.perf_counter()
+    merged = list(registers[0])
+    for other in registers[1:]:  # Register by register
+        merged = [a if a >= b else b for a, b in zip(merged, other)]
+    per_register = (time.perf_counter() - start) / 9 * (days - 1)
+    print(f"counting PFCOUNT of {days} counters: SWAR merge {swar * 1000:6.1f} ms | per-register loop {per_register * 1000:6.0f} ms "
+          f"({per_register / swar:4.1f}x); PFADD {pfadd * 1e6:4.1f} us/element, {len(core.db.get(keys[0]))} bytes per counter")
+
+
+def bench_strings(count=200000, rounds=100000):  # int encoding and INCR
+    """Compare the memory of `count` small counters stored as bytes and int-encoded, then time INCR against GET+SET."""
+    numbers = [random.randrange(10000) for _ in range(count)]  # Page views, stock levels, ...
+    sizes = {}
+    for name, convert in (("bytes", lambda raw: raw), ("int", string_object)):
+        tracemalloc.start()
+        values = {b"counter:%d" % i: convert(b"%d" % number) for i, number in enumerate(numbers)}
+        sizes[name] = tracemalloc.get_traced_memory()[0] / count
+        tracemalloc.stop()
+        del values
+    print(f"strings {count} counters: bytes {sizes['bytes']:5.0f} B/key | int-encoded {sizes['int']:5.0f} B/key "
+          f"({sizes['bytes'] / sizes['int']:3.1f}x smaller, keys and dict included)")
+    core = CommandCore({"dir": tempfile.gettempdir()})
+    client = Client()
+    core.execute(client, [b"SET", b"hits", b"0"])
+    start = time.perf_counter()
+    for _ in range(rounds):  # What clients had to do: read, add, write back (and race)
+        value = int(core.execute(client, [b"GET", b"hits"]).split(b"\r\n")[1])
+        core.execute(client, [b"SET", b"hits", b"%d" % (value + 1)])
+    get_set = (time.perf_counter() - start) / rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        core.execute(client, [b"INCR", b"hits"])
+    incr = (time.perf_counter() - start) / rounds
+    print(f"strings counter update: GET+SET {get_set * 1e6:5.2f} us | INCR {incr * 1e6:5.2f} us ({get_set / incr:3.1f}x, one round trip instead of two)")
+
+
+BENCHMARKS = {  # Name -> benchmark function
+    "parser": bench_parser,
+    "pipeline": bench_pipeline,
+    "rdb": bench_rdb,
+    "hashes": bench_small_hashes,
+    "zset": bench_zset,
+    "cluster": bench_cluster,
+    "threaded": bench_threaded,
+    "asyncio": bench_asyncio,
+    "multikey": bench_multikey,
+    "scan": bench_scan,
+    "stats": bench_stats,
+    "replication": bench_replication,
+    "timeouts": bench_timeouts,
+    "scripting": bench_scripting,
+    "client": bench_client,
+    "counting": bench_counting,
+    "strings": bench_strings,
+}
+
+
+if __name__ == "__main__":  # If this script is executed directly
+    for name in sys.argv[1:] or list(BENCHMARKS):  # Run the requested benchmarks (all by default)
+        BENCHMARKS[name]()
@@ -0,0 +1,91 @@
+"""Bit operations over string values (SETBIT, GETBIT, BITCOUNT, BITPOS, BITOP).
+
+Bits are numbered from the most significant bit of the first byte, as in
+Redis, so a bitmap is an ordinary string value: GET returns it and SET
+replaces it. SETBIT turns the stored bytes into a bytearray once and
+then flips bits in place (growing it pads with zero bytes), so setting a
+bit in a 100 MB bitmap does not copy it. The scans run in C over large
+slices: BITCOUNT converts 64 KB windows of the value to an int and takes
+int.bit_count(), BITPOS finds the first byte that is not all zeros (or
+all ones) with a regex search, and BITOP combines whole values as ints.
+"""
+import functools  # Folding BITOP operands
+import operator  # BITOP operators
+import re  # First byte with a wanted bit
+
+MAX_BIT_OFFSET = 8 * 512 * 1024 * 1024 - 1  # Strings are limited to 512 MB
+COUNT_WINDOW = 1 << 16  # Bytes converted to one int by count_bits(): stays in cache, bounds the temporary
+NOT_TABLE = bytes(255 - byte for byte in range(256))  # BITOP NOT through bytes.translate()
+OPERATORS = {b"AND": operator.and_, b"OR": operator.or_, b"XOR": operator.xor}
+
+_ANY_ONE = re.compile(rb"[^\x00]")  # A byte with a set bit
+_ANY_ZERO = re.compile(rb"[^\xff]")  # A byte with a clear bit
+
+
+def get_bit(value, offset):  # GETBIT
+    """Return bit offset of value (0 past its end)."""
+    pos = offset >> 3
+    return (value[pos] >> (7 - (offset & 7))) & 1 if pos < len(value) else 0
+
+
+def set_bit(value, offset, bit):  # SETBIT; value is the stored bytearray
+    """Set bit offset of value to bit, growing it with zero bytes as needed; return the previous bit."""
+    pos = offset >> 3
+    if pos >= len(value):
+        value += bytes(pos + 1 - len(value))  # In place: value is the object stored under the key
+    mask = 0x80 >> (offset & 7)
+    previous = value[pos] & mask
+    value[pos] = value[pos] | mask if bit else value[pos] & ~mask
+    return 1 if previous else 0
+
+
+def count_bits(value, start, end):  # BITCOUNT
+    """Return the number of set bits in bytes start..end-1 of value."""
+    total = 0
+    with memoryview(value) as view:  # Windows without copying the value first
+        for pos in range(start, end, COUNT_WINDOW):
+            total += int.from_bytes(view[pos:min(pos + COUNT_WINDOW, end)], "little").bit_count()  # Order does not matter to a count; little is cheaper
+    return total
+
+
+def count_bit_range(value, first, last):  # BITCOUNT ... BIT
+    """Return the number of set bits from bit first to bit last, inclusive."""
+    start, end = first >> 3, (last >> 3) + 1
+    total = count_bits(value, start, end)
+    total -= (value[start] >> (8 - (first & 7))).bit_count()  # Bits of the first byte before first
+    total -= (value[end - 1] & (0xFF >> ((last & 7) + 1))).bit_count()  # Bits of the last byte after last
+    return total
+
+
+def find_bit(value, bit, start, end):  # BITPOS
+    """Return the position of the first bit equal to bit in bytes start..end-1 of value, or -1."""
+    match = (_ANY_ONE if bit else _ANY_ZERO).search(value, start, end)
+    if match is None:
+        return -1
+    pos = match.start()
+    byte = value[pos] if bit else value[pos] ^ 0xFF
+    return pos * 8 + 8 - byte.bit_length()  # Highest set bit = first one in Redis' bit order
+
+
+def find_bit_range(value, bit, first, last):  # BITPOS ... BIT
+    """Return the position of the first bit equal to bit from bit first to bit last, inclusive, or -1."""
+    for offset in range(first, min(last, first | 7) + 1):  # The first byte may be partial
+        if get_bit(value, offset) == bit:
+            return offset
+    if last >> 3 > first >> 3:
+        found = find_bit(value, bit, (first >> 3) + 1, last >> 3)  # Whole bytes in between
+        if found >= 0:
+            return found
+        for offset in range(last & ~7, last + 1):  # So may the last one
+            if get_bit(value, offset) == bit:
+                return offset
+    return -1
+
+
+def bit_op(operation, values):  # BITOP
+    """Combine values (missing keys as b"") with AND, OR, XOR or NOT and return the result as bytes."""
+    if operation == b"NOT":
+        return bytes(values[0]).translate(NOT_TABLE)
+    length = max(map(len, values))
+    numbers = [int.from_bytes(value, "big") << (8 * (length - len(value))) for value in values]  # Shorter values are zero-padded
+    return functools.reduce(OPERATORS[operation], numbers).to_bytes(length, "big")
@@ -0,0 +1,81 @@
+"""Clients parked by BLPOP/BRPOP.
+
+A blocked client gets no reply and the front end stops executing its
+pipelined commands until it is unblocked. The registry keeps, per key, the
+clients waiting on it in arrival order (a dict used as an ordered set, so
+removing a client that was served through another key is O(1)), and a
+min-heap of deadlines for clients blocked with a timeout. Heap entries are
+invalidated lazily: an entry whose client was already unblocked is simply
+skipped when it reaches the top.
+"""
+import heapq  # Timeout heap
+import itertools  # Tie-breaker for equal deadlines
+import time  # Monotonic deadlines
+
+
+class BlockedClients:  # Registry of parked clients
+    """Per-key wait queues plus a deadline heap for blocking list pops."""
+
+    def __init__(self):
+        self.waiting = {}  # Key -> {Client: None} in arrival order
+        self.ready_keys = {}  # Keys pushed to while someone waits on them (ordered set)
+        self.timeouts = []  # Heap of (deadline, sequence, Client)
+        self.unblocked = []  # Clients unblocked since the front end last looked; it resumes their input
+        self.sequence = itertools.count()  # Keeps heap entries comparable
+        self.count = 0  # Clients currently blocked
+
+    def __len__(self):  # Number of blocked clients (INFO)
+        return self.count
+
+    def block(self, client, keys, left, timeout):  # BLPOP/BRPOP found every list empty
+        """Park client on keys; timeout is in seconds, 0 meaning forever."""
+        client.blocked_keys = tuple(dict.fromkeys(keys))  # Deduplicated, in argument order
+        client.blocked_left = left
+        self.count += 1
+        client.blocked_deadline = time.monotonic() + timeout if timeout else None
+        for key in client.blocked_keys:
+            self.waiting.setdefault(key, {})[client] = None
+        if client.blocked_deadline is not None:
+            heapq.heappush(self.timeouts, (client.blocked_deadline, next(self.sequence), client))
+
+    def unblock(self, client):  # Served, timed out or disconnected
+        """Remove client from every wait queue it is in."""
+        for key in client.blocked_keys:
+            queue = self.waiting[key]
+            del queue[client]
+            if not queue:
+                del self.waiting[key]
+        client.blocked_keys = ()
+        client.blocked_deadline = None
+        self.count -= 1
+        self.unblocked.append(client)
+
+    def signal(self, key):  # Called after a push
+        """Mark key as ready if a client is waiting on it."""
+        if key in self.waiting:
+            self.ready_keys[key] = None
+
+    def first_waiting(self, key):  # Oldest client blocked on key
+        """Return the client that has waited longest on key, or None."""
+        queue = self.waiting.get(key)
+        return next(iter(queue)) if queue else None
+
+    def expired(self, now=None):  # Timed-out clients, earliest first
+        """Pop and return the clients whose deadline has passed."""
+        now = time.monotonic() if now is None else now
+        timeouts = self.timeouts
+        expired = []
+        while timeouts and timeouts[0][0] <= now:
+            deadline, _, client = heapq.heappop(timeouts)
+            if client.blocked_keys and client.blocked_deadline == deadline:  # Not a stale entry
+                expired.append(client)
+        return expired
+
+    def next_timeout(self):  # How long the event loop may sleep
+        """Return the seconds until the earliest deadline, or None if no client has one."""
+        timeouts = self.timeouts
+        while timeouts and not timeouts[0][2].blocked_keys:  # Drop stale entries
+            heapq.heappop(timeouts)
+        if not timeouts:
+            return None
+        return max(0.0, timeouts[0][0] - time.monotonic())
@@ -0,0 +1,532 @@
+"""Python client for the RESP front ends: pooled connections, pipelines, blocking and asyncio.
+
+    r = Redis(port=6379, max_connections=32)    # Thread-safe; share one per process
+    r.set("key", "value")
+    r.get("key")                                # b"value"
+    with r.pipeline() as pipe:                  # One write, replies parsed in bulk
+        pipe.incr("hits").expire("hits", 60)
+        hits, _ = pipe.execute()
+
+    r = AsyncRedis(port=6379)                    # Same commands, awaited
+    await r.get("key")
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.set("a", 1).get("a")
+        await pipe.execute()
+
+A pool keeps connections open between requests, so a GET costs one round
+trip instead of a TCP handshake plus a round trip. Connections are handed
+out most-recently-used first (idle ones at the bottom age out first when
+the server's timeout closes them), checked before reuse and replaced when
+the server closed them: the blocking pool polls the socket (readable while
+no request is in flight means EOF or garbage), and a connection idle for
+more than health_check_interval seconds must answer a PING. A connection
+that failed in the middle of a command is closed, never reused, and the
+error is raised rather than retried, since the command may have run.
+
+Replies are decoded by resp.ReplyParser from a reusable receive buffer:
+bulk strings as bytes, integers as int, nil as None, arrays as lists and
+status replies as bytes. Error replies raise ResponseError; inside a
+pipeline they are returned in place (raise_on_error=False) or raised
+after every reply was read.
+"""
+import asyncio  # AsyncRedis
+import select  # Poll idle pooled sockets for EOF
+import socket  # Blocking connections
+import threading  # Pool lock
+import time  # Health checks
+
+from resp import NOT_READY, ProtocolError, ReplyParser, ResponseError, encode_command
+
+__all__ = ["Redis", "AsyncRedis", "ConnectionPool", "AsyncConnectionPool", "Pipeline", "AsyncPipeline", "ResponseError"]
+
+RECV_SIZE = 65536  # Bytes read per recv
+
+
+def _pairs_to_dict(reply):  # HGETALL, CONFIG GET
+    return dict(zip(reply[::2], reply[1::2])) if isinstance(reply, list) else reply
+
+
+def _ok(reply):  # Status replies as booleans, like redis-py
+    return reply == b"OK" if isinstance(reply, bytes) else reply
+
+
+class Commands:  # Shared by the clients and their pipelines
+    """Command methods; _command(callback, *args) executes (clients) or queues (pipelines) them."""
+
+    def ping(self):
+        return self._command(lambda reply: reply == b"PONG", "PING")
+
+    def get(self, name):
+        return self._command(None, "GET", name)
+
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False):
+        args = ["SET", name, value]
+        if ex is not None:
+            args += ("EX", ex)
+        if px is not None:
+            args += ("PX", px)
+        if nx:
+            args.append("NX")
+        if xx:
+            args.append("XX")
+        return self._command(_ok, *args)
+
+    def mget(self, *names):
+        return self._command(None, "MGET", *names)
+
+    def mset(self, mapping):
+        return self._command(_ok, "MSET", *[item for pair in mapping.items() for item in pair])
+
+    def delete(self, *names):
+        return self._command(None, "DEL", *names)
+
+    def exists(self, *names):
+        return self._command(None, "EXISTS", *names)
+
+    def expire(self, name, seconds):
+        return self._command(bool, "EXPIRE", name, seconds)
+
+    def ttl(self, name):
+        return self._command(None, "TTL", name)
+
+    def incr(self, name, amount=1):
+        return self._command(None, "INCRBY", name, amount) if amount != 1 else self._command(None, "INCR", name)
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        items = ([key, value] if key is not None else []) + [item for pair in (mapping or {}).items() for item in pair]
+        return self._command(None, "HSET", name, *items)
+
+    def hget(self, name, key):
+        return self._command(None, "HGET", name, key)
+
+    def hgetall(self, name):
+        return self._command(_pairs_to_dict, "HGETALL", name)
+
+    def lpush(self, name, *values):
+        return self._command(None, "LPUSH", name, *values)
+
+    def rpush(self, name, *values):
+        return self._command(None, "RPUSH", name, *values)
+
+    def lrange(self, name, start, end):
+        return self._command(None, "LRANGE", name, start, end)
+
+    def sadd(self, name, *values):
+        return self._command(None, "SADD", name, *values)
+
+    def smembers(self, name):
+        return self._command(set, "SMEMBERS", name)
+
+    def zadd(self, name, mapping):
+        return self._command(None, "ZADD", name, *[item for member, score in mapping.items() for item in (score, member)])
+
+    def zrange(self, name, start, end):
+        return self._command(None, "ZRANGE", name, start, end)
+
+    def publish(self, channel, message):
+        return self._command(None, "PUBLISH", channel, message)
+
+    def eval(self, script, numkeys, *keys_and_args):
+        return self._command(None, "EVAL", script, numkeys, *keys_and_args)
+
+    def evalsha(self, sha, numkeys, *keys_and_args):
+        return self._command(None, "EVALSHA", sha, numkeys, *keys_and_args)
+
+    def script_load(self, script):
+        return self._command(lambda reply: reply.decode(), "SCRIPT", "LOAD", script)
+
+    def config_get(self, pattern="*"):
+        return self._command(_pairs_to_dict, "CONFIG", "GET", pattern)
+
+    def info(self):
+        return self._command(lambda reply: reply.decode(), "INFO")
+
+    def execute_command(self, *args):  # Anything without a method
+        return self._command(None, *args)
+
+
+class Connection:  # One blocking socket
+    """A connection with its reply parser; used by one thread at a time (the pool's)."""
+
+    def __init__(self, host, port, socket_timeout=None, connect_timeout=5.0):
+        self.host = host
+        self.port = port
+        self.socket_timeout = socket_timeout  # Seconds a reply may take; None = wait forever
+        self.connect_timeout = connect_timeout
+        self.sock = None  # Connected lazily
+        self.parser = ReplyParser()
+        self.chunk = bytearray(RECV_SIZE)  # recv_into() target, reused for every read
+        self.last_used = 0.0  # time.monotonic() of the last reply, for health checks
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), self.connect_timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Requests are already written whole
+        self.sock.settimeout(self.socket_timeout)
+        self.parser.reset()
+        self.last_used = time.monotonic()
+
+    def disconnect(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def is_healthy(self, health_check_interval):  # Called by the pool before reuse
+        """Return False if the server closed the connection or it no longer answers PING."""
+        if self.sock is None:
+            return False
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        if readable:  # No request in flight: EOF, a reset, or bytes we did not ask for
+            return False
+        if time.monotonic() - self.last_used > health_check_interval:
+            try:
+                return self.execute([b"PING"]) == b"PONG"
+            except (OSError, ValueError, ProtocolError):
+                return False
+        return True
+
+    def send(self, data):
+        if self.sock is None:
+            self.connect()
+        self.sock.sendall(data)
+
+    def read_reply(self):
+        """Return the next reply, reading from the socket as needed."""
+        parser = self.parser
+        reply = parser.get()
+        if reply is NOT_READY:
+            view = memoryview(self.chunk)
+            while reply is NOT_READY:
+                received = self.sock.recv_into(view)
+                if not received:
+                    raise ConnectionError(f"{self.host}:{self.port} closed the connection")
+                parser.feed(view[:received])
+                reply = parser.get()
+        self.last_used = time.monotonic()
+        return reply
+
+    def execute(self, args):
+        """Send one command and return its reply (a ResponseError instance for an error reply)."""
+        self.send(encode_command(*args))
+        return self.read_reply()
+
+
+class ConnectionPool:  # Thread-safe, blocking
+    """Up to max_connections connections shared by threads; get() waits up to `timeout` for a free one."""
+
+    def __init__(self, host="localhost", port=6379, max_connections=50, timeout=20.0, health_check_interval=30.0, **connection_options):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.timeout = timeout  # Seconds get() waits when every connection is in use
+        self.health_check_interval = health_check_interval  # Idle seconds after which a connection must answer PING
+        self.connection_options = connection_options  # socket_timeout, connect_timeout
+        self.idle = []  # Free connections, most recently used last
+        self.created = 0  # Connections in use or idle
+        self.condition = threading.Condition()
+
+    def get(self):
+        """Return a healthy connection, connecting a new one while under max_connections."""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self.condition:
+                while not self.idle and self.created >= self.max_connections:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self.condition.wait(remaining):
+                        raise ConnectionError(f"no connection available within {self.timeout}s (max_connections={self.max_connections})")
+                if self.idle:
+                    connection = self.idle.pop()
+                else:
+                    self.created += 1
+                    connection = None
+            if connection is None:  # Connect outside the lock
+                connection = Connection(self.host, self.port, **self.connection_options)
+                try:
+                    connection.connect()
+                except OSError:
+                    self._forget(connection)
+                    raise
+                return connection
+            if connection.is_healthy(self.health_check_interval):
+                return connection
+            connection.disconnect()  # Reconnect in place; the slot stays ours
+            try:
+                connection.connect()
+            except OSError:
+                self._forget(connection)
+                raise
+            return connection
+
+    def release(self, connection):
+        """Hand a connection back; a disconnected one gives its slot up."""
+        if connection.sock is None:
+            self._forget(connection)
+            return
+        with self.condition:
+            self.idle.append(connection)
+            self.condition.notify()
+
+    def _forget(self, connection):
+        connection.disconnect()
+        with self.condition:
+            self.created -= 1
+            self.condition.notify()
+
+    def close(self):
+        """Close the idle connections; connections in use are closed by whoever holds them."""
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.created -= len(idle)
+        for connection in idle:
+            connection.disconnect()
+
+
+class Redis(Commands):  # Blocking client
+    """Executes commands on connections borrowed from a ConnectionPool."""
+
+    def __init__(self, host="localhost", port=6379, pool=None, **pool_options):
+        self.pool = pool or ConnectionPool(host, port, **pool_options)
+
+    def _command(self, callback, *args):
+        connection = self.pool.get()
+        try:
+            reply = connection.execute(args)
+        except (OSError, ValueError, ProtocolError) as e:  # ValueError: garbage where a length was expected
+            connection.disconnect()  # The reply stream is out of step: never reuse it
+            raise ConnectionError(f"error talking to {self.pool.host}:{self.pool.port}: {e}") from e
+        finally:
+            self.pool.release(connection)
+        if isinstance(reply, ResponseError):
+            raise reply
+        return callback(reply) if callback is not None else reply
+
+    def pipeline(self, transaction=False):
+        return Pipeline(self, transaction)
+
+    def close(self):
+        self.pool.close()
+
+
+def _pipeline_results(commands, replies, transaction, raise_on_error):  # Shared by both pipelines
+    """Apply callbacks to the replies of queued commands, raising the first error if asked to."""
+    if transaction:  # Replies: +OK, a +QUEUED per command, then EXEC's array
+        queued, replies = replies[1:-1], replies[-1]
+        errors = [reply for reply in queued if isinstance(reply, ResponseError)]
+        if replies is None:
+            raise ResponseError("EXECABORT transaction aborted (WATCHed key changed)" if not errors else str(errors[0]))
+        if isinstance(replies, ResponseError):
+            raise replies
+    results = [reply if callback is None or isinstance(reply, ResponseError) else callback(reply)
+               for (callback, _), reply in zip(commands, replies)]
+    if raise_on_error:
+        for result in results:
+            if isinstance(result, ResponseError):
+                raise result
+    return results
+
+
+class Pipeline(Commands):  # Redis.pipeline()
+    """Queues commands and sends them in one write; execute() reads every reply and returns them in order."""
+
+    def __init__(self, client, transaction=False):
+        self.client = client
+        self.transaction = transaction  # Wrap in MULTI/EXEC
+        self.commands = []  # (callback, args)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.commands = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def _command(self, callback, *args):
+        self.commands.append((callback, args))
+        return self  # Chainable
+
+    def execute(self, raise_on_error=True):
+        """Send the queued commands together and return their results."""
+        commands, self.commands = self.commands, []
+        if not commands:
+            return []
+        requests = [args for _, args in commands]
+        if self.transaction:
+            requests = [("MULTI",), *requests, ("EXEC",)]
+        pool = self.client.pool
+        connection = pool.get()
+        try:
+            connection.send(b"".join([encode_command(*args) for args in requests]))
+            replies = [connection.read_reply() for _ in requests]
+        except (OSError, ValueError, ProtocolError) as e:
+            connection.disconnect()
+            raise ConnectionError(f"error talking to {pool.host}:{pool.port}: {e}") from e
+        finally:
+            pool.release(connection)
+        return _pipeline_results(commands, replies, self.transaction, raise_on_error)
+
+
+class _AsyncConnection(asyncio.Protocol):  # One asyncio connection
+    """Feeds received bytes to a ReplyParser and resolves the futures of requests in order."""
+
+    def __init__(self):
+        self.transport = None
+        self.parser = ReplyParser()
+        self.waiters = []  # Futures of the requests sent, oldest first
+        self.served = 0  # Waiters resolved; the list is trimmed in bulk
+        self.closed = False
+        self.last_used = time.monotonic()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def data_received(self, data):
+        parser = self.parser
+        parser.feed(data)
+        try:
+            while self.served < len(self.waiters):
+                reply = parser.get()
+                if reply is NOT_READY:
+                    break
+                future = self.waiters[self.served]
+                self.served += 1
+                if not future.done():  # Cancelled by its caller: the reply is dropped
+                    future.set_result(reply)
+        except (ValueError, ProtocolError) as e:
+            self._fail(ConnectionError(f"malformed reply: {e}"))
+            self.transport.abort()
+            return
+        if self.served == len(self.waiters):
+            self.waiters = []
+            self.served = 0
+        self.last_used = time.monotonic()
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self._fail(ConnectionError(f"connection lost: {exc or 'closed by the server'}"))
+
+    def _fail(self, error):
+        for future in self.waiters[self.served:]:
+            if not future.done():
+                future.set_exception(error)
+        self.waiters = []
+        self.served = 0
+
+    def request(self, data, replies):
+        """Write data and return the futures of its `replies` replies."""
+        if self.closed:
+            raise ConnectionError("connection is closed")
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in range(replies)]
+        self.waiters += futures
+        self.transport.write(data)
+        return futures
+
+
+class AsyncConnectionPool:  # For one event loop
+    """Up to max_connections asyncio connections; acquire() waits for a free one."""
+
+    def __init__(self, host="localhost", port=6379, max_connections=50, timeout=20.0, health_check_interval=30.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.slots = asyncio.Semaphore(max_connections)  # Connections in use or being opened
+        self.idle = []  # Free connections, most recently used last
+
+    async def acquire(self):
+        """Return a healthy connection."""
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError(f"no connection available within {self.timeout}s") from None
+        try:
+            while self.idle:
+                connection = self.idle.pop()
+                if connection.closed:  # connection_lost() already ran: the server closed it
+                    continue
+                if time.monotonic() - connection.last_used <= self.health_check_interval or await self._ping(connection):
+                    return connection
+                connection.transport.abort()
+            loop = asyncio.get_running_loop()
+            _, connection = await asyncio.wait_for(loop.create_connection(_AsyncConnection, self.host, self.port), self.timeout)
+            return connection
+        except BaseException:
+            self.slots.release()
+            raise
+
+    @staticmethod
+    async def _ping(connection):
+        try:
+            return await connection.request(encode_command("PING"), 1)[0] == b"PONG"
+        except ConnectionError:
+            return False
+
+    def release(self, connection):
+        if not connection.closed:
+            self.idle.append(connection)
+        self.slots.release()
+
+    def close(self):
+        idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.transport.close()
+
+
+class AsyncRedis(Commands):  # asyncio client; every command method returns an awaitable
+    """Executes commands on connections borrowed from an AsyncConnectionPool."""
+
+    def __init__(self, host="localhost", port=6379, pool=None, **pool_options):
+        self.pool = pool or AsyncConnectionPool(host, port, **pool_options)
+
+    async def _command(self, callback, *args):
+        connection = await self.pool.acquire()
+        try:
+            reply = await connection.request(encode_command(*args), 1)[0]
+        except asyncio.CancelledError:  # The reply would arrive for whoever used the connection next
+            connection.transport.abort()
+            raise
+        finally:
+            self.pool.release(connection)
+        if isinstance(reply, ResponseError):
+            raise reply
+        return callback(reply) if callback is not None else reply
+
+    def pipeline(self, transaction=False):
+        return AsyncPipeline(self, transaction)
+
+    def close(self):
+        self.pool.close()
+
+
+class AsyncPipeline(Pipeline):  # AsyncRedis.pipeline()
+    """Pipeline whose execute() is a coroutine."""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.commands = []
+
+    async def execute(self, raise_on_error=True):
+        """Send the queued commands together and return their results."""
+        commands, self.commands = self.commands, []
+        if not commands:
+            return []
+        requests = [args for _, args in commands]
+        if self.transaction:
+            requests = [("MULTI",), *requests, ("EXEC",)]
+        pool = self.client.pool
+        connection = await pool.acquire()
+        try:
+            replies = await asyncio.gather(*connection.request(b"".join([encode_command(*args) for args in requests]), len(requests)))
+        except asyncio.CancelledError:
+            connection.transport.abort()
+            raise
+        finally:
+            pool.release(connection)
+        return _pipeline_results(commands, replies, self.transaction, raise_on_error)
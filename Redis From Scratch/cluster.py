@@ -0,0 +1,205 @@
+"""Multi-process sharded mode: N event-loop workers, each owning a range of hash slots.
+
+Every key hashes to one of 16384 slots (CRC16 of the key, or of its
+{hash tag}, mod 16384, exactly like Redis Cluster). Worker i owns a
+contiguous range of slots and keeps only those keys, so the workers share
+nothing and run on separate cores.
+
+All workers listen on the same port with SO_REUSEPORT, so the kernel
+spreads connections across them. Each worker also listens on a port of
+its own (port + 1 + worker), which is what -MOVED redirections and
+CLUSTER SLOTS point at. A worker that receives a command for a slot it
+does not own either answers -MOVED (cluster-redirect moved, for
+cluster-aware clients) or forwards the command to the owner over a
+socketpair and relays the reply (cluster-redirect forward, the default,
+so plain clients work unchanged). WATCH is never forwarded: the watch
+must belong to the client's own connection, so a foreign-slot WATCH is
+refused in forward mode.
+
+Frames on a worker-to-worker channel are <kind:1 byte> <length:uint32 LE>
+<payload>: b"Q" carries a command as length-prefixed arguments, b"R" the
+raw reply to the oldest unanswered request. Both directions carry both
+kinds, and a channel is FIFO, so replies need no request ids.
+"""
+import binascii  # CRC16 of keys
+import collections  # Clients awaiting forwarded replies
+import os  # fork
+import signal  # Stop the workers
+import socket  # SO_REUSEPORT listeners and socketpairs
+import struct  # Frame headers
+
+from commands import COMMANDS, DEFAULT_CONFIG, Client  # Key positions of every command; default file names; pseudo-client for forwarded commands
+
+SLOTS = 16384  # Hash slots, as in Redis Cluster
+FRAME = struct.Struct("<cI")  # Kind + payload length
+ARG_LENGTH = struct.Struct("<I")  # Length prefix of one forwarded argument
+
+
+def crc16(data):  # Checksum of a key
+    """Return the CRC16-CCITT (XMODEM) of data, the variant Redis Cluster uses."""
+    return binascii.crc_hqx(data, 0)  # Same polynomial (0x1021) and initial value (0), computed in C
+
+
+def key_hash_slot(key):  # CLUSTER KEYSLOT
+    """Return the hash slot of key; only the first non-empty {tag} is hashed if there is one."""
+    start = key.find(b"{")
+    if start >= 0:
+        end = key.find(b"}", start + 1)
+        if end > start + 1:  # Non-empty tag: keys sharing it land in the same slot
+            key = key[start + 1:end]
+    return crc16(key) % SLOTS
+
+
+def shard_config(config, shard):  # One set of persistence files per shard
+    """Return a copy of config whose dbfilename and appendfilename carry a -<shard> suffix."""
+    result = dict(config)
+    for name in ("dbfilename", "appendfilename"):
+        stem, extension = os.path.splitext(config.get(name) or DEFAULT_CONFIG[name])
+        result[name] = f"{stem}-{shard}{extension}"
+    return result
+
+
+def encode_args(args):  # Request payload
+    """Pack a command as length-prefixed arguments."""
+    return b"".join(ARG_LENGTH.pack(len(arg)) + arg for arg in args)
+
+
+def decode_args(payload):  # Inverse of encode_args
+    """Unpack a request payload into a list of bytes arguments."""
+    args = []
+    pos = 0
+    while pos < len(payload):
+        length = ARG_LENGTH.unpack_from(payload, pos)[0]
+        pos += ARG_LENGTH.size
+        args.append(bytes(payload[pos:pos + length]))
+        pos += length
+    return args
+
+
+class ClusterState:  # What one worker knows about the shard layout
+    """Slot ownership and redirection settings of one worker."""
+
+    def __init__(self, worker, workers, host, port, redirect="forward"):
+        if redirect not in ("forward", "moved"):
+            raise ValueError("cluster-redirect must be forward or moved")
+        self.worker = worker  # This worker's index
+        self.workers = workers  # Number of workers
+        self.host = host  # Advertised in -MOVED and CLUSTER SLOTS
+        self.port = port  # Shared SO_REUSEPORT port
+        self.redirect = redirect  # forward | moved
+        self.ranges = [(i * SLOTS // workers, (i + 1) * SLOTS // workers - 1) for i in range(workers)]  # Slots owned by each worker
+        self.slot_owner = bytes(i for i, (first, last) in enumerate(self.ranges) for _ in range(first, last + 1))  # Slot -> worker
+        self.forwarded = 0  # Commands sent to another worker (stats, counted by the front end)
+
+    @staticmethod
+    def key_slot(key):  # CLUSTER KEYSLOT
+        """Return the hash slot of key."""
+        return key_hash_slot(key)
+
+    def port_of(self, worker):  # Private port of a worker
+        """Return the port only the given worker listens on."""
+        return self.port + 1 + worker
+
+    def route(self, args):  # Called for every command before it executes
+        """Return None to execute locally, the owning worker's index, or an error reply (bytes)."""
+        spec = COMMANDS.get(args[0].upper())
+        if spec is None or (spec.first_key == 0 and spec.find_keys is None) or len(args) <= spec.first_key:  # No keys: any worker can answer
+            return None
+        keys = spec.keys(args)
+        if not keys:  # EVAL with numkeys 0
+            return None
+        slot = key_hash_slot(keys[0])
+        for key in keys[1:]:
+            if key_hash_slot(key) != slot:
+                return b"-CROSSSLOT Keys in request don't hash to the same slot\r\n"
+        owner = self.slot_owner[slot]
+        if owner == self.worker:
+            return None
+        if self.redirect == "moved":
+            return b"-MOVED %d %s:%d\r\n" % (slot, self.host.encode(), self.port_of(owner))
+        if spec.name == b"watch":  # Forwarded, it would watch as the channel's shared pseudo-client, never the caller
+            return b"-ERR WATCH keys must belong to the worker the connection is on (use -MOVED redirects or a {hash tag})\r\n"
+        return owner
+
+
+class PeerChannel:  # One end of a worker-to-worker socketpair
+    """Buffered, framed channel to another worker."""
+
+    def __init__(self, worker, sock):
+        sock.setblocking(False)
+        self.worker = worker  # Index of the worker at the other end
+        self.sock = sock
+        self.inbuffer = bytearray()  # Received bytes not yet split into frames
+        self.outbuffer = bytearray()  # Frames waiting to be written
+        self.waiting = collections.deque()  # Client sockets whose forwarded command awaits a reply, oldest first
+        self.client = Client(address=("worker", worker))  # Executes the peer's requests; it cannot block or subscribe
+
+    def send_request(self, args, client_socket):  # Forward a command
+        """Queue a command for the other worker; its reply goes to client_socket."""
+        payload = encode_args(args)
+        self.outbuffer += FRAME.pack(b"Q", len(payload)) + payload
+        self.waiting.append(client_socket)
+
+    def send_reply(self, reply):  # Answer a forwarded command
+        """Queue the reply to the oldest request received from the other worker."""
+        self.outbuffer += FRAME.pack(b"R", len(reply)) + reply
+
+    def frames(self):  # Complete frames received so far
+        """Yield (kind, payload) for every complete frame in the input buffer."""
+        buffer = self.inbuffer
+        pos = 0
+        while len(buffer) - pos >= FRAME.size:
+            kind, length = FRAME.unpack_from(buffer, pos)
+            end = pos + FRAME.size + length
+            if end > len(buffer):  # Partial frame
+                break
+            yield kind, bytes(buffer[pos + FRAME.size:end])
+            pos = end
+        del buffer[:pos]
+
+
+def run_cluster(server_class, host, port, config):  # Entry point of --cluster-workers N
+    """Fork config["cluster-workers"] workers running server_class and wait for them."""
+    if not hasattr(os, "fork") or not hasattr(socket, "SO_REUSEPORT"):
+        raise SystemExit("cluster mode needs fork() and SO_REUSEPORT")
+    workers = config["cluster-workers"]
+    pairs = {(i, j): socket.socketpair() for i in range(workers) for j in range(i + 1, workers)}  # Full mesh
+    children = []
+    for worker in range(workers):
+        pid = os.fork()
+        if pid == 0:  # Worker: keep only its own ends of the mesh
+            status = 1
+            try:
+                peers = {}
+                for (i, j), (first, second) in pairs.items():
+                    if i == worker:
+                        peers[j] = first
+                        second.close()
+                    elif j == worker:
+                        peers[i] = second
+                        first.close()
+                    else:
+                        first.close()
+                        second.close()
+                worker_config = shard_config(config, worker)
+                state = ClusterState(worker, workers, host, port, config.get("cluster-redirect", "forward"))
+                server_class(host=host, port=port, config=worker_config, cluster=state, peers=peers).start()
+                status = 0
+            except KeyboardInterrupt:
+                status = 0
+            finally:
+                os._exit(status)
+        children.append(pid)
+    for first, second in pairs.values():  # The parent only supervises
+        first.close()
+        second.close()
+    print(f"Cluster: {workers} workers on {host}:{port} (private ports {port + 1}-{port + workers})")
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
@@ -0,0 +1,2238 @@
+"""Command table and dispatcher shared by every server front end.
+
+Each command is registered once with @command together with its metadata
+(arity, flags, key positions). CommandCore.execute() looks the name up in
+the COMMANDS dict, checks the arity and calls the handler, which returns
+the encoded reply as bytes. Front ends only parse requests and write the
+returned bytes; they never look at command names themselves.
+"""
+import decimal  # INCRBYFLOAT results in fixed-point notation
+import itertools  # Client ids
+import math  # INCRBYFLOAT overflow, BLPOP timeouts
+import os  # Persistence file paths
+import time  # Load timing
+import traceback  # Handler bugs are logged, not fatal
+from time import perf_counter_ns  # Command timings
+
+import bitmaps
+import hyperloglog
+import listpack
+import rdb
+from aof import AppendOnlyFile, rewrite_value
+from blocking import BlockedClients
+from eviction import POLICIES, Evictor
+from globmatch import compile_glob
+from hashes import Hash
+from lazyfree import LazyFree
+from pubsub import PubSub
+from quicklist import QuickList
+from replication import Replication
+from scripting import SCRIPTS, ScriptError, ScriptRunner, load as load_script
+from resp import OK, PONG, NULL_ARRAY, NULL_BULK, encode_array, encode_bulk, encode_error, encode_integer, encode_simple, encode_value
+from sets import Set, as_int64
+from stats import SUB_BUCKET_BITS, SUB_BUCKETS, Metrics
+from storage import Keyspace, now_ms
+from strings import STRING_MAX_LENGTH, as_bytes, shared, string_object, encoding as string_encoding
+from timerwheel import TimerWheel
+from zset import ZSet, format_score
+
+
+class CommandError(Exception):  # Raised by handlers to produce an error reply
+    """Error reply; the message is sent as "-<message>\\r\\n"."""
+
+
+class Command:  # One entry of the command table
+    """A command handler plus the metadata reported by COMMAND INFO."""
+
+    __slots__ = ("name", "handler", "arity", "flags", "first_key", "last_key", "key_step", "find_keys")
+
+    def __init__(self, name, handler, arity, flags, first_key, last_key, key_step, find_keys=None):
+        self.name = name  # Lowercase command name, as bytes
+        self.handler = handler  # handler(core, client, args) -> encoded reply bytes
+        self.arity = arity  # Exact argument count (>0) or minimum count (<0), command name included
+        self.flags = flags  # Tuple of flag names such as "write", "readonly", "fast"
+        self.first_key = first_key  # Index of the first key argument (0 = no keys)
+        self.last_key = last_key  # Index of the last key argument (-1 = last argument)
+        self.key_step = key_step  # Distance between key arguments
+        self.find_keys = find_keys  # find_keys(args) -> keys, for commands whose key positions depend on the arguments (EVAL)
+
+    def info(self):  # The COMMAND INFO entry for this command
+        """Return the command's metadata in COMMAND INFO layout."""
+        return [self.name, self.arity, [flag.encode() for flag in self.flags], self.first_key, self.last_key, self.key_step]
+
+    def keys(self, args):  # Key arguments of a concrete invocation
+        """Return the key arguments of args according to the key positions."""
+        if self.find_keys is not None:  # "movablekeys"
+            return self.find_keys(args)
+        if self.first_key == 0:  # Command takes no keys
+            return []
+        last = self.last_key if self.last_key >= 0 else len(args) + self.last_key  # Negative index counts from the end
+        return args[self.first_key:last + 1:self.key_step]
+
+
+COMMANDS = {}  # Upper-case command name (bytes) -> Command
+SUBSCRIBED_COMMANDS = {b"subscribe", b"unsubscribe", b"psubscribe", b"punsubscribe", b"ping", b"quit"}  # Allowed while subscribed
+TRANSACTION_COMMANDS = {b"multi", b"exec", b"discard", b"watch", b"quit"}  # Run right away inside MULTI instead of being queued
+QUEUED = b"+QUEUED\r\n"  # Reply to a command queued inside MULTI
+INTERNAL_ERROR = b"-ERR internal error\r\n"  # Reply to a command whose handler raised unexpectedly
+
+
+def command(name, arity, flags=(), first_key=0, last_key=0, key_step=0, find_keys=None):  # Registration decorator
+    """Register the decorated function as the handler of a command."""
+    def register(handler):
+        COMMANDS[name.upper().encode()] = Command(name.lower().encode(), handler, arity, tuple(flags), first_key, last_key, key_step, find_keys)
+        return handler
+    return register
+
+
+CLIENT_IDS = itertools.count(1)  # CLIENT ID: unique and increasing for the life of the process
+
+
+class Client:  # Per-connection state that command handlers can see
+    """Connection state shared between a front end and the command core."""
+
+    def __init__(self, address=None, send=None, conn=None):
+        self.id = next(CLIENT_IDS)  # CLIENT ID, CLIENT KILL ID
+        self.address = address  # Peer address, for logging and introspection
+        self.name = b""  # CLIENT SETNAME
+        self.created = self.last_interaction = time.monotonic()  # The front end refreshes last_interaction on every read (idle time, timeout)
+        self.last_command = b"NULL"  # Name of the last command run, for CLIENT LIST
+        self.close = None  # close() asks the front end to drop the connection (CLIENT KILL, timeout, buffer limits); None for pseudo-clients
+        self.buffers = None  # buffers() -> (query buffer bytes, output buffer bytes, bytes allocated for both), for CLIENT LIST
+        self.output_soft_since = 0.0  # When the output buffer went over its soft limit (0.0 = it is under)
+        self.output_allowance = 0  # Queued output bytes the limits ignore (the snapshot of a full sync)
+        self.conn = conn  # The front end's handle for the connection (opaque to the core)
+        self.close_after_reply = False  # Set by QUIT: the front end closes the connection once the reply is written
+        self.send = send  # send(bytes) queues unsolicited output (Pub/Sub messages); None if the front end cannot push
+        self.channels = set()  # Subscribed channels
+        self.patterns = set()  # Subscribed glob patterns
+        self.blocked_keys = ()  # Keys a BLPOP/BRPOP is waiting on; non-empty while blocked
+        self.blocked_left = True  # Pop from the head (BLPOP) or the tail (BRPOP) once served
+        self.blocked_deadline = None  # time.monotonic() at which the blocking call times out, None = never
+        self.multi = None  # Commands queued since MULTI, or None outside a transaction
+        self.multi_error = False  # A command was rejected while queueing: EXEC aborts
+        self.watched = {}  # WATCHed key -> the CommandCore whose registry holds it
+        self.watch_dirty = False  # A watched key was modified: EXEC fails
+        self.replica = None  # replication.Replica once PSYNC made this connection a replica
+        self.replica_port = 0  # Port the replica listens on (REPLCONF listening-port), for INFO
+
+
+def client_class(client):  # Which output buffer limits apply
+    """Return "replica", "pubsub" or "normal"."""
+    if client.replica is not None:
+        return "replica"
+    return "pubsub" if client.channels or client.patterns else "normal"
+
+
+def format_address(client):  # CLIENT LIST addr=, CLIENT KILL ADDR
+    address = client.address
+    return f"{address[0]}:{address[1]}" if isinstance(address, tuple) and len(address) >= 2 else ""
+
+
+DEFAULT_CONFIG = {  # Server settings; front ends override them with --name value arguments
+    "dir": ".",  # Directory for persistence files
+    "appendonly": False,  # Log write commands to the append-only file
+    "appendfilename": "appendonly.aof",  # Name of the append-only file inside dir
+    "appendfsync": "everysec",  # always | everysec | no
+    "dbfilename": "dump.rdb",  # Name of the snapshot file inside dir
+    "maxmemory": 0,  # Memory limit for the dataset in bytes (0 = unlimited); accepts kb/mb/gb suffixes
+    "maxmemory-policy": "noeviction",  # What to evict when the limit is reached
+    "maxmemory-samples": 5,  # Keys sampled per eviction round
+    "lfu-log-factor": 10,  # How slowly the LFU counter saturates
+    "lfu-decay-time": 1,  # Minutes of idleness per LFU counter decrement
+    "hash-max-listpack-entries": 128,  # Hashes with more fields are converted to a dict
+    "hash-max-listpack-value": 64,  # ... as are hashes with a longer field or value
+    "set-max-intset-entries": 512,  # All-integer sets with more members are converted to a set
+    "set-max-listpack-entries": 128,  # Other small sets with more members are converted to a set
+    "set-max-listpack-value": 64,  # ... as are sets with a longer member
+    "zset-max-listpack-entries": 128,  # Sorted sets with more members are converted to a skiplist
+    "zset-max-listpack-value": 64,  # ... as are sorted sets with a longer member
+    "cluster-workers": 0,  # >0: run that many worker processes, each owning a range of hash slots
+    "cluster-redirect": "forward",  # forward: relay commands for other workers' slots; moved: answer -MOVED
+    "slowlog-log-slower-than": 10000,  # Microseconds a command must run to enter the slow log (negative disables it)
+    "slowlog-max-len": 128,  # Slow log entries kept
+    "latency-tracking": True,  # Record per-command latency histograms (LATENCY HISTOGRAM, INFO latencystats)
+    "replicaof": "",  # "host port": start as a replica of that server
+    "replica-read-only": True,  # Replicas refuse writes from their own clients
+    "repl-backlog-size": 1024 * 1024,  # Bytes of recent stream kept for partial resyncs
+    "repl-ping-replica-period": 10,  # Seconds between PINGs a primary streams to its replicas
+    "repl-timeout": 60,  # Seconds without data from the primary before a replica reconnects
+    "maxclients": 10000,  # Connections accepted at once; more are refused with an error
+    "timeout": 0,  # Seconds of inactivity after which a client is disconnected (0 = never)
+    "client-query-buffer-limit": 1024 ** 3,  # Unparsed input a client may accumulate before it is disconnected
+    "client-output-buffer-limit": "normal 0 0 0 replica 256mb 64mb 60 pubsub 32mb 8mb 60",  # class hard soft seconds, per client class
+    "script-time-limit": 5000,  # Milliseconds a script may run before it is stopped with an error (0 = no limit)
+    "hll-sparse-max-bytes": 3000,  # HyperLogLogs with larger sparse registers are converted to the 12 KB dense encoding
+}
+
+CLIENT_CLASSES = ("normal", "replica", "pubsub")  # Classes with their own output buffer limits, as in Redis
+MEMORY_UNITS = {"kb": 1000, "k": 1000, "mb": 1000 ** 2, "m": 1000 ** 2, "gb": 1000 ** 3, "g": 1000 ** 3}  # Suffixes accepted for byte sizes
+
+
+def parse_memory(raw):  # "100mb" -> 100000000
+    """Parse a byte count with an optional kb/mb/gb suffix."""
+    raw = raw.strip().lower()
+    for suffix in sorted(MEMORY_UNITS, key=len, reverse=True):  # Longest suffix first ("mb" before "b")
+        if raw.endswith(suffix):
+            return int(raw[:-len(suffix)]) * MEMORY_UNITS[suffix]
+    return int(raw)
+
+
+def parse_output_limits(raw):  # "replica 256mb 64mb 60 pubsub 32mb 8mb 60"
+    """Parse client-output-buffer-limit into {class: (hard bytes, soft bytes, soft seconds)}."""
+    fields = raw.split()
+    if len(fields) % 4:
+        raise ValueError("client-output-buffer-limit needs class hard soft seconds groups")
+    limits = {}
+    for name, hard, soft, seconds in zip(fields[::4], fields[1::4], fields[2::4], fields[3::4]):
+        name = "replica" if name.lower() == "slave" else name.lower()  # Old name of the replica class
+        if name not in CLIENT_CLASSES:
+            raise ValueError(f"invalid client class '{name}'")
+        limits[name] = (parse_memory(hard), parse_memory(soft), int(seconds))
+    return limits
+
+
+def format_output_limits(limits):  # CONFIG GET client-output-buffer-limit
+    return " ".join(f"{name} {hard} {soft} {seconds}" for name, (hard, soft, seconds) in limits.items())
+
+
+def parse_config_args(argv):  # "--port 6380 --appendonly yes" style arguments
+    """Turn --name value pairs into a dict, converting values to the type of the defaults."""
+    config = {}
+    for name, raw in zip(argv[::2], argv[1::2]):
+        name = name.lstrip("-")
+        default = DEFAULT_CONFIG.get(name)
+        if isinstance(default, bool):
+            config[name] = raw.lower() in ("yes", "true", "1")
+        elif isinstance(default, int):
+            config[name] = parse_memory(raw)
+        else:
+            config[name] = raw
+    return config
+
+
+class CommandCore:  # The dataset plus the dispatcher
+    """Owns the dataset and executes parsed commands against it."""
+
+    def __init__(self, config=None, metrics=None):
+        self.config = dict(DEFAULT_CONFIG, **(config or {}))  # Effective settings
+        self.metrics = metrics or Metrics(self.config["slowlog-log-slower-than"], self.config["slowlog-max-len"])  # Shared by the shards of a StripedStore
+        self.command_stats = self.metrics.commands  # Shortcuts for execute()
+        self.slowlog = self.metrics.slowlog
+        self.db = Keyspace()  # Key (bytes) -> value, plus the expires index
+        self.db.lfu_log_factor = self.config["lfu-log-factor"]
+        self.db.lfu_decay_time = self.config["lfu-decay-time"]
+        Hash.max_listpack_entries = self.config["hash-max-listpack-entries"]  # Encoding thresholds are server-wide
+        Hash.max_listpack_value = min(self.config["hash-max-listpack-value"], listpack.MAX_ENTRY)
+        Set.max_intset_entries = self.config["set-max-intset-entries"]
+        Set.max_listpack_entries = self.config["set-max-listpack-entries"]
+        Set.max_listpack_value = min(self.config["set-max-listpack-value"], listpack.MAX_ENTRY)
+        ZSet.max_listpack_entries = self.config["zset-max-listpack-entries"]
+        ZSet.max_listpack_value = min(self.config["zset-max-listpack-value"], listpack.MAX_ENTRY)
+        hyperloglog.sparse_max_bytes = self.config["hll-sparse-max-bytes"]
+        self.pubsub = PubSub()  # Channel and pattern subscriptions
+        self.cluster = None  # ClusterState set by a front end running in sharded mode
+        self.blocked = BlockedClients()  # Clients parked by BLPOP/BRPOP
+        self.watched_keys = {}  # Key -> {Client: None} of clients WATCHing it
+        self.transaction_log = None  # Commands propagated by the EXEC being run, logged together once it ends
+        self.lazyfree = LazyFree()  # Values dropped by UNLINK, released a slice at a time by the cron
+        self.evictor = Evictor(self.db, self.config["maxmemory-policy"], self.config["maxmemory-samples"])  # maxmemory enforcement
+        self.loading = False  # True while persistence files are replayed (nothing is re-logged)
+        self.latency_tracking = self.config["latency-tracking"]  # Read on every command
+        self.propagate_as = None  # Set by a handler to log different commands than the one executed
+        self.replication = Replication(self)  # Backlog and replicas; the link to our primary when we are a replica
+        self.read_only = False  # Replica with replica-read-only: writes are only accepted from the primary
+        self.scripting = ScriptRunner(self)  # EVAL/EVALSHA
+        self.script_router = None  # script_router(args) -> the CommandCore a script's command runs on, or an error reply; set by StripedStore
+        self.clients = {}  # Client id -> Client of every connection the front end registered (CLIENT LIST/KILL)
+        self.idle_clients = TimerWheel(time.monotonic())  # Client -> when it may have been idle for timeout seconds
+        self.output_limits = {**parse_output_limits(DEFAULT_CONFIG["client-output-buffer-limit"]),  # Client class -> (hard, soft, seconds);
+                              **parse_output_limits(self.config["client-output-buffer-limit"])}  # classes not configured keep their defaults
+        self.config["client-output-buffer-limit"] = format_output_limits(self.output_limits)  # CONFIG GET shows every class
+        self.output_limit_floor = 0  # Output buffers up to this size cannot break any limit; set by configure_limits()
+        self.configure_limits()
+        self.aof = None  # AppendOnlyFile when appendonly is enabled
+        self.rdb_path = os.path.join(self.config["dir"], self.config["dbfilename"])  # Snapshot location
+        self.rdb_child = None  # PID of the BGSAVE child, if one is running
+        self.last_save = int(time.time())  # Unix time of the last successful snapshot (LASTSAVE)
+        if self.config["appendonly"]:
+            self.aof = AppendOnlyFile(os.path.join(self.config["dir"], self.config["appendfilename"]), self.config["appendfsync"])
+
+    def load(self):  # Called once by the front end before it starts serving
+        """Restore the dataset from the append-only file if enabled, otherwise from the snapshot."""
+        if self.aof is None:  # The AOF, when enabled, is the more complete source
+            if os.path.exists(self.rdb_path):
+                start = time.perf_counter()
+                keys = rdb.load(self.rdb_path, self.db)
+                print(f"RDB: loaded {keys} keys in {time.perf_counter() - start:.3f}s")
+            return
+        if not os.path.exists(self.aof.path):
+            return
+        start = time.perf_counter()
+        loader = Client()  # Pseudo-client for replayed commands
+        self.loading = True
+        try:
+            commands = self.aof.load(lambda args: self.execute(loader, args))
+        finally:
+            self.loading = False
+        print(f"AOF: replayed {commands} commands in {time.perf_counter() - start:.3f}s")
+
+    def propagate(self, commands):  # Send write commands to the persistence layer and the replicas
+        """Log executed write commands (each a list of bytes) and stream them to replicas."""
+        if self.transaction_log is not None:  # Inside EXEC: logged as one MULTI ... EXEC block afterwards
+            self.transaction_log.extend(commands)
+            return
+        if self.aof is not None:
+            for args in commands:
+                self.aof.feed(args)
+        if self.replication.backlog is not None and self.replication.link is None:  # A replica relays its primary's bytes instead
+            self.replication.feed(commands)
+
+    def child_running(self):  # Only one fork child at a time
+        """Return True while a BGSAVE, BGREWRITEAOF or full-sync snapshot child is running."""
+        return (self.rdb_child is not None or self.replication.child is not None
+                or (self.aof is not None and self.aof.rewrite_child is not None))
+
+    def save(self):  # SAVE: blocks the caller
+        """Write a snapshot synchronously; return the number of keys written."""
+        keys = rdb.save(self.rdb_path, self.db.data, self.db.expires, now_ms())
+        self.last_save = int(time.time())
+        return keys
+
+    def bgsave(self):  # BGSAVE: fork and let the child write the copy-on-write view
+        """Start a background snapshot; return False if a child is already running."""
+        if self.child_running():
+            return False
+        if not hasattr(os, "fork"):  # No copy-on-write snapshot available: save in place
+            self.save()
+            return True
+        pid = os.fork()
+        if pid == 0:  # Child: the dataset is frozen as of the fork
+            status = 1
+            try:
+                rdb.save(self.rdb_path, self.db.data, self.db.expires, now_ms())
+                status = 0
+            finally:
+                os._exit(status)  # Skip the parent's cleanup handlers
+        self.rdb_child = pid
+        return True
+
+    def check_bgsave(self):  # Called from the cron
+        """Reap a finished BGSAVE child."""
+        if self.rdb_child is None:
+            return
+        pid, status = os.waitpid(self.rdb_child, os.WNOHANG)  # Non-blocking reap
+        if pid == 0:  # Still running
+            return
+        self.rdb_child = None
+        if os.waitstatus_to_exitcode(status) == 0:
+            self.last_save = int(time.time())
+            print("RDB: background saving finished")
+        else:
+            print("RDB: background saving failed")
+
+    def propagate_eviction(self, key):  # Evictions change the dataset too
+        """Log an evicted key as a DEL."""
+        if not self.loading:
+            self.propagate([[b"DEL", key]])
+        if self.watched_keys:
+            self.touch_key(key)
+
+    def info(self):  # INFO sections
+        """Return the INFO text as a dict of section name -> list of (field, value)."""
+        metrics = self.metrics
+        loop = metrics.loop
+        uptime = int(time.time() - metrics.start_time)
+        metrics.used_memory_peak = max(metrics.used_memory_peak, self.db.used_memory)
+        return {
+            "server": [
+                ("process_id", os.getpid()),
+                *metrics.server.items(),  # tcp_port, multiplexing_api, hz: filled in by the front end
+                ("uptime_in_seconds", uptime),
+                ("uptime_in_days", uptime // 86400),
+            ],
+            "clients": [
+                ("connected_clients", metrics.connected_clients),
+                ("blocked_clients", len(self.blocked)),
+                ("pubsub_channels", len(self.pubsub.channels)),
+                ("watching_keys", len(self.watched_keys)),
+            ],
+            "memory": [
+                ("used_memory", self.db.used_memory),
+                ("used_memory_human", f"{self.db.used_memory / 1024 ** 2:.2f}M"),
+                ("used_memory_peak", metrics.used_memory_peak),
+                ("maxmemory", self.config["maxmemory"]),
+                ("maxmemory_policy", self.evictor.policy),
+            ],
+            "stats": [
+                ("total_connections_received", metrics.connections_received),
+                ("total_commands_processed", metrics.total_calls()),
+                ("instantaneous_ops_per_sec", metrics.instantaneous_ops()),
+                ("expired_keys", self.db.expired_keys),
+                ("evicted_keys", self.evictor.evicted_keys),
+                ("lazyfree_pending_objects", len(self.lazyfree)),
+                ("lazyfreed_objects", self.lazyfree.freed_objects),
+                ("sync_full", self.replication.sync_full),
+                ("sync_partial_ok", self.replication.sync_partial_ok),
+                ("sync_partial_err", self.replication.sync_partial_err),
+                ("eventloop_cycles", loop.cycles),
+                ("eventloop_duration_sum", loop.ns // 1000),
+                ("eventloop_duration_max", loop.max_ns // 1000),
+                ("eventloop_duration_p99", loop.histogram.percentile(0.99) // 1000),
+                ("eventloop_ready_events_sum", loop.ready),
+                ("eventloop_ready_events_max", loop.max_ready),
+            ],
+            "commandstats": [
+                (f"cmdstat_{name.decode()}", f"calls={stats.calls},usec={stats.ns // 1000},"
+                                             f"usec_per_call={stats.ns / 1000 / stats.calls if stats.calls else 0:.2f},"
+                                             f"rejected_calls={stats.rejected},failed_calls={stats.failed}")
+                for name, stats in sorted(metrics.commands.items())
+            ],
+            "latencystats": [
+                (f"latency_percentiles_usec_{name.decode()}",
+                 ",".join(f"p{label}={stats.percentile(fraction) / 1000:.3f}" for label, fraction in (("50", 0.5), ("99", 0.99), ("99.9", 0.999))))
+                for name, stats in sorted(metrics.commands.items()) if any(stats.buckets)
+            ],
+            "replication": self.replication.info(),
+            "keyspace": [
+                ("db0", f"keys={len(self.db)},expires={len(self.db.expires)}"),
+            ],
+        }
+
+    def client_closed(self, client):  # Called by the front end when a connection goes away
+        """Release everything the core holds for a disconnected client."""
+        if client.channels or client.patterns:
+            self.pubsub.unsubscribe_all(client)
+        if client.blocked_keys:
+            self.blocked.unblock(client)
+        if client.watched:
+            self.unwatch_all(client)
+        if client.replica is not None:
+            self.replication.remove(client)
+        if self.clients.pop(client.id, None) is not None:
+            self.idle_clients.cancel(client)
+
+    def add_client(self, client):  # Called by the front end for every accepted connection
+        """Register a connection; return False if maxclients connections are already open."""
+        if len(self.clients) >= self.config["maxclients"]:
+            return False
+        self.clients[client.id] = client
+        if self.config["timeout"]:
+            self.idle_clients.schedule(client, client.last_interaction + self.config["timeout"])
+        return True
+
+    def configure_limits(self):  # At start-up and after CONFIG SET
+        """Recompute the output limit floor and (re)arm idle timers for the current settings."""
+        self.output_limit_floor = min((limit for hard, soft, _ in self.output_limits.values() for limit in (hard, soft) if limit),
+                                      default=float("inf"))  # Front ends skip the check below it
+        timeout = self.config["timeout"]
+        for client in self.clients.values():  # Timers of a disabled timeout are dropped when they fire
+            if timeout:
+                self.idle_clients.schedule(client, client.last_interaction + timeout)
+
+    def output_limit_exceeded(self, client, size):  # Front ends call this once output exceeds output_limit_floor
+        """Return True if an output buffer of size bytes breaks the hard limit, or the soft limit for too long, of client's class."""
+        hard, soft, seconds = self.output_limits[client_class(client)]
+        size -= client.output_allowance
+        if hard and size > hard:
+            return True
+        if not soft or size <= soft:
+            client.output_soft_since = 0.0
+            return False
+        now = time.monotonic()
+        if not client.output_soft_since:  # Just went over: the clock starts
+            client.output_soft_since = now
+            return False
+        return now - client.output_soft_since > seconds
+
+    def close_idle_clients(self, now):  # Called from the cron
+        """Disconnect the clients whose idle timer fired and that really were idle for timeout seconds."""
+        timeout = self.config["timeout"]
+        for client in self.idle_clients.advance(now):
+            if not timeout or client.id not in self.clients:  # Timeout disabled, or the client left
+                continue
+            deadline = client.last_interaction + timeout
+            if client.replica is not None or client.channels or client.patterns or client.blocked_keys:  # Quiet by design, never timed out
+                self.idle_clients.schedule(client, now + timeout)
+            elif deadline > now:  # Active since the timer was set
+                self.idle_clients.schedule(client, deadline)
+            else:  # Logged only at verbose level by Redis: not printed
+                client.close()
+
+    def watch(self, client, key):  # WATCH
+        """Make EXEC fail for client if key is modified before it runs."""
+        if key not in client.watched:
+            self.watched_keys.setdefault(key, {})[client] = None
+            client.watched[key] = self
+
+    def unwatch_all(self, client):  # UNWATCH, EXEC, DISCARD, disconnect
+        """Forget every key client watches and reset its dirty flag."""
+        for key, core in client.watched.items():
+            watchers = core.watched_keys[key]
+            del watchers[client]
+            if not watchers:
+                del core.watched_keys[key]
+        client.watched = {}
+        client.watch_dirty = False
+
+    def touch_key(self, key):  # Called for every modified key while some key is watched
+        """Flag the transactions of the clients watching key."""
+        for client in self.watched_keys.get(key, ()):
+            client.watch_dirty = True
+
+    def exec_transaction(self, client, queued):  # EXEC
+        """Run queued commands back to back and return their replies as one array."""
+        self.transaction_log = log = []  # Also tells blocking commands not to block
+        try:
+            replies = [self.execute(client, args) for args in queued]
+        finally:
+            self.transaction_log = None
+        if log:  # Replayed atomically from the AOF
+            self.propagate_as = [[b"MULTI"], *log, [b"EXEC"]]
+        return b"*%d\r\n" % len(replies) + b"".join(replies)
+
+    def serve_blocked(self):  # Called after every command that may have pushed to a watched key
+        """Hand elements of ready lists to the clients blocked on them, oldest client first."""
+        blocked = self.blocked
+        while blocked.ready_keys:
+            key = next(iter(blocked.ready_keys))
+            del blocked.ready_keys[key]
+            while True:
+                client = blocked.first_waiting(key)
+                value = self.db.get(key)
+                if client is None or value.__class__ is not QuickList:  # Nobody left, or the list is gone
+                    break
+                element = value.popleft() if client.blocked_left else value.pop()
+                self.container_changed(key, value)
+                self.propagate([[b"LPOP" if client.blocked_left else b"RPOP", key]])  # Replayed as the pop it became
+                if self.watched_keys:
+                    self.touch_key(key)
+                blocked.unblock(client)
+                client.send(encode_array([key, element]))
+
+    def container_changed(self, key, value):  # Bookkeeping after an in-place mutation
+        """Re-account key after its container was mutated, deleting it once empty; counts as a change."""
+        if value:
+            self.db.update_memory(key)
+            self.db.dirty += 1
+        else:
+            self.db.delete(key)  # Empty containers do not exist
+
+    def blocked_timeout(self):  # The front end sleeps at most this long
+        """Return the seconds until the next blocking call times out, or None."""
+        return self.blocked.next_timeout() if len(self.blocked) else None
+
+    def expire_blocked(self):  # Called by the front end on every loop iteration
+        """Send a nil reply to every blocked client whose timeout elapsed."""
+        for client in self.blocked.expired():
+            self.blocked.unblock(client)
+            client.send(NULL_ARRAY)
+
+    def take_unblocked(self):  # The front end resumes these clients' pipelined input
+        """Return and forget the clients unblocked since the last call."""
+        unblocked, self.blocked.unblocked = self.blocked.unblocked, []
+        return unblocked
+
+    def before_sleep(self):  # Called by the front end before replies are written
+        """Write the AOF buffer so no client sees a reply before its write reached the log."""
+        if self.aof is not None:
+            self.aof.flush()
+
+    def cron(self):  # Periodic housekeeping, called by the front end's event loop
+        """Run background tasks: active expiry and reaping BGSAVE / AOF rewrite children."""
+        self.db.refresh_clock()  # LRU clock used by reads until the next tick
+        self.db.active_expire_cycle()  # Bounded, sampled collection of expired keys
+        self.check_bgsave()  # Note a finished BGSAVE
+        if self.lazyfree.pending:
+            self.lazyfree.step()  # Release another slice of the values UNLINK dropped
+        self.metrics.sample(self.db.used_memory)  # instantaneous_ops_per_sec, used_memory_peak
+        self.replication.cron()  # Snapshot children of full syncs, pings, the link to our primary
+        if len(self.idle_clients):
+            self.close_idle_clients(time.monotonic())  # Only the timers that are due, not every client
+        if self.aof is not None:
+            self.aof.check_rewrite()  # Install a finished BGREWRITEAOF
+
+    def dataset_commands(self):  # Snapshot of the dataset as commands
+        """Yield the commands that recreate the current dataset (used by AOF rewrites)."""
+        now = now_ms()
+        expires = self.db.expires
+        for key, value in self.db.data.items():
+            when = expires.get(key)
+            if when is not None and when <= now:  # Already expired: leave it out
+                continue
+            yield from rewrite_value(key, value)
+            if when is not None:  # Absolute expiry so replay does not extend TTLs
+                yield [b"PEXPIREAT", key, b"%d" % when]
+
+    def execute(self, client, args):  # Dispatch one command
+        """Execute one command (a list of bytes) and return the encoded reply.
+
+        Returns None when the command blocked the client (BLPOP on empty
+        lists): the reply is sent later through client.send().
+        """
+        spec = COMMANDS.get(args[0].upper())  # O(1) lookup instead of an if/elif chain
+        if spec is None:  # Not in the table
+            client.multi_error = client.multi is not None  # Inside MULTI the whole transaction is aborted
+            return encode_error(f"ERR unknown command '{args[0].decode(errors='replace')}'")
+        arity = spec.arity  # Checked here once for every command
+        if (arity > 0 and len(args) != arity) or len(args) < -arity:
+            client.multi_error = client.multi is not None
+            self.metrics.command(spec.name).rejected += 1
+            return encode_error(f"ERR wrong number of arguments for '{spec.name.decode()}' command")
+        if (client.channels or client.patterns) and spec.name not in SUBSCRIBED_COMMANDS:  # RESP2 subscriber mode
+            return encode_error(f"ERR Can't execute '{spec.name.decode()}': only (P)SUBSCRIBE / (P)UNSUBSCRIBE / PING / QUIT are allowed in this context")
+        if self.read_only and "write" in spec.flags and client is not self.replication.link.client:
+            client.multi_error = client.multi is not None
+            return encode_error("READONLY You can't write against a read only replica.")
+        if client.multi is not None and spec.name not in TRANSACTION_COMMANDS:  # Runs when EXEC arrives
+            client.multi.append(args)
+            return QUEUED
+
+        if self.config["maxmemory"] and "write" in spec.flags and not self.loading:  # Make room before the dataset grows
+            if not self.evictor.free_memory(self.config["maxmemory"], self.propagate_eviction) and "denyoom" in spec.flags:
+                self.metrics.command(spec.name).rejected += 1
+                return encode_error("OOM command not allowed when used memory > 'maxmemory'.")
+
+        client.last_command = spec.name
+        dirty = self.db.dirty  # To detect whether the command changed the dataset
+        self.propagate_as = None
+        start = perf_counter_ns()
+        try:
+            reply = spec.handler(self, client, args)  # Handlers return ready-to-send bytes
+        except CommandError as e:  # Expected failures become error replies
+            reply = encode_error(str(e))
+        except Exception:  # A bug in a handler: report it and keep serving every other client
+            print(f"Error executing {spec.name.decode()}:")
+            traceback.print_exc()
+            reply = INTERNAL_ERROR
+        duration = perf_counter_ns() - start
+        stats = self.command_stats.get(spec.name) or self.metrics.command(spec.name)
+        stats.calls += 1
+        stats.ns += duration
+        if self.latency_tracking:  # LatencyHistogram.record() inlined: this runs for every command
+            shift = duration.bit_length() - SUB_BUCKET_BITS - 1
+            stats.buckets[((shift + 1) << SUB_BUCKET_BITS) + (duration >> shift) - SUB_BUCKETS if shift > 0 else duration] += 1
+        if reply is not None and reply[0] == 45:  # "-": an error reply
+            stats.failed += 1
+        if duration >= self.slowlog.threshold_ns:
+            self.slowlog.add(args, duration, client)
+        if self.db.dirty != dirty:
+            if not self.loading:  # Only commands that changed something are logged
+                self.propagate(self.propagate_as or [args])
+            if self.watched_keys:  # Fail the transactions watching the keys it wrote
+                for key in spec.keys(args):
+                    self.touch_key(key)
+        if self.blocked.ready_keys:  # A push reached a key someone is blocked on
+            self.serve_blocked()
+        return reply
+
+
+@command("PING", arity=-1, flags=("fast",))
+def ping_command(core, client, args):
+    """PING [message]"""
+    if len(args) > 2:  # At most one optional message
+        raise CommandError("ERR wrong number of arguments for 'ping' command")
+    return encode_bulk(args[1]) if len(args) == 2 else PONG
+
+
+@command("ECHO", arity=-2, flags=("fast",))
+def echo_command(core, client, args):
+    """ECHO message"""
+    return encode_bulk(b" ".join(args[1:]))  # Inline clients may send the message unquoted
+
+
+def parse_int(raw, message="ERR value is not an integer or out of range"):  # Integer arguments
+    """Parse an integer argument, raising CommandError on garbage."""
+    try:
+        return int(raw)
+    except ValueError:
+        raise CommandError(message) from None
+
+
+WRONGTYPE = "WRONGTYPE Operation against a key holding the wrong kind of value"
+
+
+def lookup(core, key, kind):  # Typed read
+    """Return the value of key (None if missing), raising WRONGTYPE unless it is of class kind."""
+    value = core.db.get(key)
+    if value is not None and value.__class__ is not kind:
+        raise CommandError(WRONGTYPE)
+    return value
+
+
+def lookup_string(core, key):  # Strings are bytes, an int (int encoding) or a bytearray once written in place
+    """Return the bytes of the string at key (None if missing), raising WRONGTYPE for other types."""
+    value = core.db.get(key)
+    if value is None or value.__class__ is bytes or value.__class__ is bytearray:
+        return value
+    if value.__class__ is int:
+        return b"%d" % value
+    raise CommandError(WRONGTYPE)
+
+
+def mutable_string(core, key, value):  # Before an in-place string write (APPEND, SETRANGE, SETBIT, PFADD)
+    """Return value, the string at key (or None), as a bytearray stored under key."""
+    if value.__class__ is not bytearray:  # Converted once; later writes reuse it
+        value = bytearray(b"" if value is None else value)
+        core.db.set(key, value, keep_ttl=True)
+    return value
+
+
+def string_changed(core, key):  # After an in-place string write
+    """Re-account the string at key; counts as a change."""
+    core.db.update_memory(key)
+    core.db.dirty += 1
+
+
+@command("SET", arity=-3, flags=("write", "denyoom"), first_key=1, last_key=1, key_step=1)
+def set_command(core, client, args):
+    """SET key value [NX | XX] [EX seconds | PX milliseconds | KEEPTTL]"""
+    key, value = args[1], args[2]
+    condition = None  # b"NX" / b"XX"
+    expire_at = None  # Absolute expiry in unix ms
+    keep_ttl = False
+    i = 3
+    while i < len(args):  # Parse the options
+        option = args[i].upper()
+        if option in (b"NX", b"XX") and condition is None:
+            condition = option
+        elif option == b"KEEPTTL" and expire_at is None:
+            keep_ttl = True
+        elif option in (b"EX", b"PX") and expire_at is None and not keep_ttl and i + 1 < len(args):
+            amount = parse_int(args[i + 1])
+            if amount <= 0:
+                raise CommandError("ERR invalid expire time in 'set' command")
+            expire_at = checked_expire_time(now_ms() + (amount * 1000 if option == b"EX" else amount), "set")
+            i += 1
+        else:
+            raise CommandError("ERR syntax error")
+        i += 1
+
+    if condition is not None and (core.db.get(key) is not None) != (condition == b"XX"):  # NX needs a missing key, XX an existing one
+        return NULL_BULK
+    core.db.set(key, string_object(value), keep_ttl=keep_ttl)  # Clears any previous TTL unless KEEPTTL
+    if expire_at is not None:
+        core.db.set_expire(key, expire_at)
+        core.propagate_as = [[b"SET", key, value], [b"PEXPIREAT", key, b"%d" % expire_at]]  # Log an absolute expiry
+    return OK
+
+
+@command("GET", arity=2, flags=("readonly", "fast"), first_key=1, last_key=1, key_step=1)
+def get_command(core, client, args):
+    """GET key"""
+    return encode_bulk(lookup_string(core, args[1]))  # Nil bulk string if the key is missing or expired
+
+
+@command("DEL", arity=-2, flags=("write",), first_key=1, last_key=-1, key_step=1)
+def del_command(core, client, args):
+    """DEL key [key ...]"""
+    return encode_integer(sum(core.db.delete(key) for key in args[1:]))  # Number of keys that existed
+
+
+@command("UNLINK", arity=-2, flags=("write", "fast"), first_key=1, last_key=-1, key_step=1)
+def unlink_command(core, client, args):
+    """UNLINK key [key ...]"""
+    removed = 0
+    for key in args[1:]:
+        value = core.db.get(key)
+        if value is not None:
+            core.db.delete(key)  # The key is gone now; large values are released by the cron
+            core.lazyfree.free(value)
+            removed += 1
+    return encode_integer(removed)
+
+
+@command("EXISTS", arity=-2, flags=("readonly", "fast"), first_key=1, last_key=-1, key_step=1)
+def exists_command(core, client, args):
+    """EXISTS key [key ...]"""
+    return encode_integer(sum(key in core.db for key in args[1:]))  # A key named twice counts twice
+
+
+@command("MGET", arity=-2, flags=("readonly", "fast"), first_key=1, last_key=-1, key_step=1)
+def mget_command(core, client, args):
+    """MGET key [key ...]"""
+    get = core.db.get
+    values = []
+    for key in args[1:]:
+        value = get(key)
+        values.append(as_bytes(value) if value.__class__ in (bytes, int, bytearray) else None)  # Missing keys and other types read as nil
+    return encode_array(values)
+
+
+@command("MSET", arity=-3, flags=("write", "denyoom"), first_key=1, last_key=-1, key_step=2)
+def mset_command(core, client, args):
+    """MSET key value [key value ...]"""
+    if len(args) % 2 == 0:
+        raise CommandError("ERR wrong number of arguments for 'mset' command")
+    for i in range(1, len(args), 2):
+        core.db.set(args[i], string_object(args[i + 1]))
+    return OK
+
+
+@command("MSETNX", arity=-3, flags=("write", "denyoom"), first_key=1, last_key=-1, key_step=2)
+def msetnx_command(core, client, args):
+    """MSETNX key value [key value ...]"""
+    if len(args) % 2 == 0:
+        raise CommandError("ERR wrong number of arguments for 'msetnx' command")
+    if any(args[i] in core.db for i in range(1, len(args), 2)):  # All or nothing
+        return encode_integer(0)
+    for i in range(1, len(args), 2):
+        core.db.set(args[i], string_object(args[i + 1]))
+    return encode_integer(1)
+
+
+def incr_generic(core, key, increment):  # Shared by INCR, INCRBY, DECR and DECRBY
+    """Add increment to the integer at key (0 if missing) and return the reply."""
+    value = core.db.get(key)
+    if value.__class__ is int:  # The int encoding: nothing to parse
+        number = value
+    elif value is None:
+        number = 0
+    elif value.__class__ is bytes or value.__class__ is bytearray:
+        number = as_int64(value)
+        if number is None:
+            raise CommandError("ERR value is not an integer or out of range")
+    else:
+        raise CommandError(WRONGTYPE)
+    number += increment
+    if not -(1 << 63) <= number < 1 << 63:  # Same range as Redis' long long
+        raise CommandError("ERR increment or decrement would overflow")
+    core.db.set(key, shared(number), keep_ttl=True)
+    return encode_integer(number)
+
+
+@command("INCR", arity=2, flags=("write", "denyoom", "fast"), first_key=1, last_key=1, key_step=1)
+def incr_command(core, client, args):
+    """INCR key"""
+    return incr_generic(core, args[1], 1)
+
+
+@command("DECR", arity=2, flags=("write", "denyoom", "fast"), first_key=1, last_key=1, key_step=1)
+def decr_command(core, client, args):
+    """DECR key"""
+    return incr_generic(core, args[1], -1)
+
+
+@command("INCRBY", arity=3, flags=("write", "denyoom", "fast"), first_key=1, last_key=1, key_step=1)
+def incrby_command(core, client, args):
+    """INCRBY key increment"""
+    return incr_generic(core, args[1], parse_int(args[2]))
+
+
+@command("DECRBY", arity=3, flags=("write", "denyoom", "fast"), first_key=1, last_key=1, key_step=1)
+def decrby_command(core, client, args):
+    """DECRBY key decrement"""
+    decrement = parse_int(args[2])
+    if decrement == -(1 << 63):  # Its negation is not a long long
+        raise CommandError("ERR decrement would overflow")
+    return incr_generic(core, args[1], -decrement)
+
+
+def format_float(number):  # INCRBYFLOAT results
+    """Return number in fixed-point notation with the fewest digits that parse back to it ("10.6", "5000")."""
+    text = format(decimal.Decimal(repr(number)), "f")
+    return (text.rstrip("0").rstrip(".") if "." in text else text).encode()
+
+
+@command("INCRBYFLOAT", arity=3, flags=("write", "denyoom", "fast"), first_key=1, last_key=1, key_step=1)
+def incrbyfloat_command(core, client, args):
+    """INCRBYFLOAT key increment"""
+    key = args[1]
+    increment = parse_score(args[2])
+    value = lookup_string(core, key)
+    number = (parse_score(value) if value is not None else 0.0) + increment
+    if math.isinf(number) or math.isnan(number):
+        raise CommandError("ERR increment would produce NaN or Infinity")
+    result = format_float(number)
+    core.db.set(key, string_object(result), keep_ttl=True)
+    core.propagate_as = [[b"SET", key, result, b"KEEPTTL"]]  # Replicas and the AOF must not redo the float arithmetic
+    return encode_bulk(result)
+
+
+@command("APPEND", arity=3, flags=("write", "denyoom", "fast"), first_key=1, last_key=1, key_step=1)
+def append_command(core, client, args):
+    """APPEND key value"""
+    key = args[1]
+    value = lookup_string(core, key)
+    if value is None:  # A new key is stored the way SET stores it
+        core.db.set(key, string_object(args[2]))
+        return encode_integer(len(args[2]))
+    if len(value) + len(args[2]) > STRING_MAX_LENGTH:
+        raise CommandError("ERR string exceeds maximum allowed size (proto-max-bulk-len)")
+    value = mutable_string(core, key, value)
+    value += args[2]  # In place, amortized O(len(args[2])): the bytearray over-allocates as it grows
+    string_changed(core, key)
+    return encode_integer(len(value))
+
+
+@command("GETRANGE", arity=4, flags=("readonly",), first_key=1, last_key=1, key_step=1)
+def getrange_command(core, client, args):
+    """GETRANGE key start end"""
+    start, end = parse_int(args[2]), parse_int(args[3])
+    value = lookup_string(core, args[1]) or b""
+    length = len(value)
+    if start < 0 and end < 0 and start > end:
+        return encode_bulk(b"")
+    if start < 0:  # Unlike LRANGE, an end before the string still selects its first byte
+        start = max(start + length, 0)
+    if end < 0:
+        end = max(end + length, 0)
+    end = min(end, length - 1)
+    if start > end:
+        return encode_bulk(b"")
+    return encode_bulk(value[start:end + 1])
+
+
+@command("SETRANGE", arity=4, flags=("write", "denyoom"), first_key=1, last_key=1, key_step=1)
+def setrange_command(core, client, args):
+    """SETRANGE key offset value"""
+    key, data = args[1], args[3]
+    offset = parse_int(args[2])
+    if offset < 0:
+        raise CommandError("ERR offset is out of range")
+    value = lookup_string(core, key)
+    if not data:  # Nothing to write: a missing key is not even created
+        return encode_integer(len(value) if value is not None else 0)
+    if offset + len(data) > STRING_MAX_LENGTH:
+        raise CommandError("ERR string exceeds maximum allowed size (proto-max-bulk-len)")
+    value = mutable_string(core, key, value)
+    if len(value) < offset:
+        value += bytes(offset - len(value))  # Zero padding up to offset
+    value[offset:offset + len(data)] = data
+    string_changed(core, key)
+    return encode_integer(len(value))
+
+
+@command("STRLEN", arity=2, flags=("readonly", "fast"), first_key=1, last_key=1, key_step=1)
+def strlen_command(core, client, args):
+    """STRLEN key"""
+    value = lookup_string(core, args[1])
+    return encode_integer(len(value) if value is not None else 0)
+
+
+def parse_bit_offset(raw):  # SETBIT, GETBIT
+    """Parse a bit offset within the largest possible string."""
+    offset = parse_int(raw, "ERR bit offset is not an integer or out of range")
+    if not 0 <= offset <= bitmaps.MAX_BIT_OFFSET:
+        raise CommandError("ERR bit offset is not an integer or out of range")
+    return offset
+
+
+def parse_bit_range(args, length):  # BITCOUNT, BITPOS: [start end [BYTE | BIT]] at args[0:]
+    """Return (first, last, in_bits) for a string of length bytes; first is None for an empty range."""
+    in_bits = False
+    if len(args) == 3:
+        unit = args[2].upper()
+        if unit not in (b"BYTE", b"BIT"):
+            raise CommandError("ERR syntax error")
+        in_bits = unit == b"BIT"
+    start = parse_int(args[0])
+    end = parse_int(args[1]) if len(args) > 1 else -1
+    bounds = list_range(start, end, length * 8 if in_bits else length)
+    return (None, None, in_bits) if bounds is None else (*bounds, in_bits)
+
+
+@command("SETBIT", arity=4, flags=("write", "denyoom"), first_key=1, last_key=1, key_step=1)
+def setbit_command(core, client, args):
+    """SETBIT key offset value"""
+    key = args[1]
+    offset = parse_bit_offset(args[2])
+    if args[3] not in (b"0", b"1"):
+        raise CommandError("ERR bit is not an integer or out of range")
+    value = mutable_string(core, key, lookup_string(core, key))
+    previous = bitmaps.set_bit(value, offset, args[3] == b"1")  # In place, whatever the size of the bitmap
+    string_changed(core, key)
+    return encode_integer(previous)
+
+
+@command("GETBIT", arity=3, flags=("readonly", "fast"), first_key=1, last_key=1, key_step=1)
+def getbit_command(core, client, args):
+    """GETBIT key offset"""
+    offset = parse_bit_offset(args[2])
+    value = lookup_string(core, args[1])
+    return encode_integer(bitmaps.get_bit(value, offset) if value is not None else 0)
+
+
+@command("BITCOUNT", arity=-2, flags=("readonly",), first_key=1, last_key=1, key_step=1)
+def bitcount_command(core, client, args):
+    """BITCOUNT key [start end [BYTE | BIT]]"""
+    if len(args) == 3 or len(args) > 5:
+        raise CommandError("ERR syntax error")
+    value = lookup_string(core, args[1])
+    if value is None:
+        return encode_integer(0)
+    if len(args) == 2:
+        return encode_integer(bitmaps.count_bits(value, 0, len(value)))
+    first, last, in_bits = parse_bit_range(args[2:], len(value))
+    if first is None:
+        return encode_integer(0)
+    return encode_integer(bitmaps.count_bit_range(value, first, last) if in_bits else bitmaps.count_bits(value, first, last + 1))
+
+
+@command("BITPOS", arity=-3, flags=("readonly",), first_key=1, last_key=1, key_step=1)
+def bitpos_command(core, client, args):
+    """BITPOS key bit [start [end [BYTE | BIT]]]"""
+    if args[2] not in (b"0", b"1"):
+        raise CommandError("ERR The bit argument must be 1 or 0.")
+    if len(args) > 6:
+        raise CommandError("ERR syntax error")
+    bit = args[2] == b"1"
+    value = lookup_string(core, args[1])
+    if not value:  # A missing key is an empty string: all zeros
+        return encode_integer(-1 if bit else 0)
+    first, last, in_bits = parse_bit_range(args[3:], len(value)) if len(args) > 3 else (0, len(value) - 1, False)
+    if first is None:
+        return encode_integer(-1)
+    position = bitmaps.find_bit_range(value, bit, first, last) if in_bits else bitmaps.find_bit(value, bit, first, last + 1)
+    if position < 0 and not bit and len(args) < 5:  # Without an end, the string counts as padded with zeros
+        return encode_integer(len(value) * 8)
+    return encode_integer(position)
+
+
+@command("BITOP", arity=-4, flags=("write", "denyoom"), first_key=2, last_key=-1, key_step=1)
+def bitop_command(core, client, args):
+    """BITOP AND | OR | XOR | NOT destkey key [key ...]"""
+    operation = args[1].upper()
+    if operation not in bitmaps.OPERATORS and operation != b"NOT":
+        raise CommandError("ERR syntax error")
+    if operation == b"NOT" and len(args) != 4:
+        raise CommandError("ERR BITOP NOT must be called with a single source key.")
+    values = [lookup_string(core, key) or b"" for key in args[3:]]  # Missing keys are empty strings
+    result = bitmaps.bit_op(operation, values)
+    if result:
+        core.db.set(args[2], result)
+    else:
+        core.db.delete(args[2])  # An empty result deletes the destination
+    return encode_integer(len(result))
+
+
+HLL_WRONGTYPE = "WRONGTYPE Key is not a valid HyperLogLog string value."
+HLL_CORRUPTED = "INVALIDOBJ Corrupted HLL object detected"
+
+
+def lookup_counter(core, key):  # Typed read of a HyperLogLog
+    """Return the HyperLogLog string at key (None if missing), raising WRONGTYPE for anything else."""
+    value = lookup_string(core, key)
+    if value is not None and not hyperloglog.is_valid(value):
+        raise CommandError(HLL_WRONGTYPE)
+    if value is not None and not hyperloglog.sparse_intact(value):  # SET can store any bytes behind a valid header
+        raise CommandError(HLL_CORRUPTED)
+    return value
+
+
+@command("PFADD", arity=-2, flags=("write", "denyoom", "fast"), first_key=1, last_key=1, key_step=1)
+def pfadd_command(core, client, args):
+    """PFADD key [element ...]"""
+    key = args[1]
+    value = lookup_counter(core, key)
+    if value is None:
+        value = hyperloglog.new()
+        core.db.set(key, value)
+        hyperloglog.add(value, args[2:])
+        changed = True  # Creating the key counts as a change
+    else:
+        value = mutable_string(core, key, value)
+        changed = hyperloglog.add(value, args[2:])
+    if changed:
+        string_changed(core, key)
+    return encode_integer(1 if changed else 0)
+
+
+@command("PFCOUNT", arity=-2, flags=("readonly",), first_key=1, last_key=-1, key_step=1)
+def pfcount_command(core, client, args):
+    """PFCOUNT key [key ...]"""
+    values = [lookup_counter(core, key) for key in args[1:]]
+    try:
+        if len(values) == 1:
+            return encode_integer(hyperloglog.count(values[0]) if values[0] is not None else 0)  # Cached until the next PFADD
+        registers = None
+        for value in values:  # The cardinality of the union
+            if value is not None:
+                registers = hyperloglog.registers(value) if registers is None else hyperloglog.merge(registers, hyperloglog.registers(value))
+    except hyperloglog.CorruptedCounter:
+        raise CommandError(HLL_CORRUPTED) from None
+    return encode_integer(hyperloglog.estimate(registers) if registers is not None else 0)
+
+
+@command("PFMERGE", arity=-2, flags=("write", "denyoom"), first_key=1, last_key=-1, key_step=1)
+def pfmerge_command(core, client, args):
+    """PFMERGE destkey [sourcekey ...]"""
+    registers = bytes(hyperloglog.REGISTERS)
+    for key in args[1:]:  # The destination is merged too
+        value = lookup_counter(core, key)
+        if value is not None:
+            try:
+                registers = hyperloglog.merge(registers, hyperloglog.registers(value))
+            except hyperloglog.CorruptedCounter:
+                raise CommandError(HLL_CORRUPTED) from None
+    core.db.set(args[1], hyperloglog.from_registers(registers), keep_ttl=True)
+    return OK
+
+
+TYPE_NAMES = {bytes: b"string", int: b"string", bytearray: b"string", QuickList: b"list", Hash: b"hash", Set: b"set", ZSet: b"zset"}  # Value class -> TYPE reply
+
+
+@command("TYPE", arity=2, flags=("readonly", "fast"), first_key=1, last_key=1, key_step=1)
+def type_command(core, client, args):
+    """TYPE key"""
+    value = core.db.get(args[1])
+    return encode_simple(b"none" if value is None else TYPE_NAMES[value.__class__])
+
+
+def object_encoding(value):  # OBJECT ENCODING
+    """Return the encoding name Redis would report for value."""
+    if value.__class__ in (bytes, int, bytearray):
+        return string_encoding(value)
+    return "quicklist" if value.__class__ is QuickList else value.encoding
+
+
+@command("OBJECT", arity=-2, flags=("readonly",), first_key=2, last_key=2, key_step=1)
+def object_command(core, client, args):
+    """OBJECT ENCODING | REFCOUNT | IDLETIME | FREQ key"""
+    subcommand = args[1].upper()
+    if len(args) != 3 or subcommand not in (b"ENCODING", b"REFCOUNT", b"IDLETIME", b"FREQ"):
+        raise CommandError(f"ERR unknown subcommand or wrong number of arguments for '{args[1].decode(errors='replace')}'")
+    key = args[2]
+    value = core.db.peek(key)  # Looking does not count as an access
+    if value is None:
+        return NULL_BULK
+    if subcommand == b"ENCODING":
+        return encode_bulk(object_encoding(value))
+    if subcommand == b"REFCOUNT":  # Shared integers report Redis' OBJ_SHARED_REFCOUNT
+        return encode_integer(2147483647 if value.__class__ is int and 0 <= value < 10000 else 1)
+    if subcommand == b"IDLETIME":
+        return encode_integer(core.db.idle_time(key))
+    return encode_integer(core.db.lfu_counter(key))  # Both clocks are kept whatever the policy
+
+
+@command("MEMORY", arity=-2, flags=("readonly",), first_key=2, last_key=2, key_step=1)
+def memory_command(core, client, args):
+    """MEMORY USAGE key [SAMPLES count]"""
+    if args[1].upper() != b"USAGE" or len(args) not in (3, 5):
+        raise CommandError(f"ERR unknown subcommand or wrong number of arguments for '{args[1].decode(errors='replace')}'")
+    if len(args) == 5 and (args[3].upper() != b"SAMPLES" or parse_int(args[4]) < 0):  # Accepted for compatibility:
+        raise CommandError("ERR syntax error")  # the accounted size is exact, nothing is sampled
+    if core.db.peek(args[2]) is None:
+        return NULL_BULK
+    return encode_integer(core.db.memory_of(args[2]))  # Entry overhead, key and value, as maintained on every write
+
+
+def parse_scan_args(args, start, with_type=False):  # Options shared by the SCAN family
+    """Parse "cursor [MATCH pattern] [COUNT n] [TYPE t]" from args[start:]; return (cursor, match, count, type)."""
+    cursor = parse_int(args[start], "ERR invalid cursor")
+    if cursor < 0:
+        raise CommandError("ERR invalid cursor")
+    match, count, kind = None, 10, None
+    i = start + 1
+    while i < len(args):
+        option = args[i].upper()
+        if i + 1 >= len(args):
+            raise CommandError("ERR syntax error")
+        if option == b"MATCH":
+            match = None if args[i + 1] == b"*" else compile_glob(args[i + 1])  # Compiled once per distinct pattern
+        elif option == b"COUNT":
+            count = parse_int(args[i + 1])
+            if count < 1:
+                raise CommandError("ERR syntax error")
+        elif option == b"TYPE" and with_type:
+            kind = args[i + 1].lower()
+        else:
+            raise CommandError("ERR syntax error")
+        i += 2
+    return cursor, match, count, kind
+
+
+def encode_scan(cursor, items):  # Reply of the SCAN family
+    """Encode [cursor, [items...]]."""
+    return b"*2\r\n" + encode_bulk(b"%d" % cursor) + encode_array(items)
+
+
+@command("SCAN", arity=-2, flags=("readonly",))
+def scan_command(core, client, args):
+    """SCAN cursor [MATCH pattern] [COUNT count] [TYPE type]"""
+    cursor, match, count, kind = parse_scan_args(args, 1, with_type=True)
+    cursor, keys = core.db.scan(cursor, count)
+    if match is not None:
+        keys = [key for key in keys if match(key)]
+    if kind is not None:
+        data = core.db.data
+        keys = [key for key in keys if TYPE_NAMES[data[key].__class__] == kind]
+    return encode_scan(cursor, keys)
+
+
+def scan_collection(core, args, kind):  # Shared by HSCAN, SSCAN and ZSCAN
+    """Return (next cursor, elements) of the collection at args[1], filtered by MATCH."""
+    cursor, match, count, _ = parse_scan_args(args, 2)
+    value = lookup(core, args[1], kind)
+    if value is None:
+        return 0, []
+    indexed = value.scan_index is not None
+    cursor, elements = value.scan(cursor, count)
+    if not indexed and value.scan_index is not None:  # The first scan built the index
+        core.db.update_memory(args[1])
+    if match is not None:
+        elements = [element for element in elements if match(element if kind is Set else element[0])]
+    return cursor, elements
+
+
+@command("MULTI", arity=1, flags=("noscript", "loading", "fast"))
+def multi_command(core, client, args):
+    """MULTI"""
+    if client.multi is not None:
+        raise CommandError("ERR MULTI calls can not be nested")
+    client.multi = []  # Later commands are queued by CommandCore.execute()
+    client.multi_error = False
+    return OK
+
+
+@command("EXEC", arity=1, flags=("noscript", "loading"))
+def exec_command(core, client, args):
+    """EXEC"""
+    if client.multi is None:
+        raise CommandError("ERR EXEC without MULTI")
+    queued, client.multi = client.multi, None
+    aborted, dirty = client.multi_error, client.watch_dirty
+    client.multi_error = False
+    if client.watched:
+        core.unwatch_all(client)  # Before running: the transaction's own writes must not matter
+    if aborted:
+        raise CommandError("EXECABORT Transaction discarded because of previous errors.")
+    if dirty:  # A watched key changed: nothing runs
+        return NULL_ARRAY
+    return core.exec_transaction(client, queued)  # One reply buffer for the whole transaction
+
+
+@command("DISCARD", arity=1, flags=("noscript", "loading", "fast"))
+def discard_command(core, client, args):
+    """DISCARD"""
+    if client.multi is None:
+        raise CommandError("ERR DISCARD without MULTI")
+    client.multi = None
+    client.multi_error = False
+    if client.watched:
+        core.unwatch_all(client)
+    return OK
+
+
+@command("WATCH", arity=-2, flags=("noscript", "loading", "fast"), first_key=1, last_key=-1, key_step=1)
+def watch_command(core, client, args):
+    """WATCH key [key ...]"""
+    if client.multi is not None:
+        raise CommandError("ERR WATCH inside MULTI is not allowed")
+    for key in args[1:]:
+        core.watch(client, key)
+    return OK
+
+
+@command("UNWATCH", arity=1, flags=("noscript", "loading", "fast"))
+def unwatch_command(core, client, args):
+    """UNWATCH"""
+    if client.watched:
+        core.unwatch_all(client)
+    return OK
+
+
+def checked_expire_time(when, name):  # Absolute expiries are saved as int64
+    """Return when (unix ms), raising CommandError if it does not fit in a signed 64-bit integer."""
+    if not -(1 << 63) <= when < 1 << 63:
+        raise CommandError(f"ERR invalid expire time in '{name}' command")
+    return when
+
+
+def expire_generic(core, key, when, name):  # Shared by the EXPIRE family
+    """Make key expire at the absolute unix time `when` (ms)."""
+    checked_expire_time(when, name)
+    if core.db.get(key) is None:  # Missing keys cannot get a TTL
+        return encode_integer(0)
+    if when <= now_ms() and not core.loading:  # A TTL in the past deletes the key right away
+        core.db.delete(key)
+        core.propagate_as = [[b"DEL", key]]
+    else:
+        core.db.set_expire(key, when)
+        core.propagate_as = [[b"PEXPIREAT", key, b"%d" % when]]  # Relative TTLs are logged as absolute times
+    return encode_integer(1)
+
+
+@command("EXPIRE", arity=3, flags=("write", "fast"), first_key=1, last_key=1, key_step=1)
+def expire_command(core, client, args):
+    """EXPIRE key seconds"""
+    return expire_generic(core, args[1], now_ms() + parse_int(args[2]) * 1000, "expire")
+
+
+@command("PEXPIRE", arity=3, flags=("write", "fast"), first_key=1, last_key=1, key_step=1)
+def pexpire_command(core, client, args):
+    """PEXPIRE key milliseconds"""
+    return expire_generic(core, args[1], now_ms() + parse_int(args[2]), "pexpire")
+
+
+@command("EXPIREAT", arity=3, flags=("write", "fast"), first_key=1, last_key=1, key_step=1)
+def expireat_command(core, client, args):
+    """EXPIREAT key unix-time-seconds"""
+    return expire_generic(core, args[1], parse_int(args[2]) * 1000, "expireat")
+
+
+@command("PEXPIREAT", arity=3, flags=("write", "fast"), first_key=1, last_key=1, key_step=1)
+def pexpireat_command(core, client, args):
+    """PEXPIREAT key unix-time-milliseconds"""
+    return expire_generic(core, args[1], parse_int(args[2]), "pexpireat")
+
+
+def ttl_generic(core, key, unit_ms):  # Shared by TTL and PTTL
+    """Remaining TTL in units of unit_ms: -2 if the key is missing, -1 if it has no TTL."""
+    if core.db.get(key) is None:  # Missing (or just expired)
+        return encode_integer(-2)
+    when = core.db.get_expire(key)
+    if when is None:  # Persistent key
+        return encode_integer(-1)
+    remaining = max(when - now_ms(), 0)
+    return encode_integer((remaining + unit_ms // 2) // unit_ms)  # Rounded like Redis
+
+
+@command("TTL", arity=2, flags=("readonly", "fast"), first_key=1, last_key=1, key_step=1)
+def ttl_command(core, client, args):
+    """TTL key"""
+    return ttl_generic(core, args[1], 1000)
+
+
+@command("PTTL", arity=2, flags=("readonly", "fast"), first_key=1, last_key=1, key_step=1)
+def pttl_command(core, client, args):
+    """PTTL key"""
+    return ttl_generic(core, args[1], 1)
+
+
+@command("PERSIST", arity=2, flags=("write", "fast"), first_key=1, last_key=1, key_step=1)
+def persist_command(core, client, args):
+    """PERSIST key"""
+    return encode_integer(1 if core.db.persist(args[1]) else 0)
+
+
+@command("QUIT", arity=-1, flags=("fast",))
+def quit_command(core, client, args):
+    """QUIT"""
+    client.close_after_reply = True  # The front end closes the connection after writing the reply
+    return encode_simple("OK Goodbye")
+
+
+def client_info(client, now):  # One line of CLIENT LIST
+    """Describe a connection in the key=value format of Redis's CLIENT LIST."""
+    flags = ("S" if client.replica is not None else "") + ("P" if client.channels or client.patterns else "") + \
+            ("b" if client.blocked_keys else "") + ("x" if client.multi is not None else "") + ("d" if client.watch_dirty else "")
+    query, output, allocated = client.buffers() if client.buffers is not None else (0, 0, 0)
+    return (f"id={client.id} addr={format_address(client)} name={client.name.decode(errors='replace')} "
+            f"age={int(now - client.created)} idle={int(now - client.last_interaction)} flags={flags or 'N'} db=0 "
+            f"sub={len(client.channels)} psub={len(client.patterns)} multi={-1 if client.multi is None else len(client.multi)} "
+            f"qbuf={query} omem={output} tot-mem={allocated} cmd={client.last_command.decode()}")
+
+
+def kill_client(client, victim):  # CLIENT KILL
+    if victim is client:  # Our own connection: after the reply
+        client.close_after_reply = True
+    else:
+        victim.close()
+
+
+@command("CLIENT", arity=-2, flags=("noscript", "loading"))
+def client_command(core, client, args):
+    """CLIENT ID | GETNAME | SETNAME name | LIST [TYPE type] | KILL addr | KILL [ID id] [ADDR addr] [TYPE type] [SKIPME yes|no]"""
+    subcommand = args[1].upper()
+    if subcommand == b"ID" and len(args) == 2:
+        return encode_integer(client.id)
+    if subcommand == b"GETNAME" and len(args) == 2:
+        return encode_bulk(client.name or None)
+    if subcommand == b"SETNAME" and len(args) == 3:
+        if any(byte <= 32 or byte > 126 for byte in args[2]):  # Names end up in space-separated CLIENT LIST lines
+            raise CommandError("ERR Client names cannot contain spaces, newlines or special characters.")
+        client.name = args[2]
+        return OK
+    if subcommand == b"LIST" and len(args) in (2, 4):
+        wanted = None
+        if len(args) == 4:
+            if args[2].upper() != b"TYPE":
+                raise CommandError("ERR syntax error")
+            wanted = parse_client_class(args[3])
+        now = time.monotonic()
+        return encode_bulk("".join(client_info(other, now) + "\n" for other in core.clients.values()
+                                   if wanted is None or client_class(other) == wanted))
+    if subcommand == b"KILL" and len(args) == 3:  # Old form: one address, an error if nobody has it
+        address = args[2].decode(errors="replace")
+        victim = next((other for other in core.clients.values() if format_address(other) == address), None)
+        if victim is None:
+            raise CommandError("ERR No such client")
+        kill_client(client, victim)
+        return OK
+    if subcommand == b"KILL" and len(args) >= 4 and len(args) % 2 == 0:
+        filters = []
+        skip_me = True
+        for option, value in zip(args[2::2], args[3::2]):
+            option = option.upper()
+            if option == b"ID":
+                filters.append(lambda other, wanted=parse_int(value, "ERR client-id should be greater than 0"): other.id == wanted)
+            elif option == b"ADDR":
+                filters.append(lambda other, wanted=value.decode(errors="replace"): format_address(other) == wanted)
+            elif option == b"TYPE":
+                filters.append(lambda other, wanted=parse_client_class(value): client_class(other) == wanted)
+            elif option == b"SKIPME" and value.lower() in (b"yes", b"no"):
+                skip_me = value.lower() == b"yes"
+            else:
+                raise CommandError("ERR syntax error")
+        victims = [other for other in core.clients.values()
+                   if all(match(other) for match in filters) and not (skip_me and other is client)]
+        for victim in victims:
+            kill_client(client, victim)
+        return encode_integer(len(victims))
+    raise CommandError(f"ERR unknown subcommand or wrong number of arguments for '{args[1].decode(errors='replace')}'")
+
+
+def parse_client_class(raw):  # CLIENT LIST TYPE, CLIENT KILL TYPE
+    name = raw.decode(errors="replace").lower()
+    name = {"slave": "replica", "master": "normal"}.get(name, name)
+    if name not in CLIENT_CLASSES:
+        raise CommandError(f"ERR Unknown client type '{raw.decode(errors='replace')}'")
+    return name
+
+
+@command("COMMAND", arity=-1, flags=("loading",))
+def command_command(core, client, args):
+    """COMMAND | COMMAND COUNT | COMMAND INFO name [name ...] | COMMAND LIST"""
+    if len(args) == 1:  # Every command's metadata
+        return encode_value([spec.info() for spec in COMMANDS.values()])
+
+    subcommand = args[1].upper()
+    if subcommand == b"COUNT":
+        return encode_integer(len(COMMANDS))
+    if subcommand == b"INFO":  # Metadata for the named commands (nil for unknown ones)
+        specs = [COMMANDS.get(name.upper()) for name in args[2:]] if len(args) > 2 else list(COMMANDS.values())
+        return encode_value([spec.info() if spec else None for spec in specs])
+    if subcommand == b"LIST":  # Just the names
+        return encode_array([spec.name for spec in COMMANDS.values()])
+    raise CommandError(f"ERR unknown subcommand '{args[1].decode(errors='replace')}'")
+
+
+@command("BGREWRITEAOF", arity=1, flags=("admin", "noscript"))
+def bgrewriteaof_command(core, client, args):
+    """BGREWRITEAOF"""
+    if core.aof is None:
+        raise CommandError("ERR Append only file is disabled")
+    if core.rdb_child is not None:
+        raise CommandError("ERR Background save already in progress")
+    if not core.aof.start_rewrite(core.dataset_commands):
+        raise CommandError("ERR Background append only file rewriting already in progress")
+    return encode_simple("Background append only file rewriting started")
+
+
+@command("SAVE", arity=1, flags=("admin", "noscript"))
+def save_command(core, client, args):
+    """SAVE"""
+    if core.child_running():
+        raise CommandError("ERR Background save already in progress")
+    core.save()
+    return OK
+
+
+@command("BGSAVE", arity=1, flags=("admin", "noscript"))
+def bgsave_command(core, client, args):
+    """BGSAVE"""
+    if not core.bgsave():
+        raise CommandError("ERR Background save already in progress")
+    return encode_simple("Background saving started")
+
+
+@command("LASTSAVE", arity=1, flags=("fast",))
+def lastsave_command(core, client, args):
+    """LASTSAVE"""
+    return encode_integer(core.last_save)
+
+
+@command("INFO", arity=-1, flags=("loading",))
+def info_command(core, client, args):
+    """INFO [section ...]"""
+    sections = core.info()
+    wanted = {arg.decode(errors="replace").lower() for arg in args[1:]}
+    everything = bool(wanted & {"all", "everything"})
+    if not wanted or "default" in wanted:  # Per-command sections only when asked for, as in Redis
+        wanted |= set(sections) - {"commandstats", "latencystats"}
+    lines = []
+    for name, fields in sections.items():
+        if not everything and name not in wanted:
+            continue
+        lines.append(f"# {name.capitalize()}")
+        lines.extend(f"{field}:{value}" for field, value in fields)
+        lines.append("")
+    return encode_bulk("\r\n".join(lines))
+
+
+@command("SLAVEOF", arity=3, flags=("admin", "noscript"))  # Old name
+@command("REPLICAOF", arity=3, flags=("admin", "noscript"))
+def replicaof_command(core, client, args):
+    """REPLICAOF host port | REPLICAOF NO ONE"""
+    if args[1].upper() == b"NO" and args[2].upper() == b"ONE":
+        if core.replication.link is not None:
+            core.replication.promote()
+            print("Replication: promoted to primary")
+        return OK
+    if not core.replication.link_supported or core.cluster is not None:
+        raise CommandError("ERR REPLICAOF is not supported by this server mode")
+    port = parse_int(args[2], "ERR Invalid master port")
+    if not core.replication.replicate(args[1].decode(errors="replace"), port):
+        return encode_simple("OK Already connected to specified master")
+    print(f"Replication: replicating from {args[1].decode(errors='replace')}:{port}")
+    return OK
+
+
+@command("PSYNC", arity=3, flags=("admin", "noscript"))
+def psync_command(core, client, args):
+    """PSYNC replicationid offset"""
+    if client.send is None:  # The stream is pushed through client.send()
+        raise CommandError("ERR this connection cannot receive the replication stream")
+    if client.replica is not None:
+        raise CommandError("ERR this connection is already a replica")
+    if core.cluster is not None:
+        raise CommandError("ERR replication is not supported in sharded mode")
+    return core.replication.psync(client, args[1], parse_int(args[2]))
+
+
+@command("REPLCONF", arity=-3, flags=("admin", "noscript", "loading"))
+def replconf_command(core, client, args):
+    """REPLCONF listening-port port | REPLCONF ACK offset"""
+    option = args[1].lower()
+    if option == b"ack" and len(args) == 3:
+        if client.replica is None:
+            raise CommandError("ERR REPLCONF ACK from a connection that is not a replica")
+        core.replication.ack(client, parse_int(args[2]))
+        return None  # Acknowledgements are never answered
+    if option == b"listening-port" and len(args) == 3:
+        client.replica_port = parse_int(args[2])
+        return OK
+    if len(args) % 2 == 1:  # Other options (capa, ...) are accepted and ignored
+        return OK
+    raise CommandError("ERR syntax error")
+
+
+@command("SLOWLOG", arity=-2, flags=("admin", "loading"))
+def slowlog_command(core, client, args):
+    """SLOWLOG GET [count] | SLOWLOG LEN | SLOWLOG RESET"""
+    slowlog = core.slowlog
+    subcommand = args[1].upper()
+    if subcommand == b"GET" and len(args) <= 3:
+        count = parse_int(args[2]) if len(args) == 3 else 10
+        entries = list(reversed(slowlog.entries))  # Newest first
+        return encode_value(entries if count < 0 else entries[:count])
+    if subcommand == b"LEN" and len(args) == 2:
+        return encode_integer(len(slowlog.entries))
+    if subcommand == b"RESET" and len(args) == 2:
+        slowlog.entries.clear()
+        return OK
+    raise CommandError(f"ERR unknown subcommand or wrong number of arguments for '{args[1].decode(errors='replace')}'")
+
+
+@command("LATENCY", arity=-2, flags=("admin", "loading"))
+def latency_command(core, client, args):
+    """LATENCY HISTOGRAM [command ...]"""
+    if args[1].upper() != b"HISTOGRAM":
+        raise CommandError(f"ERR unknown subcommand '{args[1].decode(errors='replace')}'")
+    commands = core.metrics.commands
+    names = [name.lower() for name in args[2:]] or sorted(commands)
+    reply = []
+    for name in names:
+        stats = commands.get(name)
+        if stats is None or not any(stats.buckets):  # Unknown or never timed: left out, as in Redis
+            continue
+        buckets = [item for bucket in stats.power_of_two_usec() for item in bucket]
+        reply += (name, [b"calls", stats.calls, b"histogram_usec", buckets])
+    return encode_value(reply)
+
+
+RUNTIME_CONFIG = ("slowlog-log-slower-than", "slowlog-max-len", "latency-tracking", "maxmemory", "maxmemory-policy",
+                  "maxmemory-samples", "lfu-log-factor", "lfu-decay-time", "maxclients", "timeout",
+                  "client-query-buffer-limit", "client-output-buffer-limit", "script-time-limit")  # What CONFIG SET may change while serving
+CONFIG_MINIMUMS = {"slowlog-max-len": 0, "maxclients": 0, "timeout": 0, "client-query-buffer-limit": 0, "script-time-limit": 0,
+                   "maxmemory": 0, "maxmemory-samples": 1, "lfu-log-factor": 0, "lfu-decay-time": 0}  # Smallest value CONFIG SET accepts
+
+
+def apply_config(core):  # After CONFIG SET
+    """Push the runtime-changeable settings of core.config to the objects that use them."""
+    config = core.config
+    core.slowlog.configure(config["slowlog-log-slower-than"], config["slowlog-max-len"])
+    core.latency_tracking = config["latency-tracking"]
+    if core.evictor.policy != config["maxmemory-policy"]:
+        core.evictor.policy = config["maxmemory-policy"]
+        core.evictor.pool = []  # Scores of the old policy are meaningless
+    core.evictor.samples = config["maxmemory-samples"]
+    core.db.lfu_log_factor = config["lfu-log-factor"]
+    core.db.lfu_decay_time = config["lfu-decay-time"]
+    core.output_limits = parse_output_limits(config["client-output-buffer-limit"])
+    core.configure_limits()
+
+
+@command("CONFIG", arity=-2, flags=("admin", "noscript", "loading"))
+def config_command(core, client, args):
+    """CONFIG GET pattern [pattern ...] | CONFIG SET name value [name value ...] | CONFIG RESETSTAT"""
+    subcommand = args[1].upper()
+    if subcommand == b"GET" and len(args) >= 3:
+        matchers = [compile_glob(pattern.lower()) for pattern in args[2:]]
+        reply = []
+        for name, value in core.config.items():
+            if any(match(name.encode()) for match in matchers):
+                reply += (name, ("yes" if value else "no") if isinstance(value, bool) else str(value))
+        return encode_array(reply)
+    if subcommand == b"SET" and len(args) >= 4 and len(args) % 2 == 0:
+        argv = [arg.decode(errors="replace").lower() if i % 2 == 0 else arg.decode(errors="replace") for i, arg in enumerate(args[2:])]
+        try:
+            changes = parse_config_args(argv)  # Same conversions as the command line
+        except ValueError:
+            raise CommandError("ERR CONFIG SET failed - argument couldn't be parsed into an integer") from None
+        for name, value in changes.items():  # Validate everything before changing anything
+            if name not in RUNTIME_CONFIG:
+                raise CommandError(f"ERR CONFIG SET failed (possibly related to argument '{name}') - can't set this config at runtime")
+            if name == "maxmemory-policy" and value not in POLICIES:
+                raise CommandError(f"ERR CONFIG SET failed (possibly related to argument '{name}') - argument(s) must be one of the following: {', '.join(POLICIES)}")
+            if name in CONFIG_MINIMUMS and value < CONFIG_MINIMUMS[name]:
+                raise CommandError(f"ERR CONFIG SET failed (possibly related to argument '{name}') - argument must be positive")
+            if name == "client-output-buffer-limit":  # Only the classes given change
+                try:
+                    changes[name] = format_output_limits({**core.output_limits, **parse_output_limits(value)})
+                except ValueError as e:
+                    raise CommandError(f"ERR CONFIG SET failed (possibly related to argument '{name}') - {e}") from None
+        core.config.update(changes)
+        apply_config(core)
+        return OK
+    if subcommand == b"RESETSTAT" and len(args) == 2:
+        core.metrics.reset()
+        core.db.expired_keys = core.evictor.evicted_keys = 0
+        return OK
+    raise CommandError(f"ERR unknown subcommand or wrong number of arguments for '{args[1].decode(errors='replace')}'")
+
+
+def script_keys(args):  # Key positions of EVAL/EVALSHA: numkeys keys after the script
+    """Return the keys of EVAL/EVALSHA args (none if numkeys is invalid: the handler reports it)."""
+    count = int(args[2]) if len(args) > 2 and args[2].isdigit() else 0
+    return args[3:3 + count] if count <= len(args) - 3 else []
+
+
+def run_script(core, args, sha, code):  # EVAL, EVALSHA
+    count = parse_int(args[2])
+    if count < 0:
+        raise CommandError("ERR Number of keys can't be negative")
+    if count > len(args) - 3:
+        raise CommandError("ERR Number of keys can't be greater than number of args")
+    try:
+        return core.scripting.run(sha, code, args[3:3 + count], args[3 + count:])
+    except ScriptError as e:
+        raise CommandError(str(e)) from None
+
+
+@command("EVAL", arity=-3, flags=("noscript", "movablekeys"), find_keys=script_keys)
+def eval_command(core, client, args):
+    """EVAL script numkeys [key ...] [arg ...]"""
+    try:
+        sha, code = load_script(args[1])  # Compiled once, then found by its SHA1
+    except ScriptError as e:
+        raise CommandError(str(e)) from None
+    return run_script(core, args, sha, code)
+
+
+@command("EVALSHA", arity=-3, flags=("noscript", "movablekeys"), find_keys=script_keys)
+def evalsha_command(core, client, args):
+    """EVALSHA sha1 numkeys [key ...] [arg ...]"""
+    sha = args[1].lower()
+    code = SCRIPTS.get(sha)
+    if code is None:
+        raise CommandError("NOSCRIPT No matching script. Please use EVAL.")
+    return run_script(core, args, sha, code)
+
+
+@command("SCRIPT", arity=-2, flags=("noscript",))
+def script_command(core, client, args):
+    """SCRIPT LOAD script | SCRIPT EXISTS sha1 [sha1 ...] | SCRIPT FLUSH [ASYNC|SYNC] | SCRIPT KILL"""
+    subcommand = args[1].upper()
+    if subcommand == b"LOAD" and len(args) == 3:
+        try:
+            return encode_bulk(load_script(args[2])[0])
+        except ScriptError as e:
+            raise CommandError(str(e)) from None
+    if subcommand == b"EXISTS" and len(args) >= 3:
+        return encode_value([1 if sha.lower() in SCRIPTS else 0 for sha in args[2:]])
+    if subcommand == b"FLUSH" and (len(args) == 2 or (len(args) == 3 and args[2].upper() in (b"ASYNC", b"SYNC"))):
+        SCRIPTS.clear()
+        return OK
+    if subcommand == b"KILL" and len(args) == 2:  # Scripts over script-time-limit stop by themselves
+        raise CommandError("NOTBUSY No scripts in execution right now.")
+    raise CommandError(f"ERR unknown subcommand or wrong number of arguments for '{args[1].decode(errors='replace')}'")
+
+
+@command("SUBSCRIBE", arity=-2, flags=("pubsub", "noscript", "loading"))
+def subscribe_command(core, client, args):
+    """SUBSCRIBE channel [channel ...]"""
+    if client.send is None:  # Pseudo-clients (AOF loading) cannot receive messages
+        raise CommandError("ERR this connection cannot subscribe")
+    return b"".join(core.pubsub.subscribe(client, channel) for channel in args[1:])  # One confirmation per channel
+
+
+@command("UNSUBSCRIBE", arity=-1, flags=("pubsub", "noscript", "loading"))
+def unsubscribe_command(core, client, args):
+    """UNSUBSCRIBE [channel ...]"""
+    channels = args[1:] or list(client.channels)  # No arguments: every channel
+    if not channels:  # Nothing to leave: a single confirmation with a nil channel
+        return encode_value([b"unsubscribe", None, len(client.patterns)])
+    return b"".join(core.pubsub.unsubscribe(client, channel) for channel in channels)
+
+
+@command("PSUBSCRIBE", arity=-2, flags=("pubsub", "noscript", "loading"))
+def psubscribe_command(core, client, args):
+    """PSUBSCRIBE pattern [pattern ...]"""
+    if client.send is None:
+        raise CommandError("ERR this connection cannot subscribe")
+    return b"".join(core.pubsub.psubscribe(client, pattern) for pattern in args[1:])
+
+
+@command("PUNSUBSCRIBE", arity=-1, flags=("pubsub", "noscript", "loading"))
+def punsubscribe_command(core, client, args):
+    """PUNSUBSCRIBE [pattern ...]"""
+    patterns = args[1:] or list(client.patterns)  # No arguments: every pattern
+    if not patterns:
+        return encode_value([b"punsubscribe", None, len(client.channels)])
+    return b"".join(core.pubsub.punsubscribe(client, pattern) for pattern in patterns)
+
+
+@command("PUBLISH", arity=3, flags=("pubsub", "loading", "fast"))
+def publish_command(core, client, args):
+    """PUBLISH channel message"""
+    return encode_integer(core.pubsub.publish(args[1], args[2]))  # Number of clients that received it
+
+
+@command("PUBSUB", arity=-2, flags=("pubsub", "loading"))
+def pubsub_command(core, client, args):
+    """PUBSUB CHANNELS [pattern] | PUBSUB NUMSUB [channel ...] | PUBSUB NUMPAT"""
+    subcommand = args[1].upper()
+    pubsub = core.pubsub
+    if subcommand == b"CHANNELS" and len(args) <= 3:  # Active channels, optionally filtered
+        if len(args) == 3:
+            match = compile_glob(args[2])
+            return encode_array([channel for channel in pubsub.channels if match(channel)])
+        return encode_array(list(pubsub.channels))
+    if subcommand == b"NUMSUB":  # Flat [channel, count, ...] list
+        reply = []
+        for channel in args[2:]:
+            reply += [channel, len(pubsub.channels.get(channel, ()))]
+        return encode_value(reply)
+    if subcommand == b"NUMPAT" and len(args) == 2:
+        return encode_integer(len(pubsub.patterns))
+    raise CommandError(f"ERR unknown subcommand '{args[1].decode(errors='replace')}'")
+
+
+def push_generic(core, args, left):  # Shared by LPUSH and RPUSH
+    """Push args[2:] onto the list at args[1], creating it if needed."""
+    key = args[1]
+    value = lookup(core, key, QuickList)
+    if value is None:
+        value = QuickList()
+        core.db.set(key, value)
+    push = value.appendleft if left else value.append
+    for element in args[2:]:
+        push(element)
+    core.container_changed(key, value)
+    core.blocked.signal(key)  # Wake BLPOP/BRPOP clients once the command finishes
+    return encode_integer(len(value))
+
+
+@command("LPUSH", arity=-3, flags=("write", "denyoom", "fast"), first_key=1, last_key=1, key_step=1)
+def lpush_command(core, client, args):
+    """LPUSH key element [element ...]"""
+    return push_generic(core, args, left=True)
+
+
+@command("RPUSH", arity=-3, flags=("write", "denyoom", "fast"), first_key=1, last_key=1, key_step=1)
+def rpush_command(core, client, args):
+    """RPUSH key element [element ...]"""
+    return push_generic(core, args, left=False)
+
+
+def pop_generic(core, args, left):  # Shared by LPOP and RPOP
+    """Pop one element, or up to count elements when a count is given."""
+    if len(args) > 3:
+        raise CommandError("ERR syntax error")
+    count = parse_int(args[2], "ERR value is out of range, must be positive") if len(args) == 3 else None
+    if count is not None and count < 0:
+        raise CommandError("ERR value is out of range, must be positive")
+    key = args[1]
+    value = lookup(core, key, QuickList)
+    if value is None:
+        return NULL_BULK if count is None else NULL_ARRAY
+    pop = value.popleft if left else value.pop
+    if count is None:
+        element = pop()
+    else:
+        element = [pop() for _ in range(min(count, len(value)))]
+    if count is None or element:  # A count of 0 pops nothing: no change to log or to abort WATCH with
+        core.container_changed(key, value)
+    return encode_bulk(element) if count is None else encode_array(element)
+
+
+@command("LPOP", arity=-2, flags=("write", "fast"), first_key=1, last_key=1, key_step=1)
+def lpop_command(core, client, args):
+    """LPOP key [count]"""
+    return pop_generic(core, args, left=True)
+
+
+@command("RPOP", arity=-2, flags=("write", "fast"), first_key=1, last_key=1, key_step=1)
+def rpop_command(core, client, args):
+    """RPOP key [count]"""
+    return pop_generic(core, args, left=False)
+
+
+def list_range(start, stop, length):  # Redis index semantics
+    """Resolve negative indexes and clamp; return (start, stop) or None for an empty range."""
+    if start < 0:
+        start = max(start + length, 0)
+    if stop < 0:
+        stop += length
+    stop = min(stop, length - 1)
+    if start > stop or start >= length:
+        return None
+    return start, stop
+
+
+@command("LRANGE", arity=4, flags=("readonly",), first_key=1, last_key=1, key_step=1)
+def lrange_command(core, client, args):
+    """LRANGE key start stop"""
+    start, stop = parse_int(args[2]), parse_int(args[3])
+    value = lookup(core, args[1], QuickList)
+    bounds = list_range(start, stop, len(value)) if value is not None else None
+    if bounds is None:
+        return encode_array([])
+    return encode_array(value.range(*bounds))  # Copies only the requested elements
+
+
+@command("LLEN", arity=2, flags=("readonly", "fast"), first_key=1, last_key=1, key_step=1)
+def llen_command(core, client, args):
+    """LLEN key"""
+    value = lookup(core, args[1], QuickList)
+    return encode_integer(len(value) if value is not None else 0)
+
+
+@command("LINDEX", arity=3, flags=("readonly",), first_key=1, last_key=1, key_step=1)
+def lindex_command(core, client, args):
+    """LINDEX key index"""
+    index = parse_int(args[2])
+    value = lookup(core, args[1], QuickList)
+    if value is None:
+        return NULL_BULK
+    return encode_bulk(value.index(index + len(value) if index < 0 else index))
+
+
+@command("LTRIM", arity=4, flags=("write",), first_key=1, last_key=1, key_step=1)
+def ltrim_command(core, client, args):
+    """LTRIM key start stop"""
+    start, stop = parse_int(args[2]), parse_int(args[3])
+    key = args[1]
+    value = lookup(core, key, QuickList)
+    if value is None:
+        return OK
+    bounds = list_range(start, stop, len(value))
+    if bounds is None:
+        value.trim(1, 0)  # Empty range: clear the list
+    else:
+        value.trim(*bounds)
+    core.container_changed(key, value)
+    return OK
+
+
+def bpop_generic(core, client, args, left):  # Shared by BLPOP and BRPOP
+    """Pop from the first non-empty list, or park the client until a push or the timeout."""
+    try:
+        timeout = float(args[-1])
+    except ValueError:
+        raise CommandError("ERR timeout is not a float or out of range") from None
+    if not math.isfinite(timeout):  # A nan deadline would never expire and would stall the timeouts behind it
+        raise CommandError("ERR timeout is not a float or out of range")
+    if timeout < 0:
+        raise CommandError("ERR timeout is negative")
+    keys = args[1:-1]
+    for key in keys:
+        value = lookup(core, key, QuickList)
+        if value is not None:  # Something to pop right away
+            element = value.popleft() if left else value.pop()
+            core.container_changed(key, value)
+            core.propagate_as = [[b"LPOP" if left else b"RPOP", key]]  # Logged as the pop it became
+            return encode_array([key, element])
+    if client.send is None or core.loading or core.transaction_log is not None:  # Cannot wait (no push channel, replay, inside EXEC): behave as if it timed out
+        return NULL_ARRAY
+    core.blocked.block(client, keys, left, timeout)
+    return None  # No reply yet: serve_blocked() or expire_blocked() sends it
+
+
+@command("BLPOP", arity=-3, flags=("write", "noscript", "blocking"), first_key=1, last_key=-2, key_step=1)
+def blpop_command(core, client, args):
+    """BLPOP key [key ...] timeout"""
+    return bpop_generic(core, client, args, left=True)
+
+
+@command("BRPOP", arity=-3, flags=("write", "noscript", "blocking"), first_key=1, last_key=-2, key_step=1)
+def brpop_command(core, client, args):
+    """BRPOP key [key ...] timeout"""
+    return bpop_generic(core, client, args, left=False)
+
+
+def hash_for_write(core, key):  # Lookup-or-create for hash writes
+    """Return the hash at key, creating an empty one if the key is missing."""
+    value = lookup(core, key, Hash)
+    if value is None:
+        value = Hash()
+        core.db.set(key, value)
+    return value
+
+
+@command("HSET", arity=-4, flags=("write", "denyoom", "fast"), first_key=1, last_key=1, key_step=1)
+def hset_command(core, client, args):
+    """HSET key field value [field value ...]"""
+    if len(args) % 2:
+        raise CommandError("ERR wrong number of arguments for 'hset' command")
+    key = args[1]
+    value = hash_for_write(core, key)
+    added = changed = 0
+    for i in range(2, len(args), 2):
+        if value.get(args[i]) != args[i + 1]:  # Rewriting a field with the value it has is not a change
+            added += value.set(args[i], args[i + 1])
+            changed += 1
+    if changed:
+        core.container_changed(key, value)
+    return encode_integer(added)
+
+
+@command("HGET", arity=3, flags=("readonly", "fast"), first_key=1, last_key=1, key_step=1)
+def hget_command(core, client, args):
+    """HGET key field"""
+    value = lookup(core, args[1], Hash)
+    return encode_bulk(value.get(args[2]) if value is not None else None)
+
+
+@command("HMGET", arity=-3, flags=("readonly", "fast"), first_key=1, last_key=1, key_step=1)
+def hmget_command(core, client, args):
+    """HMGET key field [field ...]"""
+    value = lookup(core, args[1], Hash)
+    return encode_value([value.get(field) if value is not None else None for field in args[2:]])
+
+
+@command("HGETALL", arity=2, flags=("readonly",), first_key=1, last_key=1, key_step=1)
+def hgetall_command(core, client, args):
+    """HGETALL key"""
+    value = lookup(core, args[1], Hash)
+    reply = []
+    if value is not None:
+        for field, item in value.items():
+            reply += (field, item)
+    return encode_array(reply)
+
+
+@command("HSCAN", arity=-3, flags=("readonly",), first_key=1, last_key=1, key_step=1)
+def hscan_command(core, client, args):
+    """HSCAN key cursor [MATCH pattern] [COUNT count]"""
+    cursor, pairs = scan_collection(core, args, Hash)
+    return encode_scan(cursor, [item for pair in pairs for item in pair])
+
+
+@command("HDEL", arity=-3, flags=("write", "fast"), first_key=1, last_key=1, key_step=1)
+def hdel_command(core, client, args):
+    """HDEL key field [field ...]"""
+    key = args[1]
+    value = lookup(core, key, Hash)
+    if value is None:
+        return encode_integer(0)
+    removed = sum(value.delete(field) for field in args[2:])
+    if removed:
+        core.container_changed(key, value)
+    return encode_integer(removed)
+
+
+@command("HINCRBY", arity=4, flags=("write", "denyoom", "fast"), first_key=1, last_key=1, key_step=1)
+def hincrby_command(core, client, args):
+    """HINCRBY key field increment"""
+    key, field = args[1], args[2]
+    increment = parse_int(args[3])
+    value = lookup(core, key, Hash)
+    current = value.get(field) if value is not None else None
+    number = parse_int(current, "ERR hash value is not an integer") if current is not None else 0
+    number += increment
+    if not -(1 << 63) <= number < 1 << 63:  # Same range as Redis' long long
+        raise CommandError("ERR increment or decrement would overflow")
+    value = hash_for_write(core, key)  # Created only once the command cannot fail
+    value.set(field, b"%d" % number)
+    core.container_changed(key, value)
+    return encode_integer(number)
+
+
+@command("SADD", arity=-3, flags=("write", "denyoom", "fast"), first_key=1, last_key=1, key_step=1)
+def sadd_command(core, client, args):
+    """SADD key member [member ...]"""
+    key = args[1]
+    value = lookup(core, key, Set)
+    if value is None:
+        value = Set()
+        core.db.set(key, value)
+    added = sum(value.add(member) for member in args[2:])
+    if added:  # Members that were already there change nothing
+        core.container_changed(key, value)
+    return encode_integer(added)
+
+
+@command("SREM", arity=-3, flags=("write", "fast"), first_key=1, last_key=1, key_step=1)
+def srem_command(core, client, args):
+    """SREM key member [member ...]"""
+    key = args[1]
+    value = lookup(core, key, Set)
+    if value is None:
+        return encode_integer(0)
+    removed = sum(value.discard(member) for member in args[2:])
+    if removed:
+        core.container_changed(key, value)
+    return encode_integer(removed)
+
+
+@command("SISMEMBER", arity=3, flags=("readonly", "fast"), first_key=1, last_key=1, key_step=1)
+def sismember_command(core, client, args):
+    """SISMEMBER key member"""
+    value = lookup(core, args[1], Set)
+    return encode_integer(1 if value is not None and args[2] in value else 0)
+
+
+@command("SMEMBERS", arity=2, flags=("readonly",), first_key=1, last_key=1, key_step=1)
+def smembers_command(core, client, args):
+    """SMEMBERS key"""
+    value = lookup(core, args[1], Set)
+    return encode_array(list(value) if value is not None else [])
+
+
+@command("SCARD", arity=2, flags=("readonly", "fast"), first_key=1, last_key=1, key_step=1)
+def scard_command(core, client, args):
+    """SCARD key"""
+    value = lookup(core, args[1], Set)
+    return encode_integer(len(value) if value is not None else 0)
+
+
+@command("SINTER", arity=-2, flags=("readonly",), first_key=1, last_key=-1, key_step=1)
+def sinter_command(core, client, args):
+    """SINTER key [key ...]"""
+    sets = [lookup(core, key, Set) for key in args[1:]]  # Type-check every key before answering
+    if any(value is None for value in sets):  # A missing key is an empty set
+        return encode_array([])
+    sets.sort(key=len)  # Iterate the smallest set, probe the others
+    smallest, others = sets[0], sets[1:]
+    return encode_array([member for member in smallest if all(member in other for other in others)])
+
+
+@command("SSCAN", arity=-3, flags=("readonly",), first_key=1, last_key=1, key_step=1)
+def sscan_command(core, client, args):
+    """SSCAN key cursor [MATCH pattern] [COUNT count]"""
+    return encode_scan(*scan_collection(core, args, Set))
+
+
+def parse_score(raw):  # Scores and increments
+    """Parse a float argument ("inf", "-inf" and "+inf" included), rejecting NaN."""
+    try:
+        score = float(raw)
+    except ValueError:
+        raise CommandError("ERR value is not a valid float") from None
+    if score != score:  # NaN
+        raise CommandError("ERR value is not a valid float")
+    return score
+
+
+def parse_score_bound(raw):  # ZRANGEBYSCORE-style bounds
+    """Parse "1.5", "(1.5", "-inf" or "+inf" into (score, exclusive)."""
+    exclusive = raw[:1] == b"("
+    try:
+        score = float(raw[1:] if exclusive else raw)
+    except ValueError:
+        raise CommandError("ERR min or max is not a float") from None
+    if score != score:
+        raise CommandError("ERR min or max is not a float")
+    return score, exclusive
+
+
+def encode_pairs(pairs, with_scores):  # Range replies
+    """Encode [(member, score)] as members, or member, score, ... with WITHSCORES."""
+    if not with_scores:
+        return encode_array([member for member, _ in pairs])
+    reply = []
+    for member, score in pairs:
+        reply += (member, format_score(score))
+    return encode_array(reply)
+
+
+@command("ZADD", arity=-4, flags=("write", "denyoom", "fast"), first_key=1, last_key=1, key_step=1)
+def zadd_command(core, client, args):
+    """ZADD key [NX | XX] [GT | LT] [CH] [INCR] score member [score member ...]"""
+    options = set()
+    i = 2
+    while i < len(args) and args[i].upper() in (b"NX", b"XX", b"GT", b"LT", b"CH", b"INCR"):
+        options.add(args[i].upper())
+        i += 1
+    pairs = args[i:]
+    if not pairs or len(pairs) % 2:
+        raise CommandError("ERR syntax error")
+    if {b"NX", b"XX"} <= options:
+        raise CommandError("ERR XX and NX options at the same time are not compatible")
+    if len(options & {b"NX", b"GT", b"LT"}) > 1:
+        raise CommandError("ERR GT, LT, and/or NX options at the same time are not compatible")
+    incr = b"INCR" in options
+    if incr and len(pairs) != 2:
+        raise CommandError("ERR INCR option supports a single increment-element pair")
+    scores = [parse_score(raw) for raw in pairs[::2]]  # Validate everything before changing anything
+
+    key = args[1]
+    value = lookup(core, key, ZSet)
+    if value is None:
+        if b"XX" in options:  # Nothing to update
+            return NULL_BULK if incr else encode_integer(0)
+        value = ZSet()
+        core.db.set(key, value)
+    added = changed = 0
+    result = None
+    for score, member in zip(scores, pairs[1::2]):
+        old = value.score(member)
+        if (old is None and b"XX" in options) or (old is not None and b"NX" in options):
+            continue
+        if incr and old is not None:
+            score += old
+            if score != score:
+                raise CommandError("ERR resulting score is not a number (NaN)")
+        if old is not None and ((b"GT" in options and score <= old) or (b"LT" in options and score >= old)):
+            continue
+        result = score
+        if old is None:
+            added += 1
+        elif old != score:
+            changed += 1
+        value.set(member, score)
+    if added or changed:  # Unchanged scores and skipped members change nothing
+        core.container_changed(key, value)
+    if incr:
+        return encode_bulk(format_score(result)) if result is not None else NULL_BULK
+    return encode_integer(added + changed if b"CH" in options else added)
+
+
+@command("ZINCRBY", arity=4, flags=("write", "denyoom", "fast"), first_key=1, last_key=1, key_step=1)
+def zincrby_command(core, client, args):
+    """ZINCRBY key increment member"""
+    key, member = args[1], args[3]
+    increment = parse_score(args[2])
+    value = lookup(core, key, ZSet)
+    old = value.score(member) if value is not None else None
+    score = increment + (old or 0.0)
+    if score != score:  # inf + -inf
+        raise CommandError("ERR resulting score is not a number (NaN)")
+    if value is None:
+        value = ZSet()
+        core.db.set(key, value)
+    value.set(member, score)
+    core.container_changed(key, value)
+    return encode_bulk(format_score(score))
+
+
+@command("ZSCORE", arity=3, flags=("readonly", "fast"), first_key=1, last_key=1, key_step=1)
+def zscore_command(core, client, args):
+    """ZSCORE key member"""
+    value = lookup(core, args[1], ZSet)
+    score = value.score(args[2]) if value is not None else None
+    return encode_bulk(format_score(score) if score is not None else None)
+
+
+@command("ZRANK", arity=3, flags=("readonly", "fast"), first_key=1, last_key=1, key_step=1)
+def zrank_command(core, client, args):
+    """ZRANK key member"""
+    value = lookup(core, args[1], ZSet)
+    rank = value.rank(args[2]) if value is not None else None
+    return encode_integer(rank) if rank is not None else NULL_BULK
+
+
+@command("ZCARD", arity=2, flags=("readonly", "fast"), first_key=1, last_key=1, key_step=1)
+def zcard_command(core, client, args):
+    """ZCARD key"""
+    value = lookup(core, args[1], ZSet)
+    return encode_integer(len(value) if value is not None else 0)
+
+
+@command("ZRANGE", arity=-4, flags=("readonly",), first_key=1, last_key=1, key_step=1)
+def zrange_command(core, client, args):
+    """ZRANGE key start stop [REV] [WITHSCORES]"""
+    start, stop = parse_int(args[2]), parse_int(args[3])
+    options = {arg.upper() for arg in args[4:]}
+    if not options <= {b"REV", b"WITHSCORES"}:
+        raise CommandError("ERR syntax error")
+    value = lookup(core, args[1], ZSet)
+    bounds = list_range(start, stop, len(value)) if value is not None else None
+    if bounds is None:
+        return encode_array([])
+    start, stop = bounds
+    if b"REV" in options:  # Ranks counted from the highest score
+        last = len(value) - 1
+        pairs = value.range_by_rank(last - stop, last - start)[::-1]
+    else:
+        pairs = value.range_by_rank(start, stop)
+    return encode_pairs(pairs, b"WITHSCORES" in options)
+
+
+@command("ZRANGEBYSCORE", arity=-4, flags=("readonly",), first_key=1, last_key=1, key_step=1)
+def zrangebyscore_command(core, client, args):
+    """ZRANGEBYSCORE key min max [WITHSCORES] [LIMIT offset count]"""
+    low, low_ex = parse_score_bound(args[2])
+    high, high_ex = parse_score_bound(args[3])
+    with_scores = False
+    offset, count = 0, -1
+    i = 4
+    while i < len(args):
+        option = args[i].upper()
+        if option == b"WITHSCORES":
+            with_scores = True
+        elif option == b"LIMIT" and i + 2 < len(args):
+            offset, count = parse_int(args[i + 1]), parse_int(args[i + 2])
+            i += 2
+        else:
+            raise CommandError("ERR syntax error")
+        i += 1
+    value = lookup(core, args[1], ZSet)
+    if value is None or offset < 0:
+        return encode_array([])
+    return encode_pairs(value.range_by_score(low, low_ex, high, high_ex, offset, count), with_scores)
+
+
+@command("ZREMRANGEBYSCORE", arity=4, flags=("write",), first_key=1, last_key=1, key_step=1)
+def zremrangebyscore_command(core, client, args):
+    """ZREMRANGEBYSCORE key min max"""
+    low, low_ex = parse_score_bound(args[2])
+    high, high_ex = parse_score_bound(args[3])
+    key = args[1]
+    value = lookup(core, key, ZSet)
+    if value is None:
+        return encode_integer(0)
+    removed = value.remove_range_by_score(low, low_ex, high, high_ex)
+    if removed:
+        core.container_changed(key, value)
+    return encode_integer(removed)
+
+
+@command("ZSCAN", arity=-3, flags=("readonly",), first_key=1, last_key=1, key_step=1)
+def zscan_command(core, client, args):
+    """ZSCAN key cursor [MATCH pattern] [COUNT count]"""
+    cursor, pairs = scan_collection(core, args, ZSet)
+    return encode_scan(cursor, [item for member, score in pairs for item in (member, format_score(score))])
+
+
+@command("CLUSTER", arity=-2, flags=("loading",))
+def cluster_command(core, client, args):
+    """CLUSTER KEYSLOT key | CLUSTER SLOTS | CLUSTER INFO"""
+    cluster = core.cluster
+    if cluster is None:
+        raise CommandError("ERR This instance has cluster support disabled")
+    subcommand = args[1].upper()
+    if subcommand == b"KEYSLOT" and len(args) == 3:
+        return encode_integer(cluster.key_slot(args[2]))
+    if subcommand == b"SLOTS" and len(args) == 2:  # [first, last, [host, port]] per worker
+        host = cluster.host.encode()
+        return encode_value([[first, last, [host, cluster.port_of(worker)]] for worker, (first, last) in enumerate(cluster.ranges)])
+    if subcommand == b"INFO" and len(args) == 2:
+        fields = [("cluster_state", "ok"), ("cluster_slots_assigned", 16384), ("cluster_known_nodes", cluster.workers),
+                  ("cluster_size", cluster.workers), ("cluster_my_worker", cluster.worker), ("cluster_redirect", cluster.redirect),
+                  ("cluster_forwarded_commands", cluster.forwarded)]
+        return encode_bulk("".join(f"{field}:{value}\r\n" for field, value in fields))
+    raise CommandError(f"ERR unknown subcommand '{args[1].decode(errors='replace')}'")
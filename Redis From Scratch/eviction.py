@@ -0,0 +1,90 @@
+"""maxmemory enforcement with sampled LRU/LFU/TTL eviction.
+
+Like Redis, eviction does not keep keys in a global order. Each round
+samples `maxmemory-samples` keys, scores them (idle time for LRU, inverted
+access frequency for LFU, nearness of expiry for volatile-ttl) and merges
+them into a small pool of the best candidates seen so far; the best
+candidate in the pool is evicted. The pool survives between rounds, so the
+approximation improves the more evictions happen.
+"""
+import bisect  # Sorted insertion into the pool
+import random  # Sampling volatile keys
+
+POLICIES = ("noeviction", "allkeys-lru", "allkeys-lfu", "allkeys-random",
+            "volatile-lru", "volatile-lfu", "volatile-ttl", "volatile-random")  # Valid maxmemory-policy values
+POOL_SIZE = 16  # Candidates kept between rounds (EVPOOL_SIZE in Redis)
+
+
+class Evictor:  # Eviction state of one keyspace
+    """Frees memory by evicting keys according to maxmemory-policy."""
+
+    def __init__(self, db, policy="noeviction", samples=5):
+        if policy not in POLICIES:
+            raise ValueError(f"maxmemory-policy must be one of {', '.join(POLICIES)}")
+        self.db = db  # The Keyspace to evict from
+        self.policy = policy  # maxmemory-policy
+        self.samples = samples  # maxmemory-samples
+        self.pool = []  # (score, key) sorted ascending; higher score = better candidate
+        self.evicted_keys = 0  # Stats for INFO
+
+    def free_memory(self, maxmemory, on_evict=None):  # Called before write commands
+        """Evict keys until used memory is within maxmemory; return False if that is impossible."""
+        db = self.db
+        while db.used_memory > maxmemory:
+            if self.policy == "noeviction":
+                return False
+            key = self._select_victim()
+            if key is None:  # Nothing evictable left (e.g. volatile-* with no TTLs)
+                return False
+            if not db.delete(key):  # It had just expired: the memory is freed all the same
+                continue
+            self.evicted_keys += 1
+            if on_evict is not None:  # Let the caller propagate a DEL
+                on_evict(key)
+        return True
+
+    def _select_victim(self):  # One eviction decision
+        """Return the key to evict next, or None."""
+        db = self.db
+        volatile = self.policy.startswith("volatile-")
+        if volatile and not db.volatile_keys:
+            return None
+        if self.policy.endswith("-random"):  # No scoring needed
+            return self._sample(volatile)
+
+        for _ in range(self.samples):  # Fill the pool with freshly scored samples
+            key = self._sample(volatile)
+            if key is None:
+                break
+            if any(pooled == key for _, pooled in self.pool):  # Already a candidate
+                continue
+            entry = (self._score(key), key)
+            if len(self.pool) < POOL_SIZE:
+                bisect.insort(self.pool, entry)
+            elif entry[0] > self.pool[0][0]:  # Better than the worst candidate: replace it
+                self.pool.pop(0)
+                bisect.insort(self.pool, entry)
+
+        while self.pool:  # Best candidate first; skip keys deleted or changed since they were pooled
+            _, key = self.pool.pop()
+            if key in db.meta and (not volatile or key in db.expires):
+                return key
+        return None
+
+    def _sample(self, volatile):  # Random key from the right population
+        """Return a random key with a TTL (volatile) or any random key."""
+        db = self.db
+        if volatile:
+            keys = db.volatile_keys
+            return keys[random.randrange(len(keys))] if keys else None
+        return db.random_key()
+
+    def _score(self, key):  # Higher = evict sooner
+        """Score a key for the current policy."""
+        db = self.db
+        if self.policy.endswith("-lru"):
+            return db.idle_time(key)  # Seconds since last access
+        if self.policy.endswith("-lfu"):
+            return 255 - db.lfu_counter(key)  # Least frequently used first
+        return -db.expires[key]  # volatile-ttl: soonest expiry first
+
@@ -0,0 +1,46 @@
+"""Redis-style glob patterns (PSUBSCRIBE, SCAN MATCH, KEYS)."""
+import functools  # Cache compiled patterns
+import re  # Patterns are compiled to regular expressions once
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_glob(pattern):  # Compiled once per distinct pattern
+    """Compile a bytes glob (*, ?, [abc], [^a-z], \\x escapes) into a fullmatch function."""
+    out = []
+    i, size = 0, len(pattern)
+    while i < size:
+        char = pattern[i:i + 1]
+        if char == b"*":
+            out.append(b".*")
+        elif char == b"?":
+            out.append(b".")
+        elif char == b"\\" and i + 1 < size:  # Escaped literal
+            i += 1
+            out.append(re.escape(pattern[i:i + 1]))
+        elif char == b"[":
+            end = i + 1
+            if end < size and pattern[end:end + 1] == b"^":
+                end += 1
+            if end < size and pattern[end:end + 1] == b"]":  # "]" right after "[" is a literal
+                end += 1
+            while end < size and pattern[end:end + 1] != b"]":
+                end += 1
+            if end >= size:  # Unterminated class: treat "[" literally
+                out.append(re.escape(char))
+            else:
+                body = pattern[i + 1:end]
+                negate = body.startswith(b"^")
+                if negate:
+                    body = body[1:]
+                body = body.replace(b"\\", b"\\\\")  # Keep backslashes literal inside the class
+                out.append(b"[" + (b"^" if negate else b"") + body + b"]")
+                i = end
+        else:
+            out.append(re.escape(char))
+        i += 1
+    return re.compile(b"".join(out), re.DOTALL).fullmatch
+
+
+def glob_match(pattern, subject):  # Convenience wrapper
+    """Return True if subject (bytes) matches the glob pattern (bytes)."""
+    return compile_glob(pattern)(subject) is not None
@@ -0,0 +1,138 @@
+"""Hash values: a listpack while small, a dict once they grow.
+
+A new hash starts as a listpack (field, value, field, value, ...). It is
+converted to a dict, once and for good, when it gets more than
+max_listpack_entries fields or a field or value longer than
+max_listpack_value bytes (hash-max-listpack-entries / -value).
+"""
+import sys  # Memory accounting
+
+import listpack  # Compact encoding
+from scan import ScanIndex  # Stable positions for HSCAN
+
+
+class Hash:  # Value type behind HSET
+    """Field -> value mapping with a compact small encoding."""
+
+    __slots__ = ("listpack", "table", "count", "element_bytes", "scan_index")
+
+    max_listpack_entries = 128  # hash-max-listpack-entries (set by CommandCore from the config)
+    max_listpack_value = 64  # hash-max-listpack-value
+
+    def __init__(self):
+        self.listpack = bytearray()  # Small encoding; None once converted
+        self.table = None  # dict encoding
+        self.count = 0  # Number of fields
+        self.element_bytes = 0  # sys.getsizeof() of fields and values, tracked in dict encoding only
+        self.scan_index = None  # Field positions for HSCAN, created by the first scan of the dict encoding
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def encoding(self):  # OBJECT ENCODING
+        """Return "listpack" or "hashtable"."""
+        return "listpack" if self.table is None else "hashtable"
+
+    def memory_usage(self):  # O(1): called after every mutation
+        """Return the approximate memory used by the hash."""
+        if self.table is None:
+            return sys.getsizeof(self) + sys.getsizeof(self.listpack)
+        size = sys.getsizeof(self) + sys.getsizeof(self.table) + self.element_bytes
+        return size if self.scan_index is None else size + self.scan_index.memory_usage()
+
+    def get(self, field):  # HGET
+        """Return the value of field, or None."""
+        if self.table is not None:
+            return self.table.get(field)
+        blob = self.listpack
+        pos = listpack.find(blob, field, 2)  # Fields sit at even positions
+        if pos < 0:
+            return None
+        start, end = listpack.span(blob, listpack.span(blob, pos)[1])  # The value follows its field
+        return bytes(blob[start:end])
+
+    def set(self, field, value):  # HSET
+        """Set field to value; return True if the field is new."""
+        if self.table is None:
+            if len(field) > self.max_listpack_value or len(value) > self.max_listpack_value:
+                self._convert()
+            else:
+                blob = self.listpack
+                pos = listpack.find(blob, field, 2)
+                if pos >= 0:  # Overwrite the value in place
+                    value_pos = listpack.span(blob, pos)[1]
+                    blob[value_pos:listpack.span(blob, value_pos)[1]] = listpack.encode_entry(value)
+                    return False
+                if self.count < self.max_listpack_entries:
+                    blob += listpack.encode_entry(field) + listpack.encode_entry(value)
+                    self.count += 1
+                    return True
+                self._convert()
+        table = self.table
+        old = table.get(field)
+        table[field] = value
+        self.element_bytes += sys.getsizeof(value)
+        if old is None:
+            self.element_bytes += sys.getsizeof(field)
+            self.count += 1
+            if self.scan_index is not None:
+                self.scan_index.add(field)
+            return True
+        self.element_bytes -= sys.getsizeof(old)
+        return False
+
+    def delete(self, field):  # HDEL
+        """Remove field; return True if it existed."""
+        if self.table is not None:
+            value = self.table.pop(field, None)
+            if value is None:
+                return False
+            self.element_bytes -= sys.getsizeof(field) + sys.getsizeof(value)
+            if self.scan_index is not None:
+                self.scan_index.discard(field)
+        else:
+            blob = self.listpack
+            pos = listpack.find(blob, field, 2)
+            if pos < 0:
+                return False
+            del blob[pos:listpack.span(blob, listpack.span(blob, pos)[1])[1]]  # Field and value together
+        self.count -= 1
+        return True
+
+    def items(self):  # HGETALL, persistence
+        """Yield (field, value) pairs."""
+        if self.table is not None:
+            yield from self.table.items()
+            return
+        fields = listpack.entries(self.listpack)
+        for field in fields:
+            yield field, next(fields)
+
+    def scan(self, cursor, count):  # HSCAN
+        """Return (next cursor, [(field, value)]): everything at once while small, a slice of the index otherwise."""
+        if self.table is None:
+            return 0, list(self.items())
+        if self.scan_index is None:
+            self.scan_index = ScanIndex(self.table)
+        cursor, fields = self.scan_index.scan(cursor, count)
+        table = self.table
+        return cursor, [(field, table[field]) for field in fields]
+
+    def _convert(self):  # listpack -> dict
+        """Switch to the dict encoding."""
+        self.table = dict(self.items())
+        self.listpack = None
+        self.element_bytes = sum(sys.getsizeof(field) + sys.getsizeof(value) for field, value in self.table.items())
+
+    @classmethod
+    def from_listpack(cls, blob, count):  # RDB loading
+        """Build a hash from a serialized listpack of count fields."""
+        value = cls()
+        if count > cls.max_listpack_entries:  # Loaded with a smaller threshold than it was saved with
+            for field, item in zip(*[listpack.entries(blob)] * 2):
+                value.set(field, item)
+            return value
+        value.listpack = bytearray(blob)
+        value.count = count
+        return value
@@ -0,0 +1,250 @@
+"""HyperLogLog counters (PFADD, PFCOUNT, PFMERGE) stored as string values.
+
+A counter estimates the number of distinct elements added to it with a
+standard error of 0.81%, in at most 12 KB however many there are. Each
+element is hashed to 64 bits; the low 14 bits pick one of 16384
+registers, which keeps the longest run of trailing zeros (plus one) seen
+in the remaining 50 bits. The estimate is computed from the histogram of
+register values with the same improved estimator Redis uses.
+
+Like Redis, a counter is a string: a 16-byte header ("HYLL", the
+encoding, three unused bytes and a little-endian cached cardinality whose
+top bit marks it stale) followed by the registers in one of two
+encodings:
+
+    sparse  sorted 3-byte entries (register index big-endian, value) of
+            the registers that are not zero; a new counter is 16 bytes
+    dense   16384 6-bit registers packed least significant bit first,
+            12288 bytes
+
+PFADD updates the bytearray in place: a binary search and a slice insert
+for sparse counters, a two-byte read-modify-write for dense ones. A
+sparse counter is converted to dense in place once its entries take more
+than sparse_max_bytes (hll-sparse-max-bytes). PFCOUNT and PFMERGE unpack
+the registers to one byte each and work on whole arrays as ints, 8 bits
+per register (SWAR): the per-register maximum of a merge is a handful of
+big-int operations instead of a 16384-step loop. The element hash is
+BLAKE2b rather than Redis' MurmurHash64A, so counters are not
+interchangeable with real Redis dumps.
+
+A counter is an ordinary string, so SET can store one with registers no
+PFADD would write (a sparse index past 16383, a value above Q + 1):
+is_valid() checks only the header, sparse_intact() the sparse entries,
+and decoding raises CorruptedCounter.
+"""
+import hashlib  # Element hash
+import math  # Estimator
+import re  # Non-zero registers
+
+MAGIC = b"HYLL"
+DENSE, SPARSE = 0, 1  # Encoding byte
+HEADER_SIZE = 16
+P = 14  # Index bits
+REGISTERS = 1 << P
+Q = 64 - P  # Hash bits left for the run of zeros
+REGISTER_BITS = 6
+DENSE_SIZE = HEADER_SIZE + REGISTERS * REGISTER_BITS // 8
+ALPHA_INF = 0.5 / math.log(2)
+STALE = 0x80  # In header byte 15: the cached cardinality must be recomputed
+
+sparse_max_bytes = 3000  # hll-sparse-max-bytes (set by CommandCore from the config)
+
+_LANES = REGISTERS // 4  # Registers in each of the four interleaved columns, one byte-lane each
+_M2 = int.from_bytes(b"\x03" * _LANES, "little")  # Per-lane masks of the column arithmetic
+_M4 = int.from_bytes(b"\x0f" * _LANES, "little")
+_M6 = int.from_bytes(b"\x3f" * _LANES, "little")
+_HIGH = int.from_bytes(b"\x80" * REGISTERS, "little")  # Top bit of every lane of a whole register array
+_NON_ZERO = re.compile(rb"[^\x00]")
+_TOO_LARGE = re.compile(b"[%c-\xff]" % (Q + 2))  # A register value no run of zeros produces
+
+
+class CorruptedCounter(ValueError):  # Turned into an INVALIDOBJ reply by the commands
+    """The registers of a counter hold values PFADD never writes."""
+
+
+def new():  # PFADD of a missing key
+    """Return an empty sparse counter."""
+    return bytearray(MAGIC + bytes((SPARSE,)) + bytes(11))  # Cached cardinality 0, valid
+
+
+def is_valid(value):  # WRONGTYPE check
+    """Return True if the string value is a counter of either encoding."""
+    if len(value) < HEADER_SIZE or value[:4] != MAGIC:
+        return False
+    if value[4] == DENSE:
+        return len(value) == DENSE_SIZE
+    return value[4] == SPARSE and (len(value) - HEADER_SIZE) % 3 == 0
+
+
+def sparse_intact(counter):  # Before PFADD searches the entries of a stored counter
+    """Return False if counter is sparse and an entry has an index or value PFADD never writes."""
+    if counter[4] != SPARSE or len(counter) == HEADER_SIZE:
+        return True
+    return max(counter[HEADER_SIZE::3]) < REGISTERS >> 8 and max(counter[HEADER_SIZE + 2::3]) <= Q + 1
+
+
+def element_position(element):  # Register and value an element maps to
+    """Return (register index, run of trailing zeros + 1) for element."""
+    digest = int.from_bytes(hashlib.blake2b(element, digest_size=8).digest(), "little")
+    rest = (digest >> P) | (1 << Q)  # The sentinel bounds the run at Q + 1
+    return digest & (REGISTERS - 1), (rest & -rest).bit_length()
+
+
+def add(counter, elements):  # PFADD
+    """Add elements to counter (a bytearray) in place; return True if a register changed."""
+    changed = False
+    for element in elements:
+        index, run = element_position(element)
+        if counter[4] == DENSE:
+            changed |= _dense_raise(counter, index, run)
+        elif _sparse_raise(counter, index, run):
+            changed = True
+            if len(counter) - HEADER_SIZE > sparse_max_bytes:
+                counter[HEADER_SIZE:] = _pack(registers(counter))
+                counter[4] = DENSE
+    if changed:
+        counter[15] |= STALE
+    return changed
+
+
+def _dense_raise(counter, index, run):  # Register index = max(register, run)
+    bit = index * REGISTER_BITS
+    pos = HEADER_SIZE + (bit >> 3)
+    shift = bit & 7
+    spans = shift > 8 - REGISTER_BITS  # The register continues in the next byte
+    word = counter[pos] | (counter[pos + 1] << 8 if spans else 0)
+    if (word >> shift) & 63 >= run:
+        return False
+    word = (word & ~(63 << shift)) | (run << shift)
+    counter[pos] = word & 0xFF
+    if spans:
+        counter[pos + 1] = word >> 8
+    return True
+
+
+def _sparse_raise(counter, index, run):  # Same on the sorted entries
+    low, high = 0, (len(counter) - HEADER_SIZE) // 3
+    while low < high:  # Binary search for the first entry with a register >= index
+        middle = (low + high) >> 1
+        pos = HEADER_SIZE + 3 * middle
+        if (counter[pos] << 8 | counter[pos + 1]) < index:
+            low = middle + 1
+        else:
+            high = middle
+    pos = HEADER_SIZE + 3 * low
+    if pos < len(counter) and (counter[pos] << 8 | counter[pos + 1]) == index:
+        if counter[pos + 2] >= run:
+            return False
+        counter[pos + 2] = run
+    else:
+        counter[pos:pos] = bytes((index >> 8, index & 0xFF, run))  # One memmove of the entries after it
+    return True
+
+
+def registers(counter):  # Unpacked form for counting and merging
+    """Return the registers of counter as bytes, one byte per register; raise CorruptedCounter if one is out of range."""
+    if counter[4] == SPARSE:
+        unpacked = bytearray(REGISTERS)
+        try:
+            for pos in range(HEADER_SIZE, len(counter), 3):
+                unpacked[counter[pos] << 8 | counter[pos + 1]] = counter[pos + 2]
+        except IndexError:  # A register index of 16384 or more
+            raise CorruptedCounter("register index out of range") from None
+        return _checked(bytes(unpacked))
+    # Every 3 bytes hold 4 registers; each column of bytes becomes an int with one byte-lane per group
+    b0, b1, b2 = (int.from_bytes(counter[HEADER_SIZE + k::3], "little") for k in range(3))
+    unpacked = bytearray(REGISTERS)
+    unpacked[0::4] = (b0 & _M6).to_bytes(_LANES, "little")
+    unpacked[1::4] = ((b0 >> 6) & _M2 | (b1 & _M4) << 2).to_bytes(_LANES, "little")
+    unpacked[2::4] = ((b1 >> 4) & _M4 | (b2 & _M2) << 4).to_bytes(_LANES, "little")
+    unpacked[3::4] = ((b2 >> 2) & _M6).to_bytes(_LANES, "little")
+    return _checked(bytes(unpacked))
+
+
+def _checked(unpacked):  # Every estimate and merge goes through registers()
+    if _TOO_LARGE.search(unpacked):  # 6-bit dense registers can hold up to 63
+        raise CorruptedCounter("register value out of range")
+    return unpacked
+
+
+def _pack(unpacked):  # Inverse of registers() for the dense encoding
+    r0, r1, r2, r3 = (int.from_bytes(unpacked[k::4], "little") for k in range(4))
+    packed = bytearray(DENSE_SIZE - HEADER_SIZE)
+    packed[0::3] = (r0 | (r1 & _M2) << 6).to_bytes(_LANES, "little")
+    packed[1::3] = ((r1 >> 2) & _M4 | (r2 & _M4) << 4).to_bytes(_LANES, "little")
+    packed[2::3] = ((r2 >> 4) & _M2 | r3 << 2).to_bytes(_LANES, "little")
+    return packed
+
+
+def merge(unpacked, other):  # PFMERGE, PFCOUNT of several keys
+    """Return the per-register maximum of two unpacked register arrays."""
+    a = int.from_bytes(unpacked, "little")
+    b = int.from_bytes(other, "little")
+    ge = (((a | _HIGH) - b) & _HIGH) >> 7  # 1 in the lanes where a >= b (no lane borrows: values are < 64)
+    keep = ge * 0xFF
+    return (a & keep | b & ~keep).to_bytes(REGISTERS, "little")
+
+
+def from_registers(unpacked):  # PFMERGE result
+    """Return a counter holding the unpacked registers, sparse if they fit in sparse_max_bytes."""
+    header = bytearray(MAGIC + bytes(12))
+    header[15] = STALE
+    if 3 * (REGISTERS - unpacked.count(0)) <= sparse_max_bytes:
+        header[4] = SPARSE
+        header += b"".join(bytes((match.start() >> 8, match.start() & 0xFF, unpacked[match.start()]))
+                           for match in _NON_ZERO.finditer(unpacked))
+        return header
+    return header + _pack(unpacked)
+
+
+def count(counter):  # PFCOUNT of one key
+    """Return the estimated cardinality of counter, from its cache when valid (refreshing it otherwise)."""
+    if not counter[15] & STALE:
+        return int.from_bytes(counter[8:16], "little")
+    cardinality = estimate(registers(counter))
+    if counter.__class__ is bytearray:  # Not a logical change: nothing is propagated
+        counter[8:16] = cardinality.to_bytes(8, "little")
+    return cardinality
+
+
+def estimate(unpacked):  # Ertl's improved raw estimator, as in Redis' hllCount()
+    """Return the estimated cardinality of unpacked registers."""
+    histogram = [0] * (Q + 2)
+    remaining = REGISTERS
+    value = 0
+    while remaining:  # Values are small in practice: stop once every register was counted
+        histogram[value] = unpacked.count(value)
+        remaining -= histogram[value]
+        value += 1
+    m = REGISTERS
+    z = m * _tau((m - histogram[Q + 1]) / m)
+    for j in range(Q, 0, -1):
+        z = (z + histogram[j]) * 0.5
+    z += m * _sigma(histogram[0] / m)
+    return round(ALPHA_INF * m * m / z)
+
+
+def _tau(x):
+    if x == 0.0 or x == 1.0:
+        return 0.0
+    y, z = 1.0, 1 - x
+    while True:
+        x = math.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+
+def _sigma(x):
+    if x == 1.0:
+        return math.inf
+    y, z = 1.0, x
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if z == previous:
+            return z
@@ -0,0 +1,98 @@
+"""Lazy freeing for UNLINK: large values are taken apart a bounded amount at a time.
+
+CPython frees a container in one C call while holding the GIL, so passing
+a huge value to a background thread would still stall the event loop for
+as long as the deallocation takes. Instead, UNLINK removes the key at
+once and queues the value here; the cron then dismantles it in slices of
+at most BATCH elements under a small time budget per tick. Skiplist nodes
+point at each other in both directions, so a dropped skiplist would even
+wait for the cyclic garbage collector; dismantling cuts those links.
+"""
+import collections  # Queue of values being freed
+import time  # Time budget per step
+
+from hashes import Hash
+from quicklist import CHUNK_SIZE, QuickList
+from sets import Set
+from zset import ZSet
+
+LAZYFREE_THRESHOLD = 64  # Values with at most this many elements are cheaper to free right away
+BATCH = 1024  # Elements released between two time checks
+
+
+def _dismantle(value):  # Generator: each next() releases about BATCH elements
+    if value.__class__ is QuickList:
+        chunks = value.chunks
+        while chunks:
+            for _ in range(min(BATCH // CHUNK_SIZE, len(chunks))):
+                chunks.popleft()
+            yield
+    elif value.__class__ is ZSet and value.skiplist is not None:
+        node = value.skiplist.header.forward[0]
+        value.skiplist.header.forward = []  # Detach the chain from the sentinel
+        value.skiplist.tail = None
+        while node is not None:
+            for _ in range(BATCH):
+                if node is None:
+                    break
+                following = node.forward[0]
+                node.forward = node.backward = None  # Break the cycle so refcounting frees the node
+                node = following
+            yield
+        table = value.table
+        while table:
+            for _ in range(min(BATCH, len(table))):
+                table.popitem()
+            yield
+        yield from _dismantle_index(value)
+    elif value.__class__ in (Hash, Set) and value.table is not None:
+        table = value.table
+        pop = table.popitem if value.__class__ is Hash else table.pop
+        while table:
+            for _ in range(min(BATCH, len(table))):
+                pop()
+            yield
+        yield from _dismantle_index(value)
+
+
+def _dismantle_index(value):  # The SCAN positions of a large hash, set or sorted set
+    index = value.scan_index
+    if index is None:
+        return
+    value.scan_index = None
+    while index.slots:
+        del index.slots[-BATCH:]
+        for _ in range(min(BATCH, len(index.positions))):
+            index.positions.popitem()
+        yield
+
+
+class LazyFree:  # Owned by CommandCore
+    """Queue of unlinked values, released incrementally by step()."""
+
+    def __init__(self):
+        self.pending = collections.deque()  # Generators dismantling one value each
+        self.freed_objects = 0  # Values released through the queue (INFO lazyfreed_objects)
+
+    def __len__(self):  # INFO lazyfree_pending_objects
+        return len(self.pending)
+
+    def free(self, value):  # UNLINK
+        """Release value now if it is small, otherwise queue it for step()."""
+        if value.__class__ in (bytes, bytearray, int) or len(value) <= LAZYFREE_THRESHOLD:  # Strings are one object
+            return  # Dropping the last reference is cheap
+        self.pending.append(_dismantle(value))
+
+    def step(self, budget_ms=1.0):  # Called from the cron
+        """Dismantle queued values for at most budget_ms milliseconds."""
+        deadline = time.perf_counter() + budget_ms / 1000
+        pending = self.pending
+        while pending:
+            try:
+                next(pending[0])
+            except StopIteration:  # Fully taken apart; the empty shell goes with the generator
+                pending.popleft()
+                self.freed_objects += 1
+                continue
+            if time.perf_counter() >= deadline:
+                return
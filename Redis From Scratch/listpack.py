@@ -0,0 +1,52 @@
+"""Listpack: a flat bytearray of length-prefixed entries for small containers.
+
+Each entry is its length followed by its bytes. Lengths below 0x80 take one
+byte; longer entries (up to MAX_ENTRY bytes) take two, with the high bit of
+the first byte set. Small hashes store field, value, field, value, ...;
+small non-integer sets store their members.
+
+Compared with a dict or set, a listpack saves the hash table and one bytes
+object per element: a three-field hash is ~100 bytes instead of ~400.
+Lookups are a linear walk, which is why containers convert to a real
+dict/set once they grow past the configured thresholds.
+"""
+
+MAX_ENTRY = 0x7FFF  # Longest entry a two-byte length can describe
+
+
+def encode_entry(entry):  # Length prefix + bytes
+    """Encode one entry."""
+    length = len(entry)
+    if length < 0x80:
+        return bytes((length,)) + entry
+    return bytes((0x80 | (length >> 8), length & 0xFF)) + entry
+
+
+def span(blob, pos):  # Decode the length prefix at pos
+    """Return (data start, data end) of the entry whose prefix starts at pos."""
+    length = blob[pos]
+    if length & 0x80:
+        return pos + 2, pos + 2 + (((length & 0x7F) << 8) | blob[pos + 1])
+    return pos + 1, pos + 1 + length
+
+
+def entries(blob):  # Every entry, in order
+    """Yield the entries of blob as bytes."""
+    pos, end = 0, len(blob)
+    while pos < end:
+        start, pos = span(blob, pos)
+        yield bytes(blob[start:pos])
+
+
+def find(blob, target, step=1):  # Linear search
+    """Return the prefix offset of the first entry equal to target among entries 0, step, 2*step, ..., or -1."""
+    if target not in blob:  # Substring search in C rejects most misses without walking
+        return -1
+    pos, end, size, index = 0, len(blob), len(target), 0
+    while pos < end:
+        start, stop = span(blob, pos)
+        if index % step == 0 and stop - start == size and blob[start:stop] == target:
+            return pos
+        pos = stop
+        index += 1
+    return -1
@@ -0,0 +1,345 @@
+"""Load generator in the spirit of redis-benchmark, for every server variant in this directory.
+
+Start a variant locally and load it:
+
+    python loadgen.py --server reactor -c 50 -P 16 -n 200000 -t set,get,mixed
+
+or load a server that is already running:
+
+    python loadgen.py --host 10.0.0.5 --port 6379 -t ping --json results.json
+
+The load comes from --processes client processes, each driving its share
+of the --clients connections from one non-blocking selectors loop, so the
+client side scales past one core. Every connection keeps one batch of
+--pipeline requests in flight; a reply's latency is the time from sending
+its batch to receiving it, as redis-benchmark counts it. Latencies go into
+a stats.LatencyHistogram per process (percentiles within its 12.5%
+bucket precision), merged across processes. The JSON report carries the
+settings next to the results so runs of different versions can be
+compared.
+
+The line-based variants (threaded, betav, test, testi) only understand
+inline commands, which is what --inline sends; every connection starts
+with an inline PING whose +PONG also skips a greeting some of them send.
+"""
+import argparse  # Command line
+import json  # Machine-readable report
+import multiprocessing  # Client processes and the local server process
+import os  # cpu_count, scratch directory of the local server
+import platform  # Recorded in the report
+import random  # Keys and the mixed workload
+import selectors  # One non-blocking loop per client process
+import socket  # Client connections
+import sys  # Silence the local server's output
+import tempfile  # Working directory of the local server
+import time  # Run timestamps and start-up polling
+from time import perf_counter_ns  # Latency clock
+
+from resp import encode_command  # RESP requests
+from stats import LatencyHistogram  # Latency percentiles
+
+TESTS = ("ping", "set", "get", "mixed")  # -t choices, run in the order given
+BATCH_POOL = 256  # Distinct pre-encoded batches per connection, cycled through
+VARIANTS = {  # --server name -> (script, protocol it understands)
+    "reactor": ("Building a Redis-Like Server.py", "resp"),  # RedisLikeServer, selectors event loop
+    "asyncio": ("aioserver.py", "resp"),  # AsyncRedisServer
+    "threaded": ("minimal_tcp-server.py", "inline"),  # TCPServer: handler pool over a StripedStore
+    "betav": ("tcp_server_betaV.py", "inline"),  # TCPServer that answers PING only
+    "test": ("test.py", "inline"),  # select() prototype
+    "testi": ("testi.py", "inline"),  # Earlier select() prototype
+}
+
+
+class ReplyError(Exception):  # The server sent something this client cannot count
+    """Unexpected reply type, or the server closed the connection."""
+
+
+def count_replies(buffer, pos):  # Scalar replies only: PING, SET and GET never return arrays
+    """Return (new position, complete replies, error replies) for the replies in buffer from pos on."""
+    replies = errors = 0
+    while True:
+        end = buffer.find(b"\r\n", pos)
+        if end == -1:
+            break
+        kind = buffer[pos]
+        if kind == 36:  # '$': bulk string, or $-1 for a missing key
+            length = int(buffer[pos + 1:end])
+            following = end + 4 + length if length >= 0 else end + 2
+            if following > len(buffer):  # Body not complete yet
+                break
+        elif kind in (43, 45, 58):  # '+', '-', ':'
+            following = end + 2
+            errors += kind == 45
+        else:
+            raise ReplyError(f"unexpected reply {bytes(buffer[pos:end + 2])!r}")
+        replies += 1
+        pos = following
+    return pos, replies, errors
+
+
+def build_batches(test, pipeline, keyspace, value, read_ratio, inline, rng):  # Pre-encoded so the loop only sends
+    """Return BATCH_POOL lists of `pipeline` encoded requests each for the given test."""
+    encode = (lambda *args: b" ".join(args) + b"\r\n") if inline else encode_command
+    batches = []
+    for _ in range(BATCH_POOL):
+        requests = []
+        for _ in range(pipeline):
+            if test == "ping":
+                requests.append(encode(b"PING"))
+                continue
+            key = b"key:%012d" % rng.randrange(keyspace)
+            if test == "get" or (test == "mixed" and rng.random() < read_ratio):
+                requests.append(encode(b"GET", key))
+            else:
+                requests.append(encode(b"SET", key, value))
+        batches.append(requests)
+    return batches
+
+
+def connect(address):  # Blocking handshake, then non-blocking for the run
+    """Open a connection and wait for the +PONG of an inline PING (skipping any greeting)."""
+    sock = socket.create_connection(address)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall(b"PING\r\n")
+    received = b""
+    while not received.endswith(b"+PONG\r\n"):
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise ReplyError("server closed the connection during the handshake")
+        received += chunk
+    sock.setblocking(False)
+    return sock
+
+
+class _Connection:  # State of one client connection
+    __slots__ = ("sock", "batches", "requests", "turn", "out", "buffer", "pos", "sent_at", "awaiting")
+
+    def __init__(self, sock, batches):
+        self.sock = sock
+        self.batches = [b"".join(requests) for requests in batches]  # Pre-encoded request batches
+        self.requests = batches  # The same, request by request, for a shorter last batch
+        self.turn = 0  # Next batch to send
+        self.out = b""  # Unsent bytes of the current batch
+        self.buffer = bytearray()  # Received reply bytes
+        self.pos = 0  # Parse position in buffer
+        self.sent_at = 0  # perf_counter_ns() when the current batch was written
+        self.awaiting = 0  # Replies of the current batch not received yet
+
+
+def client_process(address, options, test, connections, requests, seed, barrier, results):  # Runs in a client process
+    """Drive `connections` connections until `requests` replies arrived; put this process's counters on results."""
+    rng = random.Random(seed)
+    value = b"x" * options["data_size"]
+    selector = selectors.DefaultSelector()
+    clients = []
+    for _ in range(connections):
+        batches = build_batches(test, options["pipeline"], options["keyspace"], value, options["read_ratio"], options["inline"], rng)
+        client = _Connection(connect(address), batches)
+        selector.register(client.sock, selectors.EVENT_READ, client)
+        clients.append(client)
+    histogram = LatencyHistogram()
+    record = histogram.record
+    pipeline = options["pipeline"]
+    unsent = requests  # Requests not yet handed to a connection
+    done = errors = total_ns = max_ns = 0
+
+    def send_batch(client):  # Start the next batch on a connection
+        nonlocal unsent
+        size = min(pipeline, unsent)
+        unsent -= size
+        batch = client.batches[client.turn] if size == pipeline else b"".join(client.requests[client.turn][:size])
+        client.turn = (client.turn + 1) % BATCH_POOL
+        client.awaiting = size
+        client.sent_at = perf_counter_ns()
+        flush(client, batch)
+
+    def flush(client, data):  # Non-blocking write; EVENT_WRITE only while something is left
+        try:
+            written = client.sock.send(data)
+        except BlockingIOError:
+            written = 0
+        waiting = bool(client.out)
+        client.out = data[written:]
+        if bool(client.out) != waiting:
+            selector.modify(client.sock, selectors.EVENT_READ | selectors.EVENT_WRITE if client.out else selectors.EVENT_READ, client)
+
+    barrier.wait()  # Every process starts loading at the same time
+    start = perf_counter_ns()
+    for client in clients:
+        if unsent:
+            send_batch(client)
+    while done < requests:
+        for key, events in selector.select():
+            client = key.data
+            if events & selectors.EVENT_WRITE and client.out:
+                flush(client, client.out)
+            if not events & selectors.EVENT_READ:
+                continue
+            try:
+                data = client.sock.recv(262144)
+            except BlockingIOError:
+                continue
+            if not data:
+                raise ReplyError("server closed the connection")
+            client.buffer += data
+            client.pos, replies, failed = count_replies(client.buffer, client.pos)
+            if not replies:
+                continue
+            if client.pos > 65536:  # Drop parsed bytes now and then
+                del client.buffer[:client.pos]
+                client.pos = 0
+            latency = perf_counter_ns() - client.sent_at
+            for _ in range(replies):
+                record(latency)
+            total_ns += latency * replies
+            if latency > max_ns:
+                max_ns = latency
+            done += replies
+            errors += failed
+            client.awaiting -= replies
+            if client.awaiting <= 0 and unsent:
+                send_batch(client)
+    elapsed = perf_counter_ns() - start
+    for client in clients:
+        client.sock.close()
+    results.put({"requests": done, "errors": errors, "elapsed_ns": elapsed, "total_ns": total_ns,
+                 "max_ns": max_ns, "buckets": histogram.buckets})
+
+
+
+def run_test(address, options, test):  # One line of the report
+    """Run one workload from options["processes"] client processes and return its merged results."""
+    processes = min(options["processes"], options["clients"])
+    barrier = multiprocessing.Barrier(processes)
+    results = multiprocessing.Queue()
+    workers = []
+    for index in range(processes):  # Connections and requests dealt out as evenly as possible
+        connections = options["clients"] // processes + (index < options["clients"] % processes)
+        requests = options["requests"] // processes + (index < options["requests"] % processes)
+        workers.append(multiprocessing.Process(target=client_process, daemon=True,
+                                               args=(address, options, test, connections, requests, options["seed"] + index, barrier, results)))
+    for worker in workers:
+        worker.start()
+    parts = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    histogram = LatencyHistogram()
+    for part in parts:
+        histogram.buckets = [a + b for a, b in zip(histogram.buckets, part["buckets"])]
+    done = sum(part["requests"] for part in parts)
+    elapsed = max(part["elapsed_ns"] for part in parts) / 1e9  # The processes started together at the barrier
+    max_ns = max(part["max_ns"] for part in parts)
+    percentile = lambda fraction: round(min(histogram.percentile(fraction), max_ns) / 1e6, 4)  # A bucket bound can exceed the largest value
+    return {
+        "test": test,
+        "requests": done,
+        "errors": sum(part["errors"] for part in parts),
+        "seconds": round(elapsed, 6),
+        "ops_per_sec": round(done / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "avg": round(sum(part["total_ns"] for part in parts) / done / 1e6, 4) if done else 0.0,
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "p99.9": percentile(0.999),
+            "max": round(max_ns / 1e6, 4),
+        },
+    }
+
+
+def serve_variant(variant, port):  # Body of the local server process
+    """Run one of the server scripts on port, quietly, in a scratch directory."""
+    from benchmarks import load_script  # The scripts' file names are not importable
+    os.chdir(tempfile.mkdtemp(prefix="loadgen-"))  # Snapshots and AOF files land here
+    sys.stdout = sys.stderr = open(os.devnull, "w")  # Per-connection prints would cost the server time
+    module = load_script(VARIANTS[variant][0])
+    if variant == "asyncio":
+        module.run(module.AsyncRedisServer(port=port))
+    elif variant in ("threaded", "betav"):
+        module.TCPServer(port=port).run()
+    else:
+        module.RedisLikeServer(port=port).start()
+
+
+def start_variant(variant, port):  # --server
+    """Start a server variant in its own process and return the process once the port accepts connections."""
+    process = multiprocessing.Process(target=serve_variant, args=(variant, port), daemon=True)
+    process.start()
+    for _ in range(250):
+        try:
+            connect(("localhost", port)).close()
+            return process
+        except OSError:
+            time.sleep(0.02)
+    process.terminate()
+    raise RuntimeError(f"server variant {variant!r} did not start on port {port}")
+
+
+def parse_args(argv=None):  # Names follow redis-benchmark where it has one
+    parser = argparse.ArgumentParser(description="Load generator for the Redis-like server variants.")
+    parser.add_argument("--server", choices=sorted(VARIANTS), help="start this variant locally instead of using --host/--port")
+    parser.add_argument("--host", default="localhost", help="server host (default localhost)")
+    parser.add_argument("-p", "--port", type=int, default=6379, help="server port, also used by --server (default 6379)")
+    parser.add_argument("-c", "--clients", type=int, default=50, help="concurrent connections (default 50)")
+    parser.add_argument("-n", "--requests", type=int, default=100000, help="requests per test (default 100000)")
+    parser.add_argument("-P", "--pipeline", type=int, default=1, help="requests in flight per connection (default 1)")
+    parser.add_argument("-r", "--keyspace", type=int, default=10000, help="distinct keys for SET/GET (default 10000)")
+    parser.add_argument("-d", "--data-size", type=int, default=3, help="SET value size in bytes (default 3)")
+    parser.add_argument("-t", "--tests", default=",".join(TESTS), help="comma-separated tests: " + ", ".join(TESTS))
+    parser.add_argument("--read-ratio", type=float, default=0.8, help="share of GETs in the mixed test (default 0.8)")
+    parser.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="client processes (default: half the CPUs, leaving the rest to the server)")
+    parser.add_argument("--inline", action="store_true", help="send inline commands (implied by the line-based variants)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the generated keys")
+    parser.add_argument("--label", default="", help="free text stored in the JSON report, e.g. a version")
+    parser.add_argument("--json", metavar="FILE", help="also write the report as JSON to FILE ('-' for stdout only)")
+    options = parser.parse_args(argv)
+    tests = options.tests.lower().split(",")
+    unknown = [test for test in tests if test not in TESTS]
+    if unknown:
+        parser.error(f"unknown tests: {', '.join(unknown)}")
+    options.tests = tests
+    if min(options.clients, options.requests, options.pipeline, options.keyspace, options.processes) < 1 or options.data_size < 0:
+        parser.error("counts must be positive")
+    if options.server and VARIANTS[options.server][1] == "inline":
+        options.inline = True
+    if options.inline and options.data_size == 0:
+        parser.error("inline commands cannot carry an empty value")
+    return options
+
+
+def main(argv=None):
+    """Run the requested tests and print (and optionally save) the report."""
+    options = parse_args(argv)
+    settings = {name: getattr(options, name) for name in ("clients", "requests", "pipeline", "keyspace", "data_size",
+                                                          "read_ratio", "processes", "inline", "seed")}
+    server = start_variant(options.server, options.port) if options.server else None
+    address = ("localhost" if server else options.host, options.port)
+    report = {"label": options.label, "server": options.server or f"{options.host}:{options.port}",
+              "timestamp": int(time.time()), "python": platform.python_version(), "cpus": os.cpu_count(),
+              "settings": settings, "results": []}
+    quiet = options.json == "-"  # Nothing but the JSON on stdout
+    try:
+        for test in options.tests:
+            result = run_test(address, settings, test)
+            report["results"].append(result)
+            if not quiet:
+                latency = result["latency_ms"]
+                print(f"{test.upper():<6} {result['ops_per_sec']:>11.1f} requests per second, "
+                      f"p50={latency['p50']:.3f} p95={latency['p95']:.3f} p99={latency['p99']:.3f} "
+                      f"p99.9={latency['p99.9']:.3f} max={latency['max']:.3f} msec"
+                      + (f" ({result['errors']} errors)" if result["errors"] else ""), flush=True)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join()
+    if quiet:
+        print(json.dumps(report, indent=2))
+    elif options.json:
+        with open(options.json, "w") as handle:
+            json.dump(report, handle, indent=2)
+    return report
+
+
+if __name__ == "__main__":  # If this script is executed directly
+    main()
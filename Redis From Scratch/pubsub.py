@@ -0,0 +1,109 @@
+"""Publish/Subscribe channels and pattern subscriptions.
+
+Subscriptions are kept in two dict-of-sets indexes per kind: channel ->
+subscribed clients here, and client -> channels on the Client itself
+(client.channels / client.patterns), so dropping a disconnected client
+costs O(its subscriptions) rather than a scan of every channel.
+
+Patterns live in their own index. The patterns that match a channel are
+computed the first time something is published to it and cached until the
+set of patterns changes, so a publish does not glob-match every pattern.
+
+A message is encoded once per publish (once per matching pattern for
+pmessage frames) and the same bytes object is handed to every
+subscriber's send(), which only appends to that client's output buffer:
+a slow subscriber just accumulates output, it never blocks the publisher.
+"""
+from globmatch import compile_glob  # Redis-style glob patterns
+from resp import encode_array, encode_bulk, encode_integer  # Frames
+
+MATCH_CACHE_SIZE = 4096  # Channels whose matching patterns are remembered
+
+
+class PubSub:  # Server-wide subscription registry
+    """Channel and pattern subscriptions with O(subscribers) fan-out."""
+
+    def __init__(self):
+        self.channels = {}  # Channel (bytes) -> set of subscribed Clients
+        self.patterns = {}  # Pattern (bytes) -> set of subscribed Clients
+        self.matchers = {}  # Pattern -> compiled fullmatch function
+        self.match_cache = {}  # Channel -> tuple of patterns matching it (valid until the pattern set changes)
+
+    def subscribe(self, client, channel):  # SUBSCRIBE
+        """Subscribe client to channel; return the "subscribe" confirmation frame."""
+        if channel not in client.channels:
+            client.channels.add(channel)
+            self.channels.setdefault(channel, set()).add(client)
+        return self._confirm(b"subscribe", channel, client)
+
+    def unsubscribe(self, client, channel):  # UNSUBSCRIBE
+        """Unsubscribe client from channel; return the "unsubscribe" confirmation frame."""
+        if channel in client.channels:
+            client.channels.discard(channel)
+            subscribers = self.channels[channel]
+            subscribers.discard(client)
+            if not subscribers:  # Last subscriber gone: drop the channel
+                del self.channels[channel]
+        return self._confirm(b"unsubscribe", channel, client)
+
+    def psubscribe(self, client, pattern):  # PSUBSCRIBE
+        """Subscribe client to a glob pattern; return the "psubscribe" confirmation frame."""
+        if pattern not in client.patterns:
+            client.patterns.add(pattern)
+            if pattern not in self.patterns:  # New pattern: cached matches are stale
+                self.patterns[pattern] = set()
+                self.matchers[pattern] = compile_glob(pattern)
+                self.match_cache.clear()
+            self.patterns[pattern].add(client)
+        return self._confirm(b"psubscribe", pattern, client)
+
+    def punsubscribe(self, client, pattern):  # PUNSUBSCRIBE
+        """Unsubscribe client from a pattern; return the "punsubscribe" confirmation frame."""
+        if pattern in client.patterns:
+            client.patterns.discard(pattern)
+            subscribers = self.patterns[pattern]
+            subscribers.discard(client)
+            if not subscribers:  # Pattern gone: cached matches are stale
+                del self.patterns[pattern]
+                del self.matchers[pattern]
+                self.match_cache.clear()
+        return self._confirm(b"punsubscribe", pattern, client)
+
+    def unsubscribe_all(self, client):  # Disconnect cleanup
+        """Drop every subscription of client in O(its channels + patterns)."""
+        for channel in list(client.channels):
+            self.unsubscribe(client, channel)
+        for pattern in list(client.patterns):
+            self.punsubscribe(client, pattern)
+
+    def publish(self, channel, message):  # PUBLISH
+        """Deliver message to the channel's and matching patterns' subscribers; return the receiver count."""
+        receivers = 0
+        subscribers = self.channels.get(channel)
+        if subscribers:
+            frame = encode_array([b"message", channel, message])  # Encoded once for every subscriber
+            for client in subscribers:
+                client.send(frame)
+            receivers += len(subscribers)
+        if self.patterns:
+            for pattern in self._matching_patterns(channel):
+                frame = encode_array([b"pmessage", pattern, channel, message])  # Once per pattern
+                for client in self.patterns[pattern]:
+                    client.send(frame)
+                receivers += len(self.patterns[pattern])
+        return receivers
+
+    def _matching_patterns(self, channel):  # Cached pattern lookup
+        """Return the patterns that match channel."""
+        matches = self.match_cache.get(channel)
+        if matches is None:
+            matches = tuple(pattern for pattern, match in self.matchers.items() if match(channel))
+            if len(self.match_cache) >= MATCH_CACHE_SIZE:  # Bounded: start over rather than track recency
+                self.match_cache.clear()
+            self.match_cache[channel] = matches
+        return matches
+
+    @staticmethod
+    def _confirm(kind, name, client):  # [kind, name, subscription count]
+        """Encode a (un)subscribe confirmation frame."""
+        return b"*3\r\n" + encode_bulk(kind) + encode_bulk(name) + encode_integer(len(client.channels) + len(client.patterns))
@@ -0,0 +1,161 @@
+"""List values: a deque of fixed-size chunks (a Python take on Redis' quicklist).
+
+Pushes and pops at either end touch only the first or last chunk, so they
+are O(1). Indexing, LRANGE and LTRIM walk whole chunks from the nearer end
+and then copy only the elements they return, so a range near either end of
+a long list costs O(range + chunks skipped), never a copy of the list.
+"""
+import collections  # deque of chunks
+import itertools  # Iterate chunks from a position without indexing the deque repeatedly
+import sys  # Element sizes for memory accounting
+
+CHUNK_SIZE = 128  # Elements per chunk; small enough that insert(0) on a chunk stays cheap
+CHUNK_OVERHEAD = 120  # One list object plus its deque slot, approximately
+
+
+class QuickList:  # Value type behind LPUSH/RPUSH
+    """Double-ended list of bytes stored in chunks of up to CHUNK_SIZE elements."""
+
+    __slots__ = ("chunks", "length", "element_bytes")
+
+    def __init__(self, elements=()):
+        self.chunks = collections.deque()  # Lists of at most CHUNK_SIZE elements, head first
+        self.length = 0  # Total number of elements
+        self.element_bytes = 0  # Sum of sys.getsizeof() of the elements, kept up to date by every mutation
+        self.extend(elements)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):  # Head to tail (persistence)
+        for chunk in self.chunks:
+            yield from chunk
+
+    def memory_usage(self):  # Called by the keyspace after every mutation, so it must be O(1)
+        """Return the approximate memory used by the list."""
+        return sys.getsizeof(self) + len(self.chunks) * CHUNK_OVERHEAD + self.length * 8 + self.element_bytes
+
+    def append(self, value):  # RPUSH
+        """Add value at the tail."""
+        chunks = self.chunks
+        if not chunks or len(chunks[-1]) >= CHUNK_SIZE:
+            chunks.append([value])
+        else:
+            chunks[-1].append(value)
+        self.length += 1
+        self.element_bytes += sys.getsizeof(value)
+
+    def appendleft(self, value):  # LPUSH
+        """Add value at the head."""
+        chunks = self.chunks
+        if not chunks or len(chunks[0]) >= CHUNK_SIZE:
+            chunks.appendleft([value])
+        else:
+            chunks[0].insert(0, value)  # Moves at most CHUNK_SIZE pointers
+        self.length += 1
+        self.element_bytes += sys.getsizeof(value)
+
+    def extend(self, values):  # Bulk append (loading)
+        """Append every value in order."""
+        for value in values:
+            self.append(value)
+
+    def pop(self):  # RPOP
+        """Remove and return the tail element, or None if the list is empty."""
+        if not self.length:
+            return None
+        chunk = self.chunks[-1]
+        value = chunk.pop()
+        if not chunk:
+            self.chunks.pop()
+        self.length -= 1
+        self.element_bytes -= sys.getsizeof(value)
+        return value
+
+    def popleft(self):  # LPOP
+        """Remove and return the head element, or None if the list is empty."""
+        if not self.length:
+            return None
+        chunk = self.chunks[0]
+        value = chunk.pop(0)
+        if not chunk:
+            self.chunks.popleft()
+        self.length -= 1
+        self.element_bytes -= sys.getsizeof(value)
+        return value
+
+    def index(self, index):  # LINDEX
+        """Return the element at a non-negative index, or None if it is out of range."""
+        if not 0 <= index < self.length:
+            return None
+        chunk, offset = self._locate(index)
+        return self.chunks[chunk][offset]
+
+    def range(self, start, stop):  # LRANGE
+        """Return the elements from start to stop inclusive (0 <= start <= stop < len)."""
+        chunk, offset = self._locate(start)
+        count = stop - start + 1
+        result = []
+        for elements in itertools.islice(self.chunks, chunk, None):  # Skipping chunks is a pointer walk in C
+            part = elements[offset:offset + count]  # Copies only the requested elements
+            result += part
+            count -= len(part)
+            if count <= 0:
+                break
+            offset = 0
+        return result
+
+    def trim(self, start, stop):  # LTRIM
+        """Keep only the elements from start to stop inclusive; an empty range clears the list."""
+        if start > stop or start >= self.length:
+            self._drop_right(self.length)
+            return
+        self._drop_right(self.length - 1 - stop)
+        self._drop_left(start)
+
+    def _drop_left(self, count):  # Remove count elements from the head
+        """Drop count elements from the head, whole chunks at a time where possible."""
+        chunks = self.chunks
+        while count > 0:
+            chunk = chunks[0]
+            if len(chunk) <= count:  # The whole chunk goes
+                chunks.popleft()
+                removed = chunk
+            else:
+                removed = chunk[:count]
+                del chunk[:count]
+            count -= len(removed)
+            self.length -= len(removed)
+            self.element_bytes -= sum(map(sys.getsizeof, removed))
+
+    def _drop_right(self, count):  # Remove count elements from the tail
+        """Drop count elements from the tail, whole chunks at a time where possible."""
+        chunks = self.chunks
+        while count > 0:
+            chunk = chunks[-1]
+            if len(chunk) <= count:
+                chunks.pop()
+                removed = chunk
+            else:
+                removed = chunk[-count:]
+                del chunk[-count:]
+            count -= len(removed)
+            self.length -= len(removed)
+            self.element_bytes -= sum(map(sys.getsizeof, removed))
+
+    def _locate(self, index):  # Chunk walk from the nearer end
+        """Return (chunk number, offset in chunk) of a valid index."""
+        chunks = self.chunks
+        if index < self.length // 2:  # Walk from the head
+            for number, chunk in enumerate(chunks):
+                if index < len(chunk):
+                    return number, index
+                index -= len(chunk)
+        remaining = self.length - index  # Elements from index to the tail, inclusive
+        number = len(chunks)
+        for chunk in reversed(chunks):  # Walk from the tail
+            number -= 1
+            if remaining <= len(chunk):
+                return number, len(chunk) - remaining
+            remaining -= len(chunk)
+        raise IndexError(index)
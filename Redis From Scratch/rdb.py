@@ -0,0 +1,270 @@
+"""Compact binary snapshots of the keyspace (SAVE / BGSAVE).
+
+File layout:
+
+    "PYRDB" <version:1 byte>
+    { [0xFC <expire-ms: int64 LE>] <type:1 byte> <key:string> <value> }*
+    0xFF <crc32 of everything before it: uint32 LE>
+
+Lengths use the Redis length encoding: 00xxxxxx (6 bits), 01xxxxxx
+xxxxxxxx (14 bits), 0x80 + uint32 BE, 0x81 + uint64 BE. A string is a
+length followed by its bytes, or, when it is the canonical decimal form
+of a small integer, 11xxxxxx (0xC0 int8, 0xC1 int16, 0xC2 int32) followed
+by the little-endian integer.
+
+Values by type: a string is one string; a list is its length followed by
+that many strings, head first; a hash is its field count followed by
+field, value, ...; a set is its size followed by the members; a sorted
+set is its size followed by member, score (float64 LE), ... in score
+order, so loading rebuilds the skiplist by appending. Hashes, sets and
+sorted sets still in a small encoding are written as that encoding: the element
+count plus the listpack as one string, or the intset as one string of
+little-endian int64s, so loading them is a single copy.
+"""
+import mmap  # Zero-copy view of the snapshot while loading
+import os  # fsync, rename
+import struct  # Fixed-width integers
+import zlib  # crc32 checksum
+
+from hashes import Hash  # Hash values
+from quicklist import QuickList  # List values
+from sets import Set  # Set values
+from strings import as_bytes, shared, string_object  # String values and their int encoding
+from zset import ZSet  # Sorted set values
+
+MAGIC = b"PYRDB"  # File signature
+VERSION = 1  # Format version
+
+TYPE_STRING = 0  # Plain string value
+TYPE_LIST = 1  # QuickList
+TYPE_HASH = 2  # Hash in dict encoding
+TYPE_SET = 3  # Set in set encoding
+TYPE_HASH_LISTPACK = 4  # Hash in listpack encoding
+TYPE_SET_INTSET = 5  # Set in intset encoding
+TYPE_SET_LISTPACK = 6  # Set in listpack encoding
+TYPE_ZSET = 7  # Sorted set in skiplist encoding
+TYPE_ZSET_LISTPACK = 8  # Sorted set in listpack encoding
+
+OPCODE_EXPIRETIME_MS = 0xFC  # The next key has an absolute expiry in unix ms
+OPCODE_EOF = 0xFF  # End of data; the checksum follows
+
+ENC_INT8, ENC_INT16, ENC_INT32 = 0, 1, 2  # Integer-encoded string variants (low bits after 0xC0)
+WRITE_CHUNK = 1024 * 1024  # Bytes buffered before each write()
+
+_INT64 = struct.Struct("<q")
+_UINT32_LE = struct.Struct("<I")
+_UINT32_BE = struct.Struct(">I")
+_UINT64_BE = struct.Struct(">Q")
+_DOUBLE = struct.Struct("<d")
+_INT_ENCODINGS = ((-(1 << 7), (1 << 7) - 1, b"\xc0", struct.Struct("<b")),  # (min, max, prefix, packer)
+                  (-(1 << 15), (1 << 15) - 1, b"\xc1", struct.Struct("<h")),
+                  (-(1 << 31), (1 << 31) - 1, b"\xc2", struct.Struct("<i")))
+
+
+class RdbError(Exception):  # Raised for corrupt or foreign files
+    """The snapshot file cannot be loaded."""
+
+
+def encode_length(length):  # Redis-style variable-width length
+    """Encode a non-negative length in 1, 2, 5 or 9 bytes."""
+    if length < 1 << 6:
+        return bytes((length,))
+    if length < 1 << 14:
+        return bytes((0x40 | (length >> 8), length & 0xFF))
+    if length < 1 << 32:
+        return b"\x80" + _UINT32_BE.pack(length)
+    return b"\x81" + _UINT64_BE.pack(length)
+
+
+def encode_string(value):  # Length-prefixed or integer-encoded string
+    """Encode a bytes value, using the integer encoding when it round-trips exactly."""
+    if 0 < len(value) <= 11 and value[0] in b"-0123456789":  # Could be a small integer
+        try:
+            number = int(value)
+        except ValueError:
+            number = None
+        if number is not None and b"%d" % number == value:  # Canonical form only ("007" stays a string)
+            for low, high, prefix, packer in _INT_ENCODINGS:
+                if low <= number <= high:
+                    return prefix + packer.pack(number)
+    return encode_length(len(value)) + value
+
+
+def encode_value(value):  # Type byte plus payload
+    """Return (type byte, encoded payload) for a stored value."""
+    if value.__class__ is QuickList:
+        return TYPE_LIST, encode_length(len(value)) + b"".join(map(encode_string, value))
+    if value.__class__ is Hash:
+        if value.listpack is not None:
+            return TYPE_HASH_LISTPACK, encode_length(len(value)) + encode_length(len(value.listpack)) + value.listpack
+        return TYPE_HASH, encode_length(len(value)) + b"".join(encode_string(field) + encode_string(item) for field, item in value.items())
+    if value.__class__ is Set:
+        if value.intset is not None:
+            raw = value.intset_bytes()
+            return TYPE_SET_INTSET, encode_length(len(raw)) + raw
+        if value.listpack is not None:
+            return TYPE_SET_LISTPACK, encode_length(len(value)) + encode_length(len(value.listpack)) + value.listpack
+        return TYPE_SET, encode_length(len(value)) + b"".join(map(encode_string, value))
+    if value.__class__ is ZSet:
+        if value.listpack is not None:
+            return TYPE_ZSET_LISTPACK, encode_length(len(value)) + encode_length(len(value.listpack)) + value.listpack
+        return TYPE_ZSET, encode_length(len(value)) + b"".join(encode_string(member) + _DOUBLE.pack(score) for member, score in value.items())
+    return TYPE_STRING, encode_string(as_bytes(value))  # int-encoded values are saved as integers again
+
+
+def save(path, data, expires, now_ms):  # SAVE and the BGSAVE child
+    """Write data/expires to path atomically (temp file + rename); return the number of keys written."""
+    temp = f"{path}.temp-{os.getpid()}"
+    keys = 0
+    crc = 0
+    with open(temp, "wb") as out:
+        buffer = bytearray(MAGIC + bytes((VERSION,)))  # Header
+        for key, value in data.items():
+            when = expires.get(key)
+            if when is not None:
+                if when <= now_ms:  # Already expired: not worth saving
+                    continue
+                buffer.append(OPCODE_EXPIRETIME_MS)
+                buffer += _INT64.pack(when)
+            if value.__class__ is bytes and len(value) < 64 and len(key) < 64 and not value[:1].isdigit() and value[:1] != b"-":
+                buffer += bytes((TYPE_STRING, len(key))) + key + bytes((len(value),)) + value  # Fast path: short text value
+            else:
+                value_type, payload = encode_value(value)
+                buffer.append(value_type)
+                buffer += encode_string(key)
+                buffer += payload
+            keys += 1
+            if len(buffer) >= WRITE_CHUNK:  # Bounded memory: stream the snapshot out
+                crc = zlib.crc32(buffer, crc)
+                out.write(buffer)
+                buffer.clear()
+        buffer.append(OPCODE_EOF)
+        crc = zlib.crc32(buffer, crc)
+        buffer += _UINT32_LE.pack(crc)
+        out.write(buffer)
+        out.flush()
+        os.fsync(out.fileno())  # The rename must not expose a half-written file
+    os.replace(temp, path)  # Atomic on POSIX
+    return keys
+
+
+def load(path, db):  # Startup
+    """Load the snapshot at path into the Keyspace db; return the number of keys loaded."""
+    with open(path, "rb") as snapshot:
+        size = os.fstat(snapshot.fileno()).st_size
+        if size < len(MAGIC) + 6:
+            raise RdbError("file too short")
+        with mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ) as view:  # Pages come straight from the page cache
+            if view[:len(MAGIC)] != MAGIC:
+                raise RdbError("not a snapshot file")
+            if view[len(MAGIC)] != VERSION:
+                raise RdbError(f"unsupported version {view[len(MAGIC)]}")
+            with memoryview(view) as body:  # crc32 over the mapping without copying it
+                expected = _UINT32_LE.unpack_from(view, size - 4)[0]
+                if zlib.crc32(body[:size - 4]) != expected:
+                    raise RdbError("checksum mismatch")
+            return _load_records(view, len(MAGIC) + 1, db)
+
+
+def _load_records(view, pos, db):  # The hot loop of load()
+    """Parse records starting at pos into db."""
+    store = db.set  # Goes through the keyspace so memory accounting stays right
+    keys = 0
+    while True:
+        opcode = view[pos]
+        pos += 1
+        when = None
+        if opcode == OPCODE_EOF:
+            return keys
+        if opcode == OPCODE_EXPIRETIME_MS:
+            when = _INT64.unpack_from(view, pos)[0]
+            pos += 8
+            opcode = view[pos]
+            pos += 1
+        length = view[pos]
+        if length < 64:  # Fast path: short key (6-bit length)
+            key = view[pos + 1:pos + 1 + length]
+            pos += 1 + length
+        else:
+            key, pos = _read_string(view, pos)
+        if opcode == TYPE_STRING:
+            length = view[pos]
+            if length < 64:  # Fast path: short plain string
+                value = string_object(view[pos + 1:pos + 1 + length])  # Canonical integers get the int encoding
+                pos += 1 + length
+            elif length >> 6 == 3 and length & 0x3F <= ENC_INT32:  # Integer-encoded: straight to the int encoding, no text
+                packer = _INT_ENCODINGS[length & 0x3F][3]
+                value = shared(packer.unpack_from(view, pos + 1)[0])
+                pos += 1 + packer.size
+            else:
+                value, pos = _read_string(view, pos)
+                value = string_object(value)
+        elif opcode == TYPE_LIST:
+            value = QuickList()
+            count, _, pos = _read_length(view, pos)
+            for _ in range(count):
+                element, pos = _read_string(view, pos)
+                value.append(element)
+        elif opcode == TYPE_HASH:
+            value = Hash()
+            count, _, pos = _read_length(view, pos)
+            for _ in range(count):
+                field, pos = _read_string(view, pos)
+                item, pos = _read_string(view, pos)
+                value.set(field, item)
+        elif opcode == TYPE_SET:
+            value = Set()
+            count, _, pos = _read_length(view, pos)
+            for _ in range(count):
+                member, pos = _read_string(view, pos)
+                value.add(member)
+        elif opcode == TYPE_ZSET:
+            count, _, pos = _read_length(view, pos)
+            pairs = []
+            for _ in range(count):
+                member, pos = _read_string(view, pos)
+                pairs.append((_DOUBLE.unpack_from(view, pos)[0], member))
+                pos += 8
+            value = ZSet.from_sorted(pairs)  # Saved in order: no sorting, no skiplist searches
+        elif opcode in (TYPE_HASH_LISTPACK, TYPE_SET_LISTPACK, TYPE_ZSET_LISTPACK):
+            count, _, pos = _read_length(view, pos)
+            blob, pos = _read_string(view, pos)
+            value = {TYPE_HASH_LISTPACK: Hash, TYPE_SET_LISTPACK: Set, TYPE_ZSET_LISTPACK: ZSet}[opcode].from_listpack(blob, count)
+        elif opcode == TYPE_SET_INTSET:
+            raw, pos = _read_string(view, pos)
+            value = Set.from_intset(raw)
+        else:
+            raise RdbError(f"unknown value type {opcode}")
+        store(key, value)
+        if when is not None:
+            db.set_expire(key, when)
+        keys += 1
+
+
+def _read_length(view, pos):  # Inverse of encode_length (also reports integer encodings)
+    """Return (length, is_int_encoding, new_pos)."""
+    first = view[pos]
+    kind = first >> 6
+    if kind == 0:
+        return first, False, pos + 1
+    if kind == 1:
+        return ((first & 0x3F) << 8) | view[pos + 1], False, pos + 2
+    if kind == 3:  # Integer-encoded string; the low bits say which width
+        return first & 0x3F, True, pos + 1
+    if first == 0x80:
+        return _UINT32_BE.unpack_from(view, pos + 1)[0], False, pos + 5
+    if first == 0x81:
+        return _UINT64_BE.unpack_from(view, pos + 1)[0], False, pos + 9
+    raise RdbError(f"bad length prefix {first:#x}")
+
+
+def _read_string(view, pos):  # Inverse of encode_string
+    """Return (bytes, new_pos)."""
+    length, is_int, pos = _read_length(view, pos)
+    if is_int:
+        if length > ENC_INT32:
+            raise RdbError(f"unknown string encoding {length}")
+        _, _, _, packer = _INT_ENCODINGS[length]
+        return b"%d" % packer.unpack_from(view, pos)[0], pos + packer.size
+    end = pos + length
+    return view[pos:end], end  # Slicing an mmap yields bytes: one copy, straight from the page cache
@@ -0,0 +1,508 @@
+"""Primary -> replica replication: a snapshot to start from, then the write-command stream.
+
+A replica connects to its primary like any client and sends
+"PSYNC <replication id> <offset>". The offset counts the bytes of the
+replication stream the replica has applied. If the primary still has
+everything after that offset in its backlog (a fixed-size ring holding
+the most recent repl-backlog-size bytes of the stream), and the id is
+its own, it answers +CONTINUE and sends the missing bytes: a replica that
+lost its connection for a moment catches up without a full copy.
+Otherwise it answers "+FULLRESYNC <id> <offset>", forks a child that
+writes a snapshot (the same format as BGSAVE), and once the child is done
+sends it as "$<length>\\r\\n<bytes>" followed by the commands executed
+since the fork. From then on every command that changed the dataset is
+streamed to the replica exactly as it is logged to the AOF.
+
+On the replica, a MasterLink owns the connection: it is polled by the
+front end's event loop like the client sockets, reconnects on its own,
+and acknowledges the applied offset once a second. Commands from the
+primary are executed through CommandCore.execute() by a pseudo-client;
+ordinary clients can read but get -READONLY for writes. The replica
+forwards the stream unchanged to replicas of its own, so its offsets are
+the primary's. Keys carry absolute expiry times in the stream
+(PEXPIREAT), so a replica expires them on its own clock.
+"""
+import errno  # Non-blocking connect
+import os  # fork, snapshot files
+import selectors  # Interest of the master link
+import socket  # Connection to the primary
+import time  # Reconnects, pings, acknowledgements
+
+import rdb  # Snapshot format of the full sync
+from resp import ProtocolError, RespParser, encode_command
+from storage import now_ms
+
+RECONNECT_INTERVAL = 1.0  # Seconds between attempts to reach the primary
+ACK_INTERVAL = 1.0  # Seconds between REPLCONF ACKs from a replica
+WAIT_BGSAVE_START = "wait_bgsave"  # Replica waits for a snapshot child to be started for it
+WAIT_BGSAVE_END = "send_bulk"  # Snapshot child running; the stream since its fork is buffered
+ONLINE = "online"  # Receiving the command stream
+
+
+def new_replid():  # 40 hex characters, as in Redis
+    return os.urandom(20).hex().encode()
+
+
+class ReplicationBacklog:  # Fixed-size ring of the latest stream bytes
+    """The last `size` bytes of the replication stream, addressed by stream offset."""
+
+    def __init__(self, size, offset=0):
+        self.buffer = bytearray(size)  # Allocated once; feed() overwrites the oldest bytes
+        self.size = size
+        self.offset = offset  # Stream offset just past the newest byte
+        self.histlen = 0  # Valid bytes in the ring
+
+    def feed(self, data):  # Append stream bytes
+        if len(data) >= self.size:  # Only the tail fits; stream offset x always lives at x % size
+            tail = data[-self.size:]
+            position = (self.offset + len(data)) % self.size
+            self.buffer[position:] = tail[:self.size - position]
+            self.buffer[:position] = tail[self.size - position:]
+        else:
+            position = self.offset % self.size
+            first = min(len(data), self.size - position)
+            self.buffer[position:position + first] = data[:first]
+            self.buffer[:len(data) - first] = data[first:]
+        self.offset += len(data)
+        self.histlen = min(self.size, self.histlen + len(data))
+
+    def first_offset(self):  # repl_backlog_first_byte_offset
+        return self.offset - self.histlen
+
+    def read_from(self, offset):  # PSYNC
+        """Return the stream bytes from offset to the end, or None if they are no longer (or not yet) held."""
+        if not self.first_offset() <= offset <= self.offset:
+            return None
+        start, count = offset % self.size, self.offset - offset
+        if start + count <= self.size:
+            return bytes(self.buffer[start:start + count])
+        return bytes(self.buffer[start:]) + bytes(self.buffer[:start + count - self.size])
+
+
+class Replica:  # The primary's view of one replica connection
+    """State of a connected replica: sync progress and acknowledged offset."""
+
+    __slots__ = ("client", "state", "pending", "ack_offset", "ack_time")
+
+    def __init__(self, client, state):
+        self.client = client  # Its commands.Client; client.send() carries the stream
+        self.state = state  # WAIT_BGSAVE_START, WAIT_BGSAVE_END or ONLINE
+        self.pending = None  # Stream fed while its snapshot is being written
+        self.ack_offset = 0  # Last REPLCONF ACK
+        self.ack_time = time.monotonic()
+
+
+class Replication:  # Owned by CommandCore
+    """Replication state of one server, as primary and (after REPLICAOF) as replica."""
+
+    def __init__(self, core):
+        self.core = core
+        self.replid = new_replid()  # Identifies the history of this dataset
+        self.replid2 = b"0" * 40  # Previous id, still accepted for PSYNC up to second_offset (after a promotion)
+        self.second_offset = -1
+        self.offset = 0  # master_repl_offset: bytes of stream produced (or applied, on a replica)
+        self.backlog = None  # Created when the first replica attaches; propagate() skips replication until then
+        self.replicas = []  # Replica objects, in connection order
+        self.child = None  # PID of the snapshot child of a full sync
+        self.child_path = None  # Snapshot it writes
+        self.link = None  # MasterLink while this server is a replica
+        self.link_supported = False  # Set by front ends that poll link.sock
+        self.forget_socket = None  # Set by such a front end: forget_socket(sock) runs before the link closes sock
+        self.last_ping = time.monotonic()  # Pings keep the replicas' timeouts from firing on an idle primary
+        self.sync_full = 0  # INFO stats
+        self.sync_partial_ok = 0
+        self.sync_partial_err = 0
+
+    # Primary side
+
+    def feed(self, commands):  # From CommandCore.propagate()
+        """Append commands (lists of bytes) to the stream."""
+        self.stream(b"".join([encode_command(*args) for args in commands]))
+
+    def stream(self, data):  # Commands already encoded (or relayed from our own primary)
+        """Append encoded stream bytes to the backlog and send them to the replicas."""
+        self.backlog.feed(data)
+        self.offset += len(data)
+        for replica in self.replicas:
+            if replica.state == ONLINE:
+                replica.client.send(data)
+            elif replica.state == WAIT_BGSAVE_END:  # Sent right after its snapshot
+                replica.pending += data
+
+    def psync(self, client, replid, offset):  # PSYNC
+        """Continue the stream for client from offset, or start a full sync; return the reply (None: sent later)."""
+        if self.backlog is None:
+            self.backlog = ReplicationBacklog(self.core.config["repl-backlog-size"], self.offset)
+        if replid == self.replid or (replid == self.replid2 and offset <= self.second_offset):
+            missing = self.backlog.read_from(offset)
+            if missing is not None:
+                client.replica = Replica(client, ONLINE)
+                self.replicas.append(client.replica)
+                self.sync_partial_ok += 1
+                return b"+CONTINUE %s\r\n" % self.replid + missing
+        if replid != b"?":  # It asked for a partial resync we cannot serve
+            self.sync_partial_err += 1
+        self.sync_full += 1
+        client.replica = Replica(client, WAIT_BGSAVE_START)
+        self.replicas.append(client.replica)
+        self.start_sync()
+        return None  # +FULLRESYNC goes out when the snapshot child starts
+
+    def start_sync(self):  # Now, or from the cron once no other child runs
+        """Fork a snapshot child for the replicas waiting for one."""
+        waiting = [replica for replica in self.replicas if replica.state == WAIT_BGSAVE_START]
+        if not waiting or self.core.child_running():
+            return
+        core = self.core
+        self.child_path = os.path.join(core.config["dir"], f"temp-repl-{os.getpid()}.rdb")
+        for replica in waiting:  # The snapshot is of the dataset at this offset
+            replica.state = WAIT_BGSAVE_END
+            replica.pending = bytearray()
+            replica.client.send(b"+FULLRESYNC %s %d\r\n" % (self.replid, self.offset))
+        if not hasattr(os, "fork"):  # No copy-on-write snapshot available: save in place
+            rdb.save(self.child_path, core.db.data, core.db.expires, now_ms())
+            self.finish_sync(True)
+            return
+        pid = os.fork()
+        if pid == 0:  # Child: the dataset is frozen as of the fork
+            status = 1
+            try:
+                rdb.save(self.child_path, core.db.data, core.db.expires, now_ms())
+                status = 0
+            finally:
+                os._exit(status)
+        self.child = pid
+
+    def finish_sync(self, ok):  # The snapshot child exited
+        """Send the snapshot and the stream buffered since the fork to the replicas that waited for it."""
+        snapshot = None
+        if ok:
+            with open(self.child_path, "rb") as handle:
+                snapshot = handle.read()
+        for replica in [replica for replica in self.replicas if replica.state == WAIT_BGSAVE_END]:
+            if snapshot is None:  # The replica drops the connection and retries
+                replica.client.send(b"-ERR snapshot for replication failed\r\n")
+                self.remove(replica.client)
+                continue
+            payload = b"$%d\r\n" % len(snapshot) + snapshot
+            replica.client.output_allowance = len(payload)  # The replica output limits apply to the stream, not to the snapshot
+            replica.client.send(payload)  # The front end streams it out as the socket allows
+            replica.client.send(bytes(replica.pending))
+            replica.pending = None
+            replica.state = ONLINE
+        if os.path.exists(self.child_path):
+            os.remove(self.child_path)
+        self.child_path = None
+
+    def remove(self, client):  # The replica's connection closed
+        self.replicas.remove(client.replica)
+        client.replica = None
+
+    def drop_replicas(self):  # Our dataset was replaced: their copies are stale
+        """Make every replica reconnect (they fall back to a full sync since the id changed)."""
+        for replica in list(self.replicas):
+            replica.client.send(b"-ERR primary dataset replaced, resync required\r\n")
+            self.remove(replica.client)
+
+    def ack(self, client, offset):  # REPLCONF ACK
+        client.replica.ack_offset = offset
+        client.replica.ack_time = time.monotonic()
+
+    def cron(self):  # From CommandCore.cron
+        """Reap the snapshot child, start a pending one, ping the replicas, run the master link."""
+        if self.child is not None:
+            pid, status = os.waitpid(self.child, os.WNOHANG)
+            if pid != 0:
+                self.child = None
+                self.finish_sync(os.waitstatus_to_exitcode(status) == 0)
+        if self.child is None:
+            self.start_sync()
+        now = time.monotonic()
+        if self.replicas and self.link is None and now - self.last_ping >= self.core.config["repl-ping-replica-period"]:
+            self.last_ping = now
+            self.feed([[b"PING"]])
+        if self.link is not None:
+            self.link.cron(now)
+
+    # Replica side
+
+    def replicate(self, host, port):  # REPLICAOF host port
+        """Become a replica of host:port; return False if already replicating from it."""
+        if self.link is not None:
+            if (self.link.host, self.link.port) == (host, port):
+                return False
+            self.link.close()
+        self.link = MasterLink(self, host, port)
+        self.core.read_only = self.core.config["replica-read-only"]
+        return True
+
+    def promote(self):  # REPLICAOF NO ONE
+        """Stop replicating and accept writes; replicas of ours may continue under the old id."""
+        if self.link is None:
+            return
+        self.link.close()
+        self.link = None
+        self.core.read_only = False
+        self.replid2, self.second_offset = self.replid, self.offset
+        self.replid = new_replid()
+
+    def load_snapshot(self, path, replid, offset):  # End of a full sync
+        """Replace the dataset with the snapshot at path and adopt the primary's id and offset."""
+        core = self.core
+        core.db.clear()
+        core.evictor.pool = []  # Keys of the old dataset
+        keys = rdb.load(path, core.db)
+        os.replace(path, core.rdb_path)  # Kept as our own snapshot, as after a SAVE
+        for key in list(core.watched_keys):  # Every watched key may have changed
+            core.touch_key(key)
+        self.drop_replicas()
+        self.replid, self.offset = replid, offset
+        self.replid2, self.second_offset = b"0" * 40, -1
+        self.backlog = ReplicationBacklog(core.config["repl-backlog-size"], offset)
+        if core.aof is not None and not core.child_running():  # The log describes the old dataset
+            core.aof.start_rewrite(core.dataset_commands)
+        return keys
+
+    def info(self):  # INFO replication
+        """Return the fields of the replication section."""
+        now = time.monotonic()
+        link = self.link
+        fields = [("role", "slave" if link is not None else "master")]
+        if link is not None:
+            fields += [
+                ("master_host", link.host),
+                ("master_port", link.port),
+                ("master_link_status", "up" if link.state == MasterLink.CONNECTED else "down"),
+                ("master_last_io_seconds_ago", int(now - link.last_io) if link.last_io else -1),
+                ("master_sync_in_progress", int(link.state == MasterLink.TRANSFER)),
+                ("slave_repl_offset", self.offset),
+                ("slave_read_only", int(self.core.read_only)),
+            ]
+        fields.append(("connected_slaves", len(self.replicas)))
+        for index, replica in enumerate(self.replicas):
+            address = replica.client.address
+            host = address[0] if isinstance(address, tuple) else address
+            fields.append((f"slave{index}", f"ip={host},port={replica.client.replica_port},state={replica.state},"
+                                            f"offset={replica.ack_offset},lag={int(now - replica.ack_time)}"))
+        backlog = self.backlog
+        fields += [
+            ("master_replid", self.replid.decode()),
+            ("master_replid2", self.replid2.decode()),
+            ("master_repl_offset", self.offset),
+            ("second_repl_offset", self.second_offset),
+            ("repl_backlog_active", int(backlog is not None)),
+            ("repl_backlog_size", backlog.size if backlog is not None else self.core.config["repl-backlog-size"]),
+            ("repl_backlog_first_byte_offset", backlog.first_offset() if backlog is not None else 0),
+            ("repl_backlog_histlen", backlog.histlen if backlog is not None else 0),
+        ]
+        return fields
+
+
+class MasterLink:  # A replica's connection to its primary
+    """Connects, handshakes, receives the snapshot and applies the stream; reconnects on failure."""
+
+    CONNECT = "connect"  # Waiting for the next attempt
+    CONNECTING = "connecting"  # Non-blocking connect in progress
+    HANDSHAKE = "handshake"  # PSYNC sent, waiting for +FULLRESYNC / +CONTINUE
+    TRANSFER = "transfer"  # Receiving the snapshot
+    CONNECTED = "connected"  # Applying the stream
+
+    def __init__(self, replication, host, port):
+        from commands import Client  # commands imports this module
+        self.replication = replication
+        self.host = host
+        self.port = port
+        self.client = Client((host, port))  # Pseudo-client the stream runs as; exempt from -READONLY
+        self.state = self.CONNECT
+        self.sock = None  # Polled by the front end while not None
+        self.next_attempt = 0.0  # time.monotonic() of the next connect
+        self.last_io = 0.0  # Last data from the primary
+        self.last_ack = 0.0
+        self.outbuffer = bytearray()  # Handshake and ACKs
+        self.inbuffer = bytearray()  # Handshake lines and the snapshot header
+        self.parser = RespParser()  # The stream
+        self.unapplied = bytearray()  # Stream bytes received but not part of an executed command yet
+        self.sync_replid = None  # From +FULLRESYNC
+        self.sync_offset = 0
+        self.transfer_left = None  # Snapshot bytes still to receive (None: header not read yet)
+        self.transfer_file = None
+        self.transfer_path = None
+
+    def events(self):  # For the front end's selector
+        return selectors.EVENT_WRITE if self.state == self.CONNECTING or self.outbuffer else selectors.EVENT_READ
+
+    def cron(self, now):  # From Replication.cron
+        """Connect when due, acknowledge the offset, and give up on a silent primary."""
+        if self.state == self.CONNECT:
+            if now >= self.next_attempt:
+                self.connect()
+            return
+        if self.state != self.CONNECTING and now - self.last_io > self.replication.core.config["repl-timeout"]:
+            self.fail("timeout talking to the primary")
+        elif self.state == self.CONNECTED and now - self.last_ack >= ACK_INTERVAL:
+            self.last_ack = now
+            self.send(encode_command(b"REPLCONF", b"ACK", b"%d" % self.replication.offset))
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setblocking(False)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        error = self.sock.connect_ex((self.host, self.port))
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.fail(f"cannot connect to {self.host}:{self.port}: {os.strerror(error)}")
+            return
+        self.state = self.CONNECTING
+        self.last_io = time.monotonic()
+
+    def handle(self, mask):  # The front end saw the socket ready
+        """Finish the connect, write pending output, or process what the primary sent."""
+        if self.state == self.CONNECTING:
+            error = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error:
+                self.fail(f"cannot connect to {self.host}:{self.port}: {os.strerror(error)}")
+                return
+            self.state = self.HANDSHAKE
+            replication = self.replication
+            known = replication.backlog is not None  # A history we could continue from (we synced, or had replicas)
+            port = replication.core.metrics.server.get("tcp_port", 0)
+            self.send(encode_command(b"REPLCONF", b"listening-port", b"%d" % port)
+                      + encode_command(b"PSYNC", replication.replid if known else b"?", b"%d" % (replication.offset if known else -1)))
+            return
+        if mask & selectors.EVENT_WRITE:
+            self.flush()
+        if mask & selectors.EVENT_READ and self.sock is not None:
+            try:
+                data = self.sock.recv(262144)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                self.fail(f"connection lost: {e}")
+                return
+            if not data:
+                self.fail("connection closed by the primary")
+                return
+            self.last_io = time.monotonic()
+            self.receive(data)
+
+    def send(self, data):
+        self.outbuffer += data
+        self.flush()
+
+    def flush(self):
+        try:
+            sent = self.sock.send(self.outbuffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self.fail(f"connection lost: {e}")
+            return
+        del self.outbuffer[:sent]
+
+    def receive(self, data):  # Bytes from the primary, in whatever state the sync is
+        if self.state == self.HANDSHAKE:
+            self.inbuffer += data
+            while self.state == self.HANDSHAKE:
+                newline = self.inbuffer.find(b"\r\n")
+                if newline == -1:
+                    return
+                line = bytes(self.inbuffer[:newline])
+                del self.inbuffer[:newline + 2]
+                if line.startswith(b"+FULLRESYNC "):
+                    _, replid, offset = line.split()
+                    self.sync_replid, self.sync_offset = replid, int(offset)
+                    self.state = self.TRANSFER
+                elif line.startswith(b"+CONTINUE"):
+                    replid = line.split()[1] if len(line.split()) > 1 else self.replication.replid
+                    self.replication.replid = replid  # The primary may have been promoted meanwhile
+                    self.state = self.CONNECTED
+                    print(f"Replication: partial resync with {self.host}:{self.port} from offset {self.replication.offset}")
+                elif line.startswith(b"-"):
+                    self.fail(f"primary refused PSYNC: {line[1:].decode(errors='replace')}")
+                    return
+                # Anything else is the +OK of REPLCONF
+            data, self.inbuffer = bytes(self.inbuffer), bytearray()
+        if self.state == self.TRANSFER:
+            data = self.receive_snapshot(data)
+        if self.state == self.CONNECTED and data:
+            self.apply(data)
+
+    def receive_snapshot(self, data):  # Returns the bytes that follow the snapshot
+        if self.transfer_left is None:
+            self.inbuffer += data
+            newline = self.inbuffer.find(b"\r\n")
+            if newline == -1:
+                return b""
+            header = bytes(self.inbuffer[:newline])
+            if not header.startswith(b"$"):
+                self.fail(f"bad snapshot header {header[:64]!r}")
+                return b""
+            self.transfer_left = int(header[1:])
+            data, self.inbuffer = bytes(self.inbuffer[newline + 2:]), bytearray()
+            self.transfer_path = os.path.join(self.replication.core.config["dir"], f"temp-replica-{os.getpid()}.rdb")
+            self.transfer_file = open(self.transfer_path, "wb")
+        chunk = data[:self.transfer_left]
+        self.transfer_file.write(chunk)  # Streamed to disk as it arrives
+        self.transfer_left -= len(chunk)
+        if self.transfer_left:
+            return b""
+        self.transfer_file.close()
+        self.transfer_file = None
+        start = time.perf_counter()
+        try:
+            keys = self.replication.load_snapshot(self.transfer_path, self.sync_replid, self.sync_offset)
+        except (rdb.RdbError, OSError) as e:
+            self.fail(f"cannot load the snapshot: {e}")
+            return b""
+        print(f"Replication: full resync with {self.host}:{self.port}, loaded {keys} keys in {time.perf_counter() - start:.3f}s")
+        self.transfer_path = None
+        self.transfer_left = None
+        self.state = self.CONNECTED
+        return data[len(chunk):]
+
+    def apply(self, data):  # The command stream
+        """Execute every complete command and pass the executed bytes on to our backlog and replicas."""
+        self.unapplied += data
+        parser = self.parser
+        parser.feed(data)
+        core = self.replication.core
+        try:
+            while True:
+                args = parser.next_command()
+                if args is None:
+                    break
+                if args[0][:1] == b"-":  # An error line instead of a command: the primary wants a resync
+                    self.fail(f"primary sent {b' '.join(args).decode(errors='replace')}")
+                    return
+                core.execute(self.client, args)  # Replies go nowhere
+        except ProtocolError as e:
+            self.fail(f"protocol error in the stream: {e}")
+            return
+        applied = len(self.unapplied) - parser.pending()
+        if applied:
+            replication = self.replication
+            replication.stream(bytes(self.unapplied[:applied]))  # Advances our offset; relayed to our own replicas
+            del self.unapplied[:applied]
+
+    def fail(self, reason):  # Any error: start over after RECONNECT_INTERVAL
+        print(f"Replication: {reason}; reconnecting")
+        self.close()
+        self.state = self.CONNECT
+        self.next_attempt = time.monotonic() + RECONNECT_INTERVAL
+
+    def close(self):  # Also used by REPLICAOF NO ONE / another REPLICAOF
+        if self.sock is not None:
+            if self.replication.forget_socket is not None:  # Unregister while the fd is still ours
+                self.replication.forget_socket(self.sock)
+            self.sock.close()
+            self.sock = None
+        if self.transfer_file is not None:
+            self.transfer_file.close()
+            os.remove(self.transfer_path)
+            self.transfer_file = self.transfer_path = None
+        self.transfer_left = None
+        self.outbuffer.clear()
+        self.inbuffer.clear()
+        self.unapplied.clear()
+        self.parser = RespParser()
+        self.replication.core.client_closed(self.client)
+        self.client = type(self.client)((self.host, self.port))  # A MULTI cut short must not leak into the next stream
@@ -0,0 +1,377 @@
+"""Incremental, binary-safe RESP2 request parser, reply encoders and the client-side reply parser."""
+
+
+class ProtocolError(Exception):  # Raised when a client sends bytes that are not valid RESP
+    """Malformed request from a client."""
+
+
+class RespParser:  # Parses pipelined requests out of a growing bytearray
+    """Incremental RESP2 parser with a read cursor.
+
+    Data from recv() is appended with feed(); next_command() returns one
+    argument list (a list of bytes) per call, or None when the buffer holds
+    no complete command yet. A partially received array keeps its state
+    (arguments read so far, pending bulk length), so resuming after the
+    next recv() never re-scans bytes that were already parsed.
+    Inline commands ("PING\\r\\n", "SET key value\\n") are accepted too.
+    """
+
+    def __init__(self, max_inline_len=64 * 1024, max_bulk_len=512 * 1024 * 1024, max_multibulk_len=1024 * 1024):
+        self.buffer = bytearray()  # Received bytes that have not been discarded yet
+        self.pos = 0  # Read cursor: everything before it has been consumed
+        self.scan_from = 0  # Where the next CRLF search starts, so partial lines are not re-scanned
+        self.max_inline_len = max_inline_len  # Longest inline command / header line accepted
+        self.max_bulk_len = max_bulk_len  # Largest bulk string accepted
+        self.max_multibulk_len = max_multibulk_len  # Most arguments accepted in one command
+
+        # State of the array currently being parsed (kept across recv boundaries)
+        self.multibulk_len = 0  # Arguments still expected for the current array (0 = between commands)
+        self.bulk_len = -1  # Length of the bulk string being waited for (-1 = need its "$" header)
+        self.args = []  # Arguments of the current array parsed so far
+        self.command_start = 0  # Buffer offset where the current array began
+
+    def feed(self, data):  # Append freshly received bytes
+        """Append data received from the socket."""
+        self.buffer += data  # Amortized O(len(data)) append
+
+    def pending(self):  # Number of bytes that do not form a complete command yet
+        """Return how many received bytes are not part of a complete command."""
+        return len(self.buffer) - (self.command_start if self.multibulk_len else self.pos)
+
+    def next_command(self):  # Parse the next complete command
+        """Return the next complete command as a list of bytes, or None."""
+        buffer = self.buffer  # Local alias for speed
+        if self.multibulk_len == 0:  # Between commands: look at the type byte
+            while self.pos < len(buffer):  # Skip blank inline lines
+                if buffer[self.pos] == 0x2A:  # '*': a RESP array of bulk strings
+                    newline = buffer.find(b"\r\n", max(self.pos, self.scan_from))  # End of the "*<count>" header
+                    if newline == -1:  # Header not complete yet
+                        if len(buffer) - self.pos > self.max_inline_len:  # No valid header is this long
+                            raise ProtocolError("invalid multibulk length")
+                        self.scan_from = len(buffer) - 1  # A '\r' at the very end may pair with the next '\n'
+                        return None
+                    count = self._parse_int(buffer[self.pos + 1:newline], "invalid multibulk length")  # Number of arguments
+                    self.command_start = self.pos  # Remember where this command began
+                    self.pos = newline + 2  # Consume the header
+                    if count > self.max_multibulk_len:  # Refuse absurd argument counts
+                        raise ProtocolError("invalid multibulk length")
+                    if count <= 0:  # "*0" / "*-1": nothing to execute
+                        continue
+                    self.multibulk_len = count  # Arguments still to read
+                    self.args = []  # Start a fresh argument list
+                    self.bulk_len = -1  # Next thing to read is a "$" header
+                    break
+
+                args = self._read_inline()  # Anything else is an inline command
+                if args is None:  # Line not complete yet
+                    return None
+                if args:  # Ignore empty lines
+                    self._compact()  # Reclaim consumed bytes
+                    return args
+            else:
+                self._compact()  # The buffer is fully consumed
+                return None
+
+        pos = self.pos  # Local cursor for the hot loop; written back before returning
+        size = len(buffer)  # Bytes available
+        args = self.args  # Arguments collected so far
+        append = args.append  # Bound method, looked up once
+        remaining = self.multibulk_len  # Arguments still expected
+        bulk_len = self.bulk_len  # Pending payload length, or -1
+        try:
+            while remaining:  # Read the remaining bulk strings of the array
+                if bulk_len == -1:  # Need the "$<len>" header first
+                    if pos >= size:  # No bytes yet
+                        return None
+                    if buffer[pos] != 0x24:  # Must start with '$'
+                        raise ProtocolError(f"expected '$', got '{chr(buffer[pos])}'")
+                    scan_from = self.scan_from  # Skip bytes searched by an earlier call
+                    newline = buffer.find(b"\r\n", pos if pos > scan_from else scan_from)  # End of the header
+                    if newline == -1:  # Header not complete yet
+                        if size - pos > self.max_inline_len:  # No valid header is this long
+                            raise ProtocolError("invalid bulk length")
+                        self.scan_from = size - 1  # A '\r' at the very end may pair with the next '\n'
+                        return None
+                    try:
+                        bulk_len = int(buffer[pos + 1:newline])  # Payload length
+                    except ValueError:
+                        raise ProtocolError("invalid bulk length") from None
+                    if bulk_len < 0 or bulk_len > self.max_bulk_len:  # Reject negative or oversized bulks
+                        raise ProtocolError("invalid bulk length")
+                    pos = newline + 2  # Consume the header
+
+                end = pos + bulk_len  # Payload end (CRLF follows)
+                if size < end + 2:  # Payload or trailing CRLF not received yet
+                    return None
+                if bulk_len < 32768:  # Small values: slicing is cheaper than setting up a view
+                    append(bytes(buffer[pos:end]))
+                else:  # Large values: slice a view so the payload is copied exactly once
+                    with memoryview(buffer) as view:
+                        append(bytes(view[pos:end]))
+                pos = end + 2  # Skip payload and CRLF
+                bulk_len = -1  # Next argument needs its header
+                remaining -= 1  # One argument fewer to go
+        finally:
+            self.pos = pos  # Persist the parser state so the next call resumes here
+            self.multibulk_len = remaining
+            self.bulk_len = bulk_len
+
+        self.args = []  # Reset state for the next command; args holds the finished command
+        self._compact()  # Reclaim consumed bytes
+        return args
+
+    def _read_line(self):  # Read one CRLF-terminated line starting at the cursor
+        """Return the line at the cursor without its terminator, or None if incomplete."""
+        buffer = self.buffer  # Local alias for speed
+        newline = buffer.find(b"\n", max(self.pos, self.scan_from))  # Only scan bytes not searched before
+        if newline == -1:  # No terminator yet
+            if len(buffer) - self.pos > self.max_inline_len:  # A line this long is not a valid request
+                raise ProtocolError("too big inline request")
+            self.scan_from = len(buffer)  # Resume the search here after the next feed()
+            return None
+        end = newline - 1 if newline > self.pos and buffer[newline - 1] == 0x0D else newline  # Strip an optional '\r'
+        line = bytes(buffer[self.pos:end])  # Header lines are short; copy them out
+        self.pos = newline + 1  # Consume the line and its terminator
+        self.scan_from = self.pos  # Nothing past the cursor has been scanned
+        return line
+
+    def _read_inline(self):  # Parse a telnet-style command line
+        """Return the whitespace-separated arguments of an inline command, or None if incomplete."""
+        line = self._read_line()  # The whole command line
+        if line is None:  # Line not complete yet
+            return None
+        if b'"' not in line and b"'" not in line:  # Fast path: plain whitespace-separated words
+            return line.split()
+        return split_inline(line)  # Quoted arguments may contain spaces
+
+    def _compact(self):  # Drop consumed bytes from the front of the buffer
+        """Discard consumed bytes once they make up a large part of the buffer."""
+        if self.pos == len(self.buffer):  # Everything consumed: cheap reset
+            self.buffer.clear()  # Keep the same bytearray object
+        elif self.pos > 65536 and self.pos * 2 > len(self.buffer):  # Amortize the memmove over many commands
+            del self.buffer[:self.pos]  # Shift the unconsumed tail to the front
+        else:
+            return
+        self.scan_from -= self.pos  # Keep the scan position relative to the new start
+        self.pos = 0  # The cursor is now at the start of the buffer
+
+    @staticmethod
+    def _parse_int(raw, message):  # Parse a RESP length field
+        """Parse a decimal length field, raising ProtocolError on garbage."""
+        try:
+            return int(raw)  # int() accepts bytes holding ASCII digits
+        except ValueError:
+            raise ProtocolError(message) from None
+
+
+class ResponseError(Exception):  # Returned by ReplyParser for "-..." replies
+    """Error reply received from the server; the message is the text after the "-"."""
+
+
+NOT_READY = object()  # ReplyParser.get(): no complete reply buffered yet
+
+
+class ReplyParser:  # Client side: parses the replies a server sends
+    """Incremental RESP2 reply parser over a reusable bytearray.
+
+    feed() appends received bytes; get() returns the next complete reply
+    (bytes, int, None, a list, or a ResponseError instance) or NOT_READY.
+    Arrays keep their partial state on a stack, and a bulk string whose
+    body has not arrived yet costs one header parse per attempt, so
+    replies of any size are parsed in one pass however they are split
+    across reads.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()  # Received bytes not consumed yet
+        self.pos = 0  # Read cursor
+        self.stack = []  # [items so far, items still missing] of the arrays being filled, outermost first
+
+    def feed(self, data):  # Append freshly received bytes
+        if self.pos == len(self.buffer):  # Everything consumed: reuse the same bytearray from its start
+            self.buffer.clear()
+            self.pos = 0
+        elif self.pos > 65536 and self.pos * 2 > len(self.buffer):  # Amortize the memmove over many replies
+            del self.buffer[:self.pos]
+            self.pos = 0
+        self.buffer += data
+
+    def reset(self):  # After a connection error: partial state is meaningless
+        self.buffer.clear()
+        self.pos = 0
+        self.stack = []
+
+    def get(self):  # Parse the next reply
+        """Return the next complete reply, or NOT_READY if more bytes are needed."""
+        buffer = self.buffer
+        stack = self.stack
+        while True:
+            pos = self.pos
+            end = buffer.find(b"\r\n", pos)
+            if end < 0:
+                return NOT_READY
+            kind = buffer[pos]
+            if kind == 0x24:  # "$": bulk string
+                length = int(buffer[pos + 1:end])
+                if length < 0:
+                    value = None
+                    self.pos = end + 2
+                else:
+                    if len(buffer) < end + 4 + length:  # Body incomplete: the header is parsed again next time
+                        return NOT_READY
+                    value = bytes(buffer[end + 2:end + 2 + length])
+                    self.pos = end + 4 + length
+            elif kind == 0x2A:  # "*": array
+                count = int(buffer[pos + 1:end])
+                self.pos = end + 2
+                if count > 0:  # Its items follow
+                    stack.append([[], count])
+                    continue
+                value = [] if count == 0 else None
+            elif kind == 0x3A:  # ":"
+                value = int(buffer[pos + 1:end])
+                self.pos = end + 2
+            elif kind == 0x2B:  # "+": status, returned as bytes
+                value = bytes(buffer[pos + 1:end])
+                self.pos = end + 2
+            elif kind == 0x2D:  # "-"
+                value = ResponseError(buffer[pos + 1:end].decode(errors="replace"))
+                self.pos = end + 2
+            else:
+                raise ProtocolError(f"unexpected reply type byte {kind!r}")
+            while stack:  # Attach to the innermost open array, closing the ones it completes
+                top = stack[-1]
+                top[0].append(value)
+                top[1] -= 1
+                if top[1]:
+                    break
+                value = stack.pop()[0]
+            else:
+                return value
+
+
+INLINE_ESCAPES = {ord("n"): b"\n", ord("r"): b"\r", ord("t"): b"\t", ord("b"): b"\b", ord("a"): b"\a"}  # Escapes inside "..."
+
+
+def split_inline(line):  # Like redis-cli's argument splitting
+    """Split an inline command line, honouring "double" (with escapes) and 'single' quotes."""
+    args = []  # Finished arguments
+    i, size = 0, len(line)
+    while True:
+        while i < size and line[i] in b" \t":  # Skip blanks between arguments
+            i += 1
+        if i >= size:
+            return args
+        current = bytearray()  # The argument being built
+        quote = None  # The open quote character, if any
+        while i < size:
+            char = line[i]
+            if quote == 0x22:  # Inside "double quotes"
+                if char == 0x5C and i + 1 < size:  # Backslash escape
+                    i += 1
+                    escaped = line[i]
+                    if escaped == 0x78 and i + 2 < size:  # \xHH
+                        try:
+                            current.append(int(line[i + 1:i + 3], 16))
+                            i += 2
+                        except ValueError:
+                            current.append(escaped)
+                    else:
+                        current += INLINE_ESCAPES.get(escaped, bytes([escaped]))
+                elif char == 0x22:  # Closing quote must end the argument
+                    if i + 1 < size and line[i + 1] not in b" \t":
+                        raise ProtocolError("unbalanced quotes in request")
+                    quote = None
+                    i += 1
+                    break
+                else:
+                    current.append(char)
+            elif quote == 0x27:  # Inside 'single quotes': only \' is an escape
+                if char == 0x5C and i + 1 < size and line[i + 1] == 0x27:
+                    i += 1
+                    current.append(0x27)
+                elif char == 0x27:  # Closing quote must end the argument
+                    if i + 1 < size and line[i + 1] not in b" \t":
+                        raise ProtocolError("unbalanced quotes in request")
+                    quote = None
+                    i += 1
+                    break
+                else:
+                    current.append(char)
+            elif char in b" \t":  # Unquoted blank ends the argument
+                break
+            elif char in b"\"'" and not current:  # Opening quote at the start of an argument
+                quote = char
+            else:
+                current.append(char)
+            i += 1
+        if quote is not None:  # Line ended inside quotes
+            raise ProtocolError("unbalanced quotes in request")
+        args.append(bytes(current))
+
+
+# Reply encoders: commands build replies directly as bytes
+
+OK = b"+OK\r\n"  # The most common reply, preallocated
+PONG = b"+PONG\r\n"  # Reply to PING
+NULL_BULK = b"$-1\r\n"  # Nil bulk string (missing key)
+NULL_ARRAY = b"*-1\r\n"  # Nil array
+
+
+def encode_simple(text):  # "+<text>\r\n"
+    """Encode a simple string reply."""
+    return b"+" + (text.encode() if isinstance(text, str) else text) + b"\r\n"
+
+
+def encode_error(text):  # "-<text>\r\n"
+    """Encode an error reply."""
+    return b"-" + (text.encode() if isinstance(text, str) else text) + b"\r\n"
+
+
+def encode_integer(number):  # ":<n>\r\n"
+    """Encode an integer reply."""
+    return b":%d\r\n" % number
+
+
+SHARED_HEADERS = 1024  # Bulk/array headers for lengths below this are preallocated
+BULK_HEADERS = [b"$%d\r\n" % n for n in range(SHARED_HEADERS)]  # "$<len>\r\n" prefixes, built once
+ARRAY_HEADERS = [b"*%d\r\n" % n for n in range(SHARED_HEADERS)]  # "*<n>\r\n" prefixes, built once
+
+
+def encode_bulk(value):  # "$<len>\r\n<bytes>\r\n", or nil for None
+    """Encode a bulk string reply (None encodes as nil)."""
+    if value is None:  # Missing value
+        return NULL_BULK
+    if isinstance(value, str):  # Accept text for convenience
+        value = value.encode()
+    length = len(value)  # Payload size
+    if length < SHARED_HEADERS:  # Common case: reuse the preallocated prefix
+        return BULK_HEADERS[length] + value + b"\r\n"
+    return b"$%d\r\n%b\r\n" % (length, value)
+
+
+def encode_array(items):  # "*<n>\r\n" followed by each item as a bulk string
+    """Encode a list of bytes/str/None values as an array of bulk strings."""
+    if items is None:  # Nil array
+        return NULL_ARRAY
+    count = len(items)  # Number of elements
+    header = ARRAY_HEADERS[count] if count < SHARED_HEADERS else b"*%d\r\n" % count  # Shared prefix when possible
+    return header + b"".join([encode_bulk(item) for item in items])
+
+
+def encode_value(value):  # Nested replies (COMMAND INFO, and later collection types)
+    """Encode ints as integers, bytes/str as bulk strings, None as nil and lists as (nested) arrays."""
+    if value is None:  # Nil
+        return NULL_BULK
+    if isinstance(value, int):  # Integer reply (bool is an int too)
+        return encode_integer(value)
+    if isinstance(value, (bytes, bytearray, str)):  # Bulk string
+        return encode_bulk(value)
+    count = len(value)  # Any other sequence becomes an array
+    header = ARRAY_HEADERS[count] if count < SHARED_HEADERS else b"*%d\r\n" % count  # Shared prefix when possible
+    return header + b"".join([encode_value(item) for item in value])
+
+
+def encode_command(*args):  # Build a request the way clients do
+    """Encode a command as a RESP array of bulk strings."""
+    return encode_array([arg if isinstance(arg, (bytes, bytearray)) else str(arg).encode() for arg in args])
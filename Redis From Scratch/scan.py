@@ -0,0 +1,64 @@
+"""Cursor iteration for SCAN, HSCAN, SSCAN and ZSCAN.
+
+A dict cannot be iterated across calls: it raises "changed size during
+iteration", and positions in its insertion order shift when earlier
+entries are deleted. SCAN therefore walks a list in which every element
+keeps a fixed position while it exists. A deleted element leaves a hole,
+which the next insert reuses, and the list only ever grows, so a resize
+never moves anything. The cursor is the next position to visit: an
+element present for the whole scan is returned at least once, one that
+is added or removed during the scan may or may not be.
+
+The keyspace already keeps such a list (Keyspace.slots). A hashtable-
+encoded hash, set or sorted set gets a ScanIndex the first time it is
+scanned and keeps it up to date from then on; small encodings are
+returned whole in one call with cursor 0, as Redis does.
+"""
+import sys  # Memory accounting
+
+EMPTY_VISITS = 10  # A call visits at most COUNT * EMPTY_VISITS positions, holes included
+
+
+def scan_slots(slots, cursor, count):  # One SCAN call
+    """Return (next cursor, elements) for up to count elements from position cursor on; the cursor is 0 at the end."""
+    found = []
+    position = cursor
+    end = min(len(slots), cursor + count * EMPTY_VISITS)  # Bounded work even over long runs of holes
+    while position < end and len(found) < count:
+        window = slots[position:min(end, position + count - len(found))]  # Copied in C
+        position += len(window)
+        found += [element for element in window if element is not None]
+    return (position if position < len(slots) else 0), found
+
+
+class ScanIndex:  # Stable positions for the members of one large collection
+    """Member -> fixed position, with holes reused like Keyspace.slots."""
+
+    __slots__ = ("slots", "positions", "free_slots")
+
+    def __init__(self, members):  # O(n) once, on the first scan of the value
+        self.slots = list(members)  # Member at its position, or None for a free position
+        self.positions = dict(zip(self.slots, range(len(self.slots))))  # Member -> position
+        self.free_slots = []  # Holes, reused by the next add()
+
+    def add(self, member):  # The collection gained member
+        if self.free_slots:
+            position = self.free_slots.pop()
+            self.slots[position] = member
+        else:
+            position = len(self.slots)
+            self.slots.append(member)
+        self.positions[member] = position
+
+    def discard(self, member):  # The collection lost member
+        position = self.positions.pop(member)
+        self.slots[position] = None  # Other members keep their positions
+        self.free_slots.append(position)
+
+    def scan(self, cursor, count):  # HSCAN / SSCAN / ZSCAN
+        """Return (next cursor, members), as scan_slots()."""
+        return scan_slots(self.slots, cursor, count)
+
+    def memory_usage(self):  # Added to the owning value's accounted size
+        """Return the approximate memory used by the index."""
+        return sys.getsizeof(self.slots) + sys.getsizeof(self.positions) + sys.getsizeof(self.free_slots)
@@ -0,0 +1,267 @@
+"""Server-side scripts (EVAL/EVALSHA) in a restricted Python dialect.
+
+Embedding Lua would need a C extension, so scripts are written in a
+small subset of Python instead: assignments, if/for/while, return,
+arithmetic and comparisons, lists/dicts/comprehensions, a handful of
+builtins and whitelisted methods of the values scripts handle (bytes,
+str, list, dict). There are no imports, function definitions, try,
+attribute access beyond those methods or names starting with "_". KEYS
+and ARGV are lists of bytes; call(*args) and pcall(*args) run a command
+through CommandCore.execute directly (no request encoding or parsing)
+and return its reply decoded the way Redis hands replies to Lua:
+integers as int, bulk strings as bytes, nil as None, arrays as lists,
+status replies as {"ok": text} and errors as {"err": text} (call()
+aborts the script on an error instead). The value a script returns is
+encoded back the same way (None/False -> nil, True -> 1, floats
+truncated, dicts other than ok/err as a flat key/value array).
+
+Scripts are compiled once, checked against the whitelist, and cached by
+the SHA1 of their source in SCRIPTS; a run only builds a function object
+around the cached code with a fresh set of globals. The compiler inserts
+a check of the deadline at the top of every loop body and comprehension,
+and call() checks it too: a script running longer than script-time-limit
+milliseconds is stopped with an error (writes it already made stay, and
+are propagated). A single C-level operation (list(range(10**9))) is not
+interrupted: the sandbox bounds runaway loops, not every expensive call.
+
+The writes of a script are propagated as their effects wrapped in
+MULTI/EXEC, never as the script, so the AOF and replicas do not need the
+script cache.
+"""
+import ast  # Parsing and checking scripts
+import hashlib  # Script ids
+import types  # A function around the cached code for every run
+from time import perf_counter  # Execution time limit
+
+from resp import NULL_BULK, encode_bulk, encode_error, encode_integer, encode_simple
+
+SCRIPTS = {}  # SHA1 hex (bytes) -> compiled code; shared by every CommandCore of the process, like the command table
+
+ALLOWED_NODES = (
+    ast.Module, ast.Expr, ast.Assign, ast.AugAssign, ast.Delete, ast.If, ast.For, ast.While, ast.Break, ast.Continue,
+    ast.Pass, ast.Return, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Compare, ast.IfExp, ast.Call, ast.keyword, ast.Name,
+    ast.Constant, ast.Attribute, ast.Subscript, ast.Slice, ast.List, ast.Tuple, ast.Dict, ast.Set, ast.ListComp,
+    ast.SetComp, ast.DictComp, ast.GeneratorExp, ast.comprehension, ast.Load, ast.Store, ast.Del,
+    ast.And, ast.Or, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.BitAnd, ast.BitOr, ast.BitXor,
+    ast.Not, ast.Invert, ast.UAdd, ast.USub, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+    ast.Is, ast.IsNot,
+)  # No Pow or shifts either: one such operation can run for minutes
+ALLOWED_METHODS = frozenset((
+    "decode", "encode", "upper", "lower", "strip", "lstrip", "rstrip", "split", "startswith", "endswith", "find",
+    "count", "isdigit", "join", "replace", "append", "extend", "insert", "pop", "index", "get", "keys", "values", "items",
+))  # Methods of bytes, str, list and dict; nothing that reaches an object's internals
+SAFE_BUILTINS = {function.__name__: function for function in (
+    len, int, float, str, bytes, bool, list, dict, tuple, set, range, min, max, abs, sum, sorted, reversed, enumerate,
+    zip, any, all, round,
+)}
+TEMPLATE = "def script(KEYS, ARGV):\n    pass\n"  # Scripts become the body of this function, so return works at top level
+
+
+class ScriptError(Exception):  # Turned into a CommandError by EVAL
+    """A script failed to compile, raised, called a failing command or ran too long; the message is the error reply."""
+
+
+class _Timeout(Exception):  # Raised by the deadline check; scripts cannot catch it (no try)
+    pass
+
+
+def sha1hex(source):  # Script id, also callable from scripts
+    """Return the SHA1 of source as lowercase hex bytes."""
+    return hashlib.sha1(source if isinstance(source, bytes) else str(source).encode()).hexdigest().encode()
+
+
+class _Instrument(ast.NodeTransformer):  # Inserts the deadline checks
+    def visit_For(self, node):
+        self.generic_visit(node)
+        node.body.insert(0, ast.Expr(ast.Call(ast.Name("_tick", ast.Load()), [], [])))
+        return node
+
+    visit_While = visit_For
+
+    def visit_comprehension(self, node):  # _tick() returns True, so it filters nothing
+        self.generic_visit(node)
+        node.ifs.append(ast.Call(ast.Name("_tick", ast.Load()), [], []))
+        return node
+
+
+def _problem(node):  # Whitelist check of one syntax node
+    """Return why node is not allowed in a script, or None."""
+    if not isinstance(node, ALLOWED_NODES):
+        return f"{type(node).__name__} is not allowed in scripts"
+    if isinstance(node, ast.Name) and node.id.startswith("_"):
+        return f"name '{node.id}' is not allowed in scripts"
+    if isinstance(node, ast.Attribute) and (node.attr not in ALLOWED_METHODS or not isinstance(node.ctx, ast.Load)):
+        return f"attribute '{node.attr}' is not allowed in scripts"
+    return None
+
+
+def compile_script(source):  # EVAL of a new script, SCRIPT LOAD
+    """Check source (bytes) against the whitelist and return the code of its function."""
+    try:
+        tree = ast.parse(source.decode(), "user_script")
+    except (SyntaxError, UnicodeDecodeError, ValueError) as e:
+        raise ScriptError(f"ERR Error compiling script (new function): user_script:{getattr(e, 'lineno', 0)}: {getattr(e, 'msg', e)}") from None
+    except (MemoryError, RecursionError):  # Nested too deeply for the parser
+        raise ScriptError("ERR Error compiling script (new function): user_script:0: too many nested expressions") from None
+    for parent in ast.walk(tree):
+        for node in ast.iter_child_nodes(parent):
+            problem = _problem(node)
+            if problem is not None:
+                line = getattr(node, "lineno", getattr(parent, "lineno", 0))  # Operators carry no position
+                raise ScriptError(f"ERR Error compiling script (new function): user_script:{line}: {problem}")
+    module = ast.parse(TEMPLATE)
+    try:  # The instrumenting visitor and the compiler recurse into nested expressions
+        module.body[0].body = _Instrument().visit(tree).body or [ast.Pass()]
+        namespace = {"__builtins__": {}}
+        exec(compile(ast.fix_missing_locations(module), "user_script", "exec"), namespace)  # Only defines the function
+    except (MemoryError, RecursionError):
+        raise ScriptError("ERR Error compiling script (new function): user_script:0: too many nested expressions") from None
+    return namespace["script"].__code__
+
+
+def load(source):  # EVAL, SCRIPT LOAD
+    """Return (sha, code) of source, compiling and caching it if it is new."""
+    sha = sha1hex(source)
+    code = SCRIPTS.get(sha)
+    if code is None:
+        code = SCRIPTS[sha] = compile_script(source)
+    return sha, code
+
+
+def from_reply(reply, pos=0):  # Command reply -> script value
+    """Decode the RESP2 reply starting at pos; return (value, position after it)."""
+    end = reply.index(b"\r\n", pos)
+    kind = reply[pos]
+    if kind == 36:  # "$": bulk string or nil
+        length = int(reply[pos + 1:end])
+        if length < 0:
+            return None, end + 2
+        return reply[end + 2:end + 2 + length], end + 4 + length
+    if kind == 58:  # ":"
+        return int(reply[pos + 1:end]), end + 2
+    if kind == 43:  # "+"
+        return {"ok": reply[pos + 1:end].decode(errors="replace")}, end + 2
+    if kind == 45:  # "-"
+        return {"err": reply[pos + 1:end].decode(errors="replace")}, end + 2
+    count = int(reply[pos + 1:end])  # "*": array or nil
+    if count < 0:
+        return None, end + 2
+    items = []
+    pos = end + 2
+    for _ in range(count):
+        item, pos = from_reply(reply, pos)
+        items.append(item)
+    return items, pos
+
+
+def to_reply(value):  # Script result -> RESP2
+    """Encode what a script returned the way Redis encodes Lua values."""
+    if value is None or value is False:
+        return NULL_BULK
+    if value is True:
+        return encode_integer(1)
+    if isinstance(value, (int, float)):  # Lua numbers become integers
+        return encode_integer(int(value))
+    if isinstance(value, (bytes, str)):
+        return encode_bulk(value)
+    if isinstance(value, dict):
+        for key, encode in (("err", encode_error), ("ok", encode_simple)):
+            if key in value:
+                text = value[key]
+                return encode(text.decode(errors="replace") if isinstance(text, bytes) else str(text))
+        value = [item for pair in value.items() for item in pair]
+    items = [to_reply(item) for item in value]  # Any other iterable is an array
+    return b"*%d\r\n" % len(items) + b"".join(items)
+
+
+def _argument(value):  # call() arguments -> command arguments
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    if isinstance(value, int) and not isinstance(value, bool):
+        return b"%d" % value
+    if isinstance(value, float):
+        return repr(value).encode()
+    raise ScriptError("ERR Command arguments must be strings or integers")
+
+
+class ScriptRunner:  # Owned by a CommandCore as core.scripting
+    """Runs cached scripts against one CommandCore."""
+
+    def __init__(self, core):
+        from commands import COMMANDS, Client  # commands imports this module
+        self.core = core
+        self.commands = COMMANDS  # For the noscript check
+        self.client = Client()  # Pseudo-client the script's commands run as
+
+    def run(self, sha, code, keys, argv):  # EVAL, EVALSHA
+        """Run a compiled script atomically and return its encoded result."""
+        core = self.core
+        limit = core.config["script-time-limit"]  # Milliseconds, 0 = no limit
+        deadline = perf_counter() + limit / 1000 if limit > 0 else float("inf")
+
+        def tick():
+            if perf_counter() > deadline:
+                raise _Timeout()
+            return True
+
+        def call(*args):
+            return self.dispatch(args, deadline, True)
+
+        def pcall(*args):
+            return self.dispatch(args, deadline, False)
+
+        function = types.FunctionType(code, {
+            "__builtins__": SAFE_BUILTINS, "_tick": tick, "call": call, "pcall": pcall, "sha1hex": sha1hex,
+            "error_reply": lambda message: {"err": message}, "status_reply": lambda message: {"ok": message},
+        })
+        outer = core.transaction_log  # Set when EVAL runs inside EXEC: the writes join that transaction
+        if outer is None:
+            core.transaction_log = []  # Collects the script's writes; also keeps blocking commands from blocking
+        try:
+            result = function(keys, argv)
+        except _Timeout:
+            raise ScriptError(f"ERR Script exceeded script-time-limit ({limit} ms) and was stopped; writes it made were kept") from None
+        except ScriptError:
+            raise
+        except Exception as e:  # A bug in the script, including MemoryError and RecursionError: report where
+            line = 0
+            trace = e.__traceback__
+            while trace is not None:
+                if trace.tb_frame.f_code is code:
+                    line = trace.tb_lineno
+                trace = trace.tb_next
+            raise ScriptError(f"ERR Error running script (call to f_{sha.decode()}): user_script:{line}: {type(e).__name__}: {e}") from None
+        finally:
+            if outer is None:
+                log, core.transaction_log = core.transaction_log, None
+                if log:  # Replayed atomically from the AOF and by replicas
+                    core.propagate_as = [[b"MULTI"], *log, [b"EXEC"]]
+        try:
+            return to_reply(result)
+        except (TypeError, OverflowError, ValueError, RecursionError) as e:  # Not iterable, inf, nan, nested too deeply
+            raise ScriptError(f"ERR Script returned a value that cannot be converted to a reply: {e}") from None
+
+    def dispatch(self, args, deadline, raise_errors):  # call() and pcall()
+        """Execute one command for the running script and return its decoded reply."""
+        if perf_counter() > deadline:
+            raise _Timeout()
+        if not args:
+            raise ScriptError("ERR Please specify at least one argument for call()")
+        args = [arg if arg.__class__ is bytes else _argument(arg) for arg in args]  # Mostly KEYS/ARGV already
+        spec = self.commands.get(args[0].upper())
+        core = self.core
+        if spec is not None and "noscript" in spec.flags:
+            reply = b"-ERR This command is not allowed from script\r\n"
+        elif core.cluster is not None and core.cluster.route(args) is not None:  # Keys of another worker
+            reply = b"-ERR Script attempted to access a non local key in a cluster node\r\n"
+        else:
+            target = core.script_router(args) if core.script_router is not None else core  # The shard of the keys in a StripedStore
+            reply = target.execute(self.client, args) if not isinstance(target, bytes) else target
+        if reply == NULL_BULK:  # Common replies without the decoder
+            return None
+        value = from_reply(reply)[0]
+        if raise_errors and isinstance(value, dict) and "err" in value:
+            raise ScriptError(value["err"])
+        return value
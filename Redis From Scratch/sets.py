@@ -0,0 +1,190 @@
+"""Set values: an intset or a listpack while small, a Python set once they grow.
+
+A set whose members are all canonical 64-bit integers is an intset: a
+sorted array('q') searched with bisect, 8 bytes per member. Other small
+sets are listpacks. A set converts to a Python set once it has more than
+max_intset_entries (intset) or max_listpack_entries (listpack) members, or
+a member longer than max_listpack_value bytes (set-max-intset-entries,
+set-max-listpack-entries, set-max-listpack-value).
+"""
+import array  # intset storage
+import bisect  # Binary search in the intset
+import sys  # Memory accounting
+
+import listpack  # Compact encoding
+from scan import ScanIndex  # Stable positions for SSCAN
+
+INT64_MIN, INT64_MAX = -(1 << 63), (1 << 63) - 1  # Range of an intset member
+
+
+def as_int64(member):  # intset eligibility
+    """Return member as an int if it is the canonical decimal form of a 64-bit integer, else None."""
+    if not 0 < len(member) <= 20 or member[0] not in b"-0123456789":
+        return None
+    try:
+        number = int(member)
+    except ValueError:
+        return None
+    if b"%d" % number != member or not INT64_MIN <= number <= INT64_MAX:  # "007" or "+1" stay strings
+        return None
+    return number
+
+
+class Set:  # Value type behind SADD
+    """Set of bytes members with intset and listpack small encodings."""
+
+    __slots__ = ("intset", "listpack", "table", "count", "element_bytes", "scan_index")
+
+    max_intset_entries = 512  # set-max-intset-entries (set by CommandCore from the config)
+    max_listpack_entries = 128  # set-max-listpack-entries
+    max_listpack_value = 64  # set-max-listpack-value
+
+    def __init__(self):
+        self.intset = array.array("q")  # Sorted integers; None unless this is the encoding
+        self.listpack = None  # Small encoding for non-integer members
+        self.table = None  # set encoding
+        self.count = 0  # Number of members
+        self.element_bytes = 0  # sys.getsizeof() of the members, tracked in set encoding only
+        self.scan_index = None  # Member positions for SSCAN, created by the first scan of the set encoding
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def encoding(self):  # OBJECT ENCODING
+        """Return "intset", "listpack" or "hashtable"."""
+        if self.intset is not None:
+            return "intset"
+        return "listpack" if self.table is None else "hashtable"
+
+    def memory_usage(self):  # O(1): called after every mutation
+        """Return the approximate memory used by the set."""
+        if self.intset is not None:
+            return sys.getsizeof(self) + sys.getsizeof(self.intset)
+        if self.listpack is not None:
+            return sys.getsizeof(self) + sys.getsizeof(self.listpack)
+        size = sys.getsizeof(self) + sys.getsizeof(self.table) + self.element_bytes
+        return size if self.scan_index is None else size + self.scan_index.memory_usage()
+
+    def __contains__(self, member):  # SISMEMBER
+        if self.intset is not None:
+            number = as_int64(member)
+            if number is None:
+                return False
+            index = bisect.bisect_left(self.intset, number)
+            return index < self.count and self.intset[index] == number
+        if self.listpack is not None:
+            return listpack.find(self.listpack, member) >= 0
+        return member in self.table
+
+    def __iter__(self):  # SMEMBERS, persistence
+        if self.intset is not None:
+            return (b"%d" % number for number in self.intset)
+        if self.listpack is not None:
+            return listpack.entries(self.listpack)
+        return iter(self.table)
+
+    def add(self, member):  # SADD
+        """Add member; return True if it was not there yet."""
+        if self.intset is not None:
+            number = as_int64(member)
+            if number is not None:
+                index = bisect.bisect_left(self.intset, number)
+                if index < self.count and self.intset[index] == number:
+                    return False
+                if self.count < self.max_intset_entries:
+                    self.intset.insert(index, number)  # Keeps the array sorted
+                    self.count += 1
+                    return True
+                self._convert()
+            elif self.count < self.max_listpack_entries and len(member) <= self.max_listpack_value:
+                self.listpack = bytearray(b"".join(listpack.encode_entry(b"%d" % number) for number in self.intset))
+                self.intset = None
+            else:
+                self._convert()
+        if self.listpack is not None:
+            if listpack.find(self.listpack, member) >= 0:
+                return False
+            if self.count < self.max_listpack_entries and len(member) <= self.max_listpack_value:
+                self.listpack += listpack.encode_entry(member)
+                self.count += 1
+                return True
+            self._convert()
+        if member in self.table:
+            return False
+        self.table.add(member)
+        self.element_bytes += sys.getsizeof(member)
+        self.count += 1
+        if self.scan_index is not None:
+            self.scan_index.add(member)
+        return True
+
+    def discard(self, member):  # SREM
+        """Remove member; return True if it was there."""
+        if self.intset is not None:
+            number = as_int64(member)
+            if number is None:
+                return False
+            index = bisect.bisect_left(self.intset, number)
+            if index >= self.count or self.intset[index] != number:
+                return False
+            del self.intset[index]
+        elif self.listpack is not None:
+            pos = listpack.find(self.listpack, member)
+            if pos < 0:
+                return False
+            del self.listpack[pos:listpack.span(self.listpack, pos)[1]]
+        else:
+            if member not in self.table:
+                return False
+            self.table.discard(member)
+            self.element_bytes -= sys.getsizeof(member)
+            if self.scan_index is not None:
+                self.scan_index.discard(member)
+        self.count -= 1
+        return True
+
+    def scan(self, cursor, count):  # SSCAN
+        """Return (next cursor, members): everything at once while small, a slice of the index otherwise."""
+        if self.table is None:
+            return 0, list(self)
+        if self.scan_index is None:
+            self.scan_index = ScanIndex(self.table)
+        return self.scan_index.scan(cursor, count)
+
+    def _convert(self):  # Small encoding -> set
+        """Switch to the set encoding."""
+        self.table = set(self)
+        self.intset = self.listpack = None
+        self.element_bytes = sum(map(sys.getsizeof, self.table))
+
+    @classmethod
+    def from_intset(cls, raw):  # RDB loading
+        """Build a set from a serialized intset (little-endian int64s, sorted)."""
+        value = cls()
+        value.intset.frombytes(raw)
+        if sys.byteorder == "big":
+            value.intset.byteswap()
+        value.count = len(value.intset)
+        if value.count > cls.max_intset_entries:
+            value._convert()
+        return value
+
+    @classmethod
+    def from_listpack(cls, blob, count):  # RDB loading
+        """Build a set from a serialized listpack of count members."""
+        value = cls()
+        value.intset = None
+        value.listpack = bytearray(blob)
+        value.count = count
+        if count > cls.max_listpack_entries:
+            value._convert()
+        return value
+
+    def intset_bytes(self):  # RDB saving
+        """Return the intset as little-endian int64s."""
+        if sys.byteorder == "big":
+            swapped = array.array("q", self.intset)
+            swapped.byteswap()
+            return swapped.tobytes()
+        return self.intset.tobytes()
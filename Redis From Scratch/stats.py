@@ -0,0 +1,181 @@
+"""Instrumentation: per-command counters and latency histograms, the slow log, event-loop tick stats.
+
+Timings come from time.perf_counter_ns(), so recording one costs integer
+arithmetic only. A LatencyHistogram is HDR-style: every power of two is
+split into 2**SUB_BUCKET_BITS linear sub-buckets, which keeps the
+relative error under 12.5% from 1 ns to hours in a preallocated list of
+a few hundred counters. Recording is a bit_length(), a shift and one list
+increment; nothing is allocated per command.
+
+One Metrics object belongs to a CommandCore, or is shared by the shards
+of a StripedStore; its counters are then updated by several threads
+without a lock and are best effort. Front ends fill in what only they
+know: connection counts, server fields for INFO and LoopStats.
+"""
+import collections  # Slow log ring and ops/sec samples
+import time  # perf_counter_ns timings, wall-clock timestamps
+
+SUB_BUCKET_BITS = 3  # 8 linear sub-buckets per power of two
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+BUCKETS = SUB_BUCKETS * 62  # Enough for any 64-bit nanosecond count, so recording needs no bounds check
+SLOWLOG_MAX_ARGS = 32  # Arguments kept per slow log entry, as in Redis
+SLOWLOG_MAX_ARG_LEN = 128  # Bytes kept per argument
+OPS_SAMPLES = 16  # Cron samples behind instantaneous_ops_per_sec
+
+
+def bucket_start(index):  # Lowest value counted in a bucket
+    """Return the smallest nanosecond value recorded in bucket index."""
+    if index < SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return (index % SUB_BUCKETS + SUB_BUCKETS) << shift
+
+
+class LatencyHistogram:  # Per command and for the event loop
+    """Log-linear histogram of nanosecond durations."""
+
+    __slots__ = ("buckets",)
+
+    def __init__(self):
+        self.buckets = [0] * BUCKETS  # Preallocated counters
+
+    def record(self, ns):  # Hot path
+        shift = ns.bit_length() - SUB_BUCKET_BITS - 1
+        self.buckets[((shift + 1) << SUB_BUCKET_BITS) + (ns >> shift) - SUB_BUCKETS if shift > 0 else ns] += 1
+
+    def count(self):  # Recorded values
+        return sum(self.buckets)
+
+    def percentile(self, fraction):  # INFO latencystats
+        """Return the upper bound in ns of the bucket holding the given fraction (0-1) of the values."""
+        wanted = fraction * self.count()
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= wanted:
+                return bucket_start(index + 1) - 1
+        return 0
+
+    def power_of_two_usec(self):  # LATENCY HISTOGRAM
+        """Return [(bound in usec, cumulative count)] over power-of-two microsecond buckets, as Redis reports them."""
+        result = []
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            if not count:
+                continue
+            seen += count
+            usec = max(1, -(-(bucket_start(index + 1) - 1) // 1000))  # Highest value of the bucket, rounded up to usec
+            bound = 1 << (usec - 1).bit_length()  # Next power of two
+            if result and result[-1][0] == bound:
+                result[-1] = (bound, seen)
+            else:
+                result.append((bound, seen))
+        return result
+
+
+class CommandStats(LatencyHistogram):  # INFO commandstats and LATENCY HISTOGRAM of one command
+    """Counters of one command plus the histogram of its execution times (recorded inline by CommandCore.execute)."""
+
+    __slots__ = ("calls", "ns", "failed", "rejected")
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0  # Executions
+        self.ns = 0  # Total execution time
+        self.failed = 0  # Executions that returned an error
+        self.rejected = 0  # Refused before running (arity, OOM)
+
+
+class SlowLog:  # SLOWLOG
+    """Most recent commands that ran longer than slowlog-log-slower-than."""
+
+    def __init__(self, slower_than_usec=10000, max_len=128):
+        self.entries = collections.deque(maxlen=max_len)  # Newest last; the oldest drop off
+        self.next_id = 0  # Unique, increasing entry id
+        self.threshold_ns = 0  # Set by configure()
+        self.configure(slower_than_usec, max_len)
+
+    def configure(self, slower_than_usec, max_len):  # CONFIG SET slowlog-*
+        """Apply the threshold (negative disables the log) and the maximum length."""
+        self.threshold_ns = slower_than_usec * 1000 if slower_than_usec >= 0 else 1 << 62
+        if max_len != self.entries.maxlen:
+            self.entries = collections.deque(self.entries, maxlen=max_len)
+
+    def add(self, args, ns, client):  # Called only for slow commands
+        """Record a command with its duration and client."""
+        kept = [arg if len(arg) <= SLOWLOG_MAX_ARG_LEN else arg[:SLOWLOG_MAX_ARG_LEN] + b"... (%d more bytes)" % (len(arg) - SLOWLOG_MAX_ARG_LEN)
+                for arg in args[:SLOWLOG_MAX_ARGS]]
+        if len(args) > SLOWLOG_MAX_ARGS:  # The last slot says how many were cut
+            kept[-1] = b"... (%d more arguments)" % (len(args) - SLOWLOG_MAX_ARGS + 1)
+        address = client.address
+        peer = b"%s:%d" % (str(address[0]).encode(), address[1]) if isinstance(address, tuple) and len(address) >= 2 else b""
+        self.entries.append([self.next_id, int(time.time()), ns // 1000, kept, peer, client.name])
+        self.next_id += 1
+
+
+class LoopStats:  # Recorded by the front ends' event loops
+    """Duration and ready-socket count of every event-loop iteration."""
+
+    def __init__(self):
+        self.cycles = 0  # Iterations
+        self.ns = 0  # Time spent processing events (not waiting in select)
+        self.max_ns = 0  # Longest iteration
+        self.ready = 0  # Ready sockets over all iterations
+        self.max_ready = 0  # Most sockets ready at once
+        self.histogram = LatencyHistogram()  # Iteration durations
+
+    def record(self, ns, ready):  # Once per loop iteration
+        self.cycles += 1
+        self.ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+        self.ready += ready
+        if ready > self.max_ready:
+            self.max_ready = ready
+        self.histogram.record(ns)
+
+
+class Metrics:  # Everything INFO, SLOWLOG and LATENCY report
+    """Command stats, slow log, loop stats and connection counters of one server."""
+
+    def __init__(self, slower_than_usec=10000, slowlog_max_len=128):
+        self.commands = {}  # Command name -> CommandStats, created on first use
+        self.slowlog = SlowLog(slower_than_usec, slowlog_max_len)
+        self.loop = LoopStats()
+        self.start_time = time.time()  # For uptime_in_seconds
+        self.server = {}  # Front-end fields of the server section (tcp_port, multiplexing_api, ...)
+        self.connected_clients = 0  # Maintained by the front end
+        self.connections_received = 0  # Maintained by the front end
+        self.ops_samples = collections.deque(maxlen=OPS_SAMPLES)  # (monotonic time, total calls), one per cron tick
+        self.used_memory_peak = 0  # Highest used_memory seen by the cron or INFO
+
+    def command(self, name):  # Slow path of the first call
+        """Return the CommandStats of name, creating it."""
+        stats = self.commands.get(name)
+        if stats is None:
+            stats = self.commands[name] = CommandStats()
+        return stats
+
+    def total_calls(self):  # total_commands_processed
+        return sum(stats.calls for stats in self.commands.values())
+
+    def sample(self, used_memory):  # Called from the cron
+        """Take an ops/sec sample and track the memory peak."""
+        self.ops_samples.append((time.monotonic(), self.total_calls()))
+        if used_memory > self.used_memory_peak:
+            self.used_memory_peak = used_memory
+
+    def instantaneous_ops(self):  # instantaneous_ops_per_sec
+        """Return the command rate over the last OPS_SAMPLES cron ticks."""
+        if len(self.ops_samples) < 2:
+            return 0
+        (first_time, first_calls), (last_time, last_calls) = self.ops_samples[0], self.ops_samples[-1]
+        return int((last_calls - first_calls) / (last_time - first_time)) if last_time > first_time else 0
+
+    def reset(self):  # CONFIG RESETSTAT
+        """Clear command stats, loop stats and the memory peak."""
+        self.commands.clear()  # In place: CommandCore keeps a reference
+        self.loop = LoopStats()
+        self.connections_received = 0
+        self.ops_samples.clear()
+        self.used_memory_peak = 0
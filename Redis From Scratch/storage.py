@@ -0,0 +1,260 @@
+"""In-memory keyspace with per-key expiry and memory accounting.
+
+Values live in `data`; keys with a TTL are additionally indexed in
+`expires` (key -> absolute unix time in milliseconds). Expired keys are
+removed lazily when they are accessed, and actively by
+active_expire_cycle(), which the event loop calls on every cron tick.
+
+Every key also has one packed int in `meta`:
+
+    bits 0-7    logarithmic LFU counter
+    bits 8-31   24-bit LRU clock (seconds) of the last access
+    bits 32-63  accounted memory of the entry in bytes
+    bits 64-    index of the key in `slots`
+
+`slots` holds every key at a fixed position (deleted keys leave a hole
+that a later insert reuses), which gives O(1) random sampling for
+eviction without a second ordered structure, and a SCAN cursor that
+stays valid while keys are added and removed.
+"""
+import random  # Random sampling of volatile keys
+import sys  # Object sizes for memory accounting
+import time  # Wall-clock time for TTLs
+
+from scan import scan_slots  # Cursor walk over slots
+from strings import memory_usage as string_memory  # int and bytearray strings
+
+LFU_MASK = 0xFF  # Bits 0-7: LFU counter
+CLOCK_SHIFT, CLOCK_MASK = 8, 0xFFFFFF  # Bits 8-31: LRU clock
+SIZE_SHIFT, SIZE_MASK = 32, 0xFFFFFFFF  # Bits 32-63: accounted bytes
+SLOT_SHIFT = 64  # Bits 64 and up: slot index
+ACCESS_MASK = (1 << SIZE_SHIFT) - 1  # LFU counter + LRU clock
+LFU_INIT_VAL = 5  # New keys start here so they are not evicted right away
+ENTRY_OVERHEAD = 96  # Dict entries, the meta int and the slot pointer of one key, approximately
+
+
+def now_ms():  # Current unix time in milliseconds
+    """Return the current unix time in milliseconds."""
+    return int(time.time() * 1000)
+
+
+def lru_clock():  # 24-bit seconds clock
+    """Return the current LRU clock (unix seconds, wrapped to 24 bits)."""
+    return int(time.time()) & CLOCK_MASK
+
+
+def value_memory(value):  # Approximate footprint of a stored value
+    """Return the approximate memory used by a value; containers report it via memory_usage()."""
+    if value.__class__ is bytes:
+        return sys.getsizeof(value)
+    if value.__class__ is int or value.__class__ is bytearray:  # The other string encodings
+        return string_memory(value)
+    return value.memory_usage()
+
+
+class Keyspace:  # One logical database
+    """Key/value dictionary with an expires index, lazy expiry and sampled active expiry."""
+
+    def __init__(self):
+        self.data = {}  # Key (bytes) -> value
+        self.expires = {}  # Key -> absolute expiry time in unix milliseconds (only keys with a TTL)
+        self.volatile_keys = []  # Keys with a TTL, kept in a list so a random one can be picked in O(1)
+        self.volatile_slots = {}  # Key -> its index in volatile_keys, for O(1) swap-removal
+        self.expired_keys = 0  # Total keys removed because their TTL elapsed (lazy + active)
+        self.dirty = 0  # Modifications so far; a command that changes it gets persisted/propagated
+        self.meta = {}  # Key -> packed LFU counter, LRU clock, accounted size and slot index
+        self.slots = []  # Key at its slot position, or None for a free slot
+        self.free_slots = []  # Holes in slots, reused by the next insert
+        self.used_memory = 0  # Sum of the accounted sizes of all entries
+        self.clock = lru_clock()  # Cached LRU clock, refreshed by the cron (reads must not call time())
+        self.lfu_log_factor = 10  # Higher = counter grows more slowly (lfu-log-factor)
+        self.lfu_decay_time = 1  # Minutes for the counter to decay by one (lfu-decay-time)
+
+    def __len__(self):  # Number of keys, including expired keys not collected yet
+        return len(self.data)
+
+    def __contains__(self, key):  # Existence check with lazy expiry
+        return self.get(key) is not None
+
+    def get(self, key, default=None):  # Read a value, expiring it first if its TTL elapsed
+        """Return the value of key, or default if it is missing or expired; counts as an access."""
+        if self.expires and key in self.expires and self.expires[key] <= now_ms():  # Lazy expiry on access
+            self._expire(key)  # The key is logically gone
+            return default
+        meta = self.meta.get(key)
+        if meta is None:  # Missing key
+            return default
+        self.meta[key] = (meta & ~ACCESS_MASK) | self._access(meta)  # Update LRU clock and LFU counter
+        return self.data[key]
+
+    def set(self, key, value, keep_ttl=False):  # Write a value
+        """Store value under key; any TTL is cleared unless keep_ttl is true."""
+        meta = self.meta.get(key)
+        size = ENTRY_OVERHEAD + sys.getsizeof(key) + value_memory(value)  # Accounted bytes of the new entry
+        if meta is None:  # New key: take a slot
+            if self.free_slots:
+                slot = self.free_slots.pop()
+                self.slots[slot] = key
+            else:
+                slot = len(self.slots)
+                self.slots.append(key)
+            self.meta[key] = (slot << SLOT_SHIFT) | (size << SIZE_SHIFT) | (self.clock << CLOCK_SHIFT) | LFU_INIT_VAL
+        else:  # Overwrite: keep the slot, replace the size, count an access
+            self.used_memory -= (meta >> SIZE_SHIFT) & SIZE_MASK
+            self.meta[key] = (meta >> SLOT_SHIFT << SLOT_SHIFT) | (size << SIZE_SHIFT) | self._access(meta)
+        self.used_memory += size
+        self.data[key] = value  # Insert or overwrite
+        self.dirty += 1
+        if not keep_ttl and key in self.expires:  # A plain write makes the key persistent again
+            self._remove_expire(key)
+
+    def peek(self, key):  # OBJECT, MEMORY USAGE
+        """Return the value of key, or None if it is missing or expired, without counting an access."""
+        if self.expires and key in self.expires and self.expires[key] <= now_ms():
+            self._expire(key)
+            return None
+        return self.data.get(key)
+
+    def update_memory(self, key):  # Containers call this after changing a value in place
+        """Re-account the memory of key after its value was mutated in place."""
+        meta = self.meta[key]
+        size = ENTRY_OVERHEAD + sys.getsizeof(key) + value_memory(self.data[key])
+        self.used_memory += size - ((meta >> SIZE_SHIFT) & SIZE_MASK)
+        self.meta[key] = (meta & ~(SIZE_MASK << SIZE_SHIFT)) | (size << SIZE_SHIFT)
+
+    def delete(self, key):  # Remove a key
+        """Remove key; return True if it existed (and had not expired)."""
+        if self.get(key) is None:  # Missing or just expired
+            return False
+        self._unlink(key)
+        self.dirty += 1
+        return True
+
+    def memory_of(self, key):  # MEMORY USAGE
+        """Return the accounted bytes of key, or None if it does not exist."""
+        meta = self.meta.get(key)
+        return None if meta is None else (meta >> SIZE_SHIFT) & SIZE_MASK
+
+    def idle_time(self, key):  # OBJECT IDLETIME / LRU eviction score
+        """Return the seconds since key was last accessed."""
+        return (self.clock - ((self.meta[key] >> CLOCK_SHIFT) & CLOCK_MASK)) & CLOCK_MASK
+
+    def lfu_counter(self, key):  # OBJECT FREQ / LFU eviction score
+        """Return the decayed LFU counter of key."""
+        return self._decayed_counter(self.meta[key])
+
+    def random_key(self, attempts=32):  # Sampling for eviction
+        """Return a random key (possibly expired), or None if the keyspace looks empty."""
+        slots = self.slots
+        for _ in range(attempts if self.data else 0):  # Skip holes left by deleted keys
+            key = slots[random.randrange(len(slots))]
+            if key is not None:
+                return key
+        return None
+
+    def scan(self, cursor, count):  # SCAN
+        """Return (next cursor, keys) for about count slots from position cursor on, leaving out expired keys."""
+        cursor, keys = scan_slots(self.slots, cursor, count)
+        if self.expires:  # Not removed here: SCAN is a read, the cron collects them
+            now, expires = now_ms(), self.expires
+            keys = [key for key in keys if expires.get(key, now + 1) > now]
+        return cursor, keys
+
+    def refresh_clock(self):  # Called from the cron
+        """Refresh the cached LRU clock."""
+        self.clock = lru_clock()
+
+    def _access(self, meta):  # New LRU/LFU bits for an access
+        """Return the access bits (clock + counter) after one access."""
+        counter = self._decayed_counter(meta)
+        if counter < 255:  # Logarithmic increment: the higher the counter, the less likely it grows
+            base = counter - LFU_INIT_VAL if counter > LFU_INIT_VAL else 0
+            if random.random() < 1.0 / (base * self.lfu_log_factor + 1):
+                counter += 1
+        return (self.clock << CLOCK_SHIFT) | counter
+
+    def _decayed_counter(self, meta):  # LFU decay since the last access
+        """Return the LFU counter of meta after decaying it by the minutes elapsed since the last access."""
+        counter = meta & LFU_MASK
+        if self.lfu_decay_time:
+            idle_minutes = ((self.clock - ((meta >> CLOCK_SHIFT) & CLOCK_MASK)) & CLOCK_MASK) // 60
+            counter = max(counter - idle_minutes // self.lfu_decay_time, 0)
+        return counter
+
+    def _unlink(self, key):  # Remove a key and all of its bookkeeping
+        """Drop key from data, meta, slots and the expires index."""
+        del self.data[key]
+        meta = self.meta.pop(key)
+        slot = meta >> SLOT_SHIFT
+        self.slots[slot] = None  # Leave a hole; other keys keep their positions
+        self.free_slots.append(slot)
+        self.used_memory -= (meta >> SIZE_SHIFT) & SIZE_MASK
+        if key in self.expires:
+            self._remove_expire(key)
+
+    def clear(self):  # Full resync of a replica
+        """Remove every key, keeping the counters and settings."""
+        for index in (self.data, self.expires, self.volatile_keys, self.volatile_slots, self.meta, self.slots, self.free_slots):
+            index.clear()
+        self.used_memory = 0
+        self.dirty += 1
+
+    def set_expire(self, key, when_ms):  # Attach a TTL
+        """Make key expire at the given unix time in milliseconds (the key must exist)."""
+        if key not in self.expires:  # Newly volatile: index it for sampling
+            self.volatile_slots[key] = len(self.volatile_keys)
+            self.volatile_keys.append(key)
+        self.expires[key] = when_ms  # Absolute expiry time
+        self.dirty += 1
+
+    def get_expire(self, key):  # Read a TTL
+        """Return the absolute expiry time of key in unix milliseconds, or None if it has no TTL."""
+        return self.expires.get(key)
+
+    def persist(self, key):  # Remove a TTL
+        """Remove the TTL of key; return True if it had one."""
+        if self.get(key) is None or key not in self.expires:  # Missing, expired or already persistent
+            return False
+        self._remove_expire(key)
+        self.dirty += 1
+        return True
+
+    def active_expire_cycle(self, budget_ms=1.0, samples=20, stale_ratio=0.25):  # Background collection of expired keys
+        """Delete expired keys by random sampling; return how many were removed.
+
+        Each round samples up to `samples` volatile keys. Rounds continue
+        while more than `stale_ratio` of a sample was expired and the
+        time budget allows, so the cost stays bounded no matter how many
+        keys carry a TTL.
+        """
+        deadline = time.perf_counter() + budget_ms / 1000  # Hard stop for this cycle
+        removed = 0  # Keys expired during this cycle
+        while self.volatile_keys:  # Nothing to do once no key has a TTL
+            now = now_ms()
+            round_samples = min(samples, len(self.volatile_keys))  # Don't sample more keys than exist
+            expired = 0  # Expired keys found in this round
+            for _ in range(round_samples):
+                key = self.volatile_keys[random.randrange(len(self.volatile_keys))]  # O(1) random pick
+                if self.expires[key] <= now:  # TTL elapsed
+                    self._expire(key)
+                    expired += 1
+                if not self.volatile_keys:  # Everything volatile is gone
+                    break
+            removed += expired
+            if expired <= round_samples * stale_ratio or time.perf_counter() >= deadline:  # Few stale keys left, or out of time
+                break
+        return removed
+
+    def _expire(self, key):  # Delete a key whose TTL elapsed
+        """Remove an expired key and count it."""
+        self._unlink(key)  # Drop the value, its TTL and its bookkeeping
+        self.expired_keys += 1  # Stats
+
+    def _remove_expire(self, key):  # Unindex a volatile key
+        """Remove key from the expires index in O(1)."""
+        del self.expires[key]
+        index = self.volatile_slots.pop(key)  # Where the key sits in the sampling list
+        last = self.volatile_keys.pop()  # Swap-remove: move the last key into the hole
+        if index < len(self.volatile_keys):  # The removed key was not the last one
+            self.volatile_keys[index] = last
+            self.volatile_slots[last] = index
@@ -0,0 +1,56 @@
+"""String values: int, embstr and raw encodings.
+
+A string value is stored in one of three forms, reported by OBJECT ENCODING:
+
+    int     the canonical decimal form of a 64-bit integer ("42", "-7";
+            not "007" or "+1") is stored as a Python int; 0..9999 come from
+            SHARED_INTEGERS, so counters at small values share one object
+            and cost only the dict slot (Python itself caches only -5..256)
+    embstr  bytes of at most EMBSTR_SIZE_LIMIT bytes: header and data in
+            one allocation, which is how CPython lays out every bytes object
+    raw     longer bytes, and bytearrays: strings written in place by
+            APPEND, SETRANGE, SETBIT and PFADD, which grow with amortized
+            over-allocation instead of being copied on every write
+
+SET stores string_object(value); readers that need the bytes call
+as_bytes(), which formats an int back into its decimal text.
+"""
+import sys  # Memory accounting
+
+from sets import as_int64  # Canonical 64-bit integer check shared with intsets
+
+SHARED_INTEGERS = tuple(range(10000))  # Redis' OBJ_SHARED_INTEGERS
+EMBSTR_SIZE_LIMIT = 44  # Redis' OBJ_ENCODING_EMBSTR_SIZE_LIMIT
+STRING_MAX_LENGTH = 512 * 1024 * 1024  # proto-max-bulk-len
+
+
+def shared(number):  # INCR results and int-encoded values
+    """Return number, as the shared object when it is in the shared range."""
+    return SHARED_INTEGERS[number] if 0 <= number < 10000 else number
+
+
+def string_object(raw):  # SET, MSET, RDB load
+    """Return the stored form of raw bytes: an int for canonical integers, raw itself otherwise."""
+    if not 0 < len(raw) <= 20 or raw[0] not in b"-0123456789":  # Most text is rejected here, before any call
+        return raw
+    number = as_int64(raw)
+    return raw if number is None else shared(number)
+
+
+def as_bytes(value):  # Readers of string values
+    """Return the bytes of a stored string value (bytes and bytearrays as they are)."""
+    return b"%d" % value if value.__class__ is int else value
+
+
+def encoding(value):  # OBJECT ENCODING
+    """Return "int", "embstr" or "raw"."""
+    if value.__class__ is int:
+        return "int"
+    return "embstr" if value.__class__ is bytes and len(value) <= EMBSTR_SIZE_LIMIT else "raw"
+
+
+def memory_usage(value):  # Keyspace accounting
+    """Return the approximate memory used by a string value (0 for a shared integer)."""
+    if value.__class__ is int and 0 <= value < 10000:
+        return 0  # Shared: the key holds a reference to SHARED_INTEGERS
+    return sys.getsizeof(value)  # Includes a bytearray's spare capacity
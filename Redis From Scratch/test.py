@@ -1,6 +1,10 @@
 import socket
 import select
 import errno
+import functools
+import time
+
+from commands import Client, CommandCore
 
 class RedisLikeServer:
     def __init__(self, host='localhost', port=6379):
@@ -11,7 +15,11 @@ class RedisLikeServer:
         self.client_sockets = set()
         self.client_buffers = {}
         self.client_addresses = {}
-        self.store = {}
+        self.client_states = {}
+        self.core = CommandCore()
+
+        self.hz = 10  # background tasks (expiry, BGSAVE reaping) per second
+        self.next_cron_time = 0.0
 
     def start(self):
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -31,7 +39,7 @@ class RedisLikeServer:
             errors = list(self.client_sockets)
 
             try:
-                ready_read, ready_write, error_sockets = select.select(readable, writeable, errors, 1.0)
+                ready_read, ready_write, error_sockets = select.select(readable, writeable, errors, 1.0 / self.hz)
             except select.error:
                 continue
 
@@ -48,6 +56,16 @@ class RedisLikeServer:
             for sock in error_sockets:
                 self._disconnect_client(sock)
 
+            self._server_cron()
+
+    def _server_cron(self):
+        # run the core's background tasks hz times per second
+        now = time.monotonic()
+        if now < self.next_cron_time:
+            return
+        self.next_cron_time = now + 1.0 / self.hz
+        self.core.cron()
+
     def _accept_new_connection(self):
         try:
             client_socket, address = self.server_socket.accept()
@@ -57,9 +75,16 @@ class RedisLikeServer:
             self.client_sockets.add(client_socket)
             self.client_buffers[client_socket] = ""
             self.client_addresses[client_socket] = address
+            self.client_states[client_socket] = client = Client(address)
+            client.close = functools.partial(self._disconnect_client, client_socket)  # CLIENT KILL, idle timeout
+            if not self.core.add_client(client):
+                # maxclients connections are already open
+                self._send_to_client(client_socket, b"-ERR max number of clients reached\r\n")
+                self._disconnect_client(client_socket)
+                return
 
             print(f"New connection from {address}")
-            self._send_to_client(client_socket, "+OK Redis-like server ready\r\n")
+            self._send_to_client(client_socket, b"+OK Redis-like server ready\r\n")
 
         except BlockingIOError:
             # nothing to accept (non-blocking)
@@ -81,8 +106,12 @@ class RedisLikeServer:
             except UnicodeDecodeError:
                 decoded = data.decode('utf-8', errors='replace')
 
+            self.client_states[client_socket].last_interaction = time.monotonic()
             self.client_buffers[client_socket] += decoded
             self._process_client_buffer(client_socket)
+            if len(self.client_buffers.get(client_socket, "")) > self.core.config["client-query-buffer-limit"]:
+                # a line that never ends: drop the client instead of growing the buffer forever
+                self._disconnect_client(client_socket)
 
         except (BlockingIOError, InterruptedError):
             # no data ready
@@ -106,61 +135,19 @@ class RedisLikeServer:
         self.client_buffers[client_socket] = buffer
 
     def _execute_command(self, client_socket, message):
-        parts = message.split()
-        if not parts:
+        args = message.encode().split()
+        if not args:
             return
 
-        command = parts[0].upper()
-
-        if command == "PING":
-            self._send_to_client(client_socket, "+PONG\r\n")
-
-        elif command == "ECHO":
-            response = " ".join(parts[1:]) if len(parts) > 1 else ""
-            self._send_to_client(client_socket, f"+{response}\r\n")
-
-        elif command == "SET":
-            if len(parts) >= 3:
-                key = parts[1]
-                value = " ".join(parts[2:])
-                self.store[key] = value
-                self._send_to_client(client_socket, "+OK\r\n")
-            else:
-                self._send_to_client(client_socket, "-ERR SET requires key and value\r\n")
-
-        elif command == "GET":
-            if len(parts) >= 2:
-                key = parts[1]
-                value = self.store.get(key)
-                if value is not None:
-                    self._send_to_client(client_socket, f"+{value}\r\n")
-                else:
-                    # RESP bulk string nil
-                    self._send_to_client(client_socket, "$-1\r\n")
-            else:
-                self._send_to_client(client_socket, "-ERR GET requires key\r\n")
-
-        elif command == "DEL":
-            if len(parts) >= 2:
-                key = parts[1]
-                if key in self.store:
-                    del self.store[key]
-                    self._send_to_client(client_socket, "+OK\r\n")
-                else:
-                    self._send_to_client(client_socket, "$-1\r\n")
-            else:
-                self._send_to_client(client_socket, "-ERR DEL requires key\r\n")
-
-        elif command == "QUIT":
-            self._send_to_client(client_socket, "+OK Goodbye\r\n")
+        # dispatch through the shared command table
+        client = self.client_states[client_socket]
+        self._send_to_client(client_socket, self.core.execute(client, args))
+        if client.close_after_reply:
             self._disconnect_client(client_socket)
 
-        else:
-            self._send_to_client(client_socket, "-ERR unknown command\r\n")
-
-    def _send_to_client(self, client_socket, message):
+    def _send_to_client(self, client_socket, data):
         try:
-            client_socket.sendall(message.encode())
+            client_socket.sendall(data)
         except (BrokenPipeError, ConnectionResetError, socket.error):
             self._disconnect_client(client_socket)
 
@@ -172,6 +159,10 @@ class RedisLikeServer:
             self.client_sockets.remove(client_socket)
         self.client_buffers.pop(client_socket, None)
         self.client_addresses.pop(client_socket, None)
+        client = self.client_states.pop(client_socket, None)
+        if client is not None:
+            # release its registration, subscriptions and WATCHes
+            self.core.client_closed(client)
 
         try:
             client_socket.close()
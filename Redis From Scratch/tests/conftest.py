@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # The server modules live one level up
+
+from commands import Client, CommandCore  # noqa: E402
+
+
+@pytest.fixture
+def run(tmp_path):
+    """Return run(*args) -> reply bytes, executing commands on a fresh CommandCore."""
+    core = CommandCore({"dir": str(tmp_path)})
+    client = Client()
+
+    def run(*args):
+        return core.execute(client, [arg if isinstance(arg, bytes) else str(arg).encode() for arg in args])
+
+    run.core = core
+    return run
@@ -0,0 +1,25 @@
+import time
+
+import pytest
+
+from commands import Client
+
+
+@pytest.mark.parametrize("timeout", ["nan", "inf", "-inf", "NaN"])
+def test_non_finite_timeouts_are_rejected(run, timeout):
+    assert run("BLPOP", "q", timeout) == b"-ERR timeout is not a float or out of range\r\n"
+    assert not run.core.blocked.timeouts
+
+
+def test_timeouts_still_fire(run):
+    core = run.core
+    first, second = Client(), Client()
+    replies = []
+    first.send = second.send = replies.append
+    assert core.execute(first, [b"BLPOP", b"q", b"nan"]).startswith(b"-ERR")
+    assert core.execute(second, [b"BLPOP", b"q2", b"0.05"]) is None  # Blocked
+    time.sleep(0.1)
+    assert core.blocked_timeout() == 0.0
+    core.expire_blocked()
+    assert replies == [b"*-1\r\n"]
+    assert core.blocked_timeout() is None
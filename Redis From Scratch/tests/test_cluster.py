@@ -0,0 +1,20 @@
+from cluster import ClusterState, key_hash_slot
+
+
+def foreign_key(state):
+    return next(key for key in (b"key:%d" % i for i in range(1000)) if state.slot_owner[key_hash_slot(key)] != state.worker)
+
+
+def test_watch_on_a_foreign_slot_is_not_forwarded():
+    state = ClusterState(0, 2, "127.0.0.1", 7000)
+    key = foreign_key(state)
+    assert state.route([b"GET", key]) == 1  # Ordinary commands are forwarded
+    assert state.route([b"WATCH", key]).startswith(b"-ERR WATCH keys must belong to the worker")
+    assert state.route([b"watch", key]).startswith(b"-ERR")
+    assert state.route([b"UNWATCH"]) is None  # Runs where the watches are
+
+
+def test_watch_on_a_foreign_slot_is_redirected_in_moved_mode():
+    state = ClusterState(0, 2, "127.0.0.1", 7000, redirect="moved")
+    key = foreign_key(state)
+    assert state.route([b"WATCH", key]).startswith(b"-MOVED %d " % key_hash_slot(key))
@@ -0,0 +1,12 @@
+import commands
+
+
+def test_handler_bug_becomes_an_error_reply(run, monkeypatch, capsys):
+    def broken(core, client, args):
+        raise ZeroDivisionError("bug")
+
+    monkeypatch.setattr(commands.COMMANDS[b"GET"], "handler", broken)
+    assert run("GET", "k") == b"-ERR internal error\r\n"
+    assert "ZeroDivisionError: bug" in capsys.readouterr().err
+    assert run("SET", "k", "v") == b"+OK\r\n"
+    assert run.core.metrics.command(b"get").failed == 1
@@ -0,0 +1,36 @@
+import hyperloglog
+
+
+def stale_header(encoding):
+    header = bytearray(hyperloglog.MAGIC + bytes(12))
+    header[4] = encoding
+    header[15] = hyperloglog.STALE
+    return bytes(header)
+
+
+def test_sparse_index_out_of_range(run):
+    assert run("SET", "h", stale_header(hyperloglog.SPARSE) + b"\xff\xff\x01") == b"+OK\r\n"
+    for command in (("PFCOUNT", "h"), ("PFCOUNT", "h", "other"), ("PFMERGE", "dest", "h"), ("PFADD", "h", "x")):
+        assert run(*command) == b"-INVALIDOBJ Corrupted HLL object detected\r\n"
+
+
+def test_sparse_value_out_of_range(run):
+    run("SET", "h", stale_header(hyperloglog.SPARSE) + b"\x00\x01\x3f")
+    assert run("PFCOUNT", "h") == b"-INVALIDOBJ Corrupted HLL object detected\r\n"
+
+
+def test_dense_register_out_of_range(run):
+    run("SET", "h", stale_header(hyperloglog.DENSE) + b"\xff" * (hyperloglog.DENSE_SIZE - hyperloglog.HEADER_SIZE))
+    for command in (("PFCOUNT", "h"), ("PFCOUNT", "h", "other"), ("PFMERGE", "dest", "h")):
+        assert run(*command) == b"-INVALIDOBJ Corrupted HLL object detected\r\n"
+    assert run("PING") == b"+PONG\r\n"
+
+
+def test_valid_counters_still_count(run):
+    run("PFADD", "a", *[f"a{i}" for i in range(5000)])
+    run("PFADD", "b", *[f"b{i}" for i in range(100)])
+    assert run("OBJECT", "ENCODING", "a") == b"$3\r\nraw\r\n"
+    count = int(run("PFCOUNT", "a", "b")[1:-2])
+    assert abs(count - 5100) < 5100 * 0.05
+    assert run("PFMERGE", "c", "a", "b") == b"+OK\r\n"
+    assert int(run("PFCOUNT", "c")[1:-2]) == count
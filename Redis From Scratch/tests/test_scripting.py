@@ -0,0 +1,28 @@
+import pytest
+
+
+@pytest.mark.parametrize("script", [
+    "return float('inf')",
+    "return float('nan')",
+    "return 1e400",
+    "return {'a': float('inf')}",
+    "return [1, [float('-inf')]]",
+])
+def test_non_finite_results_are_errors(run, script):
+    assert run("EVAL", script, 0).startswith(b"-ERR Script returned a value that cannot be converted to a reply")
+    assert run("PING") == b"+PONG\r\n"
+
+
+@pytest.mark.parametrize("script", ["-" * 50000 + "1", "return " + "(" * 5000 + "1" + ")" * 5000, "return " + "[" * 5000 + "]" * 5000])
+def test_deeply_nested_source_is_a_compile_error(run, script):
+    assert run("EVAL", script, 0).startswith(b"-ERR Error compiling script")
+    assert run("PING") == b"+PONG\r\n"
+
+
+def test_deeply_nested_result_is_an_error(run):
+    script = "x = []\nfor i in range(100000):\n    x = [x]\nreturn x"
+    assert run("EVAL", script, 0).startswith(b"-ERR")
+
+
+def test_finite_floats_are_truncated(run):
+    assert run("EVAL", "return 3.99", 0) == b":3\r\n"
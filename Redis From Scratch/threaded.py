@@ -0,0 +1,315 @@
+"""Building blocks of the threaded front ends: a bounded handler pool, a lock-striped store, queued logging.
+
+HandlerPool runs a fixed number of handler threads, each multiplexing the
+connections assigned to it with its own selector. The accepting thread
+deals new connections round-robin into the handlers' bounded accept
+queues; when a queue is full it stops accepting and the listen backlog
+absorbs the rest. Idle connections cost a selector registration, not a
+thread, so a connection storm cannot create unbounded threads, and a
+request is served on the thread that saw it arrive (no hand-off between
+threads per request). Sockets are non-blocking: the front end queues
+replies with connection.write(), and the handler sends what the kernel
+takes and waits for write readiness for the rest, as the reactor does,
+so a client that stops reading only grows its own output buffer.
+
+StripedStore splits the dataset into N CommandCore shards, each behind
+its own lock; a command locks only the shard its key hashes to (the same
+CRC16 slot as the sharded mode, so {hash tags} keep keys together).
+The shards share one stats.Metrics, so INFO commandstats, SLOWLOG and
+LATENCY HISTOGRAM cover every shard whichever one answers.
+SCAN walks the shards one after another: the shard index is kept in the
+low digits of the cursor (cursor = shard cursor * shards + shard).
+EVAL and EVALSHA run holding every lock; each command a script calls
+runs on the shard of its own keys. A cron thread runs each shard's
+housekeeping (active expiry, BGSAVE reaping, lazyfree) hz times per
+second, holding only that shard's lock.
+"""
+import logging  # Connection events, written off the request path
+import logging.handlers  # QueueHandler / QueueListener
+import queue  # Accept queues and log queue
+import selectors  # One selector per handler thread
+import socket  # Wake-up pair for the poller
+import threading  # Handler threads and shard locks
+
+from cluster import key_hash_slot, shard_config  # Key -> slot; per-shard persistence files
+from commands import COMMANDS, CommandCore  # Key positions of every command; one shard of the dataset
+from resp import encode_bulk  # Rewritten SCAN cursors
+
+log = logging.getLogger("redis-like")  # Logger of the threaded front ends
+
+
+def start_logging(level=logging.INFO):  # Called once by a front end at start-up
+    """Send log records through a queue to a background thread; return the QueueListener to stop at shutdown."""
+    records = queue.SimpleQueue()  # Request threads only enqueue; console I/O happens on the listener thread
+    listener = logging.handlers.QueueListener(records, logging.StreamHandler())
+    log.addHandler(logging.handlers.QueueHandler(records))
+    log.setLevel(level)
+    log.propagate = False
+    listener.start()
+    return listener
+
+
+class Connection:  # Per-socket state handed between the poller and the handlers
+    """An accepted socket plus whatever the front end keeps for it."""
+
+    __slots__ = ("sock", "address", "buffer", "outbuffer", "client")
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.buffer = b""  # Received bytes not yet parsed
+        self.outbuffer = bytearray()  # Replies not yet taken by the kernel
+        self.client = None  # Front-end specific (commands.Client for the command server)
+
+    def write(self, data):  # Called by the front end on the connection's handler thread
+        """Queue data; the handler sends it once handle() returns."""
+        self.outbuffer += data
+
+
+class HandlerPool:  # Replaces one thread per connection
+    """A fixed set of handler threads, each polling its own share of the connections."""
+
+    def __init__(self, server_socket, handle, workers=16, queue_size=1024, closed=None):
+        self.server_socket = server_socket  # Listening socket, already bound
+        self.handle = handle  # handle(connection) -> False to close the connection
+        self.closed = closed  # closed(connection) after a connection is closed, or None
+        self.handlers = [_Handler(max(1, queue_size // workers)) for _ in range(workers)]
+        self.running = False
+
+    def serve_forever(self):  # Accepts on the calling thread
+        """Start the handler threads and accept connections until stop() or Ctrl+C."""
+        self.running = True
+        threads = [threading.Thread(target=self._work, args=(handler,), name=f"handler-{i}", daemon=True)
+                   for i, handler in enumerate(self.handlers)]
+        for thread in threads:
+            thread.start()
+        self.server_socket.settimeout(1.0)  # Notice stop() without a connection arriving
+        turn = 0  # Round-robin position
+        try:
+            while self.running:
+                try:
+                    sock, address = self.server_socket.accept()
+                except socket.timeout:
+                    continue
+                sock.setblocking(False)  # Replies wait in the connection's output buffer, never in send()
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Small replies go out at once
+                log.info("Connected by %s", address)
+                handler = self.handlers[turn]
+                turn = (turn + 1) % len(self.handlers)
+                handler.accepted.put(Connection(sock, address))  # Blocks while that handler's queue is full
+                handler.wake()
+        finally:
+            self.stop()
+
+    def stop(self):  # Callable from any thread
+        """Make serve_forever() and the handler threads return."""
+        self.running = False
+        for handler in self.handlers:
+            handler.wake()
+
+    def _work(self, handler):  # Body of a handler thread
+        selector = handler.selector
+        selector.register(handler.wakeup_reader, selectors.EVENT_READ)
+        while self.running:
+            for key, mask in selector.select(timeout=1.0):
+                if key.fileobj is handler.wakeup_reader:  # New connections were queued for this handler
+                    handler.drain()
+                    while not handler.accepted.empty():
+                        connection = handler.accepted.get_nowait()
+                        selector.register(connection.sock, selectors.EVENT_READ, connection)
+                    continue
+                connection = key.data
+                try:
+                    keep = True
+                    if mask & selectors.EVENT_READ:
+                        try:
+                            keep = self.handle(connection)
+                        except (BlockingIOError, InterruptedError):  # Spurious readiness
+                            pass
+                    if connection.outbuffer or mask & selectors.EVENT_WRITE:
+                        self._flush(selector, connection)  # Also the last replies of a connection about to close (QUIT)
+                except (ConnectionResetError, BrokenPipeError):  # The client went away mid-request
+                    keep = False
+                except Exception:
+                    log.exception("Error with %s", connection.address)
+                    keep = False
+                if not keep:
+                    selector.unregister(connection.sock)
+                    connection.sock.close()
+                    log.info("Disconnected %s", connection.address)
+                    if self.closed is not None:
+                        self.closed(connection)
+        for key in list(selector.get_map().values()):  # Shutting down
+            if key.data is not None:
+                key.fileobj.close()
+        selector.close()
+
+
+    @staticmethod
+    def _flush(selector, connection):  # On the connection's handler thread
+        """Send as much queued output as the kernel takes; keep write interest only while some is left."""
+        outbuffer = connection.outbuffer
+        while outbuffer:
+            try:
+                sent = connection.sock.send(outbuffer)
+            except (BlockingIOError, InterruptedError):  # Send buffer full: wait for write readiness
+                break
+            del outbuffer[:sent]
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if outbuffer else selectors.EVENT_READ
+        if selector.get_key(connection.sock).events != events:  # Avoid a syscall when nothing changes
+            selector.modify(connection.sock, events, connection)
+
+
+class _Handler:  # What one handler thread owns
+    """Selector, accept queue and wake-up socketpair of one handler thread."""
+
+    def __init__(self, queue_size):
+        self.selector = selectors.DefaultSelector()  # Connections served by this thread
+        self.accepted = queue.Queue(queue_size)  # Connections accepted for this thread but not yet registered
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()  # Interrupts select() when connections arrive
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+
+    def wake(self):  # Called from the accepting thread
+        try:
+            self.wakeup_writer.send(b"\0")
+        except BlockingIOError:  # Already full: the handler will wake anyway
+            pass
+
+    def drain(self):  # Called from the handler thread
+        try:
+            while self.wakeup_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+
+class StripedStore:  # Replaces one CommandCore behind one global lock
+    """N CommandCore shards, each with its own lock; a command locks only the shard of its keys."""
+
+    def __init__(self, shards=16, config=None):
+        config = dict(config or {})
+        self.shards = []
+        self.metrics = None  # Created by the first shard, shared by the others
+        for index in range(shards):
+            core = CommandCore(shard_config(config, index) if shards > 1 else config, self.metrics)
+            self.metrics = core.metrics
+            self.shards.append(core)
+        self.locks = [threading.Lock() for _ in range(shards)]
+        for core in self.shards:
+            core.script_router = self._script_shard  # A script's commands run on the shard of their own keys
+
+    def load(self):  # Before serving
+        """Restore every shard from its persistence files."""
+        for core in self.shards:
+            core.load()
+
+    def execute(self, client, args):  # Entry point of the handler threads
+        """Run one command under the lock of the shard it touches and return the reply."""
+        spec = COMMANDS.get(args[0].upper())
+        index = 0  # Commands without keys (PING, PUBLISH, INFO, ...) run on the first shard
+        if spec is None:  # Unknown: the first shard produces the error
+            pass
+        elif spec.first_key and len(args) > spec.first_key:
+            slot = key_hash_slot(args[spec.first_key])
+            if spec.last_key != spec.first_key:  # Several keys: they must share a shard
+                for key in spec.keys(args):
+                    if key_hash_slot(key) % len(self.shards) != slot % len(self.shards):
+                        return b"-CROSSSLOT Keys in request don't hash to the same shard (use a {hash tag})\r\n"
+            index = slot % len(self.shards)
+        elif spec.name == b"scan":
+            return self._scan(client, args)
+        elif spec.find_keys is not None:  # EVAL/EVALSHA: under every lock, since the script's commands may touch any shard
+            shards = {key_hash_slot(key) % len(self.shards) for key in spec.keys(args)}
+            if len(shards) > 1:
+                return b"-CROSSSLOT Keys in request don't hash to the same shard (use a {hash tag})\r\n"
+            return self._run_exclusive(shards.pop() if shards else 0, client, args)
+        elif "admin" in spec.flags:  # SAVE, BGSAVE, BGREWRITEAOF: every shard persists
+            replies = [self._run(index, client, args) for index in range(len(self.shards))]
+            return next((reply for reply in replies if reply.startswith(b"-")), replies[-1])
+        elif spec.name in (b"exec", b"discard", b"unwatch"):  # May release WATCHes registered on any shard
+            if spec.name == b"exec" and client.multi:  # The transaction runs on the shard of its keys
+                shards = {key_hash_slot(key) % len(self.shards) for queued in client.multi for key in COMMANDS[queued[0].upper()].keys(queued)}
+                if len(shards) > 1:
+                    self._run_exclusive(0, client, [b"DISCARD"])
+                    return b"-EXECABORT Transaction keys hash to different shards (use a {hash tag})\r\n"
+                index = shards.pop() if shards else 0
+            return self._run_exclusive(index, client, args)
+        return self._run(index, client, args)
+
+    def cron(self):  # One tick of the cron thread
+        """Run every shard's background tasks, each under its own lock."""
+        for core, lock in zip(self.shards, self.locks):
+            with lock:
+                core.cron()
+                core.before_sleep()  # Write whatever the cron fed to the AOF (expiry itself is not logged: the AOF holds absolute PEXPIREATs)
+
+    def serve_cron(self, stopped, hz=10):  # Body of the cron thread
+        """Call cron() hz times per second until the stopped event is set."""
+        while not stopped.wait(1.0 / hz):
+            try:
+                self.cron()
+            except Exception:
+                log.exception("Error in cron")
+
+    def add_client(self, client):  # Called by the front end for every new connection
+        """Register a connection with the first shard (CLIENT LIST/KILL); return False at maxclients."""
+        with self.locks[0]:
+            return self.shards[0].add_client(client)
+
+    def client_closed(self, client):  # Called by the front end when a connection goes away
+        """Release the registration, subscriptions and WATCHes of a disconnected client."""
+        if client.watched or client.channels or client.patterns:
+            self._run_exclusive(0, client, None)
+        else:
+            with self.locks[0]:
+                self.shards[0].client_closed(client)
+
+    def _script_shard(self, args):  # CommandCore.script_router; the script holds every lock
+        """Return the shard a command called by a script runs on, or a CROSSSLOT error reply."""
+        spec = COMMANDS.get(args[0].upper())
+        shards = {key_hash_slot(key) % len(self.shards) for key in spec.keys(args)} if spec is not None else ()
+        if len(shards) > 1:
+            return b"-CROSSSLOT Keys in request don't hash to the same shard (use a {hash tag})\r\n"
+        return self.shards[shards.pop() if shards else 0]
+
+    def _scan(self, client, args):  # SCAN over every shard
+        """Run SCAN on the shard the cursor points at and fold the shard back into the returned cursor."""
+        shards = len(self.shards)
+        cursor = int(args[1]) if args[1].isdigit() else -1
+        if cursor < 0:  # The shard produces the error
+            return self._run(0, client, args)
+        index = cursor % shards
+        reply = self._run(index, client, [args[0], b"%d" % (cursor // shards)] + args[2:])
+        if not reply.startswith(b"*2\r\n"):  # Syntax error
+            return reply
+        _, shard_cursor, rest = reply[4:].split(b"\r\n", 2)  # "$<n>", the cursor, then the key array
+        if int(shard_cursor):  # More keys on this shard
+            cursor = int(shard_cursor) * shards + index
+        else:  # Next shard from its start, or done
+            cursor = index + 1 if index + 1 < shards else 0
+        return b"*2\r\n" + encode_bulk(b"%d" % cursor) + rest
+
+    def _run(self, index, client, args):
+        core = self.shards[index]
+        with self.locks[index]:
+            reply = core.execute(client, args)
+            core.before_sleep()  # Write any logged command to the shard's AOF before replying
+        return reply
+
+    def _run_exclusive(self, index, client, args):  # Holds every lock, taken in index order so it cannot deadlock
+        """Run args on shard index while no other command runs anywhere; args None releases the client."""
+        for lock in self.locks:
+            lock.acquire()
+        try:
+            core = self.shards[index]
+            if args is None:
+                core.client_closed(client)
+                return None
+            reply = core.execute(client, args)
+            for shard in self.shards:  # A script may have written to any shard
+                shard.before_sleep()
+            return reply
+        finally:
+            for lock in self.locks:
+                lock.release()
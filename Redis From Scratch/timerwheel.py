@@ -0,0 +1,62 @@
+"""Hashed timer wheel for per-client deadlines (idle timeouts).
+
+Scanning every connection on every cron tick costs O(clients) even when
+nobody is anywhere near a deadline. A hashed wheel files each timer in
+the slot its deadline tick hashes to (tick % slots); advancing the wheel
+to the current time visits only the slots of the ticks that passed, and
+in each of them only the timers that are actually due (a timer more
+than one revolution away stays put until its own turn comes). Scheduling
+and cancelling are dict operations.
+
+Timers are not moved when a client is active: the owner re-checks the
+client when its timer fires and schedules it again if it has been busy
+since, so activity costs nothing but a timestamp.
+"""
+
+RESOLUTION = 0.1  # Seconds per tick (the cron runs at 10 Hz)
+SLOTS = 512  # Ticks per revolution (51.2 s at the default resolution)
+
+
+class TimerWheel:  # Owned by CommandCore
+    """item -> deadline (time.monotonic() seconds), fired in ticks of `resolution` seconds."""
+
+    def __init__(self, now, resolution=RESOLUTION, slots=SLOTS):
+        self.resolution = resolution
+        self.slots = [{} for _ in range(slots)]  # Slot -> {item: deadline tick}
+        self.where = {}  # Item -> the slot it is filed in
+        self.tick = int(now / resolution)  # Last tick processed
+
+    def __len__(self):
+        return len(self.where)
+
+    def schedule(self, item, deadline):  # Replaces any timer item already has
+        """Fire item at the first advance() at or after deadline."""
+        tick = max(int(deadline / self.resolution), self.tick + 1)  # Never in a tick that was already processed
+        slot = tick % len(self.slots)
+        previous = self.where.get(item)
+        if previous is not None:
+            del self.slots[previous][item]
+        self.slots[slot][item] = tick
+        self.where[item] = slot
+
+    def cancel(self, item):
+        slot = self.where.pop(item, None)
+        if slot is not None:
+            del self.slots[slot][item]
+
+    def advance(self, now):  # Called from the cron
+        """Return the items whose deadline is at or before now, forgetting their timers."""
+        target = int(now / self.resolution)
+        fired = []
+        # Each slot needs one visit however long ago the last advance was: it checks the deadlines, not the position
+        for tick in range(self.tick + 1, min(target, self.tick + len(self.slots)) + 1):
+            slot = self.slots[tick % len(self.slots)]
+            if not slot:
+                continue
+            due = [item for item, deadline in slot.items() if deadline <= target]
+            for item in due:
+                del slot[item]
+                del self.where[item]
+            fired += due
+        self.tick = max(self.tick, target)
+        return fired
@@ -0,0 +1,428 @@
+"""Sorted set values: a listpack while small, a skiplist plus a dict once they grow.
+
+The skiplist orders (score, member) pairs and stores, next to every
+forward pointer, its span: the number of level-0 steps it skips. Summing
+spans along a search path gives a node's rank, so inserts, deletes, rank
+lookups and "n-th element" lookups are all O(log n), and a range is one
+O(log n) search followed by a walk along level 0. The dict maps member ->
+score for O(1) ZSCORE.
+
+Small sorted sets are a listpack of member, score, member, score, ...
+kept in (score, member) order; they convert to the skiplist once they
+pass zset-max-listpack-entries members or hold a member longer than
+zset-max-listpack-value bytes.
+"""
+import bisect  # Sorted insertion into the small encoding
+import math  # Infinity handling in score formatting
+import random  # Node levels
+import sys  # Memory accounting
+
+import listpack  # Compact encoding
+from scan import ScanIndex  # Stable positions for ZSCAN
+
+MAX_LEVEL = 32  # Enough for 4^32 elements
+LEVEL_P = 0.25  # Probability that a node reaches the next level
+NODE_OVERHEAD = 200  # Node object, forward/span lists, score float and dict entry of one member, approximately
+
+
+def format_score(score):  # Scores in replies and rewritten commands
+    """Return the shortest decimal text that parses back to score ("3", "1.5", "inf")."""
+    if math.isinf(score):
+        return b"inf" if score > 0 else b"-inf"
+    if score.is_integer() and abs(score) < 1 << 53:
+        return b"%d" % score
+    return repr(score).encode()
+
+
+class Node:  # One skiplist element
+    """A (score, member) pair with per-level forward pointers and spans."""
+
+    __slots__ = ("member", "score", "backward", "forward", "span")
+
+    def __init__(self, member, score, level):
+        self.member = member
+        self.score = score
+        self.backward = None  # Previous node on level 0 (None for the first node)
+        self.forward = [None] * level  # Next node on each level
+        self.span = [0] * level  # Level-0 steps skipped by each forward pointer
+
+
+def random_level():  # Geometric distribution
+    """Return a random node level between 1 and MAX_LEVEL."""
+    level = 1
+    while level < MAX_LEVEL and random.random() < LEVEL_P:
+        level += 1
+    return level
+
+
+class SkipList:  # Order-statistic index of a large sorted set
+    """Skiplist ordered by (score, member) with span counts for rank queries."""
+
+    __slots__ = ("header", "tail", "length", "level")
+
+    def __init__(self):
+        self.header = Node(None, 0.0, MAX_LEVEL)  # Sentinel before the first element
+        self.tail = None  # Last element
+        self.length = 0
+        self.level = 1  # Highest level in use
+
+    def insert(self, score, member):  # O(log n)
+        """Insert a pair that is not in the list yet; return its node."""
+        update = [None] * MAX_LEVEL  # Rightmost node before the new one, per level
+        rank = [0] * MAX_LEVEL  # Rank of update[i]
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            rank[i] = rank[i + 1] if i < self.level - 1 else 0
+            while True:
+                following = x.forward[i]
+                if following is None or following.score > score or (following.score == score and following.member >= member):
+                    break
+                rank[i] += x.span[i]
+                x = following
+            update[i] = x
+        level = random_level()
+        if level > self.level:  # New levels start at the header and span the whole list
+            for i in range(self.level, level):
+                update[i] = self.header
+                self.header.span[i] = self.length
+            self.level = level
+        node = Node(member, score, level)
+        for i in range(level):
+            before = update[i]
+            node.forward[i] = before.forward[i]
+            before.forward[i] = node
+            node.span[i] = before.span[i] - (rank[0] - rank[i])
+            before.span[i] = rank[0] - rank[i] + 1
+        for i in range(level, self.level):  # Pointers that now jump over one more node
+            update[i].span[i] += 1
+        node.backward = None if update[0] is self.header else update[0]
+        if node.forward[0] is not None:
+            node.forward[0].backward = node
+        else:
+            self.tail = node
+        self.length += 1
+        return node
+
+    def delete(self, score, member):  # O(log n)
+        """Remove a pair; return True if it was found."""
+        update = [None] * MAX_LEVEL
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while True:
+                following = x.forward[i]
+                if following is None or following.score > score or (following.score == score and following.member >= member):
+                    break
+                x = following
+            update[i] = x
+        x = x.forward[0]
+        if x is None or x.score != score or x.member != member:
+            return False
+        self._delete_node(x, update)
+        return True
+
+    def _delete_node(self, x, update):  # Unlink x given its predecessors
+        """Unlink node x; update[i] is the last node before x on level i."""
+        for i in range(self.level):
+            if update[i].forward[i] is x:
+                update[i].span[i] += x.span[i] - 1
+                update[i].forward[i] = x.forward[i]
+            else:  # A pointer that jumped over x
+                update[i].span[i] -= 1
+        if x.forward[0] is not None:
+            x.forward[0].backward = x.backward
+        else:
+            self.tail = x.backward
+        while self.level > 1 and self.header.forward[self.level - 1] is None:
+            self.level -= 1
+        self.length -= 1
+
+    def rank(self, score, member):  # ZRANK
+        """Return the 1-based rank of a pair, or 0 if it is not in the list."""
+        rank = 0
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while True:
+                following = x.forward[i]
+                if following is None or following.score > score or (following.score == score and following.member > member):
+                    break
+                rank += x.span[i]
+                x = following
+            if x is not self.header and x.member == member:
+                return rank
+        return 0
+
+    def by_rank(self, rank):  # Start of a ZRANGE
+        """Return the node with the given 1-based rank, or None."""
+        traversed = 0
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while x.forward[i] is not None and traversed + x.span[i] <= rank:
+                traversed += x.span[i]
+                x = x.forward[i]
+            if traversed == rank:
+                return x if x is not self.header else None
+        return None
+
+    def first_in_range(self, low, low_ex):  # Start of a ZRANGEBYSCORE
+        """Return the first node with score > low (low_ex) or >= low, or None."""
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while True:
+                following = x.forward[i]
+                if following is None or (following.score > low if low_ex else following.score >= low):
+                    break
+                x = following
+        return x.forward[0]
+
+    def delete_range_by_score(self, low, low_ex, high, high_ex, table):  # ZREMRANGEBYSCORE
+        """Remove every node with a score in the range, also from table; return the removed members."""
+        update = [None] * MAX_LEVEL
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while True:
+                following = x.forward[i]
+                if following is None or (following.score > low if low_ex else following.score >= low):
+                    break
+                x = following
+            update[i] = x
+        x = x.forward[0]
+        removed = []
+        while x is not None and (x.score < high if high_ex else x.score <= high):
+            following = x.forward[0]
+            self._delete_node(x, update)
+            del table[x.member]
+            removed.append(x.member)
+            x = following
+        return removed
+
+    def __iter__(self):  # (member, score) in order
+        x = self.header.forward[0]
+        while x is not None:
+            yield x.member, x.score
+            x = x.forward[0]
+
+    @classmethod
+    def from_sorted(cls, pairs):  # Bulk build for conversions and loading
+        """Build a skiplist from (score, member) pairs already in order, appending at the tail in O(1) each."""
+        skiplist = cls()
+        last = [skiplist.header] * MAX_LEVEL  # Last node on each level so far
+        last_rank = [0] * MAX_LEVEL  # Its rank
+        previous = None
+        rank = 0
+        for score, member in pairs:
+            rank += 1
+            level = random_level()
+            node = Node(member, score, level)
+            for i in range(level):
+                last[i].forward[i] = node
+                last[i].span[i] = rank - last_rank[i]
+                last[i] = node
+                last_rank[i] = rank
+            node.backward = previous
+            previous = node
+            if level > skiplist.level:
+                skiplist.level = level
+        for i in range(skiplist.level):  # Pointers to the end span the rest of the list
+            last[i].span[i] = rank - last_rank[i]
+        skiplist.tail = previous
+        skiplist.length = rank
+        return skiplist
+
+
+class ZSet:  # Value type behind ZADD
+    """Sorted set with a listpack small encoding and a skiplist + dict large encoding."""
+
+    __slots__ = ("listpack", "count", "table", "skiplist", "element_bytes", "scan_index")
+
+    max_listpack_entries = 128  # zset-max-listpack-entries (set by CommandCore from the config)
+    max_listpack_value = 64  # zset-max-listpack-value
+
+    def __init__(self):
+        self.listpack = bytearray()  # member, score, ... in order; None once converted
+        self.count = 0  # Members in the listpack
+        self.table = None  # Member -> score
+        self.skiplist = None  # (score, member) order with ranks
+        self.element_bytes = 0  # Accounted bytes of the skiplist encoding
+        self.scan_index = None  # Member positions for ZSCAN, created by the first scan of the skiplist encoding
+
+    def __len__(self):
+        return self.count if self.table is None else len(self.table)
+
+    @property
+    def encoding(self):  # OBJECT ENCODING
+        """Return "listpack" or "skiplist"."""
+        return "listpack" if self.table is None else "skiplist"
+
+    def memory_usage(self):  # O(1): called after every mutation
+        """Return the approximate memory used by the sorted set."""
+        if self.table is None:
+            return sys.getsizeof(self) + sys.getsizeof(self.listpack)
+        size = sys.getsizeof(self) + sys.getsizeof(self.table) + self.element_bytes
+        return size if self.scan_index is None else size + self.scan_index.memory_usage()
+
+    def score(self, member):  # ZSCORE
+        """Return the score of member, or None."""
+        if self.table is not None:
+            return self.table.get(member)
+        blob = self.listpack
+        pos = listpack.find(blob, member, 2)
+        if pos < 0:
+            return None
+        start, end = listpack.span(blob, listpack.span(blob, pos)[1])
+        return float(blob[start:end])
+
+    def set(self, member, score):  # ZADD / ZINCRBY
+        """Set the score of member; return True if the member is new."""
+        if self.table is None:
+            pairs = self._pairs()
+            old = self.score(member)
+            if old is not None:
+                pairs.remove((old, member))
+            if len(pairs) < self.max_listpack_entries and len(member) <= self.max_listpack_value:
+                bisect.insort(pairs, (score, member))
+                self._store(pairs)
+                return old is None
+            self._convert(pairs)
+        table = self.table
+        old = table.get(member)
+        if old is not None:
+            if old == score:
+                return False
+            self.skiplist.delete(old, member)
+        else:
+            self.element_bytes += NODE_OVERHEAD + sys.getsizeof(member)
+            if self.scan_index is not None:
+                self.scan_index.add(member)
+        table[member] = score
+        self.skiplist.insert(score, member)
+        return old is None
+
+    def remove(self, member):  # ZREM
+        """Remove member; return True if it was there."""
+        if self.table is None:
+            old = self.score(member)
+            if old is None:
+                return False
+            pairs = self._pairs()
+            pairs.remove((old, member))
+            self._store(pairs)
+            return True
+        old = self.table.pop(member, None)
+        if old is None:
+            return False
+        self.skiplist.delete(old, member)
+        self.element_bytes -= NODE_OVERHEAD + sys.getsizeof(member)
+        if self.scan_index is not None:
+            self.scan_index.discard(member)
+        return True
+
+    def rank(self, member):  # ZRANK
+        """Return the 0-based rank of member, or None."""
+        if self.table is None:
+            for rank, (_, candidate) in enumerate(self._pairs()):
+                if candidate == member:
+                    return rank
+            return None
+        score = self.table.get(member)
+        return None if score is None else self.skiplist.rank(score, member) - 1
+
+    def range_by_rank(self, start, stop):  # ZRANGE
+        """Return [(member, score)] for ranks start..stop inclusive (0 <= start <= stop < len)."""
+        if self.table is None:
+            return [(member, score) for score, member in self._pairs()[start:stop + 1]]
+        node = self.skiplist.by_rank(start + 1)  # O(log n) to the first element
+        result = []
+        for _ in range(stop - start + 1):  # Then a walk along level 0
+            result.append((node.member, node.score))
+            node = node.forward[0]
+        return result
+
+    def range_by_score(self, low, low_ex, high, high_ex, offset=0, count=-1):  # ZRANGEBYSCORE
+        """Return [(member, score)] with scores in the range, skipping offset and returning at most count (-1 = all)."""
+        result = []
+        if self.table is None:
+            for score, member in self._pairs():
+                if (score > low if low_ex else score >= low) and (score < high if high_ex else score <= high):
+                    result.append((member, score))
+            return result[offset:] if count < 0 else result[offset:offset + count]
+        node = self.skiplist.first_in_range(low, low_ex)
+        while node is not None and offset > 0:  # LIMIT offset walks level 0, as in Redis
+            node = node.forward[0]
+            offset -= 1
+        while node is not None and count != 0 and (node.score < high if high_ex else node.score <= high):
+            result.append((node.member, node.score))
+            node = node.forward[0]
+            count -= 1
+        return result
+
+    def remove_range_by_score(self, low, low_ex, high, high_ex):  # ZREMRANGEBYSCORE
+        """Remove members with scores in the range; return how many were removed."""
+        if self.table is None:
+            pairs = self._pairs()
+            kept = [(score, member) for score, member in pairs
+                    if not ((score > low if low_ex else score >= low) and (score < high if high_ex else score <= high))]
+            self._store(kept)
+            return len(pairs) - len(kept)
+        removed = self.skiplist.delete_range_by_score(low, low_ex, high, high_ex, self.table)
+        self.element_bytes -= sum(NODE_OVERHEAD + sys.getsizeof(member) for member in removed)
+        if self.scan_index is not None:
+            for member in removed:
+                self.scan_index.discard(member)
+        return len(removed)
+
+    def items(self):  # ZRANGE 0 -1, persistence
+        """Yield (member, score) in order."""
+        if self.table is None:
+            for score, member in self._pairs():
+                yield member, score
+        else:
+            yield from self.skiplist
+
+    def scan(self, cursor, count):  # ZSCAN
+        """Return (next cursor, [(member, score)]): everything at once while small, a slice of the index otherwise."""
+        if self.table is None:
+            return 0, list(self.items())
+        if self.scan_index is None:
+            self.scan_index = ScanIndex(self.table)
+        cursor, members = self.scan_index.scan(cursor, count)
+        table = self.table
+        return cursor, [(member, table[member]) for member in members]
+
+    def _pairs(self):  # Decode the small encoding
+        """Return the listpack contents as a sorted list of (score, member)."""
+        entries = listpack.entries(self.listpack)
+        return [(float(score), member) for member, score in zip(entries, entries)]
+
+    def _store(self, pairs):  # Encode the small encoding
+        """Replace the listpack with the given sorted (score, member) pairs."""
+        self.listpack = bytearray(b"".join(listpack.encode_entry(member) + listpack.encode_entry(format_score(score))
+                                           for score, member in pairs))
+        self.count = len(pairs)
+
+    def _convert(self, pairs):  # listpack -> skiplist + dict
+        """Switch to the skiplist encoding, starting from sorted (score, member) pairs."""
+        self.table = {member: score for score, member in pairs}
+        self.skiplist = SkipList.from_sorted(pairs)
+        self.element_bytes = sum(NODE_OVERHEAD + sys.getsizeof(member) for member in self.table)
+        self.listpack = None
+        self.count = 0
+
+    @classmethod
+    def from_listpack(cls, blob, count):  # RDB loading
+        """Build a sorted set from a serialized listpack of count members."""
+        value = cls()
+        value.listpack = bytearray(blob)
+        value.count = count
+        if count > cls.max_listpack_entries:  # Loaded with a smaller threshold than it was saved with
+            value._convert(value._pairs())
+        return value
+
+    @classmethod
+    def from_sorted(cls, pairs):  # RDB loading
+        """Build a sorted set from (score, member) pairs in order."""
+        value = cls()
+        if len(pairs) <= cls.max_listpack_entries and all(len(member) <= cls.max_listpack_value for _, member in pairs):
+            value._store(pairs)
+        else:
+            value._convert(pairs)
+        return value